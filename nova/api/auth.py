@@ -22,6 +22,7 @@ import webob.dec
 import webob.exc
 
 from nova import context
+from nova import db
 from nova import flags
 from nova import log as logging
 from nova.openstack.common import cfg
@@ -103,5 +104,6 @@ class NovaKeystoneContext(wsgi.Middleware):
                                      auth_token=auth_token,
                                      remote_address=remote_address)
 
+        db.enable_request_cache(ctx)
         req.environ['nova.context'] = ctx
         return self.application
@@ -32,6 +32,7 @@ from nova.api.ec2 import ec2utils
 from nova.api.ec2 import faults
 from nova.api import validator
 from nova import context
+from nova import db
 from nova import exception
 from nova import flags
 from nova import log as logging
@@ -269,6 +270,7 @@ class EC2KeystoneAuth(wsgi.Middleware):
                                       auth_token=token_id,
                                       remote_address=remote_address)
 
+        db.enable_request_cache(ctxt)
         req.environ['nova.context'] = ctxt
 
         return self.application
@@ -291,6 +293,7 @@ class NoAuth(wsgi.Middleware):
                                      is_admin=True,
                                      remote_address=remote_address)
 
+        db.enable_request_cache(ctx)
         req.environ['nova.context'] = ctx
         return self.application
 
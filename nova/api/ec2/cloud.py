@@ -185,6 +185,12 @@ class CloudController(object):
  inbound API calls through the endpoint and messages
  sent to the other nodes.
 """
+    # The instance columns the instance descriptions are built from
+    _describe_instances_columns = ['id', 'uuid', 'reservation_id',
+            'project_id', 'image_ref', 'kernel_id', 'ramdisk_id', 'vm_state',
+            'shutdown_terminate', 'hostname', 'key_name', 'host',
+            'created_at', 'launch_index', 'root_device_name']
+
     def __init__(self):
         self.image_service = s3.S3ImageService()
         self.network_api = network.API()
@@ -1002,8 +1008,10 @@ class CloudController(object):
                 # always filter out deleted instances
                 search_opts['deleted'] = False
                 instances = self.compute_api.get_all(context,
-                                                     search_opts=search_opts,
-                                                     sort_dir='asc')
+                        search_opts=search_opts, sort_dir='asc',
+                        columns=self._describe_instances_columns,
+                        columns_to_join=['info_cache', 'security_groups',
+                                         'instance_type'])
             except exception.NotFound:
                 instances = []
         for instance in instances:
@@ -22,6 +22,7 @@ import webob.exc
 
 from nova.api.openstack import wsgi
 from nova import context
+from nova import db
 from nova import flags
 from nova import log as logging
 from nova import wsgi as base_wsgi
@@ -61,5 +62,6 @@ class NoAuthMiddleware(base_wsgi.Middleware):
                                      is_admin=True,
                                      remote_address=remote_address)
 
+        db.enable_request_cache(ctx)
         req.environ['nova.context'] = ctx
         return self.application
@@ -105,8 +105,8 @@ class ServerDiskConfigController(wsgi.Controller):
     def _add_disk_config(self, context, servers):
         # Get DB information for servers
         uuids = [server['id'] for server in servers]
-        db_servers = db.instance_get_all_by_filters(context,
-                                                    {'uuid': uuids})
+        db_servers = db.instance_get_all_by_filters(context, {'uuid': uuids},
+                columns=['uuid', INTERNAL_DISK_CONFIG])
         db_servers_by_uuid = dict((s['uuid'], s) for s in db_servers)
 
         for server in servers:
@@ -0,0 +1,87 @@
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""The scheduler stats admin extension."""
+
+from nova.api.openstack import extensions
+from nova.api.openstack import wsgi
+from nova.api.openstack import xmlutil
+from nova import log as logging
+from nova.scheduler import rpcapi as scheduler_rpcapi
+
+
+LOG = logging.getLogger(__name__)
+authorize = extensions.extension_authorizer('compute', 'scheduler_stats')
+
+HISTOGRAM_ATTRS = ('name', 'count', 'samples', 'min', 'max', 'avg',
+                   'p50', 'p90', 'p99')
+
+
+class SchedulerStatsTemplate(xmlutil.TemplateBuilder):
+    def construct(self):
+        root = xmlutil.TemplateElement('scheduler_stats',
+                                       selector='scheduler_stats')
+        stages = xmlutil.SubTemplateElement(root, 'stages')
+        stage = xmlutil.SubTemplateElement(stages, 'stage', selector='stages')
+        for attr in HISTOGRAM_ATTRS:
+            stage.set(attr)
+        filters = xmlutil.SubTemplateElement(root, 'filters')
+        elem = xmlutil.SubTemplateElement(filters, 'filter',
+                                          selector='filters')
+        for attr in HISTOGRAM_ATTRS + ('hosts_removed',):
+            elem.set(attr)
+        return xmlutil.MasterTemplate(root, 1)
+
+
+def _translate_histograms(histograms):
+    """Turn a dict of histograms keyed by name into a sorted list."""
+    result = []
+    for name in sorted(histograms):
+        histogram = dict(histograms[name])
+        histogram['name'] = name
+        result.append(histogram)
+    return result
+
+
+class SchedulerStatsController(object):
+    """Scheduler latency histograms for the OpenStack API."""
+
+    def __init__(self):
+        self.scheduler_rpcapi = scheduler_rpcapi.SchedulerAPI()
+        super(SchedulerStatsController, self).__init__()
+
+    @wsgi.serializers(xml=SchedulerStatsTemplate)
+    def index(self, req):
+        context = req.environ['nova.context']
+        authorize(context)
+        stats = self.scheduler_rpcapi.get_scheduler_stats(context)
+        return {'scheduler_stats': {
+                    'stages': _translate_histograms(stats['stages']),
+                    'filters': _translate_histograms(stats['filters'])}}
+
+
+class Scheduler_stats(extensions.ExtensionDescriptor):
+    """Admin-only access to the scheduler latency histograms"""
+
+    name = "SchedulerStats"
+    alias = "os-scheduler-stats"
+    namespace = ("http://docs.openstack.org/compute/ext/"
+                 "scheduler-stats/api/v1.1")
+    updated = "2012-08-01T00:00:00+00:00"
+
+    def get_resources(self):
+        resources = [extensions.ResourceExtension('os-scheduler-stats',
+                SchedulerStatsController())]
+        return resources
@@ -346,6 +346,9 @@ class Controller(wsgi.Controller):
 
     _view_builder_class = views_servers.ViewBuilder
 
+    # The instance columns the index view is built from
+    _index_columns = ['uuid', 'display_name']
+
     @staticmethod
     def _add_location(robj):
         # Just in case...
@@ -455,15 +458,28 @@ class Controller(wsgi.Controller):
             else:
                 search_opts['user_id'] = context.user_id
 
-        instance_list = self.compute_api.get_all(context,
-                                                 search_opts=search_opts)
+        if is_detail:
+            columns = None
+        else:
+            columns = self._index_columns
+
+        limit, marker = common.get_limit_and_marker(req)
+        try:
+            instance_list = self.compute_api.get_all(context,
+                                                     search_opts=search_opts,
+                                                     limit=limit,
+                                                     marker=marker,
+                                                     columns=columns,
+                                                     use_slave=True)
+        except exception.MarkerNotFound:
+            msg = _('marker [%s] not found') % marker
+            raise exc.HTTPBadRequest(explanation=msg)
 
-        limited_list = self._limit_items(instance_list, req)
         if is_detail:
-            self._add_instance_faults(context, limited_list)
-            return self._view_builder.detail(req, limited_list)
+            self._add_instance_faults(context, instance_list)
+            return self._view_builder.detail(req, instance_list)
         else:
-            return self._view_builder.index(req, limited_list)
+            return self._view_builder.index(req, instance_list)
 
     def _get_server(self, context, instance_uuid):
         """Utility function for looking up an instance by uuid."""
@@ -946,9 +962,6 @@ class Controller(wsgi.Controller):
         server = self._get_server(context, id)
         self.compute_api.set_admin_password(context, server, password)
 
-    def _limit_items(self, items, req):
-        return common.limited_by_marker(items, req)
-
     def _validate_metadata(self, metadata):
         """Ensure that we can work with the metadata given."""
         try:
@@ -595,24 +595,9 @@ class API(base.Base):
         instance has been determined.
         """
         elevated = context.elevated()
-        if security_group is None:
-            security_group = ['default']
-        if not isinstance(security_group, list):
-            security_group = [security_group]
-
-        security_groups = []
-        for security_group_name in security_group:
-            group = self.db.security_group_get_by_name(context,
-                    context.project_id,
-                    security_group_name)
-            security_groups.append(group['id'])
-
-        # Store image properties so we can use them later
-        # (for notifications, etc).  Only store what we can.
-        base_options.setdefault('system_metadata', {})
-        for key, value in image['properties'].iteritems():
-            new_value = str(value)[:255]
-            base_options['system_metadata']['image_%s' % key] = new_value
+        security_groups = self._get_security_group_ids(context,
+                                                       security_group)
+        self._store_image_properties(base_options, image)
 
         base_options.setdefault('launch_index', 0)
         instance = self.db.instance_create(context, base_options)
@@ -669,6 +654,114 @@ class API(base.Base):
 
         return self.update(context, instance, **updates)
 
+    def create_db_entries_for_new_instances(self, context, instance_type,
+            image, base_options, security_group, block_device_mapping,
+            reservations, instances_values):
+        """Create entries in the DB for several new instances at once.
+
+        This works like create_db_entry_for_new_instance(), except that
+        all the instance records, along with their info caches and
+        security group associations, are created in one transaction.
+        instances_values is a list with a dict of extra values for each
+        instance to create, such as its launch_index.
+
+        This is called by the scheduler after locations for all the
+        instances have been determined.
+
+        Returns a list of instance dicts.
+        """
+        elevated = context.elevated()
+        security_groups = self._get_security_group_ids(context,
+                                                       security_group)
+        self._store_image_properties(base_options, image)
+
+        # Set what create_db_entry_for_new_instance() would set in its
+        # follow up update, so we don't need one per instance.
+        defaults = {'vm_state': vm_states.BUILDING,
+                    'task_state': task_states.SCHEDULING,
+                    'architecture': image['properties'].get('architecture')}
+        if (image['properties'].get('mappings', []) or
+            image['properties'].get('block_device_mapping', []) or
+            block_device_mapping):
+            defaults['shutdown_terminate'] = False
+
+        values_list = []
+        for instance_values in instances_values:
+            values = dict(base_options)
+            values.setdefault('launch_index', 0)
+            values.update(defaults)
+            values.update(instance_values)
+            if values.get('hostname') is not None:
+                values['hostname'] = utils.sanitize_hostname(
+                        values['hostname'])
+            elif values.get('display_name') is not None:
+                values['hostname'] = utils.sanitize_hostname(
+                        values['display_name'])
+            values_list.append(values)
+
+        instance_refs = self.db.instance_create_multi(context, values_list,
+                security_group_ids=security_groups)
+
+        # Commit the reservations
+        if reservations:
+            QUOTAS.commit(context, reservations)
+
+        instances = []
+        for instance in instance_refs:
+            instance_uuid = instance['uuid']
+
+            # send a state update notification for the initial create to
+            # show it going from non-existent to BUILDING
+            notifications.send_update_with_states(context, instance, None,
+                    vm_states.BUILDING, None, None, service="api")
+
+            # BlockDeviceMapping table
+            self._update_image_block_device_mapping(elevated, instance_type,
+                instance_uuid, image['properties'].get('mappings', []))
+            self._update_block_device_mapping(elevated, instance_type,
+                                              instance_uuid,
+                image['properties'].get('block_device_mapping', []))
+            # override via command line option
+            self._update_block_device_mapping(elevated, instance_type,
+                                              instance_uuid,
+                                              block_device_mapping)
+
+            # The default display name needs the instance id
+            if instance.get('display_name') is None:
+                display_name = self._default_display_name(instance['id'])
+                updates = {'display_name': display_name}
+                if instance.get('hostname') is None:
+                    updates['hostname'] = utils.sanitize_hostname(
+                            display_name)
+                instances.append(self.update(context, instance, **updates))
+            else:
+                instances.append(dict(instance.iteritems()))
+        return instances
+
+    def _get_security_group_ids(self, context, security_group):
+        """Look up the ids of the named security groups."""
+        if security_group is None:
+            security_group = ['default']
+        if not isinstance(security_group, list):
+            security_group = [security_group]
+
+        security_groups = []
+        for security_group_name in security_group:
+            group = self.db.security_group_get_by_name(context,
+                    context.project_id,
+                    security_group_name)
+            security_groups.append(group['id'])
+        return security_groups
+
+    def _store_image_properties(self, base_options, image):
+        """Store image properties in the system metadata so we can use
+        them later (for notifications, etc).  Only store what we can.
+        """
+        base_options.setdefault('system_metadata', {})
+        for key, value in image['properties'].iteritems():
+            new_value = str(value)[:255]
+            base_options['system_metadata']['image_%s' % key] = new_value
+
     def _default_display_name(self, instance_id):
         return "Server %s" % instance_id
 
@@ -985,7 +1078,8 @@ class API(base.Base):
         return inst
 
     def get_all(self, context, search_opts=None, sort_key='created_at',
-                sort_dir='desc'):
+                sort_dir='desc', limit=None, marker=None, columns=None,
+                columns_to_join=None, use_slave=False):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retrieve
@@ -996,7 +1090,14 @@ class API(base.Base):
 
         The results will be returned sorted in the order specified by the
         'sort_dir' parameter using the key specified in the 'sort_key'
-        parameter.
+        parameter.  If a 'marker' instance uuid is given, only the instances
+        after it are returned, and no more than 'limit' of them if 'limit'
+        is given.
+
+        If 'columns' is given, only those columns and the relationships in
+        'columns_to_join' are loaded for each instance.  If 'use_slave' is
+        set, the instances may be read from the slave database, and so may
+        miss the latest changes.
         """
 
         #TODO(bcwaldon): determine the best argument for target here
@@ -1063,7 +1164,9 @@ class API(base.Base):
                         return []
 
         inst_models = self._get_instances_by_filters(context, filters,
-                                                     sort_key, sort_dir)
+                sort_key, sort_dir, limit=limit, marker=marker,
+                columns=columns, columns_to_join=columns_to_join,
+                use_slave=use_slave)
 
         # Convert the models to dictionaries
         instances = []
@@ -1075,7 +1178,9 @@ class API(base.Base):
 
         return instances
 
-    def _get_instances_by_filters(self, context, filters, sort_key, sort_dir):
+    def _get_instances_by_filters(self, context, filters, sort_key, sort_dir,
+                                  limit=None, marker=None, columns=None,
+                                  columns_to_join=None, use_slave=False):
         if 'ip6' in filters or 'ip' in filters:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
@@ -1085,7 +1190,9 @@ class API(base.Base):
             filters['uuid'] = uuids
 
         return self.db.instance_get_all_by_filters(context, filters, sort_key,
-                                                   sort_dir)
+                sort_dir, limit=limit, marker=marker,
+                columns_to_join=columns_to_join, columns=columns,
+                use_slave=use_slave)
 
     @wrap_check_policy
     @check_instance_state(vm_state=[vm_states.ACTIVE, vm_states.SHUTOFF])
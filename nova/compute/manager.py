@@ -55,6 +55,7 @@ from nova.compute import task_states
 from nova.compute import utils as compute_utils
 from nova.compute import vm_states
 import nova.context
+from nova.db import batch as db_batch
 from nova import exception
 from nova import flags
 import nova.image
@@ -136,6 +137,14 @@ compute_opts = [
                default=60,
                help="Number of seconds between instance info_cache self "
                         "healing updates"),
+    cfg.IntOpt("heal_instance_info_cache_batch_size",
+               default=1,
+               help="Number of instances whose info_cache is healed on "
+                    "each healing update, with a single database write"),
+    cfg.IntOpt("periodic_task_db_write_batch_size",
+               default=100,
+               help="Maximum number of instances written to the database "
+                    "at once by the periodic tasks"),
     cfg.ListOpt('additional_compute_capabilities',
                default=[],
                help='a list of additional capabilities for this compute '
@@ -265,6 +274,17 @@ class ComputeManager(manager.SchedulerDependentManager):
 
         return instance_ref
 
+    def _instance_update_multi(self, context, values_by_uuid):
+        """Update several instances in the database, in one transaction,
+        using the values for each instance uuid."""
+
+        results = self.db.instance_update_multi_and_get_original(context,
+                values_by_uuid)
+        for old_ref, instance_ref in results.itervalues():
+            notifications.send_update(context, old_ref, instance_ref)
+
+        return results
+
     def _set_instance_error_state(self, context, instance_uuid):
         try:
             self._instance_update(context, instance_uuid,
@@ -2238,14 +2258,15 @@ class ComputeManager(manager.SchedulerDependentManager):
     @manager.periodic_task
     def _heal_instance_info_cache(self, context):
         """Called periodically.  On every call, try to update the
-        info_cache's network information for another instance by
+        info_cache's network information for other instances by
         calling to the network manager.
 
         This is implemented by keeping a cache of uuids of instances
-        that live on this host.  On each call, we pop one off of a
-        list, pull the DB record, and try the call to the network API.
-        If anything errors, we don't care.  It's possible the instance
-        has been deleted, etc.
+        that live on this host.  On each call, we pop
+        heal_instance_info_cache_batch_size of them off of a list, pull
+        the DB records, and try the calls to the network API.  The
+        info_caches are then written in one go.  If anything errors, we
+        don't care.  It's possible the instance has been deleted, etc.
         """
         heal_interval = FLAGS.heal_instance_info_cache_interval
         if not heal_interval:
@@ -2255,10 +2276,11 @@ class ComputeManager(manager.SchedulerDependentManager):
             return
         self._last_info_cache_heal = curr_time
 
+        batch_size = max(FLAGS.heal_instance_info_cache_batch_size, 1)
         instance_uuids = getattr(self, '_instance_uuids_to_heal', None)
-        instance = None
+        instances = []
 
-        while not instance or instance['host'] != self.host:
+        while len(instances) < batch_size:
             if instance_uuids:
                 try:
                     instance = self.db.instance_get_by_uuid(context,
@@ -2266,6 +2288,9 @@ class ComputeManager(manager.SchedulerDependentManager):
                 except exception.InstanceNotFound:
                     # Instance is gone.  Try to grab another.
                     continue
+            elif instances:
+                # Heal the rest on the next call
+                break
             else:
                 # No more in our copy of uuids.  Pull from the DB.
                 db_instances = self.db.instance_get_all_by_host(
@@ -2276,14 +2301,17 @@ class ComputeManager(manager.SchedulerDependentManager):
                 instance = db_instances.pop(0)
                 instance_uuids = [inst['uuid'] for inst in db_instances]
                 self._instance_uuids_to_heal = instance_uuids
+            if instance['host'] == self.host:
+                instances.append(instance)
 
-        # We have an instance now and it's ours
+        # We have instances now and they're ours
         try:
-            # Call to network API to get instance info.. this will
-            # force an update to the instance's info_cache
-            self.network_api.get_instance_nw_info(context, instance)
-            LOG.debug(_('Updated the info_cache for instance'),
-                    instance=instance)
+            # Call to network API to get the instances info.. this will
+            # force an update to the instances' info_caches
+            self.network_api.refresh_instances_cache(context, instances)
+            for instance in instances:
+                LOG.debug(_('Updated the info_cache for instance'),
+                        instance=instance)
         except Exception:
             # We don't care about any failures
             pass
@@ -2373,12 +2401,11 @@ class ComputeManager(manager.SchedulerDependentManager):
                 # they just don't get the info in the usage events.
                 return
 
-            for usage in bw_usage:
-                self.db.bw_usage_update(context,
-                                        usage['uuid'],
-                                        usage['mac_address'],
-                                        start_time,
-                                        usage['bw_in'], usage['bw_out'])
+            usages = [{'uuid': usage['uuid'],
+                       'mac': usage['mac_address'],
+                       'bw_in': usage['bw_in'],
+                       'bw_out': usage['bw_out']} for usage in bw_usage]
+            self.db.bw_usage_update_multi(context, start_time, usages)
 
     @manager.periodic_task
     def _report_driver_status(self, context):
@@ -2408,6 +2435,9 @@ class ComputeManager(manager.SchedulerDependentManager):
 
         If the instance is not found on the hypervisor, but is in the database,
         then it will be set to power_state.NOSTATE.
+
+        The power states that changed are written to the database in
+        batches of periodic_task_db_write_batch_size instances.
         """
         db_instances = self.db.instance_get_all_by_host(context, self.host)
 
@@ -2418,72 +2448,80 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.warn(_("Found %(num_db_instances)s in the database and "
                        "%(num_vm_instances)s on the hypervisor.") % locals())
 
-        for db_instance in db_instances:
-            # Allow other periodic tasks to do some work...
-            greenthread.sleep(0)
-            db_power_state = db_instance['power_state']
+        write_fn = functools.partial(self._instance_update_multi, context)
+        with db_batch.WriteBatch(write_fn,
+                FLAGS.periodic_task_db_write_batch_size) as updates:
+            for db_instance in db_instances:
+                self._sync_instance_power_state(context, db_instance,
+                                                updates)
+
+    def _sync_instance_power_state(self, context, db_instance, updates):
+        """Queue the power state of an instance for writing to the
+        database if the hypervisor reports a different one."""
+        # Allow other periodic tasks to do some work...
+        greenthread.sleep(0)
+        db_power_state = db_instance['power_state']
+        try:
+            vm_instance = self.driver.get_info(db_instance)
+            vm_power_state = vm_instance['state']
+        except exception.InstanceNotFound:
+            # This exception might have been caused by a race condition
+            # between _sync_power_states and live migrations. Two cases
+            # are possible as documented below. To this aim, refresh the
+            # DB instance state.
             try:
-                vm_instance = self.driver.get_info(db_instance)
-                vm_power_state = vm_instance['state']
+                u = self.db.instance_get_by_uuid(context,
+                                                 db_instance['uuid'])
+                if self.host != u['host']:
+                    # on the sending end of nova-compute _sync_power_state
+                    # may have yielded to the greenthread performing a live
+                    # migration; this in turn has changed the resident-host
+                    # for the VM; However, the instance is still active, it
+                    # is just in the process of migrating to another host.
+                    # This implies that the compute source must relinquish
+                    # control to the compute destination.
+                    LOG.info(_("During the sync_power process the "
+                               "instance has moved from "
+                               "host %(src)s to host %(dst)s") %
+                               {'src': self.host,
+                                'dst': u['host']},
+                             instance=db_instance)
+                    return
+                elif (u['host'] == self.host and
+                      u['vm_state'] == vm_states.MIGRATING):
+                    # on the receiving end of nova-compute, it could happen
+                    # that the DB instance already report the new resident
+                    # but the actual VM has not showed up on the hypervisor
+                    # yet. In this case, let's allow the loop to continue
+                    # and run the state sync in a later round
+                    LOG.info(_("Instance is in the process of "
+                               "migrating to this host. Wait next "
+                               "sync_power cycle before setting "
+                               "power state to NOSTATE"),
+                               instance=db_instance)
+                    return
+                else:
+                    LOG.warn(_("Instance found in database but not "
+                               "known by hypervisor. Setting power "
+                               "state to NOSTATE"), locals(),
+                               instance=db_instance)
+                    vm_power_state = power_state.NOSTATE
             except exception.InstanceNotFound:
-                # This exception might have been caused by a race condition
-                # between _sync_power_states and live migrations. Two cases
-                # are possible as documented below. To this aim, refresh the
-                # DB instance state.
-                try:
-                    u = self.db.instance_get_by_uuid(context,
-                                                     db_instance['uuid'])
-                    if self.host != u['host']:
-                        # on the sending end of nova-compute _sync_power_state
-                        # may have yielded to the greenthread performing a live
-                        # migration; this in turn has changed the resident-host
-                        # for the VM; However, the instance is still active, it
-                        # is just in the process of migrating to another host.
-                        # This implies that the compute source must relinquish
-                        # control to the compute destination.
-                        LOG.info(_("During the sync_power process the "
-                                   "instance has moved from "
-                                   "host %(src)s to host %(dst)s") %
-                                   {'src': self.host,
-                                    'dst': u['host']},
-                                 instance=db_instance)
-                    elif (u['host'] == self.host and
-                          u['vm_state'] == vm_states.MIGRATING):
-                        # on the receiving end of nova-compute, it could happen
-                        # that the DB instance already report the new resident
-                        # but the actual VM has not showed up on the hypervisor
-                        # yet. In this case, let's allow the loop to continue
-                        # and run the state sync in a later round
-                        LOG.info(_("Instance is in the process of "
-                                   "migrating to this host. Wait next "
-                                   "sync_power cycle before setting "
-                                   "power state to NOSTATE"),
-                                   instance=db_instance)
-                    else:
-                        LOG.warn(_("Instance found in database but not "
-                                   "known by hypervisor. Setting power "
-                                   "state to NOSTATE"), locals(),
-                                   instance=db_instance)
-                        vm_power_state = power_state.NOSTATE
-                except exception.InstanceNotFound:
-                    # no need to update vm_state for deleted instances
-                    continue
+                # no need to update vm_state for deleted instances
+                return
 
-            if vm_power_state == db_power_state:
-                continue
+        if vm_power_state == db_power_state:
+            return
 
-            if (vm_power_state in (power_state.NOSTATE,
-                                   power_state.SHUTDOWN,
-                                   power_state.CRASHED)
-                and db_instance['vm_state'] == vm_states.ACTIVE):
-                self._instance_update(context,
-                                      db_instance['uuid'],
-                                      power_state=vm_power_state,
-                                      vm_state=vm_states.SHUTOFF)
-            else:
-                self._instance_update(context,
-                                      db_instance['uuid'],
-                                      power_state=vm_power_state)
+        if (vm_power_state in (power_state.NOSTATE,
+                               power_state.SHUTDOWN,
+                               power_state.CRASHED)
+            and db_instance['vm_state'] == vm_states.ACTIVE):
+            updates.add(db_instance['uuid'],
+                        power_state=vm_power_state,
+                        vm_state=vm_states.SHUTOFF)
+        else:
+            updates.add(db_instance['uuid'], power_state=vm_power_state)
 
     @manager.periodic_task
     def _reclaim_queued_deletes(self, context):
@@ -45,7 +45,7 @@ class RequestContext(object):
                  roles=None, remote_address=None, timestamp=None,
                  request_id=None, auth_token=None, overwrite=True,
                  quota_class=None, user_name=None, project_name=None,
-                 **kwargs):
+                 use_primary_db=False, **kwargs):
         """
         :param read_deleted: 'no' indicates deleted records are hidden, 'yes'
             indicates deleted records are visible, 'only' indicates that
@@ -54,6 +54,10 @@ class RequestContext(object):
         :param overwrite: Set to False to ensure that the greenthread local
             copy of the index is not overwritten.
 
+        :param use_primary_db: Set to True to read from the primary database
+            even where the DB API would read from sql_slave_connection, for
+            callers that must see their own recent writes.
+
         :param kwargs: Extra arguments that might be present, but we ignore
             because they possibly came in from older rpc messages.
         """
@@ -87,6 +91,9 @@ class RequestContext(object):
         self.quota_class = quota_class
         self.user_name = user_name
         self.project_name = project_name
+        self.use_primary_db = use_primary_db
+        # Set by db.enable_request_cache(); not sent over RPC.
+        self.db_cache = None
 
         if overwrite or not hasattr(local.store, 'context'):
             self.update_store()
@@ -121,7 +128,8 @@ class RequestContext(object):
                 'auth_token': self.auth_token,
                 'quota_class': self.quota_class,
                 'user_name': self.user_name,
-                'project_name': self.project_name}
+                'project_name': self.project_name,
+                'use_primary_db': self.use_primary_db}
 
     @classmethod
     def from_dict(cls, values):
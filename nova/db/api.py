@@ -43,6 +43,7 @@ these objects be simple dictionaries.
 
 """
 
+from nova.db import request_cache
 from nova import exception
 from nova import flags
 from nova.openstack.common import cfg
@@ -65,6 +66,11 @@ db_opts = [
     cfg.StrOpt('snapshot_name_template',
                default='snapshot-%s',
                help='Template string to be used to generate snapshot names'),
+    cfg.BoolOpt('db_request_cache',
+                default=False,
+                help='Memoize repeated DB lookups of instances, instance '
+                     'types, networks, security groups and block device '
+                     'mappings for the lifetime of each API request'),
     ]
 
 FLAGS = flags.FLAGS
@@ -87,6 +93,15 @@ class NoMoreTargets(exception.NovaException):
 ###################
 
 
+def enable_request_cache(context):
+    """Memoize the DB lookups made with context, if db_request_cache."""
+    if FLAGS.db_request_cache:
+        context.db_cache = request_cache.RequestCache()
+
+
+###################
+
+
 def constraint(**conditions):
     """Return a constraint object suitable for use with some updates."""
     return IMPL.constraint(**conditions)
@@ -211,10 +226,16 @@ def compute_node_get_by_host(context, host):
 
 
 def compute_node_utilization_update(context, host, free_ram_mb_delta=0,
-                          free_disk_gb_delta=0, work_delta=0, vm_delta=0):
+                          free_disk_gb_delta=0, work_delta=0, vm_delta=0,
+                          min_free_ram_mb=None):
+    """Update a compute node's utilization by a series of deltas.
+
+    If min_free_ram_mb is given the update is only made if the node has at
+    least that much free RAM, otherwise ComputeNodeClaimConflict is raised.
+    """
     return IMPL.compute_node_utilization_update(context, host,
                           free_ram_mb_delta, free_disk_gb_delta, work_delta,
-                          vm_delta)
+                          vm_delta, min_free_ram_mb)
 
 
 def compute_node_utilization_set(context, host, free_ram_mb=None,
@@ -537,27 +558,39 @@ def virtual_interface_get_all(context):
 ####################
 
 
+@request_cache.invalidates('instances')
 def instance_create(context, values):
     """Create an instance from the values dictionary."""
     return IMPL.instance_create(context, values)
 
 
+@request_cache.invalidates('instances')
+def instance_create_multi(context, values_list, security_group_ids=None):
+    """Create several instances from the values dictionaries in one
+    transaction, adding each of them to the given security groups."""
+    return IMPL.instance_create_multi(context, values_list,
+                                      security_group_ids=security_group_ids)
+
+
 def instance_data_get_for_project(context, project_id, session=None):
     """Get (instance_count, total_cores, total_ram) for project."""
     return IMPL.instance_data_get_for_project(context, project_id,
                                               session=session)
 
 
+@request_cache.invalidates('instances')
 def instance_destroy(context, instance_uuid, constraint=None):
     """Destroy the instance or raise if it does not exist."""
     return IMPL.instance_destroy(context, instance_uuid, constraint)
 
 
+@request_cache.cached('instances')
 def instance_get_by_uuid(context, uuid):
     """Get an instance or raise if it does not exist."""
     return IMPL.instance_get_by_uuid(context, uuid)
 
 
+@request_cache.cached('instances')
 def instance_get(context, instance_id):
     """Get an instance or raise if it does not exist."""
     return IMPL.instance_get(context, instance_id)
@@ -569,10 +602,22 @@ def instance_get_all(context):
 
 
 def instance_get_all_by_filters(context, filters, sort_key='created_at',
-                                sort_dir='desc'):
-    """Get all instances that match all filters."""
+                                sort_dir='desc', limit=None, marker=None,
+                                columns_to_join=None, columns=None,
+                                use_slave=False):
+    """Get all instances that match all filters.
+
+    If columns is given only those columns are loaded, and read-only
+    records are returned instead of instance models.  If use_slave is set
+    the slave database is read, if there is one, so only callers that can
+    live with its replication lag should set it.
+    """
     return IMPL.instance_get_all_by_filters(context, filters, sort_key,
-                                            sort_dir)
+                                            sort_dir, limit=limit,
+                                            marker=marker,
+                                            columns_to_join=columns_to_join,
+                                            columns=columns,
+                                            use_slave=use_slave)
 
 
 def instance_get_active_by_window(context, begin, end=None, project_id=None):
@@ -621,6 +666,7 @@ def instance_get_all_hung_in_rebooting(context, reboot_window):
     return IMPL.instance_get_all_hung_in_rebooting(context, reboot_window)
 
 
+@request_cache.invalidates('instances')
 def instance_test_and_set(context, instance_uuid, attr, ok_states,
                           new_state):
     """Atomically check if an instance is in a valid state, and if it is, set
@@ -630,6 +676,7 @@ def instance_test_and_set(context, instance_uuid, attr, ok_states,
                                       ok_states, new_state)
 
 
+@request_cache.invalidates('instances')
 def instance_update(context, instance_uuid, values):
     """Set the given properties on an instance and update it.
 
@@ -639,6 +686,7 @@ def instance_update(context, instance_uuid, values):
     return IMPL.instance_update(context, instance_uuid, values)
 
 
+@request_cache.invalidates('instances')
 def instance_update_and_get_original(context, instance_uuid, values):
     """Set the given properties on an instance and update it. Return
     a shallow copy of the original instance reference, as well as the
@@ -656,12 +704,28 @@ def instance_update_and_get_original(context, instance_uuid, values):
                                                  values)
 
 
+@request_cache.invalidates('instances')
+def instance_update_multi_and_get_original(context, values_by_uuid):
+    """Set the given properties on several instances in one transaction.
+
+    :param values_by_uuid: = dict of instance uuid to dict of column values
+
+    :returns: a dict of instance uuid to a tuple of the form
+              (old_instance_ref, new_instance_ref), without the instances
+              that do not exist.
+    """
+    return IMPL.instance_update_multi_and_get_original(context,
+                                                       values_by_uuid)
+
+
+@request_cache.invalidates('instances', 'security_groups')
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance."""
     return IMPL.instance_add_security_group(context, instance_id,
                                             security_group_id)
 
 
+@request_cache.invalidates('instances', 'security_groups')
 def instance_remove_security_group(context, instance_id, security_group_id):
     """Disassociate the given security group from the given instance."""
     return IMPL.instance_remove_security_group(context, instance_id,
@@ -676,6 +740,7 @@ def instance_get_id_to_uuid_mapping(context, ids):
 ###################
 
 
+@request_cache.invalidates('instances')
 def instance_info_cache_create(context, values):
     """Create a new instance cache record in the table.
 
@@ -693,6 +758,7 @@ def instance_info_cache_get(context, instance_uuid):
     return IMPL.instance_info_cache_get(context, instance_uuid)
 
 
+@request_cache.invalidates('instances')
 def instance_info_cache_update(context, instance_uuid, values):
     """Update an instance info cache record in the table.
 
@@ -702,6 +768,16 @@ def instance_info_cache_update(context, instance_uuid, values):
     return IMPL.instance_info_cache_update(context, instance_uuid, values)
 
 
+@request_cache.invalidates('instances')
+def instance_info_cache_update_multi(context, values_by_uuid):
+    """Update the info cache records of several instances at once.
+
+    :param values_by_uuid: = dict of instance uuid to dict of column values
+    """
+    return IMPL.instance_info_cache_update_multi(context, values_by_uuid)
+
+
+@request_cache.invalidates('instances')
 def instance_info_cache_delete(context, instance_uuid):
     """Deletes an existing instance_info_cache record
 
@@ -746,6 +822,7 @@ def key_pair_count_by_user(context, user_id):
 ####################
 
 
+@request_cache.invalidates('networks')
 def network_associate(context, project_id, force=False):
     """Associate a free network to a project."""
     return IMPL.network_associate(context, project_id, force)
@@ -761,6 +838,7 @@ def network_count_reserved_ips(context, network_id):
     return IMPL.network_count_reserved_ips(context, network_id)
 
 
+@request_cache.invalidates('networks')
 def network_create_safe(context, values):
     """Create a network from the values dict.
 
@@ -771,6 +849,7 @@ def network_create_safe(context, values):
     return IMPL.network_create_safe(context, values)
 
 
+@request_cache.invalidates('networks')
 def network_delete_safe(context, network_id):
     """Delete network with key network_id.
 
@@ -785,11 +864,13 @@ def network_create_fixed_ips(context, network_id, num_vpn_clients):
     return IMPL.network_create_fixed_ips(context, network_id, num_vpn_clients)
 
 
+@request_cache.invalidates('networks')
 def network_disassociate(context, network_id):
     """Disassociate the network from project or raise if it does not exist."""
     return IMPL.network_disassociate(context, network_id)
 
 
+@request_cache.cached('networks')
 def network_get(context, network_id):
     """Get a network or raise if it does not exist."""
     return IMPL.network_get(context, network_id)
@@ -818,6 +899,7 @@ def network_get_by_bridge(context, bridge):
     return IMPL.network_get_by_bridge(context, bridge)
 
 
+@request_cache.cached('networks')
 def network_get_by_uuid(context, uuid):
     """Get a network by uuid or raise if it does not exist."""
     return IMPL.network_get_by_uuid(context, uuid)
@@ -848,16 +930,19 @@ def network_get_index(context, network_id):
     return IMPL.network_get_index(context, network_id)
 
 
+@request_cache.invalidates('networks')
 def network_set_cidr(context, network_id, cidr):
     """Set the Classless Inner Domain Routing for the network."""
     return IMPL.network_set_cidr(context, network_id, cidr)
 
 
+@request_cache.invalidates('networks')
 def network_set_host(context, network_id, host_id):
     """Safely set the host for network."""
     return IMPL.network_set_host(context, network_id, host_id)
 
 
+@request_cache.invalidates('networks')
 def network_update(context, network_id, values):
     """Set the given properties on a network and update it.
 
@@ -1057,6 +1142,37 @@ def reservation_expire(context):
     return IMPL.reservation_expire(context)
 
 
+def quota_reserve_counters(context, resources, quotas, requests,
+                           until_refresh):
+    """Check quotas and create reservations for several requests at once.
+
+    Unlike quota_reserve(), the usages are not locked nor refreshed.
+    """
+    return IMPL.quota_reserve_counters(context, resources, quotas,
+                                       requests, until_refresh)
+
+
+def reservation_commit_counters(context, reservations):
+    """Commit quota reservations without locking the usages."""
+    return IMPL.reservation_commit_counters(context, reservations)
+
+
+def reservation_rollback_counters(context, reservations):
+    """Roll back quota reservations without locking the usages."""
+    return IMPL.reservation_rollback_counters(context, reservations)
+
+
+def reservation_expire_counters(context):
+    """Roll back any expired reservations without locking the usages."""
+    return IMPL.reservation_expire_counters(context)
+
+
+def quota_usage_refresh_stale(context, resources, until_refresh, max_age):
+    """Resync the quota usages which are due a refresh."""
+    return IMPL.quota_usage_refresh_stale(context, resources, until_refresh,
+                                          max_age)
+
+
 ###################
 
 
@@ -1199,33 +1315,39 @@ def snapshot_update(context, snapshot_id, values):
 ####################
 
 
+@request_cache.invalidates('block_device_mappings')
 def block_device_mapping_create(context, values):
     """Create an entry of block device mapping"""
     return IMPL.block_device_mapping_create(context, values)
 
 
+@request_cache.invalidates('block_device_mappings')
 def block_device_mapping_update(context, bdm_id, values):
     """Update an entry of block device mapping"""
     return IMPL.block_device_mapping_update(context, bdm_id, values)
 
 
+@request_cache.invalidates('block_device_mappings')
 def block_device_mapping_update_or_create(context, values):
     """Update an entry of block device mapping.
     If not existed, create a new entry"""
     return IMPL.block_device_mapping_update_or_create(context, values)
 
 
+@request_cache.cached('block_device_mappings')
 def block_device_mapping_get_all_by_instance(context, instance_uuid):
     """Get all block device mapping belonging to an instance"""
     return IMPL.block_device_mapping_get_all_by_instance(context,
                                                          instance_uuid)
 
 
+@request_cache.invalidates('block_device_mappings')
 def block_device_mapping_destroy(context, bdm_id):
     """Destroy the block device mapping."""
     return IMPL.block_device_mapping_destroy(context, bdm_id)
 
 
+@request_cache.invalidates('block_device_mappings')
 def block_device_mapping_destroy_by_instance_and_volume(context, instance_uuid,
                                                         volume_id):
     """Destroy the block device mapping or raise if it does not exist."""
@@ -1241,11 +1363,13 @@ def security_group_get_all(context):
     return IMPL.security_group_get_all(context)
 
 
+@request_cache.cached('security_groups')
 def security_group_get(context, security_group_id):
     """Get security group by its id."""
     return IMPL.security_group_get(context, security_group_id)
 
 
+@request_cache.cached('security_groups')
 def security_group_get_by_name(context, project_id, group_name):
     """Returns a security group with the specified name from a project."""
     return IMPL.security_group_get_by_name(context, project_id, group_name)
@@ -1271,11 +1395,13 @@ def security_group_in_use(context, group_id):
     return IMPL.security_group_in_use(context, group_id)
 
 
+@request_cache.invalidates('instances', 'security_groups')
 def security_group_create(context, values):
     """Create a new security group."""
     return IMPL.security_group_create(context, values)
 
 
+@request_cache.invalidates('instances', 'security_groups')
 def security_group_destroy(context, security_group_id):
     """Deletes a security group."""
     return IMPL.security_group_destroy(context, security_group_id)
@@ -1290,6 +1416,7 @@ def security_group_count_by_project(context, project_id, session=None):
 ####################
 
 
+@request_cache.invalidates('instances', 'security_groups')
 def security_group_rule_create(context, values):
     """Create a new security group."""
     return IMPL.security_group_rule_create(context, values)
@@ -1308,6 +1435,7 @@ def security_group_rule_get_by_security_group_grantee(context,
                                                              security_group_id)
 
 
+@request_cache.invalidates('instances', 'security_groups')
 def security_group_rule_destroy(context, security_group_rule_id):
     """Deletes a security group rule."""
     return IMPL.security_group_rule_destroy(context, security_group_rule_id)
@@ -1509,6 +1637,7 @@ def console_get(context, console_id, instance_uuid=None):
     ##################
 
 
+@request_cache.invalidates('instance_types', 'instances')
 def instance_type_create(context, values):
     """Create a new instance type."""
     return IMPL.instance_type_create(context, values)
@@ -1520,21 +1649,25 @@ def instance_type_get_all(context, inactive=False, filters=None):
         context, inactive=inactive, filters=filters)
 
 
+@request_cache.cached('instance_types')
 def instance_type_get(context, id):
     """Get instance type by id."""
     return IMPL.instance_type_get(context, id)
 
 
+@request_cache.cached('instance_types')
 def instance_type_get_by_name(context, name):
     """Get instance type by name."""
     return IMPL.instance_type_get_by_name(context, name)
 
 
+@request_cache.cached('instance_types')
 def instance_type_get_by_flavor_id(context, id):
     """Get instance type by name."""
     return IMPL.instance_type_get_by_flavor_id(context, id)
 
 
+@request_cache.invalidates('instance_types', 'instances')
 def instance_type_destroy(context, name):
     """Delete an instance type."""
     return IMPL.instance_type_destroy(context, name)
@@ -1548,11 +1681,13 @@ def instance_metadata_get(context, instance_uuid):
     return IMPL.instance_metadata_get(context, instance_uuid)
 
 
+@request_cache.invalidates('instances')
 def instance_metadata_delete(context, instance_uuid, key):
     """Delete the given metadata item."""
     IMPL.instance_metadata_delete(context, instance_uuid, key)
 
 
+@request_cache.invalidates('instances')
 def instance_metadata_update(context, instance_uuid, metadata, delete):
     """Update metadata if it exists, otherwise create it."""
     IMPL.instance_metadata_update(context, instance_uuid, metadata, delete)
@@ -1566,11 +1701,13 @@ def instance_system_metadata_get(context, instance_uuid):
     return IMPL.instance_system_metadata_get(context, instance_uuid)
 
 
+@request_cache.invalidates('instances')
 def instance_system_metadata_delete(context, instance_uuid, key):
     """Delete the given system metadata item."""
     IMPL.instance_system_metadata_delete(context, instance_uuid, key)
 
 
+@request_cache.invalidates('instances')
 def instance_system_metadata_update(context, instance_uuid, metadata, delete):
     """Update metadata if it exists, otherwise create it."""
     IMPL.instance_system_metadata_update(
@@ -1628,6 +1765,12 @@ def bw_usage_update(context,
                                 bw_in, bw_out)
 
 
+def bw_usage_update_multi(context, start_period, usages):
+    """Update cached bw usage for several instances at once.
+       Creates new records if needed."""
+    return IMPL.bw_usage_update_multi(context, start_period, usages)
+
+
 ####################
 
 
@@ -1636,11 +1779,13 @@ def instance_type_extra_specs_get(context, instance_type_id):
     return IMPL.instance_type_extra_specs_get(context, instance_type_id)
 
 
+@request_cache.invalidates('instance_types', 'instances')
 def instance_type_extra_specs_delete(context, instance_type_id, key):
     """Delete the given extra specs item."""
     IMPL.instance_type_extra_specs_delete(context, instance_type_id, key)
 
 
+@request_cache.invalidates('instance_types', 'instances')
 def instance_type_extra_specs_update_or_create(context, instance_type_id,
                                                extra_specs):
     """Create or update instance type extra specs. This adds or modifies the
@@ -1921,3 +2066,18 @@ def instance_action_log_get_by_instance_uuid(context, values):
     """Get instance action logs for an instance by it's uuid
     Returns all log entries, sorted by date"""
     return IMPL.instance_action_log_get_by_instance_uuid(context, values)
+
+
+###################
+
+
+def archive_deleted_rows(context, max_rows=None, batch_size=1000):
+    """Move soft-deleted rows to the shadow tables in small batches."""
+    return IMPL.archive_deleted_rows(context, max_rows=max_rows,
+                                     batch_size=batch_size)
+
+
+def purge_shadow_rows(context, before, max_rows=None, batch_size=1000):
+    """Delete the archived rows which were deleted before a given time."""
+    return IMPL.purge_shadow_rows(context, before, max_rows=max_rows,
+                                  batch_size=batch_size)
@@ -0,0 +1,80 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Coalescing of row writes into bulk DB API calls.
+
+Periodic tasks that walk every instance of a host used to write each
+change as it was found, one transaction per row.  A WriteBatch queues
+those writes instead and hands them to one of the *_multi DB API calls,
+so a pass over the host costs a few round trips::
+
+    with batch.WriteBatch(write_fn) as updates:
+        for instance in instances:
+            updates.add(instance['uuid'], power_state=state)
+"""
+
+from nova import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+class WriteBatch(object):
+    """Queues writes to rows and writes them with a single call.
+
+    Values written to the same key are merged, the later ones winning.
+    flush() calls write_fn with a dict of key to values and returns what
+    it returns.  The batch flushes itself when max_size keys are queued,
+    and on leaving the with block when used as a context manager.
+    """
+
+    def __init__(self, write_fn, max_size=None):
+        self.write_fn = write_fn
+        self.max_size = max_size
+        # { <key> : { <column> : <value>, ... } }
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, key, **values):
+        """Queue values to write to the row with the given key."""
+        self.pending.setdefault(key, {}).update(values)
+        if self.max_size and len(self.pending) >= self.max_size:
+            self.flush()
+
+    def flush(self):
+        """Write the queued values, if any."""
+        if not self.pending:
+            return None
+        pending = self.pending
+        self.pending = {}
+        return self.write_fn(pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.flush()
+            return
+        # The writes queued before the error would have been made if they
+        # had not been batched, but don't hide the error if they fail.
+        try:
+            self.flush()
+        except Exception:
+            LOG.exception(_("Failed to write a batch of queued writes"))
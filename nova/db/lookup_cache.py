@@ -0,0 +1,89 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Process wide cache of the lookups of rarely written tables.
+
+Instance types and aggregates are read on nearly every API and scheduler
+path but are only written by admins.  The DB API keeps the results of
+their lookups in a LookupCache, and every write to one of those tables
+bumps a version stamp of the table in the database.  The cache compares
+the version stamps with the ones it last saw at most once every interval
+seconds, dropping the results of the tables that were written since.
+Writes made by the process itself drop its own cached results at once.
+"""
+
+from nova.openstack.common import timeutils
+
+
+class LookupCache(object):
+    """Results of lookups, dropped when the version of their table moves.
+
+    get_versions is called with no arguments and returns a dict of table
+    name to version stamp.
+    """
+
+    def __init__(self, get_versions):
+        self.get_versions = get_versions
+        # { <table> : { <key> : <result>, ... } }
+        self.tables = {}
+        # { <table> : <version> } as of checked_at
+        self.versions = {}
+        self.checked_at = None
+        # { <table> : <count of invalidations> }, to spot lookups that
+        # raced with an invalidation
+        self.generations = {}
+
+    def _check_versions(self, interval):
+        if (self.checked_at is not None and
+                not timeutils.is_older_than(self.checked_at, interval)):
+            return
+        checked_at = timeutils.utcnow()
+        versions = self.get_versions()
+        for table in set(versions) | set(self.versions):
+            if versions.get(table) != self.versions.get(table):
+                self.invalidate(table)
+        self.versions = versions
+        self.checked_at = checked_at
+
+    def get(self, table, key, fetch, interval):
+        """Return the result cached under key, calling fetch if none.
+
+        The version stamps are checked first if they were last checked
+        more than interval seconds ago.
+        """
+        self._check_versions(interval)
+        try:
+            return self.tables[table][key]
+        except KeyError:
+            pass
+        generation = self.generations.get(table, 0)
+        result = fetch()
+        if self.generations.get(table, 0) == generation:
+            self.tables.setdefault(table, {})[key] = result
+        return result
+
+    def invalidate(self, *tables):
+        """Drop the results cached for the given tables."""
+        for table in tables:
+            self.tables.pop(table, None)
+            self.generations[table] = self.generations.get(table, 0) + 1
+
+    def clear(self):
+        """Drop all the cached results and version stamps."""
+        self.invalidate(*self.tables.keys())
+        self.versions = {}
+        self.checked_at = None
@@ -0,0 +1,100 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Memoization of DB API reads for the lifetime of one request.
+
+Serving a single API request looks up the same instance, instance type or
+security group several times.  When the API enables it on the request's
+context, the DB API calls decorated with cached() return the result of
+the first lookup for the rest of the request, and the calls decorated
+with invalidates() drop what was memoized for the entities they write.
+
+The memo hangs off the RequestContext, so it is shared with the copies
+made by context.elevated() but is not sent over RPC.  The memoized
+results are the objects the DB API returned the first time, so callers
+must not modify them.
+"""
+
+import functools
+
+
+class RequestCache(object):
+    """DB API results memoized per entity."""
+
+    def __init__(self):
+        # { <entity> : { <key> : <result>, ... } }
+        self.entities = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, entity, key, fetch):
+        """Return the result memoized under key, calling fetch if none."""
+        results = self.entities.setdefault(entity, {})
+        try:
+            result = results[key]
+        except KeyError:
+            self.misses += 1
+            result = results[key] = fetch()
+        else:
+            self.hits += 1
+        return result
+
+    def invalidate(self, *entities):
+        """Drop the results memoized for the given entities."""
+        for entity in entities:
+            self.entities.pop(entity, None)
+
+
+def _get_cache(context):
+    return getattr(context, 'db_cache', None)
+
+
+def cached(entity):
+    """Memoize the results of a DB API read of entity per request.
+
+    The results are keyed on the arguments of the call and on the parts of
+    the context that filter what the DB API returns.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(context, *args, **kwargs):
+            cache = _get_cache(context)
+            if cache is None:
+                return f(context, *args, **kwargs)
+            key = (f.__name__, context.read_deleted, context.is_admin,
+                   context.project_id, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return f(context, *args, **kwargs)
+            return cache.get(entity, key,
+                             lambda: f(context, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def invalidates(*entities):
+    """Drop the memoized reads of entities when a DB API write is made."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(context, *args, **kwargs):
+            cache = _get_cache(context)
+            if cache is not None:
+                cache.invalidate(*entities)
+            return f(context, *args, **kwargs)
+        return wrapper
+    return decorator
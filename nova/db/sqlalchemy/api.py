@@ -29,8 +29,11 @@ from nova import block_device
 from nova.compute import aggregate_states
 from nova.compute import vm_states
 from nova import db
+from nova.db import lookup_cache
 from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy.session import get_engine
 from nova.db.sqlalchemy.session import get_session
+from nova.db.sqlalchemy.session import slave_reads
 from nova import exception
 from nova import flags
 from nova import log as logging
@@ -38,14 +41,19 @@ from nova.openstack.common import timeutils
 from nova import utils
 from sqlalchemy import and_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy import MetaData
 from sqlalchemy import or_
+from sqlalchemy import Table
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
 from sqlalchemy.sql.expression import asc
 from sqlalchemy.sql.expression import desc
+from sqlalchemy.sql.expression import exists
 from sqlalchemy.sql.expression import literal_column
 from sqlalchemy.sql.expression import or_
+from sqlalchemy.sql.expression import select
 from sqlalchemy.sql import func
+from sqlalchemy.types import String
 
 FLAGS = flags.FLAGS
 flags.DECLARE('reserved_host_disk_mb', 'nova.scheduler.host_manager')
@@ -189,6 +197,108 @@ def require_aggregate_exists(f):
     return wrapper
 
 
+def read_from_slave(f):
+    """Decorator to read from the slave database, if there is one.
+
+    Only for read-only calls whose callers can live with the replication
+    lag of sql_slave_connection.  The primary database is read instead if
+    the caller passes in its own session or its context has use_primary_db
+    set.
+
+    The first argument to the wrapped function must be the context.
+    """
+    @functools.wraps(f)
+    def wrapper(context, *args, **kwargs):
+        if (not FLAGS.sql_slave_connection or
+                kwargs.get('session') is not None or
+                getattr(context, 'use_primary_db', False)):
+            return f(context, *args, **kwargs)
+        with slave_reads():
+            return f(context, *args, **kwargs)
+    return wrapper
+
+
+def _cache_versions_get():
+    session = get_session()
+    return dict((version_ref.name, version_ref.version)
+                for version_ref in session.query(models.CacheVersion))
+
+
+def _cache_version_bump(name):
+    session = get_session()
+    with session.begin():
+        updated = session.query(models.CacheVersion).\
+                filter_by(name=name).\
+                update({'version': models.CacheVersion.version + 1},
+                       synchronize_session=False)
+        if not updated:
+            version_ref = models.CacheVersion()
+            version_ref.update({'name': name, 'version': 1})
+            version_ref.save(session=session)
+
+
+_LOOKUP_CACHE = lookup_cache.LookupCache(_cache_versions_get)
+
+
+def _freeze(value):
+    """Turn dicts and lists into tuples, so value can be a dict key."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def lookup_cached(table, copy_results=False):
+    """Decorator to cache the results of a lookup of table process wide.
+
+    Only for the tables written through functions decorated with
+    lookup_writes(), so the results are dropped when they go stale.
+    Lookups given their own session are not cached.  With copy_results
+    set, every caller gets a copy of the cached result to modify.
+
+    The first argument to the wrapped function must be the context.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(context, *args, **kwargs):
+            interval = FLAGS.db_lookup_cache_interval
+            if interval <= 0 or kwargs.get('session') is not None:
+                return f(context, *args, **kwargs)
+            key = (f.__name__, context.read_deleted, _freeze(args),
+                   _freeze(kwargs))
+            try:
+                hash(key)
+            except TypeError:
+                return f(context, *args, **kwargs)
+            result = _LOOKUP_CACHE.get(table, key,
+                                       lambda: f(context, *args, **kwargs),
+                                       interval)
+            if copy_results:
+                result = copy.deepcopy(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def lookup_writes(table):
+    """Decorator for the writes to a table cached by lookup_cached().
+
+    Bumps the version of the table, so the lookups cached by every
+    service are dropped, and drops the lookups cached by this one.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _LOOKUP_CACHE.invalidate(table)
+                _cache_version_bump(table)
+        return wrapper
+    return decorator
+
+
 def model_query(context, *args, **kwargs):
     """Query helper that accounts for context's `read_deleted` field.
 
@@ -485,6 +595,7 @@ def _compute_node_get(context, compute_id, session=None):
 
 
 @require_admin_context
+@read_from_slave
 def compute_node_get_all(context, session=None):
     return model_query(context, models.ComputeNode, session=session).\
                     options(joinedload('service')).\
@@ -560,10 +671,22 @@ def compute_node_get_by_host(context, host):
 
 
 def compute_node_utilization_update(context, host, free_ram_mb_delta=0,
-                          free_disk_gb_delta=0, work_delta=0, vm_delta=0):
+                          free_disk_gb_delta=0, work_delta=0, vm_delta=0,
+                          min_free_ram_mb=None):
     """Update a specific ComputeNode entry by a series of deltas.
     Do this as a single atomic action and lock the row for the
-    duration of the operation. Requires that ComputeNode record exist."""
+    duration of the operation. Requires that ComputeNode record exist.
+
+    If min_free_ram_mb is given, the row is not locked.  Instead the
+    update is only made if the node still has at least min_free_ram_mb
+    free, and ComputeNodeClaimConflict is raised if it does not.  This
+    lets several schedulers claim resources on the same hosts
+    optimistically."""
+    if min_free_ram_mb is not None:
+        return _compute_node_utilization_claim(context, host,
+                free_ram_mb_delta, free_disk_gb_delta, work_delta, vm_delta,
+                min_free_ram_mb)
+
     session = get_session()
     compute_node = None
     with session.begin(subtransactions=True):
@@ -593,6 +716,43 @@ def compute_node_utilization_update(context, host, free_ram_mb_delta=0,
     return compute_node
 
 
+def _compute_node_utilization_claim(context, host, free_ram_mb_delta,
+                                    free_disk_gb_delta, work_delta,
+                                    vm_delta, min_free_ram_mb):
+    session = get_session()
+    with session.begin(subtransactions=True):
+        compute_node = session.query(models.ComputeNode).\
+                              join('service').\
+                              filter(models.Service.host == host).\
+                              filter(models.ComputeNode.deleted == False).\
+                              first()
+        if compute_node is None:
+            raise exception.NotFound(_("No ComputeNode for %(host)s") %
+                                     locals())
+
+        # Compare and update in a single statement, so a concurrent claim
+        # for the same RAM makes this one match no rows.
+        table = models.ComputeNode.__table__
+        values = {'free_ram_mb': table.c.free_ram_mb + free_ram_mb_delta}
+        if free_disk_gb_delta != 0:
+            values['free_disk_gb'] = (table.c.free_disk_gb +
+                                      free_disk_gb_delta)
+        if work_delta != 0:
+            values['current_workload'] = (table.c.current_workload +
+                                          work_delta)
+        if vm_delta != 0:
+            values['running_vms'] = table.c.running_vms + vm_delta
+        result = session.query(models.ComputeNode).\
+                         filter_by(id=compute_node.id).\
+                         filter(models.ComputeNode.free_ram_mb >=
+                                min_free_ram_mb).\
+                         update(values, synchronize_session=False)
+        if not result:
+            raise exception.ComputeNodeClaimConflict(host=host)
+        session.refresh(compute_node)
+    return compute_node
+
+
 def compute_node_utilization_set(context, host, free_ram_mb=None,
                                  free_disk_gb=None, work=None, vms=None):
     """Like compute_node_utilization_update() modify a specific host
@@ -1342,6 +1502,53 @@ def instance_create(context, values):
     return instance_ref
 
 
+@require_context
+def instance_create_multi(context, values_list, security_group_ids=None):
+    """Create several Instance records in the database, along with
+    their info caches and security group associations, in a single
+    transaction.
+
+    context - request context object
+    values_list - list of dicts containing column values.
+    security_group_ids - ids of the security groups to add every new
+                         instance to.
+    """
+    if security_group_ids is None:
+        security_group_ids = []
+
+    instance_refs = []
+    session = get_session()
+    with session.begin():
+        for values in values_list:
+            values = values.copy()
+            values['metadata'] = _metadata_refs(
+                    values.get('metadata'), models.InstanceMetadata)
+
+            values['system_metadata'] = _metadata_refs(
+                    values.get('system_metadata'),
+                    models.InstanceSystemMetadata)
+
+            instance_ref = models.Instance()
+            if not values.get('uuid'):
+                values['uuid'] = str(utils.gen_uuid())
+            instance_ref.update(values)
+            instance_ref.save(session=session)
+
+            info_cache = models.InstanceInfoCache()
+            info_cache.update({'instance_id': instance_ref['uuid']})
+            info_cache.save(session=session)
+
+            for security_group_id in security_group_ids:
+                association = models.SecurityGroupInstanceAssociation()
+                association.update({'instance_uuid': instance_ref['uuid'],
+                                    'security_group_id': security_group_id})
+                association.save(session=session)
+
+            instance_refs.append(instance_ref)
+
+    return instance_refs
+
+
 @require_admin_context
 def instance_data_get_for_project(context, project_id, session=None):
     result = model_query(context,
@@ -1445,11 +1652,229 @@ def instance_get_all(context):
                    all()
 
 
-@require_context
-def instance_get_all_by_filters(context, filters, sort_key, sort_dir):
+# Characters that give a regular expression a meaning other than matching
+# themselves.
+_REGEXP_META_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+def _regexp_literal_prefix(pattern):
+    """Return the literal prefix that every match of a regexp starts with.
+
+    The filters are applied with re.match(), so patterns are anchored at
+    the start already.  Returns None if the pattern has no literal prefix
+    or if it may match something that does not start with one.
+    """
+    if '|' in pattern or '(?' in pattern:
+        # Alternatives and inline flags apply to the pattern as a whole
+        return None
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    prefix = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\':
+            escaped = pattern[index + 1:index + 2]
+            if not escaped or escaped.isalnum():
+                # \d, \w, \A, ... are classes and anchors, not literals
+                break
+            prefix.append(escaped)
+            index += 2
+        elif char in _REGEXP_META_CHARS:
+            if char in '*?{' and prefix:
+                # The previous character is optional
+                prefix.pop()
+            break
+        else:
+            prefix.append(char)
+            index += 1
+    return ''.join(prefix) or None
+
+
+def _like_escape(value):
+    """Escape the LIKE wildcards in value, using \\ as the escape char."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').\
+            replace('_', '\\_')
+
+
+def _metadata_items(meta):
+    """Return the (key, value) pairs a metadata filter requires."""
+    if isinstance(meta, dict):
+        return meta.items()
+    items = []
+    for node in meta:
+        items.extend(node.items())
+    return items
+
+
+def _instance_keyset_filter(sort_key, sort_dir, marker_values):
+    """Return a clause selecting the instances that sort after a marker.
+
+    The instances are sorted by sort_key, then by id, so marker_values is
+    a (<sort_key value>, <id>) tuple.  MySQL and SQLite sort NULLs before
+    any other value.
+    """
+    column = getattr(models.Instance, sort_key)
+    value, marker_id = marker_values
+    if sort_dir == 'desc':
+        id_after = models.Instance.id < marker_id
+        if value is None:
+            return and_(column == None, id_after)
+        return or_(column < value, and_(column == value, id_after),
+                   column == None)
+    id_after = models.Instance.id > marker_id
+    if value is None:
+        return or_(and_(column == None, id_after), column != None)
+    return or_(column > value, and_(column == value, id_after))
+
+
+# Number of values put in a single IN clause when loading the relationships
+# of instance records.
+_IN_CLAUSE_BATCH_SIZE = 500
+
+# Relationships that can be loaded along with instance records.
+_INSTANCE_RECORD_JOINS = ('info_cache', 'security_groups', 'metadata',
+                          'instance_type')
+
+
+def _in_clause_batches(values):
+    """Split values into lists small enough for a single IN clause."""
+    values = list(values)
+    for i in xrange(0, len(values), _IN_CLAUSE_BATCH_SIZE):
+        yield values[i:i + _IN_CLAUSE_BATCH_SIZE]
+
+
+class _InstanceRecord(object):
+    """Read-only stand-in for an Instance loaded with some columns only.
+
+    Rows are looked up like instances, by key or by attribute, but have
+    none of the ORM state.  _instance_record_class() makes a subclass per
+    set of columns and relationships, which are kept in __slots__.
+    """
+
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, values):
+        for key, value in zip(self._fields, values):
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def iteritems(self):
+        for key in self._fields:
+            yield key, getattr(self, key)
+
+    name = property(models.Instance.__dict__['name'].fget)
+
+
+_instance_record_classes = {}
+
+
+def _instance_record_class(fields):
+    """Return the _InstanceRecord subclass holding the given fields."""
+    fields = tuple(fields)
+    record_class = _instance_record_classes.get(fields)
+    if record_class is None:
+        record_class = type('InstanceRecord', (_InstanceRecord,),
+                            {'__slots__': fields, '_fields': fields})
+        _instance_record_classes[fields] = record_class
+    return record_class
+
+
+def _load_instance_record_joins(session, records, joins):
+    """Load the relationships of instance records, with a query for each
+    relationship rather than a join per instance row.
+    """
+    records_by_uuid = dict((record.uuid, record) for record in records)
+    uuid_batches = list(_in_clause_batches(records_by_uuid.keys()))
+
+    if 'info_cache' in joins:
+        for record in records:
+            record.info_cache = None
+        for batch in uuid_batches:
+            rows = session.query(models.InstanceInfoCache).\
+                    filter(models.InstanceInfoCache.instance_id.in_(batch))
+            for info_cache in rows:
+                records_by_uuid[info_cache.instance_id].info_cache = \
+                        info_cache
+
+    if 'security_groups' in joins:
+        for record in records:
+            record.security_groups = []
+        association = models.SecurityGroupInstanceAssociation
+        for batch in uuid_batches:
+            rows = session.query(association.instance_uuid,
+                                 models.SecurityGroup).\
+                    filter(association.security_group_id ==
+                           models.SecurityGroup.id).\
+                    filter(association.instance_uuid.in_(batch)).\
+                    filter(association.deleted == False).\
+                    filter(models.SecurityGroup.deleted == False)
+            for instance_uuid, security_group in rows:
+                records_by_uuid[instance_uuid].security_groups.append(
+                        security_group)
+
+    if 'metadata' in joins:
+        for record in records:
+            record.metadata = []
+        for batch in uuid_batches:
+            rows = session.query(models.InstanceMetadata).\
+                    filter(models.InstanceMetadata.instance_uuid.in_(batch)).\
+                    filter_by(deleted=False)
+            for meta in rows:
+                records_by_uuid[meta.instance_uuid].metadata.append(meta)
+
+    if 'instance_type' in joins:
+        type_ids = set(record.instance_type_id for record in records
+                       if record.instance_type_id is not None)
+        instance_types = {}
+        for batch in _in_clause_batches(type_ids):
+            rows = session.query(models.InstanceTypes).\
+                    filter(models.InstanceTypes.id.in_(batch))
+            for instance_type in rows:
+                instance_types[instance_type.id] = instance_type
+        for record in records:
+            record.instance_type = instance_types.get(
+                    record.instance_type_id)
+
+
+@require_context
+def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
+                                limit=None, marker=None,
+                                columns_to_join=None, columns=None,
+                                use_slave=False):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
-    otherwise"""
+    otherwise
+
+    The instances are sorted by sort_key and then by id.  If marker, the
+    uuid of an instance, is given only the instances that sort after it
+    are returned, and no more than limit of them if limit is given.
+    columns_to_join lists the relationships to load along with the
+    instances, all of them by default.
+
+    If columns is given, only those columns of the instances are loaded
+    and lightweight read-only records are returned instead of Instance
+    models.  The id, uuid and the columns needed for sorting and
+    filtering are always loaded.  columns_to_join defaults to none of the
+    relationships then, and may only name info_cache, security_groups,
+    metadata and instance_type.
+
+    The slave database is only read if use_slave is set, as the API reads
+    back the instances it has just written with this call.
+    """
+    if use_slave:
+        return read_from_slave(instance_get_all_by_filters)(context,
+                filters, sort_key, sort_dir, limit=limit, marker=marker,
+                columns_to_join=columns_to_join, columns=columns)
 
     def _regexp_filter_by_metadata(instance, meta):
         inst_metadata = [{node['key']: node['value']}
@@ -1475,13 +1900,26 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir):
 
     sort_fn = {'desc': desc, 'asc': asc}
 
+    if columns_to_join is None:
+        if columns is None:
+            columns_to_join = ['info_cache', 'security_groups', 'metadata',
+                               'instance_type']
+        else:
+            columns_to_join = []
+    if 'metadata' in filters and 'metadata' not in columns_to_join:
+        # The metadata filter is checked again on the loaded instances
+        columns_to_join = list(columns_to_join) + ['metadata']
+    if columns is not None:
+        for column in columns_to_join:
+            if column not in _INSTANCE_RECORD_JOINS:
+                reason = _("%s can not be loaded along with instance "
+                           "columns") % column
+                raise exception.InvalidInput(reason=reason)
+
     session = get_session()
-    query_prefix = session.query(models.Instance).\
-            options(joinedload('info_cache')).\
-            options(joinedload('security_groups')).\
-            options(joinedload('metadata')).\
-            options(joinedload('instance_type')).\
-            order_by(sort_fn[sort_dir](getattr(models.Instance, sort_key)))
+    query_prefix = session.query(models.Instance).order_by(
+            sort_fn[sort_dir](getattr(models.Instance, sort_key)),
+            sort_fn[sort_dir](models.Instance.id))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
     # be modifying it and we shouldn't affect the caller's use of it.
@@ -1520,34 +1958,110 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir):
     query_prefix = exact_filter(query_prefix, models.Instance,
                                 filters, exact_match_filter_names)
 
-    instances = query_prefix.all()
-    if not instances:
-        return []
+    # Narrow the query down with the regexp and metadata filters as far as
+    # SQL allows.  LIKE and = may be case insensitive, so the instances
+    # returned are still matched against the filters below.
+    for filter_name, filter_value in filters.iteritems():
+        if filter_name == 'metadata':
+            if not isinstance(filter_value, (dict, list)):
+                continue
+            for k, v in _metadata_items(filter_value):
+                query_prefix = query_prefix.filter(
+                        models.Instance.metadata.any(key=k, value=v))
+            continue
+        column = models.Instance.__table__.columns.get(filter_name)
+        if column is None or not isinstance(column.type, String):
+            continue
+        prefix = _regexp_literal_prefix(str(filter_value))
+        if prefix is not None:
+            query_prefix = query_prefix.filter(
+                    getattr(models.Instance, filter_name).like(
+                        _like_escape(prefix) + '%', escape='\\'))
 
     # Now filter on everything else for regexp matching..
     # For filters not in the list, we'll attempt to use the filter_name
     # as a column name in Instance..
-    regexp_filter_funcs = {}
+    regexp_filters = []
 
     for filter_name in filters.iterkeys():
-        filter_func = regexp_filter_funcs.get(filter_name, None)
         filter_re = re.compile(str(filters[filter_name]))
-        if filter_func:
-            filter_l = lambda instance: filter_func(instance, filter_re)
-        elif filter_name == 'metadata':
-            filter_l = lambda instance: _regexp_filter_by_metadata(instance,
-                    filters[filter_name])
+        if filter_name == 'metadata':
+            filter_l = functools.partial(_regexp_filter_by_metadata,
+                                         meta=filters[filter_name])
         else:
-            filter_l = lambda instance: _regexp_filter_by_column(instance,
-                    filter_name, filter_re)
-        instances = filter(filter_l, instances)
-        if not instances:
+            filter_l = functools.partial(_regexp_filter_by_column,
+                                         filter_name=filter_name,
+                                         filter_re=filter_re)
+        regexp_filters.append(filter_l)
+
+    def _filter_instances(instances):
+        for filter_l in regexp_filters:
+            instances = filter(filter_l, instances)
+        return instances
+
+    if columns is None:
+        for column in columns_to_join:
+            query_prefix = query_prefix.options(joinedload(column))
+    else:
+        fields = list(columns)
+        needed = ['id', 'uuid', sort_key]
+        if 'instance_type' in columns_to_join:
+            needed.append('instance_type_id')
+        # The columns the regexp filters are checked against
+        needed.extend(filter_name for filter_name in filters
+                      if filter_name in models.Instance.__table__.columns)
+        for column in needed:
+            if column not in fields:
+                fields.append(column)
+        query_prefix = query_prefix.with_entities(
+                *[getattr(models.Instance, column) for column in fields])
+        record_class = _instance_record_class(fields + columns_to_join)
+
+    def _load_instances(query):
+        if columns is None:
+            return query.all()
+        records = [record_class(row) for row in query]
+        _load_instance_record_joins(session, records, columns_to_join)
+        return records
+
+    marker_values = None
+    if marker is not None:
+        marker_instance = model_query(context, models.Instance.id,
+                                      getattr(models.Instance, sort_key),
+                                      session=session, read_deleted="yes",
+                                      project_only=True).\
+                                filter_by(uuid=marker).\
+                                first()
+        if not marker_instance:
+            raise exception.MarkerNotFound(marker=marker)
+        marker_values = (marker_instance[1], marker_instance[0])
+
+    if limit is None:
+        if marker_values is not None:
+            query_prefix = query_prefix.filter(
+                    _instance_keyset_filter(sort_key, sort_dir,
+                                            marker_values))
+        return _filter_instances(_load_instances(query_prefix))
+
+    # Page through the query until enough instances passed the filters
+    # that could not be done in SQL
+    instances = []
+    while len(instances) < limit:
+        query = query_prefix
+        if marker_values is not None:
+            query = query.filter(_instance_keyset_filter(sort_key, sort_dir,
+                                                         marker_values))
+        batch = _load_instances(query.limit(limit))
+        instances.extend(_filter_instances(batch))
+        if len(batch) < limit:
             break
+        marker_values = (batch[-1][sort_key], batch[-1]['id'])
 
-    return instances
+    return instances[:limit]
 
 
 @require_context
+@read_from_slave
 def instance_get_active_by_window(context, begin, end=None, project_id=None):
     """Return instances that were active during window."""
     session = get_session()
@@ -1564,6 +2078,7 @@ def instance_get_active_by_window(context, begin, end=None, project_id=None):
 
 
 @require_admin_context
+@read_from_slave
 def instance_get_active_by_window_joined(context, begin, end=None,
                                          project_id=None):
     """Return instances and joins that were active during window."""
@@ -1712,6 +2227,34 @@ def instance_update_and_get_original(context, instance_uuid, values):
                             copy_old_instance=True)
 
 
+@require_context
+def instance_update_multi_and_get_original(context, values_by_uuid):
+    """Set the given properties on several instances in one transaction.
+
+    Only column values can be set; metadata and system_metadata are not
+    supported.  Instances that do not exist are skipped.
+
+    :param context: = request context object
+    :param values_by_uuid: = dict of instance uuid to dict of column values
+
+    :returns: a dict of instance uuid to a tuple of the form
+              (old_instance_ref, new_instance_ref)
+    """
+    session = get_session()
+    results = {}
+    with session.begin():
+        for batch in _in_clause_batches(values_by_uuid.keys()):
+            instance_refs = _build_instance_get(context, session=session).\
+                    filter(models.Instance.uuid.in_(batch)).\
+                    all()
+            for instance_ref in instance_refs:
+                old_instance_ref = copy.copy(instance_ref)
+                instance_ref.update(values_by_uuid[instance_ref['uuid']])
+                results[instance_ref['uuid']] = (old_instance_ref,
+                                                 instance_ref)
+    return results
+
+
 def _instance_update(context, instance_uuid, values, copy_old_instance=False):
     session = get_session()
 
@@ -1842,6 +2385,32 @@ def instance_info_cache_update(context, instance_uuid, values,
     return info_cache
 
 
+@require_context
+def instance_info_cache_update_multi(context, values_by_uuid):
+    """Update the info cache records of several instances in one
+    transaction, creating the missing ones.
+
+    :param values_by_uuid: = dict of instance uuid to dict of column values
+    """
+    session = get_session()
+    with session.begin():
+        for batch in _in_clause_batches(values_by_uuid.keys()):
+            info_caches = session.query(models.InstanceInfoCache).\
+                    filter(models.InstanceInfoCache.instance_id.in_(batch)).\
+                    all()
+            missing = set(batch)
+            for info_cache in info_caches:
+                if info_cache.instance_id not in missing:
+                    continue
+                missing.discard(info_cache.instance_id)
+                info_cache.update(values_by_uuid[info_cache.instance_id])
+            for instance_uuid in missing:
+                info_cache = models.InstanceInfoCache()
+                info_cache.update(values_by_uuid[instance_uuid])
+                info_cache.instance_id = instance_uuid
+                session.add(info_cache)
+
+
 @require_context
 def instance_info_cache_delete(context, instance_uuid, session=None):
     """Deletes an existing instance_info_cache record
@@ -2581,15 +3150,16 @@ def reservation_destroy(context, uuid):
 ###################
 
 
-def _get_quota_usages(context, session, keys):
+def _get_quota_usages(context, session, keys, lock=True):
     # Broken out for testability
-    rows = model_query(context, models.QuotaUsage,
-                       read_deleted="no",
-                       session=session).\
-                   filter_by(project_id=context.project_id).\
-                   filter(models.QuotaUsage.resource.in_(keys)).\
-                   with_lockmode('update').\
-                   all()
+    query = model_query(context, models.QuotaUsage,
+                        read_deleted="no",
+                        session=session).\
+                    filter_by(project_id=context.project_id).\
+                    filter(models.QuotaUsage.resource.in_(keys))
+    if lock:
+        query = query.with_lockmode('update')
+    rows = query.all()
     return dict((row.resource, row) for row in rows)
 
 
@@ -2815,6 +3385,252 @@ def reservation_expire(context):
                 reservation.delete(session=session)
 
 
+def _quota_usage_reserve(context, session, usage_id, delta, limit):
+    """Add delta to the reserved count of a usage if it stays in limit.
+
+    The check and the increment are a single UPDATE, so the usage is not
+    read and locked first.  Returns False if the limit would be exceeded.
+    """
+    query = model_query(context, models.QuotaUsage, session=session,
+                        read_deleted="no").\
+                    filter_by(id=usage_id)
+    if limit >= 0:
+        query = query.filter(models.QuotaUsage.in_use +
+                             models.QuotaUsage.reserved + delta <= limit)
+    until_refresh = models.QuotaUsage.until_refresh
+    count = query.update({'reserved': models.QuotaUsage.reserved + delta,
+                          'until_refresh': until_refresh - 1},
+                         synchronize_session=False)
+    return count == 1
+
+
+def _quota_usage_add(context, session, usage_id, in_use=0, reserved=0):
+    model_query(context, models.QuotaUsage, session=session,
+                read_deleted="no").\
+            filter_by(id=usage_id).\
+            update({'in_use': models.QuotaUsage.in_use + in_use,
+                    'reserved': models.QuotaUsage.reserved + reserved},
+                   synchronize_session=False)
+
+
+@require_context
+def quota_reserve_counters(context, resources, quotas, requests,
+                           until_refresh):
+    """Reserve the deltas of several requests without locking the usages.
+
+    requests is a list of (deltas, expire) pairs, which are all reserved
+    or none is.  The reserved counts are raised by guarded UPDATEs instead
+    of SELECT ... FOR UPDATE, in the same short transaction as the
+    reservations, so a reserved count is never raised without the
+    reservations that will release it.  Usages are synced here only when
+    they are first created; see quota_usage_refresh_stale().
+    """
+    elevated = context.elevated()
+    project_id = context.project_id
+
+    # The reserved counts only take the positive deltas, as in
+    # quota_reserve()
+    totals = {}
+    net_deltas = {}
+    for deltas, expire in requests:
+        for resource, delta in deltas.items():
+            totals[resource] = totals.get(resource, 0) + max(delta, 0)
+            net_deltas[resource] = net_deltas.get(resource, 0) + delta
+
+    session = get_session()
+    usages = _get_quota_usages(context, session, totals.keys(), lock=False)
+    missing = set(totals.keys()) - set(usages.keys())
+    if missing:
+        with session.begin():
+            while missing:
+                resource = missing.pop()
+                sync = resources[resource].sync
+                updates = sync(elevated, project_id, session)
+                for res, in_use in updates.items():
+                    if res in usages:
+                        continue
+                    usages[res] = quota_usage_create(elevated, project_id,
+                                                     res, in_use, 0,
+                                                     until_refresh or None,
+                                                     session=session)
+                    missing.discard(res)
+                if resource not in usages:
+                    usages[resource] = quota_usage_create(
+                            elevated, project_id, resource, 0, 0,
+                            until_refresh or None, session=session)
+
+    # Check for deltas that would go negative
+    unders = [resource for resource, delta in net_deltas.items()
+              if delta < 0 and delta + usages[resource].in_use < 0]
+
+    overs = []
+    result = []
+    try:
+        with session.begin():
+            # The usages are updated in a fixed order, so concurrent
+            # reservations don't deadlock on their row locks
+            for resource in sorted(totals.keys()):
+                if not totals[resource]:
+                    continue
+                if not _quota_usage_reserve(elevated, session,
+                                            usages[resource].id,
+                                            totals[resource],
+                                            quotas[resource]):
+                    overs.append(resource)
+                    # Roll back the counts already reserved
+                    raise exception.OverQuota(overs=overs)
+
+            for deltas, expire in requests:
+                uuids = []
+                for resource, delta in deltas.items():
+                    reservation = reservation_create(elevated,
+                                                     str(utils.gen_uuid()),
+                                                     usages[resource],
+                                                     project_id,
+                                                     resource, delta, expire,
+                                                     session=session)
+                    uuids.append(reservation.uuid)
+                result.append(uuids)
+    except exception.OverQuota:
+        # Report all the resources over quota, if they still are
+        usages = _get_quota_usages(context, get_session(), totals.keys(),
+                                   lock=False)
+        overs = [resource for resource, total in totals.items()
+                 if quotas[resource] >= 0 and total and
+                 quotas[resource] < total + usages[resource].total] or overs
+        usages = dict((k, dict(in_use=v['in_use'], reserved=v['reserved']))
+                      for k, v in usages.items())
+        raise exception.OverQuota(overs=sorted(overs), quotas=quotas,
+                                  usages=usages)
+
+    if unders:
+        LOG.warning(_("Change will make usage less than 0 for the following "
+                      "resources: %(unders)s") % locals())
+
+    return result
+
+
+def _quota_reservations_apply(context, session, reservations, commit):
+    """Delete reservations and apply them to the usages.
+
+    A reservation is only applied by the call that deleted it, so
+    concurrent commits, rollbacks and expiries of the same reservation
+    count it once.  The usages are updated last, summed per usage.
+    """
+    in_use = {}
+    reserved = {}
+    for reservation in reservations:
+        count = model_query(context, models.Reservation, session=session,
+                            read_deleted="no").\
+                        filter_by(id=reservation.id).\
+                        update({'deleted': True,
+                                'deleted_at': timeutils.utcnow(),
+                                'updated_at': literal_column('updated_at')},
+                               synchronize_session=False)
+        if not count:
+            continue
+        usage_id = reservation.usage_id
+        if reservation.delta >= 0:
+            reserved[usage_id] = (reserved.get(usage_id, 0) -
+                                  reservation.delta)
+        if commit:
+            in_use[usage_id] = in_use.get(usage_id, 0) + reservation.delta
+
+    for usage_id in sorted(set(in_use.keys()) | set(reserved.keys())):
+        _quota_usage_add(context, session, usage_id,
+                         in_use=in_use.get(usage_id, 0),
+                         reserved=reserved.get(usage_id, 0))
+
+
+def _reservations_get_unlocked(context, session, reservations):
+    return model_query(context, models.Reservation, session=session,
+                       read_deleted="no").\
+                   filter(models.Reservation.uuid.in_(reservations)).\
+                   all()
+
+
+@require_context
+def reservation_commit_counters(context, reservations):
+    session = get_session()
+    with session.begin():
+        rows = _reservations_get_unlocked(context, session, reservations)
+        _quota_reservations_apply(context, session, rows, True)
+
+
+@require_context
+def reservation_rollback_counters(context, reservations):
+    session = get_session()
+    with session.begin():
+        rows = _reservations_get_unlocked(context, session, reservations)
+        _quota_reservations_apply(context, session, rows, False)
+
+
+@require_admin_context
+def reservation_expire_counters(context):
+    session = get_session()
+    with session.begin():
+        rows = model_query(context, models.Reservation, session=session,
+                           read_deleted="no").\
+                       filter(models.Reservation.expire < timeutils.utcnow()).\
+                       all()
+        _quota_reservations_apply(context, session, rows, False)
+
+
+@require_admin_context
+def quota_usage_refresh_stale(context, resources, until_refresh, max_age):
+    """Resync the usages which are due a refresh.
+
+    A usage is due when its in_use count went negative, its until_refresh
+    count ran out, or it has not been updated for max_age seconds.  The
+    new in_use count is only written if the usage did not change while
+    it was counted; otherwise it is left for the next refresh.  Returns
+    the number of usages refreshed.
+    """
+    session = get_session()
+    stale = [models.QuotaUsage.in_use < 0,
+             models.QuotaUsage.until_refresh <= 0]
+    if max_age:
+        stale.append(models.QuotaUsage.updated_at <
+                     timeutils.utcnow() - datetime.timedelta(seconds=max_age))
+    rows = model_query(context, models.QuotaUsage, session=session,
+                       read_deleted="no").\
+                   filter(or_(*stale)).\
+                   all()
+
+    stale_by_project = {}
+    for row in rows:
+        if row.resource in resources:
+            stale_by_project.setdefault(row.project_id, set()).add(
+                    row.resource)
+
+    refreshed = 0
+    for project_id, work in stale_by_project.iteritems():
+        usages = dict((row.resource, row) for row in
+                      model_query(context, models.QuotaUsage,
+                                  session=session, read_deleted="no").\
+                              filter_by(project_id=project_id).\
+                              all())
+        while work:
+            resource = work.pop()
+            sync = resources[resource].sync
+            updates = sync(context, project_id, session)
+            for res, in_use in updates.items():
+                work.discard(res)
+                usage = usages.get(res)
+                if usage is None:
+                    continue
+                refreshed += model_query(context, models.QuotaUsage,
+                                         session=session,
+                                         read_deleted="no").\
+                                     filter_by(id=usage.id).\
+                                     filter_by(in_use=usage.in_use).\
+                                     update({'in_use': in_use,
+                                             'until_refresh':
+                                                 until_refresh or None},
+                                            synchronize_session=False)
+    return refreshed
+
+
 ###################
 
 
@@ -3927,6 +4743,7 @@ def console_get(context, console_id, instance_uuid=None):
 
 
 @require_admin_context
+@lookup_writes('instance_types')
 def instance_type_create(context, values):
     """Create a new instance type. In order to pass in extra specs,
     the values dict should contain a 'extra_specs' key/value pair:
@@ -3937,13 +4754,14 @@ def instance_type_create(context, values):
     session = get_session()
     with session.begin():
         try:
-            instance_type_get_by_name(context, values['name'], session)
+            instance_type_get_by_name(context, values['name'],
+                                      session=session)
             raise exception.InstanceTypeExists(name=values['name'])
         except exception.InstanceTypeNotFoundByName:
             pass
         try:
             instance_type_get_by_flavor_id(context, values['flavorid'],
-                                           session)
+                                           session=session)
             raise exception.InstanceTypeExists(name=values['name'])
         except exception.FlavorNotFound:
             pass
@@ -3991,6 +4809,7 @@ def _instance_type_get_query(context, session=None, read_deleted=None):
 
 
 @require_context
+@lookup_cached('instance_types', copy_results=True)
 def instance_type_get_all(context, inactive=False, filters=None):
     """
     Returns all instance types.
@@ -4023,6 +4842,7 @@ def instance_type_get_all(context, inactive=False, filters=None):
 
 
 @require_context
+@lookup_cached('instance_types', copy_results=True)
 def instance_type_get(context, id, session=None):
     """Returns a dict describing specific instance_type"""
     result = _instance_type_get_query(context, session=session).\
@@ -4036,6 +4856,7 @@ def instance_type_get(context, id, session=None):
 
 
 @require_context
+@lookup_cached('instance_types', copy_results=True)
 def instance_type_get_by_name(context, name, session=None):
     """Returns a dict describing specific instance_type"""
     result = _instance_type_get_query(context, session=session).\
@@ -4049,6 +4870,7 @@ def instance_type_get_by_name(context, name, session=None):
 
 
 @require_context
+@lookup_cached('instance_types', copy_results=True)
 def instance_type_get_by_flavor_id(context, flavor_id, session=None):
     """Returns a dict describing specific flavor_id"""
     result = _instance_type_get_query(context, session=session).\
@@ -4062,6 +4884,7 @@ def instance_type_get_by_flavor_id(context, flavor_id, session=None):
 
 
 @require_admin_context
+@lookup_writes('instance_types')
 def instance_type_destroy(context, name):
     """Marks specific instance_type as deleted"""
     session = get_session()
@@ -4301,6 +5124,7 @@ def agent_build_update(context, agent_build_id, values):
 ####################
 
 @require_context
+@read_from_slave
 def bw_usage_get_by_uuids(context, uuids, start_period):
     return model_query(context, models.BandwidthUsage, read_deleted="yes").\
                    filter(models.BandwidthUsage.uuid.in_(uuids)).\
@@ -4337,6 +5161,42 @@ def bw_usage_update(context,
         bwusage.save(session=session)
 
 
+@require_context
+def bw_usage_update_multi(context, start_period, usages):
+    """Create or update the bandwidth usage of several instances for a
+    period in one transaction.
+
+    :param usages: = list of dicts with uuid, mac, bw_in and bw_out keys.
+                     Later usages of the same uuid win.
+    """
+    usages_by_uuid = dict((usage['uuid'], usage) for usage in usages)
+    last_refreshed = timeutils.utcnow()
+    session = get_session()
+    with session.begin():
+        for batch in _in_clause_batches(usages_by_uuid.keys()):
+            bwusages = {}
+            rows = model_query(context, models.BandwidthUsage,
+                               session=session, read_deleted="yes").\
+                           filter_by(start_period=start_period).\
+                           filter(models.BandwidthUsage.uuid.in_(batch))
+            for bwusage in rows:
+                bwusages.setdefault(bwusage.uuid, bwusage)
+
+            for uuid in batch:
+                usage = usages_by_uuid[uuid]
+                bwusage = bwusages.get(uuid)
+                if not bwusage:
+                    bwusage = models.BandwidthUsage()
+                    bwusage.start_period = start_period
+                    bwusage.uuid = uuid
+                    bwusage.mac = usage['mac']
+                    session.add(bwusage)
+
+                bwusage.last_refreshed = last_refreshed
+                bwusage.bw_in = usage['bw_in']
+                bwusage.bw_out = usage['bw_out']
+
+
 ####################
 
 
@@ -4361,6 +5221,7 @@ def instance_type_extra_specs_get(context, instance_type_id):
 
 
 @require_context
+@lookup_writes('instance_types')
 def instance_type_extra_specs_delete(context, instance_type_id, key):
     _instance_type_extra_specs_get_query(
                             context, instance_type_id).\
@@ -4386,6 +5247,7 @@ def instance_type_extra_specs_get_item(context, instance_type_id, key,
 
 
 @require_context
+@lookup_writes('instance_types')
 def instance_type_extra_specs_update_or_create(context, instance_type_id,
                                                specs):
     session = get_session()
@@ -4839,6 +5701,7 @@ def _aggregate_get_query(context, model_class, id_field, id,
 
 
 @require_admin_context
+@lookup_writes('aggregates')
 def aggregate_create(context, values, metadata=None):
     session = get_session()
     aggregate = _aggregate_get_query(context,
@@ -4878,6 +5741,7 @@ def aggregate_get(context, aggregate_id):
 
 
 @require_admin_context
+@lookup_cached('aggregates')
 def aggregate_get_by_host(context, host):
     aggregate_host = _aggregate_get_query(context,
                                           models.AggregateHost,
@@ -4887,10 +5751,25 @@ def aggregate_get_by_host(context, host):
     if not aggregate_host:
         raise exception.AggregateHostNotFound(host=host)
 
-    return aggregate_get(context, aggregate_host.aggregate_id)
+    # Load the hosts and metadata along with the aggregate, which may be
+    # cached long after its session is gone.
+    aggregate = _aggregate_get_query(context,
+                                     models.Aggregate,
+                                     models.Aggregate.id,
+                                     aggregate_host.aggregate_id).\
+                                     options(joinedload('_hosts')).\
+                                     options(joinedload('_metadata')).\
+                                     first()
+
+    if not aggregate:
+        raise exception.AggregateNotFound(
+                aggregate_id=aggregate_host.aggregate_id)
+
+    return aggregate
 
 
 @require_admin_context
+@lookup_writes('aggregates')
 def aggregate_update(context, aggregate_id, values):
     session = get_session()
     aggregate = _aggregate_get_query(context,
@@ -4915,6 +5794,7 @@ def aggregate_update(context, aggregate_id, values):
 
 
 @require_admin_context
+@lookup_writes('aggregates')
 def aggregate_delete(context, aggregate_id):
     query = _aggregate_get_query(context,
                                  models.Aggregate,
@@ -4936,9 +5816,10 @@ def aggregate_get_all(context):
 
 @require_admin_context
 @require_aggregate_exists
-def aggregate_metadata_get(context, aggregate_id):
+@lookup_cached('aggregates', copy_results=True)
+def aggregate_metadata_get(context, aggregate_id, session=None):
     rows = model_query(context,
-                       models.AggregateMetadata).\
+                       models.AggregateMetadata, session=session).\
                        filter_by(aggregate_id=aggregate_id).all()
 
     return dict([(r['key'], r['value']) for r in rows])
@@ -4946,6 +5827,7 @@ def aggregate_metadata_get(context, aggregate_id):
 
 @require_admin_context
 @require_aggregate_exists
+@lookup_writes('aggregates')
 def aggregate_metadata_delete(context, aggregate_id, key):
     query = _aggregate_get_query(context,
                                  models.AggregateMetadata,
@@ -4980,11 +5862,13 @@ def aggregate_metadata_get_item(context, aggregate_id, key, session=None):
 
 @require_admin_context
 @require_aggregate_exists
+@lookup_writes('aggregates')
 def aggregate_metadata_add(context, aggregate_id, metadata, set_delete=False):
     session = get_session()
 
     if set_delete:
-        original_metadata = aggregate_metadata_get(context, aggregate_id)
+        original_metadata = aggregate_metadata_get(context, aggregate_id,
+                                                   session=session)
         for meta_key, meta_value in original_metadata.iteritems():
             if meta_key not in metadata:
                 meta_ref = aggregate_metadata_get_item(context, aggregate_id,
@@ -5023,6 +5907,7 @@ def aggregate_host_get_all(context, aggregate_id):
 
 @require_admin_context
 @require_aggregate_exists
+@lookup_writes('aggregates')
 def aggregate_host_delete(context, aggregate_id, host):
     query = _aggregate_get_query(context,
                                  models.AggregateHost,
@@ -5039,6 +5924,7 @@ def aggregate_host_delete(context, aggregate_id, host):
 
 @require_admin_context
 @require_aggregate_exists
+@lookup_writes('aggregates')
 def aggregate_host_add(context, aggregate_id, host):
     session = get_session()
     host_ref = _aggregate_get_query(context,
@@ -5076,6 +5962,7 @@ def instance_fault_create(context, values):
     return dict(fault_ref.iteritems())
 
 
+@read_from_slave
 def instance_fault_get_by_instance_uuids(context, instance_uuids):
     """Get all instance faults for the provided instance_uuids."""
     rows = model_query(context, models.InstanceFault, read_deleted='no').\
@@ -5111,3 +5998,151 @@ def instance_action_log_get_by_instance_uuid(context, instance_uuid):
                        order_by(desc("created_at")).\
                        all()
     return [dict(row.iteritems()) for row in rows]
+
+
+###################
+
+
+# The tables whose soft-deleted rows are moved to their shadow tables by
+# archive_deleted_rows(), in that order.  The rows which reference the
+# rows of a later table are archived before it, along with the ones of
+# its rows which are deleted, so nothing references a row by the time it
+# is archived.
+_ARCHIVED_TABLES = ['instance_metadata',
+                    'instance_system_metadata',
+                    'instance_info_caches',
+                    'block_device_mapping',
+                    'security_group_instance_association',
+                    'instance_faults',
+                    'instance_action_log',
+                    'migrations',
+                    'bw_usage_cache',
+                    'instances',
+                    ]
+
+
+def _shadow_table_name(table_name):
+    return 'shadow_' + table_name
+
+
+class _ReflectedTables(dict):
+    """The tables of the database, reflected as they are needed."""
+
+    def __init__(self):
+        super(_ReflectedTables, self).__init__()
+        self.meta = MetaData(bind=get_engine())
+
+    def __missing__(self, table_name):
+        table = Table(table_name, self.meta, autoload=True)
+        self[table_name] = table
+        return table
+
+
+def _archivable_rows(tables, table_name):
+    """Return the WHERE clause of the rows of a table that can be archived.
+
+    They are the deleted rows, and the rows referencing a deleted row of
+    an archived table, as long as no row references them.
+    """
+    table = tables[table_name]
+    where = table.c.deleted == True
+    model_table = models.BASE.metadata.tables[table_name]
+    for fk in model_table.foreign_keys:
+        parent_name = fk.column.table.name
+        if parent_name not in _ARCHIVED_TABLES:
+            continue
+        parent = tables[parent_name]
+        where = or_(where, exists().where(and_(
+                parent.c[fk.column.name] == table.c[fk.parent.name],
+                parent.c.deleted == True)))
+
+    for model_child in models.BASE.metadata.sorted_tables:
+        for fk in model_child.foreign_keys:
+            if fk.column.table.name != table_name:
+                continue
+            child = tables[model_child.name]
+            where = and_(where, ~exists().where(
+                    child.c[fk.parent.name] == table.c[fk.column.name]))
+    return where
+
+
+def _move_rows(session, table, shadow_table, where, batch_size):
+    """Move a batch of the rows matching where to shadow_table.
+
+    Without shadow_table, the rows are just deleted.  Returns the number
+    of rows moved.
+    """
+    with session.begin():
+        query = select([table.c.id], where).\
+                        order_by(table.c.id).\
+                        limit(batch_size)
+        ids = [row[0] for row in session.execute(query)]
+        if not ids:
+            return 0
+        if shadow_table is not None:
+            rows = session.execute(select([table], table.c.id.in_(ids)))
+            session.execute(shadow_table.insert(),
+                            [dict(row) for row in rows])
+        session.execute(table.delete(table.c.id.in_(ids)))
+    return len(ids)
+
+
+def _move_all_rows(table_names, move_batch, max_rows, batch_size):
+    """Call move_batch(table_name, batch_size) until it returns 0 or
+    max_rows rows were moved, for each table in turn.
+    """
+    moved = {}
+    total = 0
+    for table_name in table_names:
+        moved[table_name] = 0
+        while max_rows is None or total < max_rows:
+            if max_rows is not None:
+                batch_size = min(batch_size, max_rows - total)
+            count = move_batch(table_name, batch_size)
+            if not count:
+                break
+            moved[table_name] += count
+            total += count
+    return moved
+
+
+@require_admin_context
+def archive_deleted_rows(context, max_rows=None, batch_size=1000):
+    """Move soft-deleted rows to the shadow tables.
+
+    The rows are moved batch_size rows at a time, each batch in its own
+    short transaction, so the tables are not locked for long.  Stops
+    after max_rows rows if it is given.  Returns a dict of the number of
+    rows moved from each table.
+    """
+    tables = _ReflectedTables()
+    session = get_session()
+
+    def move_batch(table_name, batch_size):
+        return _move_rows(session, tables[table_name],
+                          tables[_shadow_table_name(table_name)],
+                          _archivable_rows(tables, table_name), batch_size)
+
+    return _move_all_rows(_ARCHIVED_TABLES, move_batch, max_rows, batch_size)
+
+
+@require_admin_context
+def purge_shadow_rows(context, before, max_rows=None, batch_size=1000):
+    """Delete the archived rows which were deleted before the given time.
+
+    The rows archived along with a deleted row they reference may not be
+    deleted themselves; their age is the time they were last updated.
+    Returns a dict of the number of rows deleted from each shadow table.
+    """
+    tables = _ReflectedTables()
+    session = get_session()
+
+    def purge_batch(table_name, batch_size):
+        table = tables[_shadow_table_name(table_name)]
+        deleted_at = func.coalesce(table.c.deleted_at, table.c.updated_at,
+                                   table.c.created_at)
+        return _move_rows(session, table, None, deleted_at < before,
+                          batch_size)
+
+    return _move_all_rows(_ARCHIVED_TABLES, purge_batch, max_rows,
+                          batch_size)
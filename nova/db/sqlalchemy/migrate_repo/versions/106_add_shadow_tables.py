@@ -0,0 +1,68 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import BigInteger, Column, MetaData, Table
+from sqlalchemy.types import NullType
+
+# The tables whose soft-deleted rows are archived by
+# nova.db.api.archive_deleted_rows().  NOTE: a migration adding a column to
+# one of them has to add it to its shadow table too.
+TABLES = ['block_device_mapping',
+          'bw_usage_cache',
+          'instance_action_log',
+          'instance_faults',
+          'instance_info_caches',
+          'instance_metadata',
+          'instance_system_metadata',
+          'instances',
+          'migrations',
+          'security_group_instance_association',
+          ]
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    for table_name in TABLES:
+        table = Table(table_name, meta, autoload=True)
+        # Same columns, but no foreign keys, unique constraints or
+        # indexes, so archiving a row never fails or slows down
+        columns = []
+        for column in table.columns:
+            column_type = column.type
+            if isinstance(column_type, NullType):
+                # NOTE: sqlite reflects the BIGINT columns of
+                # bw_usage_cache without a type.
+                column_type = BigInteger()
+            columns.append(Column(column.name, column_type,
+                                  primary_key=column.primary_key,
+                                  autoincrement=False,
+                                  nullable=column.nullable))
+        shadow_table = Table('shadow_' + table_name, meta, *columns,
+                             mysql_engine='InnoDB',
+                             mysql_charset='utf8')
+        shadow_table.create()
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    for table_name in TABLES:
+        shadow_table = Table('shadow_' + table_name, meta, autoload=True)
+        shadow_table.drop()
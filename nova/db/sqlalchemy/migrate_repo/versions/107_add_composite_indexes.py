@@ -0,0 +1,58 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Index, MetaData, Table
+
+
+# (table, columns) of the indexes, for the queries in the comments.
+# nova/tests/test_db_query_plans.py checks the queries use them.
+INDEXES = [
+    # fixed_ip_get_by_network_host()
+    ('fixed_ips', ('network_id', 'host')),
+    # instance_get_all_by_host()
+    ('instances', ('host', 'deleted')),
+    # instance_get_all_hung_in_rebooting()
+    ('instances', ('task_state', 'updated_at')),
+    # migration_get_all_unconfirmed()
+    ('migrations', ('status', 'updated_at')),
+    # bw_usage_get_by_uuids() and bw_usage_update()
+    ('bw_usage_cache', ('uuid', 'start_period')),
+    ]
+
+
+def _indexes(meta):
+    for table_name, column_names in INDEXES:
+        table = Table(table_name, meta, autoload=True)
+        columns = [table.c[column_name] for column_name in column_names]
+        yield Index('%s_%s_idx' % (table_name, '_'.join(column_names)),
+                    *columns)
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    for index in _indexes(meta):
+        index.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    for index in _indexes(meta):
+        index.drop(migrate_engine)
@@ -1050,3 +1050,15 @@ class InstanceActionLog(BASE, NovaBase):
     project_id = Column(Text, nullable=False)
     user_id = Column(Text, nullable=False)
     extra = Column(Text)
+
+
+class CacheVersion(BASE, NovaBase):
+    """Represents the version of a lookup table cached by the services.
+
+    Bumped on every write to the table, so the services can tell when
+    their cached copy is stale.
+    """
+    __tablename__ = 'cache_versions'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False, unique=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -18,8 +18,10 @@
 
 """Session Handling for SQLAlchemy backend."""
 
+import contextlib
 import time
 
+from eventlet import corolocal
 from sqlalchemy.exc import DisconnectionError, OperationalError
 import sqlalchemy.interfaces
 import sqlalchemy.orm
@@ -35,17 +37,39 @@ LOG = logging.getLogger(__name__)
 
 _ENGINE = None
 _MAKER = None
+_SLAVE_ENGINE = None
+_SLAVE_MAKER = None
 
+# Greenthread local state; 'slave' is set while the sessions should be
+# connected to the slave database.
+_LOCAL = corolocal.local()
 
-def get_session(autocommit=True, expire_on_commit=False):
-    """Return a SQLAlchemy session."""
-    global _MAKER
 
-    if _MAKER is None:
-        engine = get_engine()
-        _MAKER = get_maker(engine, autocommit, expire_on_commit)
+def get_session(autocommit=True, expire_on_commit=False, slave=None):
+    """Return a SQLAlchemy session.
 
-    session = _MAKER()
+    The session is connected to the slave database if slave is True, or
+    if it is None and the session is got in a slave_reads() block, and
+    sql_slave_connection is set.  Otherwise it is connected to the primary
+    database.
+    """
+    global _MAKER, _SLAVE_MAKER
+
+    if slave is None:
+        slave = getattr(_LOCAL, 'slave', False)
+
+    if slave and FLAGS.sql_slave_connection:
+        if _SLAVE_MAKER is None:
+            engine = get_engine(slave=True)
+            _SLAVE_MAKER = get_maker(engine, autocommit, expire_on_commit)
+        maker = _SLAVE_MAKER
+    else:
+        if _MAKER is None:
+            engine = get_engine()
+            _MAKER = get_maker(engine, autocommit, expire_on_commit)
+        maker = _MAKER
+
+    session = maker()
     session.query = nova.exception.wrap_db_error(session.query)
     session.flush = nova.exception.wrap_db_error(session.flush)
     return session
@@ -91,68 +115,97 @@ def is_db_connection_error(args):
     return False
 
 
-def get_engine():
-    """Return a SQLAlchemy engine."""
-    global _ENGINE
-    if _ENGINE is None:
-        connection_dict = sqlalchemy.engine.url.make_url(FLAGS.sql_connection)
-
-        engine_args = {
-            "pool_recycle": FLAGS.sql_idle_timeout,
-            "echo": False,
-            'convert_unicode': True,
-        }
-
-        # Map our SQL debug level to SQLAlchemy's options
-        if FLAGS.sql_connection_debug >= 100:
-            engine_args['echo'] = 'debug'
-        elif FLAGS.sql_connection_debug >= 50:
-            engine_args['echo'] = True
+@contextlib.contextmanager
+def slave_reads():
+    """Connect the sessions got in the with block to the slave database.
 
-        if "sqlite" in connection_dict.drivername:
-            engine_args["poolclass"] = NullPool
-
-            if FLAGS.sql_connection == "sqlite://":
-                engine_args["poolclass"] = StaticPool
-                engine_args["connect_args"] = {'check_same_thread': False}
-
-            if not FLAGS.sqlite_synchronous:
-                engine_args["listeners"] = [SynchronousSwitchListener()]
+    Only the queries that can tolerate replication lag belong in the
+    block, and nothing that writes.
+    """
+    slave = getattr(_LOCAL, 'slave', False)
+    _LOCAL.slave = True
+    try:
+        yield
+    finally:
+        _LOCAL.slave = slave
 
-        if 'mysql' in connection_dict.drivername:
-            engine_args['listeners'] = [MySQLPingListener()]
 
-        _ENGINE = sqlalchemy.create_engine(FLAGS.sql_connection, **engine_args)
+def get_engine(slave=False):
+    """Return a SQLAlchemy engine.
 
-        if (FLAGS.sql_connection_trace and
-                _ENGINE.dialect.dbapi.__name__ == 'MySQLdb'):
-            import MySQLdb.cursors
-            _do_query = debug_mysql_do_query()
-            setattr(MySQLdb.cursors.BaseCursor, '_do_query', _do_query)
+    The engine of the slave database is returned if slave is True and
+    sql_slave_connection is set.
+    """
+    global _ENGINE, _SLAVE_ENGINE
+    if slave and FLAGS.sql_slave_connection:
+        if _SLAVE_ENGINE is None:
+            _SLAVE_ENGINE = _create_engine(FLAGS.sql_slave_connection)
+        return _SLAVE_ENGINE
+    if _ENGINE is None:
+        _ENGINE = _create_engine(FLAGS.sql_connection)
+    return _ENGINE
 
-        try:
-            _ENGINE.connect()
-        except OperationalError, e:
-            if not is_db_connection_error(e.args[0]):
-                raise
 
-            remaining = FLAGS.sql_max_retries
-            if remaining == -1:
-                remaining = 'infinite'
-            while True:
-                msg = _('SQL connection failed. %s attempts left.')
-                LOG.warn(msg % remaining)
-                if remaining != 'infinite':
-                    remaining -= 1
-                time.sleep(FLAGS.sql_retry_interval)
-                try:
-                    _ENGINE.connect()
-                    break
-                except OperationalError, e:
-                    if (remaining != 'infinite' and remaining == 0) or \
-                       not is_db_connection_error(e.args[0]):
-                        raise
-    return _ENGINE
+def _create_engine(sql_connection):
+    """Create a SQLAlchemy engine connected to sql_connection."""
+    connection_dict = sqlalchemy.engine.url.make_url(sql_connection)
+
+    engine_args = {
+        "pool_recycle": FLAGS.sql_idle_timeout,
+        "echo": False,
+        'convert_unicode': True,
+    }
+
+    # Map our SQL debug level to SQLAlchemy's options
+    if FLAGS.sql_connection_debug >= 100:
+        engine_args['echo'] = 'debug'
+    elif FLAGS.sql_connection_debug >= 50:
+        engine_args['echo'] = True
+
+    if "sqlite" in connection_dict.drivername:
+        engine_args["poolclass"] = NullPool
+
+        if sql_connection == "sqlite://":
+            engine_args["poolclass"] = StaticPool
+            engine_args["connect_args"] = {'check_same_thread': False}
+
+        if not FLAGS.sqlite_synchronous:
+            engine_args["listeners"] = [SynchronousSwitchListener()]
+
+    if 'mysql' in connection_dict.drivername:
+        engine_args['listeners'] = [MySQLPingListener()]
+
+    engine = sqlalchemy.create_engine(sql_connection, **engine_args)
+
+    if (FLAGS.sql_connection_trace and
+            engine.dialect.dbapi.__name__ == 'MySQLdb'):
+        import MySQLdb.cursors
+        _do_query = debug_mysql_do_query()
+        setattr(MySQLdb.cursors.BaseCursor, '_do_query', _do_query)
+
+    try:
+        engine.connect()
+    except OperationalError, e:
+        if not is_db_connection_error(e.args[0]):
+            raise
+
+        remaining = FLAGS.sql_max_retries
+        if remaining == -1:
+            remaining = 'infinite'
+        while True:
+            msg = _('SQL connection failed. %s attempts left.')
+            LOG.warn(msg % remaining)
+            if remaining != 'infinite':
+                remaining -= 1
+            time.sleep(FLAGS.sql_retry_interval)
+            try:
+                engine.connect()
+                break
+            except OperationalError, e:
+                if (remaining != 'infinite' and remaining == 0) or \
+                   not is_db_connection_error(e.args[0]):
+                    raise
+    return engine
 
 
 def get_maker(engine, autocommit=True, expire_on_commit=False):
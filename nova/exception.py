@@ -988,6 +988,11 @@ class NoValidHost(NovaException):
     message = _("No valid host was found. %(reason)s")
 
 
+class ComputeNodeClaimConflict(NovaException):
+    message = _("Resources on compute host %(host)s were claimed by "
+                "another request.")
+
+
 class WillNotSchedule(NovaException):
     message = _("Host %(host)s is not up or doesn't exist.")
 
@@ -1092,6 +1097,10 @@ class InstanceNotFound(NotFound):
     message = _("Instance %(instance_id)s could not be found.")
 
 
+class MarkerNotFound(NotFound):
+    message = _("Marker %(marker)s could not be found.")
+
+
 class InvalidInstanceIDMalformed(Invalid):
     message = _("Invalid id: %(val)s (expecting \"i-...\").")
 
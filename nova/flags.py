@@ -94,6 +94,16 @@ core_opts = [
                default='sqlite:///$state_path/$sqlite_db',
                help='The SQLAlchemy connection string used to connect to the '
                     'database'),
+    cfg.StrOpt('sql_slave_connection',
+               default='',
+               help='The SQLAlchemy connection string used to connect to a '
+                    'read-only replica of the database, which serves the '
+                    'reads that can tolerate replication lag'),
+    cfg.IntOpt('db_lookup_cache_interval',
+               default=0,
+               help='Cache the lookups of instance types and aggregates, '
+                    'checking the database for changes to them at most once '
+                    'in this many seconds. 0 disables the cache'),
     cfg.StrOpt('api_paste_config',
                default="api-paste.ini",
                help='File name for the paste.deploy config for nova-api'),
@@ -264,6 +264,21 @@ class API(base.Base):
         """Returns all network info related to an instance."""
         return self._get_instance_nw_info(context, instance)
 
+    def refresh_instances_cache(self, context, instances):
+        """Refreshes the info_cache of several instances, writing them to
+        the database at once."""
+        caches = {}
+        for instance in instances:
+            try:
+                nw_info = self._get_instance_nw_info(context, instance)
+            except Exception:
+                LOG.exception(_('Failed to get network info'),
+                              instance=instance)
+                continue
+            caches[instance['uuid']] = {'network_info': nw_info.json()}
+        if caches:
+            self.db.instance_info_cache_update_multi(context, caches)
+
     def _get_instance_nw_info(self, context, instance):
         """Returns all network info related to an instance."""
         args = {'instance_id': instance['id'],
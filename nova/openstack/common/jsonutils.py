@@ -37,6 +37,10 @@ import datetime
 import inspect
 import itertools
 import json
+import types
+
+
+_simple_types = (types.NoneType, basestring, int, long, float, bool)
 
 
 def to_primitive(value, convert_instances=False, level=0):
@@ -53,6 +57,23 @@ def to_primitive(value, convert_instances=False, level=0):
     Therefore, convert_instances=True is lossy ... be aware.
 
     """
+    # Handle the most common types first, ahead of the costlier checks
+    # below.  RPC messages are mostly made of these.
+    if level <= 3:
+        if isinstance(value, _simple_types):
+            return value
+        if type(value) is dict:
+            return dict((k, to_primitive(v,
+                                         convert_instances=convert_instances,
+                                         level=level))
+                        for k, v in value.iteritems())
+        if type(value) is list:
+            return [to_primitive(v, convert_instances=convert_instances,
+                                 level=level)
+                    for v in value]
+        if isinstance(value, datetime.datetime):
+            return str(value)
+
     nasty = [inspect.ismodule, inspect.isclass, inspect.ismethod,
              inspect.isfunction, inspect.isgeneratorfunction,
              inspect.isgenerator, inspect.istraceback, inspect.isframe,
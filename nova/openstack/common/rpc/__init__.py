@@ -56,6 +56,13 @@ rpc_opts = [
     cfg.BoolOpt('fake_rabbit',
                 default=False,
                 help='If passed, use a fake RabbitMQ provider'),
+    cfg.StrOpt('rpc_serializer',
+               default='json',
+               help='Encoding of the RPC messages sent, json or msgpack. '
+                    'msgpack is more compact and faster to encode and needs '
+                    'the msgpack module. Messages carry their content type, '
+                    'so services receive both. Only supported by impl_kombu '
+                    'and impl_zmq.'),
     ]
 
 cfg.CONF.register_opts(rpc_opts)
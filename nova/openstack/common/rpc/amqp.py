@@ -25,19 +25,57 @@ Specifically, this includes impl_kombu and impl_qpid.  impl_carrot also uses
 AMQP, but is deprecated and predates this code.
 """
 
+import collections
 import inspect
 import logging
 import sys
+import time
 import uuid
+import weakref
 
-from eventlet import greenpool
+import eventlet
 from eventlet import pools
+from eventlet import queue
 from eventlet import semaphore
 
+from nova.openstack.common import cfg
 from nova.openstack.common import excutils
 from nova.openstack.common import local
 from nova.openstack.common.rpc import common as rpc_common
-
+from nova.openstack.common.rpc import metrics as rpc_metrics
+
+
+amqp_opts = [
+    cfg.BoolOpt('amqp_rpc_single_reply_queue',
+                default=False,
+                help='Receive the replies to call and multicall on a single '
+                     'reply queue per process instead of declaring a queue '
+                     'per call. Only enable once every service replying to '
+                     'the calls understands the reply queue'),
+    cfg.IntOpt('rpc_dispatch_queue_size',
+               default=64,
+               help='Number of received messages, other than the low '
+                    'priority ones, that wait for a free RPC thread before '
+                    'a service stops taking messages off its queues. Also '
+                    'the prefetch count of the kombu consumers'),
+    cfg.ListOpt('rpc_low_priority_methods',
+                default=['update_service_capabilities'],
+                help='RPC methods that only get the RPC threads left over '
+                     'by the other methods, and one kept for them'),
+    cfg.IntOpt('rpc_low_priority_thread_pool_size',
+               default=8,
+               help='Most RPC threads the low priority methods may use at '
+                    'once'),
+    cfg.IntOpt('rpc_low_priority_queue_size',
+               default=1024,
+               help='Number of low priority messages that wait for a free '
+                    'RPC thread. A newer message of the same method from '
+                    'the same service and host replaces the waiting one. '
+                    'When another one arrives, the oldest waiting one is '
+                    'dropped'),
+    ]
+
+cfg.CONF.register_opts(amqp_opts)
 
 LOG = logging.getLogger(__name__)
 
@@ -47,6 +85,7 @@ class Pool(pools.Pool):
     def __init__(self, conf, connection_cls, *args, **kwargs):
         self.connection_cls = connection_cls
         self.conf = conf
+        self.reply_proxy = None
         kwargs.setdefault("max_size", self.conf.rpc_conn_pool_size)
         kwargs.setdefault("order_as_stack", True)
         super(Pool, self).__init__(*args, **kwargs)
@@ -59,9 +98,13 @@ class Pool(pools.Pool):
     def empty(self):
         while self.free_items:
             self.get().close()
+        if self.reply_proxy:
+            self.reply_proxy.close()
+            self.reply_proxy = None
 
 
 _pool_create_sem = semaphore.Semaphore()
+_reply_proxy_create_sem = semaphore.Semaphore()
 
 
 def get_connection_pool(conf, connection_cls):
@@ -146,12 +189,57 @@ class ConnectionContext(rpc_common.Connection):
             raise rpc_common.InvalidRPCConnectionReuse()
 
 
+class ReplyProxy(ConnectionContext):
+    """Connection consuming the replies to all the calls of a process.
+
+    The replies to the calls made while amqp_rpc_single_reply_queue is set
+    are all sent to this one queue, and handed by their _msg_id to the
+    MulticallProxyWaiter of the call.
+    """
+
+    def __init__(self, conf, connection_pool):
+        self._call_waiters = {}
+        self._reply_q = 'reply_' + uuid.uuid4().hex
+        super(ReplyProxy, self).__init__(conf, connection_pool, pooled=False)
+        self.declare_direct_consumer(self._reply_q, self._process_data)
+        self.consume_in_thread()
+
+    def _process_data(self, message_data):
+        msg_id = message_data.pop('_msg_id', None)
+        waiter = self._call_waiters.get(msg_id)
+        if waiter is None:
+            LOG.warn(_('No call waiting for the reply to msg_id %s, it may '
+                       'have timed out'), msg_id)
+        else:
+            waiter.put(message_data)
+
+    def add_call_waiter(self, waiter, msg_id):
+        self._call_waiters[msg_id] = waiter
+
+    def del_call_waiter(self, msg_id):
+        self._call_waiters.pop(msg_id, None)
+
+    def get_reply_q(self):
+        return self._reply_q
+
+
+def get_reply_proxy(conf, connection_pool):
+    with _reply_proxy_create_sem:
+        # Make sure only one thread declares the reply queue.
+        if not connection_pool.reply_proxy:
+            connection_pool.reply_proxy = ReplyProxy(conf, connection_pool)
+    return connection_pool.reply_proxy
+
+
 def msg_reply(conf, msg_id, connection_pool, reply=None, failure=None,
-              ending=False):
+              ending=False, reply_q=None):
     """Sends a reply or an error on the channel signified by msg_id.
 
     Failure should be a sys.exc_info() tuple.
 
+    If the caller gave a reply_q, the reply is sent to that queue along
+    with msg_id instead.
+
     """
     with ConnectionContext(conf, connection_pool) as conn:
         if failure:
@@ -165,13 +253,18 @@ def msg_reply(conf, msg_id, connection_pool, reply=None, failure=None,
                     'failure': failure}
         if ending:
             msg['ending'] = True
-        conn.direct_send(msg_id, msg)
+        if reply_q:
+            msg['_msg_id'] = msg_id
+            conn.direct_send(reply_q, msg)
+        else:
+            conn.direct_send(msg_id, msg)
 
 
 class RpcContext(rpc_common.CommonRpcContext):
     """Context that supports replying to a rpc.call"""
     def __init__(self, **kwargs):
         self.msg_id = kwargs.pop('msg_id', None)
+        self.reply_q = kwargs.pop('reply_q', None)
         self.conf = kwargs.pop('conf')
         super(RpcContext, self).__init__(**kwargs)
 
@@ -179,13 +272,14 @@ class RpcContext(rpc_common.CommonRpcContext):
         values = self.to_dict()
         values['conf'] = self.conf
         values['msg_id'] = self.msg_id
+        values['reply_q'] = self.reply_q
         return self.__class__(**values)
 
     def reply(self, reply=None, failure=None, ending=False,
               connection_pool=None):
         if self.msg_id:
             msg_reply(self.conf, self.msg_id, connection_pool, reply, failure,
-                      ending)
+                      ending, self.reply_q)
             if ending:
                 self.msg_id = None
 
@@ -201,6 +295,7 @@ def unpack_context(conf, msg):
             value = msg.pop(key)
             context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
     context_dict['conf'] = conf
     ctx = RpcContext.from_dict(context_dict)
     rpc_common._safe_log(LOG.debug, _('unpacked context: %s'), ctx.to_dict())
@@ -221,20 +316,194 @@ def pack_context(msg, context):
     msg.update(context_d)
 
 
+class DispatchScheduler(object):
+    """Runs received messages on a bounded number of RPC threads.
+
+    Messages wait in the lane of their priority until a thread is free.
+    Free threads go to the default lane first, but it may not take the
+    last of the rpc_thread_pool_size threads, which is kept for the low
+    lane.  The low lane may use rpc_low_priority_thread_pool_size threads
+    at most, so periodic fanouts can't hold up user facing calls and
+    don't starve behind them either.
+
+    Once rpc_dispatch_queue_size messages wait in the default lane,
+    submit() blocks the consumer until one of them gets a thread, leaving
+    the rest of the messages on the broker.  The low lane never blocks
+    the consumer.  A low priority message submitted with a key replaces
+    the waiting message with the same key, e.g. an older capabilities
+    update of the same service, and takes its place in the lane.  Once
+    rpc_low_priority_queue_size messages wait in the low lane, the oldest
+    one is dropped.
+
+    A 'dispatch' metric is passed to the rpc_metrics_drivers for each
+    message that gets a thread, is superseded or is dropped.
+    """
+
+    LANES = ('default', 'low')
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.size = max(conf.rpc_thread_pool_size, 1)
+        low_limit = min(conf.rpc_low_priority_thread_pool_size, self.size)
+        self.limits = {'default': max(self.size - 1, 1),
+                       'low': max(low_limit, 1)}
+        self.slots = semaphore.Semaphore(max(conf.rpc_dispatch_queue_size, 1))
+        # { <lane> : deque([[<queued at>, <method>, <func>, <args>, <key>,
+        #                    <dropped callback>], ...]) }
+        self.waiting = dict((lane, collections.deque())
+                            for lane in self.LANES)
+        # { <key> : <the waiting entry of the low lane with that key> }
+        self.keyed = {}
+        self.running = dict((lane, 0) for lane in self.LANES)
+        self.dispatched = dict((lane, 0) for lane in self.LANES)
+        self.superseded = dict((lane, 0) for lane in self.LANES)
+        self.dropped = dict((lane, 0) for lane in self.LANES)
+        self.wait_total = dict((lane, 0.0) for lane in self.LANES)
+        self.wait_max = dict((lane, 0.0) for lane in self.LANES)
+
+    def lane_for(self, method):
+        if method in self.conf.rpc_low_priority_methods:
+            return 'low'
+        return 'default'
+
+    def submit(self, method, func, args, key=None, dropped=None):
+        """Run func(*args) on an RPC thread once the lane of method gets
+        one.
+
+        :param key: Low priority messages with the same key replace each
+                    other while they wait.
+        :param dropped: Called with the reason if the message never runs.
+        """
+        lane = self.lane_for(method)
+        queued = [time.time(), method, func, args, key, dropped]
+        if lane == 'default':
+            self.slots.acquire()
+            self.waiting[lane].append(queued)
+        elif key is not None and key in self.keyed:
+            waiting = self.keyed[key]
+            self._record(lane, list(waiting), 'superseded')
+            waiting[:] = queued
+        else:
+            waiting = self.waiting[lane]
+            while waiting and (len(waiting) >=
+                               max(self.conf.rpc_low_priority_queue_size, 1)):
+                self._record(lane, self._pop(lane), 'dropped')
+            waiting.append(queued)
+            if key is not None:
+                self.keyed[key] = queued
+        self._dispatch()
+
+    def _pop(self, lane):
+        queued = self.waiting[lane].popleft()
+        if queued[4] is not None:
+            self.keyed.pop(queued[4], None)
+        return queued
+
+    def _record(self, lane, queued, outcome):
+        queued_at, method, func, args, key, dropped = queued
+        wait = time.time() - queued_at
+        if outcome == 'dispatched':
+            self.dispatched[lane] += 1
+            self.wait_total[lane] += wait
+            self.wait_max[lane] = max(self.wait_max[lane], wait)
+            if wait >= 1:
+                LOG.debug(_('%(method)s waited %(wait).1f seconds in the '
+                            '%(lane)s lane'), locals())
+        elif outcome == 'superseded':
+            self.superseded[lane] += 1
+            LOG.debug(_('%(method)s was superseded after it waited '
+                        '%(wait).1f seconds in the %(lane)s lane'), locals())
+            if dropped:
+                dropped(_('superseded by a newer message'))
+        else:
+            self.dropped[lane] += 1
+            LOG.warn(_('Dropped %(method)s after it waited %(wait).1f '
+                       'seconds in the %(lane)s lane'), locals())
+            if dropped:
+                dropped(_('too many messages waiting'))
+        rpc_metrics.record(self.conf, {'kind': 'dispatch',
+                                       'method': method,
+                                       'lane': lane,
+                                       'wait': wait,
+                                       'waiting': len(self.waiting[lane]),
+                                       'running': self.running[lane],
+                                       'outcome': outcome})
+
+    def _next_lane(self):
+        if sum(self.running.values()) >= self.size:
+            return None
+        for lane in self.LANES:
+            if self.waiting[lane] and self.running[lane] < self.limits[lane]:
+                return lane
+        return None
+
+    def _dispatch(self):
+        lane = self._next_lane()
+        while lane is not None:
+            queued = self._pop(lane)
+            if lane == 'default':
+                self.slots.release()
+            self.running[lane] += 1
+            self._record(lane, queued, 'dispatched')
+            eventlet.spawn_n(self._run, lane, queued[2], queued[3])
+            lane = self._next_lane()
+
+    def _run(self, lane, func, args):
+        try:
+            func(*args)
+        finally:
+            self.running[lane] -= 1
+            self._dispatch()
+
+    def get_stats(self):
+        """Return the queue depth and wait times of each lane."""
+        stats = {}
+        for lane in self.LANES:
+            dispatched = self.dispatched[lane]
+            stats[lane] = {
+                'waiting': len(self.waiting[lane]),
+                'running': self.running[lane],
+                'dispatched': dispatched,
+                'superseded': self.superseded[lane],
+                'dropped': self.dropped[lane],
+                'wait_avg': dispatched and self.wait_total[lane] / dispatched,
+                'wait_max': self.wait_max[lane],
+            }
+        return stats
+
+
+# The DispatchScheduler of each proxy object, shared by all the consumers
+# of one service
+_schedulers = weakref.WeakKeyDictionary()
+
+
+def get_dispatch_scheduler(conf, proxy):
+    """Return the DispatchScheduler running the messages for proxy."""
+    scheduler = _schedulers.get(proxy)
+    if scheduler is None:
+        scheduler = _schedulers[proxy] = DispatchScheduler(conf)
+    return scheduler
+
+
+def get_dispatch_stats():
+    """Return the get_stats() of the DispatchScheduler of each service."""
+    return [scheduler.get_stats() for scheduler in _schedulers.values()]
+
+
 class ProxyCallback(object):
     """Calls methods on a proxy object based on method and args."""
 
     def __init__(self, conf, proxy, connection_pool):
         self.proxy = proxy
-        self.pool = greenpool.GreenPool(conf.rpc_thread_pool_size)
+        self.scheduler = get_dispatch_scheduler(conf, proxy)
         self.connection_pool = connection_pool
         self.conf = conf
 
     def __call__(self, message_data):
         """Consumer callback to call a method on a proxy object.
 
-        Parses the message for validity and fires off a thread to call the
-        proxy object method.
+        Parses the message for validity and hands the call of the proxy
+        object method to the DispatchScheduler.
 
         Message data should be a dictionary with two keys:
             method: string representing the method to call
@@ -257,7 +526,28 @@ class ProxyCallback(object):
             ctxt.reply(_('No method for message: %s') % message_data,
                        connection_pool=self.connection_pool)
             return
-        self.pool.spawn_n(self._process_data, ctxt, version, method, args)
+        # A newer message of the same method from the same service on the
+        # same host supersedes the older one while it waits
+        key = None
+        if 'host' in args:
+            key = (method, args.get('service_name'), args['host'])
+        self.scheduler.submit(method, self._process_data,
+                              (ctxt, version, method, args), key,
+                              lambda reason: self._dropped(ctxt, method,
+                                                           reason))
+
+    def _dropped(self, ctxt, method, reason):
+        """Return an error to the caller of a message that won't run,
+        instead of letting it time out.
+        """
+        if not ctxt.msg_id:
+            return
+        try:
+            raise rpc_common.MessageDropped(method=method, reason=reason)
+        except rpc_common.MessageDropped:
+            failure = sys.exc_info()
+        eventlet.spawn_n(ctxt.reply, None, failure,
+                         connection_pool=self.connection_pool)
 
     def _process_data(self, ctxt, version, method, args):
         """Process a message in a new thread.
@@ -286,8 +576,9 @@ class ProxyCallback(object):
 
 
 class MulticallWaiter(object):
-    def __init__(self, conf, connection, timeout):
+    def __init__(self, conf, connection, timeout, timer=None):
         self._connection = connection
+        self._timer = timer
         self._iterator = connection.iterconsume(
                                 timeout=timeout or conf.rpc_response_timeout)
         self._result = None
@@ -295,13 +586,15 @@ class MulticallWaiter(object):
         self._got_ending = False
         self._conf = conf
 
-    def done(self):
+    def done(self, exc=None):
         if self._done:
             return
         self._done = True
         self._iterator.close()
         self._iterator = None
         self._connection.close()
+        if self._timer:
+            self._timer.stop(exc)
 
     def __call__(self, data):
         """The consume() callback will call this.  Store the result."""
@@ -322,17 +615,89 @@ class MulticallWaiter(object):
         while True:
             try:
                 self._iterator.next()
-            except Exception:
+            except Exception, e:
                 with excutils.save_and_reraise_exception():
-                    self.done()
+                    self.done(e)
             if self._got_ending:
                 self.done()
                 raise StopIteration
             result = self._result
             if isinstance(result, Exception):
+                self.done(result)
+                raise result
+            try:
+                yield result
+            except GeneratorExit:
+                # The caller stopped iterating before the last reply
                 self.done()
+                raise
+
+
+class MulticallProxyWaiter(object):
+    """Waits for the replies to a call on the ReplyProxy of the process."""
+
+    def __init__(self, conf, msg_id, timeout, connection_pool, timer=None):
+        self._msg_id = msg_id
+        self._timer = timer
+        self._timeout = timeout or conf.rpc_response_timeout
+        self._reply_proxy = connection_pool.reply_proxy
+        self._done = False
+        self._got_ending = False
+        self._conf = conf
+        self._dataqueue = queue.LightQueue()
+        self._reply_proxy.add_call_waiter(self, self._msg_id)
+
+    def put(self, data):
+        """The ReplyProxy will call this with the replies to msg_id."""
+        self._dataqueue.put(data)
+
+    def done(self, exc=None):
+        if self._done:
+            return
+        self._done = True
+        self._reply_proxy.del_call_waiter(self._msg_id)
+        if self._timer:
+            self._timer.stop(exc)
+
+    def _process_data(self, data):
+        result = None
+        if data['failure']:
+            failure = data['failure']
+            result = rpc_common.deserialize_remote_exception(self._conf,
+                    failure)
+        elif data.get('ending', False):
+            self._got_ending = True
+        else:
+            result = data['result']
+        return result
+
+    def __iter__(self):
+        """Return a result until we get a reply with 'ending' set"""
+        if self._done:
+            raise StopIteration
+        while True:
+            try:
+                data = self._dataqueue.get(timeout=self._timeout)
+                result = self._process_data(data)
+            except queue.Empty:
+                exc = rpc_common.Timeout()
+                self.done(exc)
+                raise exc
+            except Exception, e:
+                with excutils.save_and_reraise_exception():
+                    self.done(e)
+            if self._got_ending:
+                self.done()
+                raise StopIteration
+            if isinstance(result, Exception):
+                self.done(result)
                 raise result
-            yield result
+            try:
+                yield result
+            except GeneratorExit:
+                # The caller stopped iterating before the last reply
+                self.done()
+                raise
 
 
 def create_connection(conf, new, connection_pool):
@@ -352,10 +717,29 @@ def multicall(conf, context, topic, msg, timeout, connection_pool):
     LOG.debug(_('MSG_ID is %s') % (msg_id))
     pack_context(msg, context)
 
-    conn = ConnectionContext(conf, connection_pool)
-    wait_msg = MulticallWaiter(conf, conn, timeout)
-    conn.declare_direct_consumer(msg_id, wait_msg)
-    conn.topic_send(topic, msg)
+    timer = rpc_metrics.Timer(conf, 'call', topic, msg)
+    wait_msg = None
+    try:
+        if not conf.amqp_rpc_single_reply_queue:
+            conn = ConnectionContext(conf, connection_pool)
+            wait_msg = MulticallWaiter(conf, conn, timeout, timer)
+            conn.declare_direct_consumer(msg_id, wait_msg)
+            conn.topic_send(topic, msg)
+        else:
+            reply_proxy = get_reply_proxy(conf, connection_pool)
+            msg.update({'_reply_q': reply_proxy.get_reply_q()})
+            # Wait for the replies before sending, so none is missed.
+            wait_msg = MulticallProxyWaiter(conf, msg_id, timeout,
+                                            connection_pool, timer)
+            with ConnectionContext(conf, connection_pool) as conn:
+                conn.topic_send(topic, msg)
+    except Exception, e:
+        with excutils.save_and_reraise_exception():
+            # Stop waiting for replies to a message that wasn't sent
+            if wait_msg:
+                wait_msg.done(e)
+            else:
+                timer.stop(e)
     return wait_msg
 
 
@@ -373,33 +757,37 @@ def cast(conf, context, topic, msg, connection_pool):
     """Sends a message on a topic without waiting for a response."""
     LOG.debug(_('Making asynchronous cast on %s...'), topic)
     pack_context(msg, context)
-    with ConnectionContext(conf, connection_pool) as conn:
-        conn.topic_send(topic, msg)
+    with rpc_metrics.Timer(conf, 'cast', topic, msg):
+        with ConnectionContext(conf, connection_pool) as conn:
+            conn.topic_send(topic, msg)
 
 
 def fanout_cast(conf, context, topic, msg, connection_pool):
     """Sends a message on a fanout exchange without waiting for a response."""
     LOG.debug(_('Making asynchronous fanout cast...'))
     pack_context(msg, context)
-    with ConnectionContext(conf, connection_pool) as conn:
-        conn.fanout_send(topic, msg)
+    with rpc_metrics.Timer(conf, 'fanout_cast', topic, msg):
+        with ConnectionContext(conf, connection_pool) as conn:
+            conn.fanout_send(topic, msg)
 
 
 def cast_to_server(conf, context, server_params, topic, msg, connection_pool):
     """Sends a message on a topic to a specific server."""
     pack_context(msg, context)
-    with ConnectionContext(conf, connection_pool, pooled=False,
-            server_params=server_params) as conn:
-        conn.topic_send(topic, msg)
+    with rpc_metrics.Timer(conf, 'cast', topic, msg):
+        with ConnectionContext(conf, connection_pool, pooled=False,
+                server_params=server_params) as conn:
+            conn.topic_send(topic, msg)
 
 
 def fanout_cast_to_server(conf, context, server_params, topic, msg,
         connection_pool):
     """Sends a message on a fanout exchange to a specific server."""
     pack_context(msg, context)
-    with ConnectionContext(conf, connection_pool, pooled=False,
-            server_params=server_params) as conn:
-        conn.fanout_send(topic, msg)
+    with rpc_metrics.Timer(conf, 'fanout_cast', topic, msg):
+        with ConnectionContext(conf, connection_pool, pooled=False,
+                server_params=server_params) as conn:
+            conn.fanout_send(topic, msg)
 
 
 def notify(conf, context, topic, msg, connection_pool):
@@ -27,9 +27,17 @@ from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import local
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 LOG = logging.getLogger(__name__)
 
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/x-msgpack'
+
 
 class RPCException(Exception):
     message = _("An unknown RPC related exception occurred.")
@@ -91,6 +99,16 @@ class UnsupportedRpcVersion(RPCException):
                 "this endpoint.")
 
 
+class MessageDropped(RPCException):
+    """Signifies that the server dropped a call before running it.
+
+    This exception is returned to the caller of a low priority method
+    the server had no RPC thread for, instead of letting it time out.
+    """
+    message = _("The %(method)s message was dropped before it ran: "
+                "%(reason)s.")
+
+
 class Connection(object):
     """A connection, returned by rpc.create_connection().
 
@@ -270,6 +288,63 @@ def deserialize_remote_exception(conf, data):
     return failure
 
 
+def _msgpack_dumps(msg):
+    # As with jsonutils.dumps(), to_primitive() is only called for the
+    # values msgpack can't encode itself.
+    return msgpack.packb(msg, default=jsonutils.to_primitive)
+
+
+def _msgpack_loads(data):
+    # Strings come back as unicode, as they do from JSON.
+    return msgpack.unpackb(data, use_list=True, encoding='utf-8')
+
+
+# { <rpc_serializer> : (<content type>, <content encoding>, <dumps>) }
+_SERIALIZERS = {
+    'json': (JSON_CONTENT_TYPE, 'utf-8', jsonutils.dumps),
+    'msgpack': (MSGPACK_CONTENT_TYPE, 'binary', _msgpack_dumps),
+    }
+
+# { <content type> : <loads> }
+_DESERIALIZERS = {
+    JSON_CONTENT_TYPE: jsonutils.loads,
+    MSGPACK_CONTENT_TYPE: _msgpack_loads,
+    }
+
+
+def serialize_msg(conf, msg):
+    """Encode msg with the rpc_serializer of conf.
+
+    Returns a tuple of the content type, the content encoding and the
+    encoded message.  The receiver decodes it with deserialize_msg() and
+    the content type, whatever its own rpc_serializer, so the services can
+    switch to another serializer one by one.
+    """
+    serializer = conf.rpc_serializer
+    if serializer == 'msgpack' and msgpack is None:
+        LOG.warn(_('rpc_serializer is msgpack but the msgpack module is not '
+                   'installed, sending JSON instead'))
+        serializer = 'json'
+    try:
+        content_type, content_encoding, dumps = _SERIALIZERS[serializer]
+    except KeyError:
+        raise RPCException(_('Unknown rpc_serializer %s') % serializer)
+    return content_type, content_encoding, dumps(msg)
+
+
+def deserialize_msg(content_type, data):
+    """Decode a message encoded by serialize_msg()."""
+    if content_type == MSGPACK_CONTENT_TYPE and msgpack is None:
+        raise RPCException(_('Received a msgpack message but the msgpack '
+                             'module is not installed'))
+    try:
+        loads = _DESERIALIZERS[content_type]
+    except KeyError:
+        raise RPCException(_('Unknown message content type %s') %
+                           content_type)
+    return loads(data)
+
+
 class CommonRpcContext(object):
     def __init__(self, **kwargs):
         self.values = kwargs
@@ -23,6 +23,7 @@ import time
 import uuid
 
 import eventlet
+from eventlet import queue
 import greenlet
 import kombu
 import kombu.connection
@@ -79,7 +80,21 @@ kombu_opts = [
     cfg.BoolOpt('rabbit_durable_queues',
                 default=False,
                 help='use durable queues in RabbitMQ'),
-
+    cfg.FloatOpt('rabbit_cast_batch_window',
+                 default=0.0,
+                 help='Seconds a cast or notification waits for the ones '
+                      'sent after it, to be published together with them '
+                      'on a connection of their own. Casts may then '
+                      'overtake calls made after them. 0 publishes each '
+                      'one as it is sent'),
+    cfg.IntOpt('rabbit_cast_batch_size',
+               default=100,
+               help='Most casts and notifications published in one batch'),
+    cfg.BoolOpt('rabbit_commit_cast_batches',
+                default=False,
+                help='Publish each batch of casts in an AMQP transaction, '
+                     'waiting for RabbitMQ to take the whole batch and '
+                     'publishing it again after a reconnect'),
     ]
 
 cfg.CONF.register_opts(kombu_opts)
@@ -138,7 +153,12 @@ class ConsumerBase(object):
         def _callback(raw_message):
             message = self.channel.message_to_python(raw_message)
             try:
-                callback(message.payload)
+                if message.content_type == rpc_common.MSGPACK_CONTENT_TYPE:
+                    payload = rpc_common.deserialize_msg(message.content_type,
+                                                         message.body)
+                else:
+                    payload = message.payload
+                callback(payload)
                 message.ack()
             except Exception:
                 LOG.exception(_("Failed to process message... skipping it."))
@@ -264,7 +284,18 @@ class FanoutConsumer(ConsumerBase):
 
 
 class Publisher(object):
-    """Base Publisher class"""
+    """Base Publisher class
+
+    A Connection keeps the publishers for which cache_key() returns a key
+    and reuses them for every topic with the same key.  The others are
+    created, and declare their exchange, on each send, as their exchange
+    may have been auto-deleted since the last one.
+    """
+
+    @classmethod
+    def cache_key(cls, conf, topic):
+        """Return the key of the publisher for topic, None to not keep it"""
+        return None
 
     def __init__(self, channel, exchange_name, routing_key, **kwargs):
         """Init the Publisher class with the exchange_name, routing_key,
@@ -282,9 +313,12 @@ class Publisher(object):
         self.producer = kombu.messaging.Producer(exchange=self.exchange,
                 channel=channel, routing_key=self.routing_key)
 
-    def send(self, msg):
-        """Send a message"""
-        self.producer.publish(msg)
+    def send(self, msg, content_type=None, content_encoding=None,
+             routing_key=None):
+        """Send a message, already encoded if content_type is given"""
+        self.producer.publish(msg, routing_key=routing_key,
+                              content_type=content_type,
+                              content_encoding=content_encoding)
 
 
 class DirectPublisher(Publisher):
@@ -308,6 +342,11 @@ class DirectPublisher(Publisher):
 
 class TopicPublisher(Publisher):
     """Publisher class for 'topic'"""
+
+    @classmethod
+    def cache_key(cls, conf, topic):
+        return conf.control_exchange
+
     def __init__(self, conf, channel, topic, **kwargs):
         """init a 'topic' publisher.
 
@@ -345,6 +384,11 @@ class FanoutPublisher(Publisher):
 class NotifyPublisher(TopicPublisher):
     """Publisher class for 'notify'"""
 
+    @classmethod
+    def cache_key(cls, conf, topic):
+        # the queue named after the topic is declared by reconnect()
+        return topic
+
     def __init__(self, conf, channel, topic, **kwargs):
         self.durable = kwargs.pop('durable', conf.rabbit_durable_queues)
         super(NotifyPublisher, self).__init__(conf, channel, topic, **kwargs)
@@ -461,10 +505,7 @@ class Connection(object):
             self.connection.transport.polling_interval = 0.0
         self.consumer_num = itertools.count(1)
         self.connection.connect()
-        self.channel = self.connection.channel()
-        # work around 'memory' transport bug in 1.1.3
-        if self.memory_transport:
-            self.channel._new_queue('ae.undeliver')
+        self._open_channel()
         for consumer in self.consumers:
             consumer.reconnect(self.channel)
         LOG.info(_('Connected to AMQP server on %(hostname)s:%(port)d'),
@@ -553,15 +594,27 @@ class Connection(object):
         self.connection.release()
         self.connection = None
 
-    def reset(self):
-        """Reset a connection so it can be used again"""
-        self.cancel_consumer_thread()
-        self.channel.close()
+    def _open_channel(self):
         self.channel = self.connection.channel()
         # work around 'memory' transport bug in 1.1.3
         if self.memory_transport:
             self.channel._new_queue('ae.undeliver')
-        self.consumers = []
+        # don't get more messages than the service has room for
+        if self.conf.rpc_dispatch_queue_size > 0:
+            self.channel.basic_qos(0, self.conf.rpc_dispatch_queue_size,
+                                   False)
+        self.publishers = {}
+        self.transactional = False
+
+    def reset(self):
+        """Reset a connection so it can be used again"""
+        self.cancel_consumer_thread()
+        # A channel that was only published on is kept, along with the
+        # publishers declared on it
+        if self.consumers:
+            self.channel.close()
+            self._open_channel()
+            self.consumers = []
 
     def declare_consumer(self, consumer_cls, topic, callback):
         """Create a Consumer using the class that was passed in and
@@ -621,19 +674,73 @@ class Connection(object):
                 pass
             self.consumer_thread = None
 
-    def publisher_send(self, cls, topic, msg, **kwargs):
-        """Send to a publisher based on the publisher class"""
+    def _get_publisher(self, cls, topic, kwargs):
+        key = cls.cache_key(self.conf, topic)
+        if key is None:
+            return cls(self.conf, self.channel, topic, **kwargs)
+        key = (cls, key, tuple(sorted(kwargs.items())))
+        publisher = self.publishers.get(key)
+        if publisher is None:
+            publisher = cls(self.conf, self.channel, topic, **kwargs)
+            self.publishers[key] = publisher
+        return publisher
+
+    def _publish(self, cls, topic, msg, content_type, content_encoding,
+                 kwargs):
+        publisher = self._get_publisher(cls, topic, kwargs)
+        publisher.send(msg, content_type, content_encoding, routing_key=topic)
+
+    def publisher_send(self, cls, topic, msg, serialize=False, **kwargs):
+        """Send to a publisher based on the publisher class
+
+        With serialize set, msg is encoded with rpc_serializer instead of
+        kombu's default JSON.
+        """
 
         def _error_callback(exc):
             log_info = {'topic': topic, 'err_str': str(exc)}
             LOG.exception(_("Failed to publish message to topic "
                 "'%(topic)s': %(err_str)s") % log_info)
 
-        def _publish():
-            publisher = cls(self.conf, self.channel, topic, **kwargs)
-            publisher.send(msg)
+        content_type = content_encoding = None
+        if serialize:
+            content_type, content_encoding, msg = \
+                    rpc_common.serialize_msg(self.conf, msg)
+
+        self.ensure(_error_callback, self._publish, cls, topic, msg,
+                    content_type, content_encoding, kwargs)
+
+    def publish_batch(self, sends, transactional=False):
+        """Publish a list of sends, as made by BatchedCastConnection
+
+        If transactional is set and the transport supports it, the sends
+        are published in an AMQP transaction: this only returns once the
+        broker has taken all of them, and all of them are published again
+        if the connection is lost before then.  Otherwise the sends left
+        when the connection was lost are published after reconnecting.
+        """
 
-        self.ensure(_error_callback, _publish)
+        def _error_callback(exc):
+            log_info = {'count': len(sends), 'err_str': str(exc)}
+            LOG.exception(_("Failed to publish a batch of %(count)d "
+                "messages: %(err_str)s") % log_info)
+
+        info = {'sent': 0}
+
+        def _publish_batch():
+            if transactional and hasattr(self.channel, 'tx_select'):
+                if not self.transactional:
+                    self.channel.tx_select()
+                    self.transactional = True
+                # whatever was not committed is gone
+                info['sent'] = 0
+            for send in sends[info['sent']:]:
+                self._publish(*send)
+                info['sent'] += 1
+            if self.transactional:
+                self.channel.tx_commit()
+
+        self.ensure(_error_callback, _publish_batch)
 
     def declare_direct_consumer(self, topic, callback):
         """Create a 'direct' queue.
@@ -655,15 +762,15 @@ class Connection(object):
 
     def direct_send(self, msg_id, msg):
         """Send a 'direct' message"""
-        self.publisher_send(DirectPublisher, msg_id, msg)
+        self.publisher_send(DirectPublisher, msg_id, msg, serialize=True)
 
     def topic_send(self, topic, msg):
         """Send a 'topic' message"""
-        self.publisher_send(TopicPublisher, topic, msg)
+        self.publisher_send(TopicPublisher, topic, msg, serialize=True)
 
     def fanout_send(self, topic, msg):
         """Send a 'fanout' message"""
-        self.publisher_send(FanoutPublisher, topic, msg)
+        self.publisher_send(FanoutPublisher, topic, msg, serialize=True)
 
     def notify_send(self, topic, msg, **kwargs):
         """Send a notify message on a topic"""
@@ -706,6 +813,109 @@ class Connection(object):
         self.declare_topic_consumer(topic, proxy_cb, pool_name)
 
 
+class CastBatcher(object):
+    """Publishes casts and notifications in batches.
+
+    The sends queued within rabbit_cast_batch_window seconds of the first
+    one, up to rabbit_cast_batch_size of them, are published in one go on
+    a Connection of the batcher's own, in the order they were queued.
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.sends = queue.LightQueue()
+        self.connection = None
+        self.thread = eventlet.spawn(self._run)
+
+    def add(self, cls, topic, msg, serialize=False, **kwargs):
+        """Queue a send to a publisher of class cls"""
+        content_type = content_encoding = None
+        if serialize:
+            content_type, content_encoding, msg = \
+                    rpc_common.serialize_msg(self.conf, msg)
+        self.sends.put((cls, topic, msg, content_type, content_encoding,
+                        kwargs))
+
+    def _next_batch(self):
+        """Wait for the next batch of sends, None in the last one"""
+        batch = [self.sends.get()]
+        deadline = time.time() + self.conf.rabbit_cast_batch_window
+        while (batch[-1] is not None and
+               len(batch) < self.conf.rabbit_cast_batch_size):
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.sends.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                try:
+                    if self.connection is None:
+                        self.connection = Connection(self.conf)
+                    self.connection.publish_batch(batch,
+                            transactional=self.conf.rabbit_commit_cast_batches)
+                except Exception:
+                    LOG.exception(_('Failed to publish a batch of casts'))
+            if stop:
+                return
+
+    def stop(self):
+        """Publish what is queued and close the connection"""
+        self.sends.put(None)
+        self.thread.wait()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class BatchedCastConnection(object):
+    """Connection whose sends are queued on the process' CastBatcher.
+
+    Used in place of Connection for casts and notifications when
+    rabbit_cast_batch_window is set.
+    """
+
+    pool = None
+    batcher = None
+
+    def __init__(self, conf):
+        if BatchedCastConnection.batcher is None:
+            BatchedCastConnection.batcher = CastBatcher(conf)
+
+    def topic_send(self, topic, msg):
+        """Queue a 'topic' message"""
+        self.batcher.add(TopicPublisher, topic, msg, serialize=True)
+
+    def fanout_send(self, topic, msg):
+        """Queue a 'fanout' message"""
+        self.batcher.add(FanoutPublisher, topic, msg, serialize=True)
+
+    def notify_send(self, topic, msg, **kwargs):
+        """Queue a notify message on a topic"""
+        self.batcher.add(NotifyPublisher, topic, msg, **kwargs)
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _get_cast_connection_pool(conf):
+    if conf.rabbit_cast_batch_window > 0:
+        return rpc_amqp.get_connection_pool(conf, BatchedCastConnection)
+    return rpc_amqp.get_connection_pool(conf, Connection)
+
+
 def create_connection(conf, new=True):
     """Create a connection"""
     return rpc_amqp.create_connection(conf, new,
@@ -727,13 +937,13 @@ def call(conf, context, topic, msg, timeout=None):
 def cast(conf, context, topic, msg):
     """Sends a message on a topic without waiting for a response."""
     return rpc_amqp.cast(conf, context, topic, msg,
-            rpc_amqp.get_connection_pool(conf, Connection))
+            _get_cast_connection_pool(conf))
 
 
 def fanout_cast(conf, context, topic, msg):
     """Sends a message on a fanout exchange without waiting for a response."""
     return rpc_amqp.fanout_cast(conf, context, topic, msg,
-            rpc_amqp.get_connection_pool(conf, Connection))
+            _get_cast_connection_pool(conf))
 
 
 def cast_to_server(conf, context, server_params, topic, msg):
@@ -751,8 +961,12 @@ def fanout_cast_to_server(conf, context, server_params, topic, msg):
 def notify(conf, context, topic, msg):
     """Sends a notification event on a topic."""
     return rpc_amqp.notify(conf, context, topic, msg,
-            rpc_amqp.get_connection_pool(conf, Connection))
+            _get_cast_connection_pool(conf))
 
 
 def cleanup():
+    if BatchedCastConnection.batcher is not None:
+        BatchedCastConnection.batcher.stop()
+        BatchedCastConnection.batcher = None
+    rpc_amqp.cleanup(BatchedCastConnection.pool)
     return rpc_amqp.cleanup(Connection.pool)
@@ -29,6 +29,7 @@ from nova.openstack.common import cfg
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import importutils
 from nova.openstack.common.rpc import common as rpc_common
+from nova.openstack.common.rpc import metrics as rpc_metrics
 
 
 # for convenience, are not modified.
@@ -73,7 +74,16 @@ def _serialize(data):
     Serialization wrapper
     We prefer using JSON, but it cannot encode all types.
     Error if a developer passes us bad data.
+
+    With rpc_serializer set to something other than json, the data is
+    encoded with it and prefixed by a NUL and its content type, which no
+    JSON document starts with.
     """
+    if FLAGS and FLAGS.rpc_serializer != 'json':
+        content_type, _encoding, data = rpc_common.serialize_msg(FLAGS, data)
+        if content_type != rpc_common.JSON_CONTENT_TYPE:
+            return '\0%s\0%s' % (content_type, data)
+        return str(data)
     try:
         return str(json.dumps(data, ensure_ascii=True))
     except TypeError:
@@ -85,6 +95,9 @@ def _deserialize(data):
     """
     Deserialization wrapper
     """
+    if data.startswith('\0'):
+        content_type, data = data[1:].split('\0', 1)
+        return rpc_common.deserialize_msg(content_type, data)
     LOG.debug(_("Deserializing: %s"), data)
     return json.loads(data)
 
@@ -605,26 +618,35 @@ def _multi_send(method, context, topic, msg, timeout=None):
     conf = FLAGS
     LOG.debug(_("%(msg)s") % {'msg': ' '.join(map(pformat, (topic, msg)))})
 
-    queues = matchmaker.queues(topic)
-    LOG.debug(_("Sending message(s) to: %s"), queues)
-
-    # Don't stack if we have no matchmaker results
-    if len(queues) == 0:
-        LOG.warn(_("No matchmaker results. Not casting."))
-        # While not strictly a timeout, callers know how to handle
-        # this exception and a timeout isn't too big a lie.
-        raise rpc_common.Timeout, "No match from matchmaker."
-
-    # This supports brokerless fanout (addresses > 1)
-    for queue in queues:
-        (_topic, ip_addr) = queue
-        _addr = "tcp://%s:%s" % (ip_addr, conf.rpc_zmq_port)
-
-        if method.__name__ == '_cast':
-            eventlet.spawn_n(method, _addr, context,
-                             _topic, _topic, msg, timeout)
-            return
-        return method(_addr, context, _topic, _topic, msg, timeout)
+    if method.__name__ == '_call':
+        kind = 'call'
+    elif topic.startswith('fanout~'):
+        kind = 'fanout_cast'
+    else:
+        kind = 'cast'
+
+    # NOTE: casts are timed until they are handed to their greenthread
+    with rpc_metrics.Timer(conf, kind, topic, msg):
+        queues = matchmaker.queues(topic)
+        LOG.debug(_("Sending message(s) to: %s"), queues)
+
+        # Don't stack if we have no matchmaker results
+        if len(queues) == 0:
+            LOG.warn(_("No matchmaker results. Not casting."))
+            # While not strictly a timeout, callers know how to handle
+            # this exception and a timeout isn't too big a lie.
+            raise rpc_common.Timeout, "No match from matchmaker."
+
+        # This supports brokerless fanout (addresses > 1)
+        for queue in queues:
+            (_topic, ip_addr) = queue
+            _addr = "tcp://%s:%s" % (ip_addr, conf.rpc_zmq_port)
+
+            if method.__name__ == '_cast':
+                eventlet.spawn_n(method, _addr, context,
+                                 _topic, _topic, msg, timeout)
+                return
+            return method(_addr, context, _topic, _topic, msg, timeout)
 
 
 def create_connection(conf, new=True):
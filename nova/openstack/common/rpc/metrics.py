@@ -0,0 +1,163 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Metrics of the RPC calls and casts a process sends and receives.
+
+The amqp and zmq drivers time each call, multicall and cast with a Timer.
+When it stops, the Timer logs the calls slower than rpc_slow_call_threshold
+and passes a metric to the record() function of each of the modules listed
+in rpc_metrics_drivers.  A metric is a dict with:
+
+    kind: 'call' (for call and multicall), 'cast' or 'fanout_cast'
+    topic: the topic the message was sent to, e.g. 'compute.host1'
+    method: the method called
+    size: the size in bytes of the message as JSON, None without drivers
+    in_flight: the messages of the same topic and method still waiting
+               for their replies, or being sent, when it was sent
+    duration: the seconds until the last reply was received, or until
+              the message was sent for casts
+    outcome: 'ok', 'timeout' or 'error'
+
+The amqp DispatchScheduler also passes a metric for each message it
+receives once the message gets an RPC thread, is superseded by a newer
+one or is dropped:
+
+    kind: 'dispatch'
+    method: the method called
+    lane: the priority lane of the method, 'default' or 'low'
+    wait: the seconds the message waited for an RPC thread
+    waiting: the messages left waiting in the lane
+    running: the messages of the lane running on RPC threads
+    outcome: 'dispatched', 'superseded' or 'dropped'
+
+record() is called in the thread that sent or received the message and
+should not block.
+"""
+
+import logging
+import time
+
+from nova.openstack.common import cfg
+from nova.openstack.common import importutils
+from nova.openstack.common import jsonutils
+from nova.openstack.common.rpc import common as rpc_common
+
+
+metrics_opts = [
+    cfg.MultiStrOpt('rpc_metrics_drivers',
+                    default=[],
+                    help='Modules with a record(metric) function, called '
+                         'with the kind, topic, method, size, duration, '
+                         'outcome and in flight count of each RPC call and '
+                         'cast sent, and the queue wait of each message '
+                         'received'),
+    cfg.FloatOpt('rpc_slow_call_threshold',
+                 default=0.0,
+                 help='Log a warning with the topic and method of the RPC '
+                      'calls that take longer than this many seconds. 0 '
+                      'disables it'),
+    ]
+
+cfg.CONF.register_opts(metrics_opts)
+
+LOG = logging.getLogger(__name__)
+
+# { (<topic>, <method>) : <count of messages in flight> }
+_in_flight = {}
+_drivers = None
+
+
+def _get_drivers(conf):
+    global _drivers
+    if _drivers is None:
+        _drivers = [importutils.import_module(driver)
+                    for driver in conf.rpc_metrics_drivers]
+    return _drivers
+
+
+def record(conf, metric):
+    """Pass metric to the record() function of each metrics driver."""
+    for driver in _get_drivers(conf):
+        try:
+            driver.record(metric)
+        except Exception:
+            LOG.exception(_('Failed to record RPC metric with %s'),
+                          driver.__name__)
+
+
+def _outcome(exc):
+    if exc is None:
+        return 'ok'
+    if isinstance(exc, rpc_common.Timeout):
+        return 'timeout'
+    return 'error'
+
+
+class Timer(object):
+    """Times one RPC message, from being sent to its last reply.
+
+    Can be used as a context manager, stopping with the outcome of the
+    block.
+    """
+
+    def __init__(self, conf, kind, topic, msg):
+        self.conf = conf
+        self.key = (topic, msg.get('method'))
+        in_flight = _in_flight.get(self.key, 0)
+        _in_flight[self.key] = in_flight + 1
+        self.metric = {'kind': kind,
+                       'topic': topic,
+                       'method': msg.get('method'),
+                       'size': None,
+                       'in_flight': in_flight}
+        if _get_drivers(conf):
+            self.metric['size'] = len(jsonutils.dumps(msg))
+        self.started_at = time.time()
+        self.stopped = False
+
+    def stop(self, exc=None):
+        """Record the metric, with the outcome of exc if it was raised."""
+        if self.stopped:
+            return
+        self.stopped = True
+        in_flight = _in_flight.pop(self.key, 1) - 1
+        if in_flight:
+            _in_flight[self.key] = in_flight
+        metric = self.metric
+        metric['duration'] = time.time() - self.started_at
+        metric['outcome'] = _outcome(exc)
+
+        threshold = self.conf.rpc_slow_call_threshold
+        if (threshold and metric['kind'] == 'call' and
+                metric['duration'] > threshold):
+            LOG.warn(_('RPC call of %(method)s on %(topic)s took '
+                       '%(duration).1f seconds (%(outcome)s), with '
+                       '%(in_flight)d others in flight'), metric)
+
+        record(self.conf, metric)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop(exc_value)
+
+
+def get_in_flight():
+    """Return the count of messages in flight per (topic, method)."""
+    return dict(_in_flight)
@@ -20,6 +20,9 @@
 
 import datetime
 
+from eventlet import event
+from eventlet import greenthread
+
 from nova import db
 from nova import exception
 from nova import flags
@@ -83,6 +86,11 @@ quota_opts = [
     cfg.StrOpt('quota_driver',
                default='nova.quota.DbQuotaDriver',
                help='default driver to use for quota checks'),
+    cfg.IntOpt('quota_limits_cache_ttl',
+               default=0,
+               help='number of seconds the quota limits of projects and '
+                    'quota classes are cached in memory; 0 disables the '
+                    'cache'),
     ]
 
 FLAGS = flags.FLAGS
@@ -96,6 +104,57 @@ class DbQuotaDriver(object):
     database.
     """
 
+    def __init__(self):
+        # { ('project_id' or 'quota_class', <name>) :
+        #       (<fetched at>, <limits>) }
+        self._limits_cache = {}
+
+    def _get_limits(self, context, key, fetch):
+        """Return fetch(), cached for quota_limits_cache_ttl seconds.
+
+        The cache is only used for the limits the context may read, so
+        the access checks done by the DB API are not bypassed.
+        """
+
+        ttl = FLAGS.quota_limits_cache_ttl
+        if ttl <= 0:
+            return fetch()
+        kind, name = key
+        if not context.is_admin and name != getattr(context, kind):
+            return fetch()
+
+        cached = self._limits_cache.get(key)
+        if cached is not None and not timeutils.is_older_than(cached[0], ttl):
+            return cached[1]
+
+        limits = fetch()
+        self._limits_cache[key] = (timeutils.utcnow(), limits)
+        return limits
+
+    def _get_project_limits(self, context, project_id):
+        return self._get_limits(context, ('project_id', project_id),
+                lambda: db.quota_get_all_by_project(context, project_id))
+
+    def _get_class_limits(self, context, quota_class):
+        return self._get_limits(context, ('quota_class', quota_class),
+                lambda: db.quota_class_get_all_by_name(context, quota_class))
+
+    def invalidate_limits(self, project_id=None, quota_class=None):
+        """Drop cached quota limits.
+
+        :param project_id: The ID of the project whose quotas changed.
+        :param quota_class: The name of the quota class which changed.
+
+        If neither is given, all the cached limits are dropped.
+        """
+
+        if project_id is None and quota_class is None:
+            self._limits_cache.clear()
+        if project_id is not None:
+            self._limits_cache.pop(('project_id', project_id), None)
+        if quota_class is not None:
+            self._limits_cache.pop(('quota_class', quota_class), None)
+
     def get_by_project(self, context, project_id, resource):
         """Get a specific quota by project."""
 
@@ -135,7 +194,7 @@ class DbQuotaDriver(object):
         """
 
         quotas = {}
-        class_quotas = db.quota_class_get_all_by_name(context, quota_class)
+        class_quotas = self._get_class_limits(context, quota_class)
         for resource in resources.values():
             if defaults or resource.name in class_quotas:
                 quotas[resource.name] = class_quotas.get(resource.name,
@@ -167,7 +226,7 @@ class DbQuotaDriver(object):
         """
 
         quotas = {}
-        project_quotas = db.quota_get_all_by_project(context, project_id)
+        project_quotas = self._get_project_limits(context, project_id)
         if usages:
             project_usages = db.quota_usage_get_all_by_project(context,
                                                                project_id)
@@ -179,7 +238,7 @@ class DbQuotaDriver(object):
         if project_id == context.project_id:
             quota_class = context.quota_class
         if quota_class:
-            class_quotas = db.quota_class_get_all_by_name(context, quota_class)
+            class_quotas = self._get_class_limits(context, quota_class)
         else:
             class_quotas = {}
 
@@ -313,14 +372,7 @@ class DbQuotaDriver(object):
         """
 
         # Set up the reservation expiration
-        if expire is None:
-            expire = FLAGS.reservation_expire
-        if isinstance(expire, (int, long)):
-            expire = datetime.timedelta(seconds=expire)
-        if isinstance(expire, datetime.timedelta):
-            expire = timeutils.utcnow() + expire
-        if not isinstance(expire, datetime.datetime):
-            raise exception.InvalidReservationExpiration(expire=expire)
+        expire = self._get_expiration(expire)
 
         # Get the applicable quotas.
         # NOTE(Vek): We're not worried about races at this point.
@@ -337,6 +389,19 @@ class DbQuotaDriver(object):
         return db.quota_reserve(context, resources, quotas, deltas, expire,
                                 FLAGS.until_refresh, FLAGS.max_age)
 
+    def _get_expiration(self, expire):
+        """Turn the expire argument of reserve() into a datetime."""
+
+        if expire is None:
+            expire = FLAGS.reservation_expire
+        if isinstance(expire, (int, long)):
+            expire = datetime.timedelta(seconds=expire)
+        if isinstance(expire, datetime.timedelta):
+            expire = timeutils.utcnow() + expire
+        if not isinstance(expire, datetime.datetime):
+            raise exception.InvalidReservationExpiration(expire=expire)
+        return expire
+
     def commit(self, context, reservations):
         """Commit reservations.
 
@@ -367,6 +432,7 @@ class DbQuotaDriver(object):
         """
 
         db.quota_destroy_all_by_project(context, project_id)
+        self.invalidate_limits(project_id=project_id)
 
     def expire(self, context):
         """Expire reservations.
@@ -379,6 +445,185 @@ class DbQuotaDriver(object):
 
         db.reservation_expire(context)
 
+    def refresh_usages(self, context, resources):
+        """Resync the usages which are due a refresh.
+
+        This driver refreshes the usages in reserve(), so there is
+        nothing to do.
+
+        :param context: The request context, for access checks.
+        :param resources: A dictionary of the registered resources.
+        """
+
+        pass
+
+
+class _RequestBatcher(object):
+    """Coalesces the concurrent requests with the same key.
+
+    The first caller for a key yields once, so that the other
+    greenthreads ready to run can add their requests, then passes them
+    all to flush_fn and hands each caller its result.  flush_fn takes a
+    list of requests and returns a list of results in the same order; a
+    result which is an exception is raised to its caller.
+    """
+
+    def __init__(self, flush_fn):
+        self.flush_fn = flush_fn
+        # { <key> : [ (<request>, <event>), ... ] }
+        self.pending = {}
+
+    def submit(self, key, request):
+        if key in self.pending:
+            done = event.Event()
+            self.pending[key].append((request, done))
+            return done.wait()
+
+        self.pending[key] = [(request, None)]
+        try:
+            greenthread.sleep(0)
+        finally:
+            batch = self.pending.pop(key)
+
+        followers = [done for _request, done in batch[1:]]
+        try:
+            results = self.flush_fn([request for request, _done in batch])
+        except Exception as exc:
+            for done in followers:
+                done.send_exception(exc)
+            raise
+
+        for done, result in zip(followers, results[1:]):
+            if isinstance(result, Exception):
+                done.send_exception(result)
+            else:
+                done.send(result)
+        if isinstance(results[0], Exception):
+            raise results[0]
+        return results[0]
+
+
+class CounterQuotaDriver(DbQuotaDriver):
+    """
+    Driver which keeps the quota usages as counters which are updated
+    without locking them, for projects which reserve a lot of
+    resources concurrently.
+
+    reserve() checks and raises the reserved counts with guarded
+    UPDATEs rather than locking the usages, and the concurrent
+    reservations, commits and rollbacks of a project are sent to the
+    database together.  The usages are not refreshed in reserve(), but
+    by refresh_usages(), which the scheduler calls periodically.
+    """
+
+    def __init__(self):
+        super(CounterQuotaDriver, self).__init__()
+        self._reserve_batcher = _RequestBatcher(self._reserve_batch)
+        self._commit_batcher = _RequestBatcher(self._commit_batch)
+        self._rollback_batcher = _RequestBatcher(self._rollback_batch)
+
+    def reserve(self, context, resources, deltas, expire=None):
+        """Check quotas and reserve resources.
+
+        See DbQuotaDriver.reserve().
+        """
+
+        expire = self._get_expiration(expire)
+        quotas = self._get_quotas(context, resources, deltas.keys(),
+                                  has_sync=True)
+        key = (context.project_id, context.quota_class)
+        return self._reserve_batcher.submit(key,
+                (context, resources, quotas, deltas, expire))
+
+    def _reserve_batch(self, batch):
+        if len(batch) > 1:
+            context, resources = batch[0][:2]
+            quotas = {}
+            requests = []
+            for request in batch:
+                quotas.update(request[2])
+                requests.append(request[3:])
+            try:
+                return db.quota_reserve_counters(context, resources, quotas,
+                                                 requests, FLAGS.until_refresh)
+            except exception.OverQuota:
+                # Find out which of the requests are over quota
+                pass
+
+        results = []
+        for context, resources, quotas, deltas, expire in batch:
+            try:
+                results.append(db.quota_reserve_counters(context, resources,
+                        quotas, [(deltas, expire)], FLAGS.until_refresh)[0])
+            except exception.NovaException as exc:
+                results.append(exc)
+        return results
+
+    def commit(self, context, reservations):
+        """Commit reservations.
+
+        :param context: The request context, for access checks.
+        :param reservations: A list of the reservation UUIDs, as
+                             returned by the reserve() method.
+        """
+
+        self._commit_batcher.submit(context.project_id,
+                                    (context, reservations))
+
+    def _commit_batch(self, batch):
+        context = batch[0][0]
+        reservations = []
+        for _context, request_reservations in batch:
+            reservations.extend(request_reservations)
+        db.reservation_commit_counters(context, reservations)
+        return [None] * len(batch)
+
+    def rollback(self, context, reservations):
+        """Roll back reservations.
+
+        :param context: The request context, for access checks.
+        :param reservations: A list of the reservation UUIDs, as
+                             returned by the reserve() method.
+        """
+
+        self._rollback_batcher.submit(context.project_id,
+                                      (context, reservations))
+
+    def _rollback_batch(self, batch):
+        context = batch[0][0]
+        reservations = []
+        for _context, request_reservations in batch:
+            reservations.extend(request_reservations)
+        db.reservation_rollback_counters(context, reservations)
+        return [None] * len(batch)
+
+    def expire(self, context):
+        """Expire reservations.
+
+        Explores all currently existing reservations and rolls back
+        any that have expired.
+
+        :param context: The request context, for access checks.
+        """
+
+        db.reservation_expire_counters(context)
+
+    def refresh_usages(self, context, resources):
+        """Resync the usages which are due a refresh.
+
+        A usage is due when its count went negative, after until_refresh
+        reservations, or when it has not been updated for max_age
+        seconds.
+
+        :param context: The request context, for access checks.
+        :param resources: A dictionary of the registered resources.
+        """
+
+        resources = dict((k, v) for k, v in resources.items()
+                         if hasattr(v, 'sync'))
+        db.quota_usage_refresh_stale(context, resources, FLAGS.until_refresh,
+                                     FLAGS.max_age)
+
 
 class BaseResource(object):
     """Describe a single resource for quota checking."""
@@ -745,6 +990,21 @@ class QuotaEngine(object):
 
         self._driver.destroy_all_by_project(context, project_id)
 
+    def invalidate_limits(self, project_id=None, quota_class=None):
+        """Drop the quota limits cached by the driver, after they were
+        changed.
+
+        :param project_id: The ID of the project whose quotas changed.
+        :param quota_class: The name of the quota class which changed.
+
+        If neither is given, all the cached limits are dropped.
+        Drivers without an invalidate_limits() method cache nothing.
+        """
+
+        invalidate_limits = getattr(self._driver, 'invalidate_limits', None)
+        if invalidate_limits:
+            invalidate_limits(project_id=project_id, quota_class=quota_class)
+
     def expire(self, context):
         """Expire reservations.
 
@@ -756,6 +1016,18 @@ class QuotaEngine(object):
 
         self._driver.expire(context)
 
+    def refresh_usages(self, context):
+        """Resync the usages which are due a refresh, if the driver
+        does not do it when reserving.  Drivers without a
+        refresh_usages() method have nothing to refresh.
+
+        :param context: The request context, for access checks.
+        """
+
+        refresh_usages = getattr(self._driver, 'refresh_usages', None)
+        if refresh_usages:
+            refresh_usages(context, self._resources)
+
     @property
     def resources(self):
         return sorted(self._resources.keys())
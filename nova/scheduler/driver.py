@@ -182,6 +182,22 @@ class Scheduler(object):
         base_options['uuid'] = instance['uuid']
         return instance
 
+    def create_instance_db_entries(self, context, request_spec,
+                                   reservations, instances_values):
+        """Create several instance DB entries based on request_spec, one
+        for each dict of extra values in instances_values.
+        """
+        base_options = request_spec['instance_properties']
+        image = request_spec['image']
+        instance_type = request_spec.get('instance_type')
+        security_group = request_spec.get('security_group', 'default')
+        block_device_mapping = request_spec.get('block_device_mapping', [])
+
+        return self.compute_api.create_db_entries_for_new_instances(
+                context, instance_type, image, base_options,
+                security_group, block_device_mapping, reservations,
+                instances_values)
+
     def schedule(self, context, topic, method, *_args, **_kwargs):
         """Must override schedule method for scheduler to work."""
         raise NotImplementedError(_("Must implement a fallback schedule"))
@@ -232,7 +248,7 @@ class Scheduler(object):
 
         # update instance state and notify
         (old_ref, new_instance_ref) = db.instance_update_and_get_original(
-                context, instance_id, values)
+                context, instance_ref['uuid'], values)
         notifications.send_update(context, old_ref, new_instance_ref,
                 service="scheduler")
 
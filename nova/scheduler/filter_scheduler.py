@@ -19,19 +19,48 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import math
 import operator
 
+from eventlet import greenpool
+
+from nova import db
 from nova import exception
 from nova import flags
 from nova import log as logging
 from nova.notifier import api as notifier
+from nova.openstack.common import cfg
 from nova.openstack.common import importutils
+from nova.openstack.common import timeutils
 from nova.scheduler import driver
+from nova.scheduler import host_manager
 from nova.scheduler import least_cost
 from nova.scheduler import scheduler_options
-
+from nova.scheduler import tracing
+
+
+filter_scheduler_opts = [
+    cfg.BoolOpt('scheduler_bulk_run_instance',
+                default=False,
+                help='Create the db entries for all the instances of a '
+                     'multi-instance request in one transaction, and cast '
+                     'them to their compute hosts concurrently'),
+    cfg.BoolOpt('scheduler_optimistic_claims',
+                default=False,
+                help='Claim the resources of each selected host in the '
+                     'database, choosing another host if a concurrent '
+                     'scheduler claimed them first. Allows running several '
+                     'schedulers without double-booking hosts'),
+    cfg.IntOpt('scheduler_claim_retries',
+               default=3,
+               help='Number of conflicting resource claims tolerated for a '
+                    'request before giving up on finding more hosts'),
+    ]
 
 FLAGS = flags.FLAGS
+FLAGS.register_opts(filter_scheduler_opts)
+flags.DECLARE('ram_allocation_ratio', 'nova.scheduler.filters.ram_filter')
+
 LOG = logging.getLogger(__name__)
 
 
@@ -69,29 +98,41 @@ class FilterScheduler(driver.Scheduler):
         notifier.notify(context, notifier.publisher_id("scheduler"),
                         'scheduler.run_instance.start', notifier.INFO, payload)
 
-        weighted_hosts = self._schedule(context, "compute", request_spec,
-                                        *args, **kwargs)
-
-        if not weighted_hosts:
-            raise exception.NoValidHost(reason="")
-
-        # NOTE(comstud): Make sure we do not pass this through.  It
-        # contains an instance of RpcContext that cannot be serialized.
-        kwargs.pop('filter_properties', None)
+        trace = tracing.start_trace('run_instance')
+        try:
+            weighted_hosts = self._schedule(context, "compute", request_spec,
+                                            trace=trace, *args, **kwargs)
 
-        instances = []
-        for num in xrange(num_instances):
             if not weighted_hosts:
-                break
-            weighted_host = weighted_hosts.pop(0)
-
-            request_spec['instance_properties']['launch_index'] = num
-            instance = self._provision_resource(elevated, weighted_host,
-                                                request_spec, reservations,
-                                                kwargs)
-
-            if instance:
-                instances.append(instance)
+                raise exception.NoValidHost(reason="")
+
+            # NOTE(comstud): Make sure we do not pass this through.  It
+            # contains an instance of RpcContext that cannot be serialized.
+            kwargs.pop('filter_properties', None)
+
+            if (FLAGS.scheduler_bulk_run_instance and num_instances > 1 and
+                    not request_spec['instance_properties'].get('uuid')):
+                with trace.timed('provision_resources'):
+                    instances = self._provision_resources(elevated,
+                            weighted_hosts[:num_instances], request_spec,
+                            reservations, kwargs)
+            else:
+                instances = []
+                for num in xrange(num_instances):
+                    if not weighted_hosts:
+                        break
+                    weighted_host = weighted_hosts.pop(0)
+
+                    request_spec['instance_properties']['launch_index'] = num
+                    with trace.timed('provision_resource'):
+                        instance = self._provision_resource(elevated,
+                                weighted_host, request_spec, reservations,
+                                kwargs)
+
+                    if instance:
+                        instances.append(instance)
+        finally:
+            trace.finish()
 
         notifier.notify(context, notifier.publisher_id("scheduler"),
                         'scheduler.run_instance.end', notifier.INFO, payload)
@@ -105,19 +146,24 @@ class FilterScheduler(driver.Scheduler):
         the prep_resize operation to it.
         """
 
-        hosts = self._schedule(context, 'compute', request_spec,
-                               *args, **kwargs)
-        if not hosts:
-            raise exception.NoValidHost(reason="")
-        host = hosts.pop(0)
+        trace = tracing.start_trace('prep_resize')
+        try:
+            hosts = self._schedule(context, 'compute', request_spec,
+                                   trace=trace, *args, **kwargs)
+            if not hosts:
+                raise exception.NoValidHost(reason="")
+            host = hosts.pop(0)
 
-        # NOTE(comstud): Make sure we do not pass this through.  It
-        # contains an instance of RpcContext that cannot be serialized.
-        kwargs.pop('filter_properties', None)
+            # NOTE(comstud): Make sure we do not pass this through.  It
+            # contains an instance of RpcContext that cannot be serialized.
+            kwargs.pop('filter_properties', None)
 
-        # Forward off to the host
-        driver.cast_to_compute_host(context, host.host_state.host,
-                'prep_resize', **kwargs)
+            # Forward off to the host
+            with trace.timed('cast_to_compute_host'):
+                driver.cast_to_compute_host(context, host.host_state.host,
+                        'prep_resize', **kwargs)
+        finally:
+            trace.finish()
 
     def _provision_resource(self, context, weighted_host, request_spec,
             reservations, kwargs):
@@ -141,6 +187,43 @@ class FilterScheduler(driver.Scheduler):
         del request_spec['instance_properties']['uuid']
         return inst
 
+    def _provision_resources(self, context, weighted_hosts, request_spec,
+            reservations, kwargs):
+        """Create the requested resources in this Zone, one for each
+        of the weighted_hosts.
+
+        All the instance DB entries are created at once, with their
+        hosts already set, and the casts to the compute hosts are sent
+        concurrently.
+        """
+        now = timeutils.utcnow()
+        instances_values = []
+        for num, weighted_host in enumerate(weighted_hosts):
+            instances_values.append({'launch_index': num,
+                                     'host': weighted_host.host_state.host,
+                                     'scheduled_at': now})
+        instances = self.create_instance_db_entries(context, request_spec,
+                reservations, instances_values)
+
+        def _cast_run_instance(instance, weighted_host):
+            payload = dict(request_spec=request_spec,
+                           weighted_host=weighted_host.to_dict(),
+                           instance_id=instance['uuid'])
+            notifier.notify(context, notifier.publisher_id("scheduler"),
+                            'scheduler.run_instance.scheduled',
+                            notifier.INFO, payload)
+
+            # The host is already set in the DB entry.
+            driver.cast_to_compute_host(context,
+                    weighted_host.host_state.host, 'run_instance',
+                    update_db=False, instance_uuid=instance['uuid'],
+                    **kwargs)
+            return driver.encode_instance(instance, local=True)
+
+        pool = greenpool.GreenPool()
+        return list(pool.imap(_cast_run_instance, instances,
+                              weighted_hosts))
+
     def _get_configuration_options(self):
         """Fetch options dictionary. Broken out for testing."""
         return self.options.get_configuration()
@@ -154,7 +237,11 @@ class FilterScheduler(driver.Scheduler):
     def _schedule(self, context, topic, request_spec, *args, **kwargs):
         """Returns a list of hosts that meet the required specs,
         ordered by their fitness.
+
+        The time spent loading, filtering and weighing the hosts is
+        recorded in the 'trace' keyword argument, if given.
         """
+        trace = kwargs.pop('trace', None) or tracing.NullTrace()
         elevated = context.elevated()
         if topic != "compute":
             msg = _("Scheduler only understands Compute nodes (for now)")
@@ -181,8 +268,9 @@ class FilterScheduler(driver.Scheduler):
         # selections can adjust accordingly.
 
         # unfiltered_hosts_dict is {host : ZoneManager.HostInfo()}
-        unfiltered_hosts_dict = self.host_manager.get_all_host_states(
-                elevated, topic)
+        with trace.timed('get_all_host_states'):
+            unfiltered_hosts_dict = self.host_manager.get_all_host_states(
+                    elevated, topic)
 
         # Note: remember, we are using an iterator here. So only
         # traverse this list once. This can bite you if the hosts
@@ -191,10 +279,12 @@ class FilterScheduler(driver.Scheduler):
 
         num_instances = request_spec.get('num_instances', 1)
         selected_hosts = []
-        for num in xrange(num_instances):
+        claim_conflicts = 0
+        while len(selected_hosts) < num_instances:
             # Filter local hosts based on requirements ...
-            hosts = self.host_manager.filter_hosts(hosts,
-                    filter_properties)
+            with trace.timed('filter_hosts'):
+                hosts = self.host_manager.filter_hosts(hosts,
+                        filter_properties, trace=trace)
             if not hosts:
                 # Can't get any more locally.
                 break
@@ -207,9 +297,35 @@ class FilterScheduler(driver.Scheduler):
             # weighing and I plan fold weighing into the host manager
             # in a future patch.  I'll address the naming of this
             # variable at that time.
-            weighted_host = least_cost.weighted_sum(cost_functions,
-                    hosts, filter_properties)
+            with trace.timed('weighing'):
+                if FLAGS.scheduler_columnar_filtering:
+                    weighted_host = least_cost.weighted_sum_columns(
+                            cost_functions,
+                            host_manager.HostStateColumns(hosts),
+                            filter_properties)
+                else:
+                    weighted_host = least_cost.weighted_sum(cost_functions,
+                            hosts, filter_properties)
             LOG.debug(_("Weighted %(weighted_host)s") % locals())
+
+            if FLAGS.scheduler_optimistic_claims:
+                with trace.timed('claim_resources'):
+                    claimed = self._claim_resources(elevated,
+                            weighted_host.host_state, instance_type)
+                if not claimed:
+                    # Another scheduler got to this host first, so what
+                    # we know about it is out of date.  Leave it out and
+                    # choose again.
+                    claim_conflicts += 1
+                    if claim_conflicts > FLAGS.scheduler_claim_retries:
+                        LOG.warning(_("Giving up after %(claim_conflicts)d "
+                                      "conflicting resource claims") %
+                                    locals())
+                        break
+                    self.host_manager.invalidate_host_states()
+                    hosts = [host for host in hosts
+                             if host is not weighted_host.host_state]
+                    continue
             selected_hosts.append(weighted_host)
 
             # Now consume the resources so the filter/weights
@@ -220,6 +336,32 @@ class FilterScheduler(driver.Scheduler):
         selected_hosts.sort(key=operator.attrgetter('weight'))
         return selected_hosts[:num_instances]
 
+    def _claim_resources(self, context, host_state, instance_type):
+        """Claim the RAM and disk for an instance of instance_type on the
+        host in the database, so schedulers running in other processes
+        see it.
+
+        Returns False if another scheduler claimed them first and the
+        host no longer passes the RamFilter.
+        """
+        if not instance_type:
+            return True
+        memory_mb = instance_type.get('memory_mb', 0)
+        disk_gb = (instance_type.get('root_gb', 0) +
+                   instance_type.get('ephemeral_gb', 0))
+        min_free_ram_mb = int(math.ceil(memory_mb /
+                                        FLAGS.ram_allocation_ratio))
+        try:
+            db.compute_node_utilization_update(context, host_state.host,
+                    free_ram_mb_delta=-memory_mb,
+                    free_disk_gb_delta=-disk_gb, work_delta=1, vm_delta=1,
+                    min_free_ram_mb=min_free_ram_mb)
+        except exception.ComputeNodeClaimConflict:
+            LOG.debug(_("Resources on %(host)s were claimed by another "
+                        "scheduler"), {'host': host_state.host})
+            return False
+        return True
+
     def get_cost_functions(self, topic=None):
         """Returns a list of tuples containing weights and cost functions to
         use for weighing hosts
@@ -30,6 +30,25 @@ class BaseHostFilter(object):
     def host_passes(self, host_state, filter_properties):
         raise NotImplemented()
 
+    def columns_pass(self, host_columns, filter_properties):
+        """Return a list of booleans, one for each host in host_columns
+        (a HostStateColumns), saying if that host passes this filter.
+
+        Filters can override this to check all the hosts at once.
+        """
+        return [self.host_passes(host_state, filter_properties)
+                for host_state in host_columns.host_states]
+
+    def candidate_hosts(self, host_index, filter_properties):
+        """Return the set of names of the hosts in host_index (a
+        HostStateIndex) that may pass this filter, or None if the filter
+        can't tell from the index.
+
+        Filters can override this to cut the hosts down before
+        host_passes() is called for each of them.
+        """
+        return None
+
     def _full_name(self):
         """module.classname of the filter."""
         return "%s.%s" % (self.__module__, self.__class__.__name__)
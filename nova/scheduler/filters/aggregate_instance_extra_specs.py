@@ -0,0 +1,58 @@
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nova import db
+from nova import exception
+from nova import log as logging
+from nova.scheduler import filters
+
+
+LOG = logging.getLogger(__name__)
+
+
+class AggregateInstanceExtraSpecsFilter(filters.BaseHostFilter):
+    """AggregateInstanceExtraSpecsFilter works with InstanceType records.
+
+    Only passes hosts in an aggregate whose metadata matches the extra
+    specs of the instance type.
+    """
+
+    def host_passes(self, host_state, filter_properties):
+        """Return True if the host's aggregate metadata satisfies the
+        extra specs of the instance type."""
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type or not instance_type.get('extra_specs'):
+            return True
+
+        context = filter_properties['context'].elevated()
+        try:
+            aggregate = db.aggregate_get_by_host(context, host_state.host)
+            metadata = aggregate.metadetails
+        except exception.AggregateHostNotFound:
+            metadata = {}
+
+        for key, value in instance_type['extra_specs'].iteritems():
+            if metadata.get(key) != value:
+                LOG.debug(_("%(host_state)s fails instance_type extra_specs "
+                        "requirements"), locals())
+                return False
+        return True
+
+    def candidate_hosts(self, host_index, filter_properties):
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type or not instance_type.get('extra_specs'):
+            return None
+        return host_index.hosts_with_aggregate_metadata(
+                filter_properties['context'], instance_type['extra_specs'])
@@ -20,11 +20,22 @@ from nova.scheduler import filters
 class AvailabilityZoneFilter(filters.BaseHostFilter):
     """Filters Hosts by availability zone."""
 
-    def host_passes(self, host_state, filter_properties):
+    @staticmethod
+    def _requested_zone(filter_properties):
         spec = filter_properties.get('request_spec', {})
         props = spec.get('instance_properties', {})
-        availability_zone = props.get('availability_zone')
+        return props.get('availability_zone')
+
+    def host_passes(self, host_state, filter_properties):
+        availability_zone = self._requested_zone(filter_properties)
 
         if availability_zone:
             return availability_zone == host_state.service['availability_zone']
         return True
+
+    def candidate_hosts(self, host_index, filter_properties):
+        availability_zone = self._requested_zone(filter_properties)
+
+        if availability_zone:
+            return host_index.hosts_in_zone(availability_zone)
+        return None
@@ -20,10 +20,18 @@ from nova import utils
 
 LOG = logging.getLogger(__name__)
 
+# Most extra specs results remembered per host between two capabilities
+# reports, beyond which they are forgotten
+MAX_EXTRA_SPECS_PER_HOST = 32
+
 
 class ComputeFilter(filters.BaseHostFilter):
     """HostFilter hard-coded to work with InstanceType records."""
 
+    def __init__(self):
+        # { <host> : (<capabilities timestamp>, { <extra specs> : result }) }
+        self._extra_specs_cache = {}
+
     def _satisfies_extra_specs(self, capabilities, instance_type):
         """Check that the capabilities provided by the compute service
         satisfy the extra specs associated with the instance type"""
@@ -38,6 +46,49 @@ class ComputeFilter(filters.BaseHostFilter):
                 return False
         return True
 
+    @staticmethod
+    def _extra_specs_key(filter_properties):
+        """Return a hashable version of the instance type's extra specs,
+        or None if it has none, computing it once per scheduling request.
+        """
+        if 'extra_specs_key' not in filter_properties:
+            instance_type = filter_properties['instance_type']
+            extra_specs = instance_type.get('extra_specs')
+            key = None
+            if extra_specs:
+                key = tuple(sorted(extra_specs.iteritems()))
+            filter_properties['extra_specs_key'] = key
+        return filter_properties['extra_specs_key']
+
+    def _host_satisfies_extra_specs(self, host_state, instance_type,
+                                    extra_specs_key):
+        """Memoized _satisfies_extra_specs() for a host.
+
+        The result can only change when the host reports new
+        capabilities, so it is remembered per host and extra specs along
+        with the timestamp of the capabilities it was computed from. A
+        new timestamp forgets all the results of the host.
+        """
+        if extra_specs_key is None:
+            return True
+        capabilities = host_state.capabilities
+        timestamp = capabilities.get('timestamp')
+        if timestamp is None:
+            return self._satisfies_extra_specs(capabilities, instance_type)
+
+        cached = self._extra_specs_cache.get(host_state.host)
+        if cached is None or cached[0] != timestamp:
+            cached = (timestamp, {})
+            self._extra_specs_cache[host_state.host] = cached
+        results = cached[1]
+        result = results.get(extra_specs_key)
+        if result is None:
+            if len(results) >= MAX_EXTRA_SPECS_PER_HOST:
+                results.clear()
+            result = self._satisfies_extra_specs(capabilities, instance_type)
+            results[extra_specs_key] = result
+        return result
+
     def host_passes(self, host_state, filter_properties):
         """Return a list of hosts that can create instance_type."""
         instance_type = filter_properties.get('instance_type')
@@ -53,8 +104,39 @@ class ComputeFilter(filters.BaseHostFilter):
         if not capabilities.get("enabled", True):
             LOG.debug(_("%(host_state)s is disabled via capabs"), locals())
             return False
-        if not self._satisfies_extra_specs(capabilities, instance_type):
+        if not self._host_satisfies_extra_specs(host_state, instance_type,
+                self._extra_specs_key(filter_properties)):
             LOG.debug(_("%(host_state)s fails instance_type extra_specs "
                     "requirements"), locals())
             return False
         return True
+
+    def columns_pass(self, host_columns, filter_properties):
+        """Check all hosts at once, without per host logging."""
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type:
+            return [True] * len(host_columns)
+        extra_specs_key = self._extra_specs_key(filter_properties)
+
+        result = []
+        for host_state in host_columns.host_states:
+            if host_state.topic != 'compute':
+                result.append(True)
+                continue
+            service = host_state.service
+            result.append(not service['disabled'] and
+                          utils.service_is_up(service) and
+                          host_state.capabilities.get('enabled', True) and
+                          self._host_satisfies_extra_specs(host_state,
+                                  instance_type, extra_specs_key))
+        return result
+
+    def candidate_hosts(self, host_index, filter_properties):
+        """Look up the hosts whose capabilities satisfy the extra specs."""
+        instance_type = filter_properties.get('instance_type')
+        if host_index.topic != 'compute' or not instance_type:
+            return None
+        extra_specs = instance_type.get('extra_specs')
+        if not extra_specs:
+            return None
+        return host_index.hosts_with_capabilities(extra_specs)
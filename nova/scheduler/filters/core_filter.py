@@ -48,3 +48,29 @@ class CoreFilter(filters.BaseHostFilter):
         instance_vcpus = instance_type['vcpus']
         vcpus_total = host_state.vcpus_total * FLAGS.cpu_allocation_ratio
         return (vcpus_total - host_state.vcpus_used) >= instance_vcpus
+
+    def columns_pass(self, host_columns, filter_properties):
+        """Only pass hosts with sufficient CPU cores."""
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type:
+            return [True] * len(host_columns)
+
+        instance_vcpus = instance_type['vcpus']
+        ratio = FLAGS.cpu_allocation_ratio
+        result = []
+        broken = False
+        for topic, vcpus_total, vcpus_used in zip(host_columns.topic,
+                                                  host_columns.vcpus_total,
+                                                  host_columns.vcpus_used):
+            if topic != 'compute':
+                result.append(True)
+            elif not vcpus_total:
+                # Fail safe
+                broken = True
+                result.append(True)
+            else:
+                result.append(
+                        vcpus_total * ratio - vcpus_used >= instance_vcpus)
+        if broken:
+            LOG.warning(_("VCPUs not set; assuming CPU collection broken"))
+        return result
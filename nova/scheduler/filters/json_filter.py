@@ -86,63 +86,115 @@ class JsonFilter(filters.BaseHostFilter):
         'and': _and,
     }
 
-    def _parse_string(self, string, host_state):
+    # Number of compiled queries kept before the cache is emptied.
+    max_cached_queries = 100
+
+    def __init__(self):
+        # { <query string> : <compiled query> }
+        self._compiled_queries = {}
+
+    def _compile_string(self, string):
         """Strings prefixed with $ are capability lookups in the
         form '$variable' where 'variable' is an attribute in the
         HostState class.  If $variable is a dictionary, you may
         use: $variable.dictkey
+
+        Returns a function of a host state giving the value of the
+        string for that host, or None for empty strings which are
+        ignored.
         """
         if not string:
             return None
         if not string.startswith("$"):
-            return string
+            return lambda host_state: string
 
         path = string[1:].split(".")
-        obj = getattr(host_state, path[0], None)
-        if obj is None:
-            return None
-        for item in path[1:]:
-            obj = obj.get(item, None)
+        attr_name = path[0]
+        keys = path[1:]
+
+        def _lookup(host_state):
+            obj = getattr(host_state, attr_name, None)
             if obj is None:
                 return None
-        return obj
-
-    def _process_filter(self, query, host_state):
-        """Recursively parse the query structure."""
+            for item in keys:
+                obj = obj.get(item, None)
+                if obj is None:
+                    return None
+            return obj
+        return _lookup
+
+    def _compile_query(self, query):
+        """Recursively compile the query structure into a function
+        of a host state returning the result of the query for it.
+        """
         if not query:
-            return True
-        cmd = query[0]
-        method = self.commands[cmd]
-        cooked_args = []
+            return lambda host_state: True
+        method = self.commands[query[0]]
+        arg_fns = []
         for arg in query[1:]:
             if isinstance(arg, list):
-                arg = self._process_filter(arg, host_state)
+                arg_fns.append(self._compile_query(arg))
             elif isinstance(arg, basestring):
-                arg = self._parse_string(arg, host_state)
-            if arg is not None:
-                cooked_args.append(arg)
-        result = method(self, cooked_args)
-        return result
+                arg_fn = self._compile_string(arg)
+                if arg_fn is not None:
+                    arg_fns.append(arg_fn)
+            elif arg is not None:
+                arg_fns.append(lambda host_state, arg=arg: arg)
+
+        def _evaluate(host_state):
+            cooked_args = []
+            for arg_fn in arg_fns:
+                arg = arg_fn(host_state)
+                if arg is not None:
+                    cooked_args.append(arg)
+            return method(self, cooked_args)
+        return _evaluate
+
+    def _get_compiled_query(self, query):
+        """Return the compiled version of a JSON query string, compiling
+        it only the first time it is seen.
+        """
+        compiled = self._compiled_queries.get(query)
+        if compiled is None:
+            compiled = self._compile_query(jsonutils.loads(query))
+            if len(self._compiled_queries) >= self.max_cached_queries:
+                self._compiled_queries.clear()
+            self._compiled_queries[query] = compiled
+        return compiled
+
+    @staticmethod
+    def _get_query(filter_properties):
+        try:
+            return filter_properties['scheduler_hints']['query']
+        except KeyError:
+            return None
+
+    @staticmethod
+    def _passes(result):
+        if isinstance(result, list):
+            # If any succeeded, include the host
+            result = any(result)
+        return bool(result)
 
     def host_passes(self, host_state, filter_properties):
         """Return a list of hosts that can fulfill the requirements
         specified in the query.
         """
-        try:
-            query = filter_properties['scheduler_hints']['query']
-        except KeyError:
-            query = None
+        query = self._get_query(filter_properties)
         if not query:
             return True
 
         # NOTE(comstud): Not checking capabilities or service for
         # enabled/disabled so that a provided json filter can decide
 
-        result = self._process_filter(jsonutils.loads(query), host_state)
-        if isinstance(result, list):
-            # If any succeeded, include the host
-            result = any(result)
-        if result:
-            # Filter it out.
-            return True
-        return False
+        compiled = self._get_compiled_query(query)
+        return self._passes(compiled(host_state))
+
+    def columns_pass(self, host_columns, filter_properties):
+        """Run the compiled query over all the hosts."""
+        query = self._get_query(filter_properties)
+        if not query:
+            return [True] * len(host_columns)
+        compiled = self._get_compiled_query(query)
+        return [self._passes(compiled(host_state))
+                for host_state in host_columns.host_states]
@@ -38,3 +38,11 @@ class RamFilter(filters.BaseHostFilter):
         requested_ram = instance_type['memory_mb']
         free_ram_mb = host_state.free_ram_mb
         return free_ram_mb * FLAGS.ram_allocation_ratio >= requested_ram
+
+    def columns_pass(self, host_columns, filter_properties):
+        """Only pass hosts with sufficient available RAM."""
+        instance_type = filter_properties.get('instance_type')
+        requested_ram = instance_type['memory_mb']
+        ratio = FLAGS.ram_allocation_ratio
+        return [free_ram_mb * ratio >= requested_ram
+                for free_ram_mb in host_columns.free_ram_mb]
@@ -38,6 +38,11 @@ the config file will look something like:
 
 Details on the specific parameters can be found in the file `trust_attest.py'.
 
+The trust level of each host is cached for `attestation_cache_ttl' seconds,
+and hosts are attested in bulk, so scheduling normally does not wait on the
+Attestation service.  Setting `attestation_refresh_interval' also keeps the
+cache up to date from a background green thread.
+
 Details on setting up and using an Attestation Service can be found at
 the Open Attestation project at:
 
@@ -52,7 +57,9 @@ from nova import flags
 from nova import log as logging
 from nova.openstack.common import cfg
 from nova.openstack.common import jsonutils
+from nova.openstack.common import timeutils
 from nova.scheduler import filters
+from nova import utils
 
 
 LOG = logging.getLogger(__name__)
@@ -73,6 +80,15 @@ trusted_opts = [
     cfg.StrOpt('auth_blob',
                default=None,
                help='attestation authorization blob - must change'),
+    cfg.IntOpt('attestation_cache_ttl',
+               default=60,
+               help='Number of seconds the trust level of a host is cached '
+                    'for. 0 disables the cache'),
+    cfg.IntOpt('attestation_refresh_interval',
+               default=0,
+               help='Interval in seconds between background attestations '
+                    'of all the cached hosts. 0 disables the background '
+                    'refresh'),
 ]
 
 FLAGS = flags.FLAGS
@@ -151,10 +167,10 @@ class AttestationService(httplib.HTTPSConnection):
         except (socket.error, IOError) as e:
             return IOError, None
 
-    def _request(self, cmd, subcmd, host):
+    def _request(self, cmd, subcmd, hosts):
         body = {}
-        body['count'] = 1
-        body['hosts'] = host
+        body['count'] = len(hosts)
+        body['hosts'] = hosts
         cooked = jsonutils.dumps(body)
         headers = {}
         headers['content-type'] = 'application/json'
@@ -177,30 +193,147 @@ class AttestationService(httplib.HTTPSConnection):
 
     def do_attestation(self, host):
         state = []
-        status, data = self._request("POST", "PollHosts", host)
+        status, data = self._request("POST", "PollHosts", [host])
         if status != httplib.OK:
             return {}
         state.append(data)
         return self._check_trust(state, host)
 
+    def do_bulk_attestation(self, hosts):
+        """Attest several hosts with a single request.
+
+        :returns: dict of host name to trust level, or None if the
+                  attestation server could not be queried
+        """
+        status, data = self._request("POST", "PollHosts", hosts)
+        if status != httplib.OK or data is None:
+            return None
+        return dict((state['host_name'], state['trust_lvl'])
+                    for state in data.get('hosts', []))
+
+
+class AttestationCache(object):
+    """Cache of the trust levels reported by the Attestation service.
+
+    A lookup attests the hosts asked for that have no fresh entry, in
+    one request.  If attestation_refresh_interval is set, all the cached
+    hosts are also attested in the background so lookups seldom miss.
+    A host whose entry has expired and that can't be attested again has
+    no trust level.
+    """
+
+    def __init__(self):
+        self.attestation_service = AttestationService()
+        # { <host> : (<trust level>, <attested at>) }
+        self.trust_levels = {}
+        self.refresh_timer = None
+        interval = FLAGS.trusted_computing.attestation_refresh_interval
+        if interval > 0:
+            self.refresh_timer = utils.LoopingCall(self.refresh)
+            self.refresh_timer.start(interval=interval,
+                                     initial_delay=interval)
+
+    def _is_fresh(self, host):
+        ttl = FLAGS.trusted_computing.attestation_cache_ttl
+        entry = self.trust_levels.get(host)
+        if ttl <= 0 or entry is None:
+            return False
+        return not timeutils.is_older_than(entry[1], ttl)
+
+    def attest_hosts(self, hosts):
+        """Attest hosts with a single request and cache the results.
+
+        :returns: dict of host name to trust level, or None if the
+                  Attestation service can't be reached, in which case
+                  nothing is cached
+        """
+        if not hosts:
+            return {}
+        levels = self.attestation_service.do_bulk_attestation(hosts)
+        if levels is None:
+            LOG.warn(_("TCP: unable to attest %(count)d hosts"),
+                     {'count': len(hosts)})
+            return None
+        levels = dict((host, levels.get(host, '')) for host in hosts)
+        if FLAGS.trusted_computing.attestation_cache_ttl > 0:
+            now = timeutils.utcnow()
+            for host, level in levels.iteritems():
+                self.trust_levels[host] = (level, now)
+        return levels
+
+    def get_trust_levels(self, hosts):
+        """Return a dict of host to trust level for hosts, attesting the
+        ones without a fresh cache entry first.
+        """
+        stale_hosts = [host for host in hosts if not self._is_fresh(host)]
+        attested = self.attest_hosts(stale_hosts) or {}
+
+        levels = {}
+        for host in hosts:
+            if host in attested:
+                levels[host] = attested[host]
+            elif self._is_fresh(host):
+                levels[host] = self.trust_levels[host][0]
+            else:
+                # Fail closed rather than trust an expired attestation
+                levels[host] = ''
+        return levels
+
+    def get_trust_level(self, host):
+        return self.get_trust_levels([host])[host]
+
+    def refresh(self):
+        """Attest all the cached hosts again."""
+        try:
+            self.attest_hosts(self.trust_levels.keys())
+        except Exception:
+            LOG.exception(_("TCP: failed to refresh the attestation cache"))
+
 
 class TrustedFilter(filters.BaseHostFilter):
     """Trusted filter to support Trusted Compute Pools."""
 
     def __init__(self):
-        self.attestation_service = AttestationService()
+        self.attestation_cache = AttestationCache()
 
-    def _is_trusted(self, host, trust):
-        level = self.attestation_service.do_attestation(host)
+    def _get_trust_level(self, host, filter_properties):
+        """Return the trust level of host.  The first lookup of a
+        scheduling request attests it along with the other candidate
+        hosts the host manager is filtering, in a single request.
+        """
+        levels = filter_properties.setdefault('trust_levels', {})
+        if host not in levels:
+            hosts = set(filter_properties.get('candidate_hosts', []))
+            hosts.difference_update(levels)
+            hosts.add(host)
+            levels.update(self.attestation_cache.get_trust_levels(
+                    list(hosts)))
+        return levels[host]
+
+    def _is_trusted(self, host, trust, filter_properties):
+        level = self._get_trust_level(host, filter_properties)
         LOG.debug(_("TCP: trust state of "
                     "%(host)s:%(level)s(%(trust)s)") % locals())
         return trust == level
 
-    def host_passes(self, host_state, filter_properties):
+    @staticmethod
+    def _requested_trust(filter_properties):
         instance = filter_properties.get('instance_type', {})
         extra = instance.get('extra_specs', {})
-        trust = extra.get('trusted_host')
+        return extra.get('trusted_host')
+
+    def host_passes(self, host_state, filter_properties):
+        trust = self._requested_trust(filter_properties)
         host = host_state.host
         if trust:
-            return self._is_trusted(host, trust)
+            return self._is_trusted(host, trust, filter_properties)
         return True
+
+    def columns_pass(self, host_columns, filter_properties):
+        """Attest all the hosts that need it in a single request."""
+        trust = self._requested_trust(filter_properties)
+        if not trust:
+            return [True] * len(host_columns)
+        hosts = [host_state.host for host_state in host_columns.host_states]
+        levels = self.attestation_cache.get_trust_levels(hosts)
+        return [levels[host] == trust for host in hosts]
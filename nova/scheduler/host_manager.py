@@ -18,6 +18,7 @@ Manage hosts in the current zone.
 """
 
 import datetime
+import time
 import UserDict
 
 from nova import db
@@ -50,6 +51,27 @@ host_manager_opts = [
                   ],
                 help='Which filter class names to use for filtering hosts '
                       'when not specified in the request.'),
+    cfg.BoolOpt('scheduler_cache_host_states',
+                default=False,
+                help='Keep host states in memory between scheduling '
+                     'requests instead of rebuilding them from the '
+                     'database for every request'),
+    cfg.IntOpt('scheduler_host_states_resync_interval',
+               default=30,
+               help='Number of seconds between full resyncs of the cached '
+                    'host states against the database.  Should be lower '
+                    'than service_down_time'),
+    cfg.BoolOpt('scheduler_columnar_filtering',
+                default=False,
+                help='Filter and weigh hosts column by column, so filters '
+                     'and cost functions that support it can look at all '
+                     'hosts at once instead of one host at a time'),
+    cfg.BoolOpt('scheduler_use_host_indexes',
+                default=False,
+                help='Keep indexes of the hosts by availability zone, '
+                     'capability and aggregate metadata, so filters that '
+                     'support it can cut down the candidate hosts with set '
+                     'intersections before checking each host'),
     ]
 
 FLAGS = flags.FLAGS
@@ -102,9 +124,7 @@ class HostState(object):
 
         # Read-only capability dicts
 
-        if capabilities is None:
-            capabilities = {}
-        self.capabilities = ReadOnlyDict(capabilities.get(topic, None))
+        self.update_capabilities(capabilities)
         if service is None:
             service = {}
         self.service = ReadOnlyDict(service)
@@ -115,6 +135,16 @@ class HostState(object):
         self.vcpus_total = 0
         self.vcpus_used = 0
 
+    def update_capabilities(self, capabilities=None):
+        """Update the read-only capabilities for this host's topic.
+
+        :param capabilities: a dict of { <service> : { cap k : v }} as
+                             kept in HostManager.service_states
+        """
+        if capabilities is None:
+            capabilities = {}
+        self.capabilities = ReadOnlyDict(capabilities.get(self.topic, None))
+
     def update_from_compute_node(self, compute):
         """Update information about a host from its compute_node info."""
         all_disk_mb = compute['local_gb'] * 1024
@@ -168,6 +198,138 @@ class HostState(object):
                 (self.host, self.free_ram_mb, self.free_disk_mb))
 
 
+class HostStateColumns(object):
+    """Column oriented view of a list of HostStates.
+
+    The consumable resources of all the hosts are kept in parallel
+    lists, so filters and cost functions that know about them can check
+    every host in one pass instead of being called once per HostState.
+    """
+
+    # HostState attributes kept as columns, in the order of host_states.
+    columns = ('host_states', 'topic', 'free_ram_mb', 'free_disk_mb',
+               'vcpus_total', 'vcpus_used')
+
+    def __init__(self, host_states=None):
+        if host_states is None:
+            host_states = []
+        self.host_states = list(host_states)
+        for column in self.columns[1:]:
+            setattr(self, column,
+                    [getattr(host_state, column)
+                     for host_state in self.host_states])
+
+    def __len__(self):
+        return len(self.host_states)
+
+    def compress(self, mask):
+        """Return a new HostStateColumns with only the hosts whose
+        matching entry in mask is True.
+        """
+        selected = HostStateColumns()
+        for column in self.columns:
+            values = getattr(self, column)
+            setattr(selected, column,
+                    [value for value, keep in zip(values, mask) if keep])
+        return selected
+
+
+class HostStateIndex(object):
+    """Inverted indexes over a set of HostStates.
+
+    Maps availability zones, capability key/value pairs and aggregate
+    metadata key/value pairs to the set of host names that have them,
+    so filters can find their candidate hosts without looking at every
+    HostState.  The aggregate metadata is only loaded from the db the
+    first time it's needed.
+    """
+
+    def __init__(self, topic, host_states=None):
+        self.topic = topic
+        self.all_hosts = set()
+        # { <availability zone> : set([<host>, ...]) }
+        self.availability_zones = {}
+        # { (<capability key>, <value>) : set([<host>, ...]) }
+        self.capabilities = {}
+        # { <host> : [(<capability key>, <value>), ...] }
+        self.host_capabilities = {}
+        # { (<metadata key>, <value>) : set([<host>, ...]) }, or None if
+        # it hasn't been loaded yet.
+        self.aggregate_metadata = None
+        for host_state in host_states or []:
+            self.add_host(host_state)
+
+    def __contains__(self, host):
+        return host in self.all_hosts
+
+    def add_host(self, host_state):
+        host = host_state.host
+        self.all_hosts.add(host)
+        zone = host_state.service.get('availability_zone')
+        self.availability_zones.setdefault(zone, set()).add(host)
+        self.update_capabilities(host_state)
+
+    def update_capabilities(self, host_state):
+        """(Re)index the capabilities of a host."""
+        host = host_state.host
+        for item in self.host_capabilities.pop(host, []):
+            self.capabilities[item].discard(host)
+        items = []
+        for item in host_state.capabilities.iteritems():
+            try:
+                self.capabilities.setdefault(item, set()).add(host)
+            except TypeError:
+                # Unhashable values can't be indexed.
+                continue
+            items.append(item)
+        self.host_capabilities[host] = items
+
+    @staticmethod
+    def _intersect(index, items):
+        """Return the hosts indexed under all of the key/value pairs, or
+        None if one of the values can't be looked up in the index.
+        """
+        hosts = None
+        for item in items:
+            if item[1] is None:
+                return None
+            try:
+                item_hosts = index.get(item, set())
+            except TypeError:
+                return None
+            if hosts is None:
+                hosts = set(item_hosts)
+            else:
+                hosts &= item_hosts
+        return hosts
+
+    def hosts_in_zone(self, availability_zone):
+        """Return the set of hosts in an availability zone."""
+        return self.availability_zones.get(availability_zone, set())
+
+    def hosts_with_capabilities(self, capabilities):
+        """Return the set of hosts that report all the capabilities in
+        a dict, or None if they can't be looked up in the index.
+        """
+        return self._intersect(self.capabilities, capabilities.iteritems())
+
+    def _load_aggregate_metadata(self, context):
+        self.aggregate_metadata = {}
+        for aggregate in db.aggregate_get_all(context.elevated()):
+            hosts = aggregate.hosts
+            for item in aggregate.metadetails.iteritems():
+                self.aggregate_metadata.setdefault(item, set()).update(hosts)
+
+    def hosts_with_aggregate_metadata(self, context, metadata):
+        """Return the set of hosts in aggregates with all the key/value
+        pairs in a metadata dict, or None if they can't be looked up in
+        the index.
+        """
+        if self.aggregate_metadata is None:
+            self._load_aggregate_metadata(context)
+        return self._intersect(self.aggregate_metadata, metadata.iteritems())
+
+
 class HostManager(object):
     """Base HostManager class."""
 
@@ -176,44 +338,213 @@ class HostManager(object):
 
     def __init__(self):
         self.service_states = {}  # { <host> : { <service> : { cap k : v }}}
+        # Cached { <host> : HostState() }, only used when
+        # scheduler_cache_host_states is set.
+        self.host_state_map = {}
+        self.host_states_synced_at = None
+        # HostStateIndex of the last host states returned by
+        # get_all_host_states(), only used when scheduler_use_host_indexes
+        # is set.
+        self.host_index = None
         self.filter_classes = filters.get_filter_classes(
                 FLAGS.scheduler_available_filters)
+        # { <filter class name> : filter instance }
+        self.filter_obj_map = {}
+        # { <tuple of filter names> : [filter functions] }
+        self.filter_fns_map = {}
+
+    def _get_filter_obj(self, filter_name):
+        """Return the shared instance of the named filter class, or
+        None if there's no such filter class.
+        """
+        filter_obj = self.filter_obj_map.get(filter_name)
+        if filter_obj is not None:
+            return filter_obj
+        for cls in self.filter_classes:
+            if cls.__name__ == filter_name:
+                filter_obj = cls()
+                self.filter_obj_map[filter_name] = filter_obj
+                return filter_obj
+        return None
 
     def _choose_host_filters(self, filters):
         """Since the caller may specify which filters to use we need
         to have an authoritative list of what is permissible. This
         function checks the filter names against a predefined set
         of acceptable filters.
+
+        Filters are only instantiated once, and the filter functions
+        for each list of filter names are remembered.
         """
         if filters is None:
             filters = FLAGS.scheduler_default_filters
         if not isinstance(filters, (list, tuple)):
             filters = [filters]
+        filters = tuple(filters)
+        good_filters = self.filter_fns_map.get(filters)
+        if good_filters is not None:
+            return list(good_filters)
+
         good_filters = []
         bad_filters = []
         for filter_name in filters:
-            found_class = False
-            for cls in self.filter_classes:
-                if cls.__name__ == filter_name:
-                    found_class = True
-                    filter_instance = cls()
-                    # Get the filter function
-                    filter_func = getattr(filter_instance,
-                            'host_passes', None)
-                    if filter_func:
-                        good_filters.append(filter_func)
-                    break
-            if not found_class:
+            filter_instance = self._get_filter_obj(filter_name)
+            if filter_instance is None:
                 bad_filters.append(filter_name)
+                continue
+            # Get the filter function
+            filter_func = getattr(filter_instance, 'host_passes', None)
+            if filter_func:
+                good_filters.append(filter_func)
         if bad_filters:
             msg = ", ".join(bad_filters)
             raise exception.SchedulerHostFilterNotFound(filter_name=msg)
-        return good_filters
+        self.filter_fns_map[filters] = good_filters
+        return list(good_filters)
+
+    @staticmethod
+    def _filter_name(filter_fn):
+        filter_obj = getattr(filter_fn, 'im_self', None)
+        if filter_obj is None:
+            return filter_fn.__name__
+        return filter_obj.__class__.__name__
+
+    def _filter_host_columns(self, hosts, filter_fns, filter_properties,
+                             trace=None):
+        """Filter hosts a whole column at a time.
+
+        Filters with a columns_pass() method check all remaining hosts
+        in one call, any other filter function is called per host.
+        """
+        host_columns = HostStateColumns(hosts)
+
+        ignore_hosts = filter_properties.get('ignore_hosts', [])
+        if ignore_hosts:
+            host_columns = host_columns.compress(
+                    [host_state.host not in ignore_hosts
+                     for host_state in host_columns.host_states])
+
+        force_hosts = filter_properties.get('force_hosts', [])
+        if force_hosts:
+            return [host_state for host_state in host_columns.host_states
+                    if host_state.host in force_hosts]
+
+        for filter_fn in filter_fns:
+            if not len(host_columns):
+                break
+            start = time.time()
+            hosts_before = len(host_columns)
+            filter_obj = getattr(filter_fn, 'im_self', None)
+            columns_fn = getattr(filter_obj, 'columns_pass', None)
+            if columns_fn is not None:
+                mask = columns_fn(host_columns, filter_properties)
+            else:
+                mask = [filter_fn(host_state, filter_properties)
+                        for host_state in host_columns.host_states]
+            host_columns = host_columns.compress(mask)
+            if trace is not None:
+                trace.add_filter(self._filter_name(filter_fn),
+                                 (time.time() - start) * 1000,
+                                 hosts_before, len(host_columns))
+            LOG.debug(_('%(count)d hosts left after %(func)s'),
+                      {'count': len(host_columns), 'func': repr(filter_fn)})
+        return host_columns.host_states
+
+    def _filter_hosts_traced(self, hosts, filter_fns, filter_properties,
+                             trace):
+        """Filter hosts one filter at a time, timing each filter and
+        recording how many hosts it removed.
+        """
+        # Ignored and forced hosts are handled before any filter runs.
+        hosts = [host for host in hosts
+                 if host.passes_filters([], filter_properties)]
+        if filter_properties.get('force_hosts'):
+            return hosts
 
-    def filter_hosts(self, hosts, filter_properties, filters=None):
-        """Filter hosts and return only ones passing all filters"""
+        for filter_fn in filter_fns:
+            if not hosts:
+                break
+            start = time.time()
+            hosts_before = len(hosts)
+            hosts = [host for host in hosts
+                     if host.passes_filters([filter_fn], filter_properties)]
+            trace.add_filter(self._filter_name(filter_fn),
+                             (time.time() - start) * 1000,
+                             hosts_before, len(hosts))
+        return hosts
+
+    def _get_candidate_hosts(self, filter_fns, filter_properties):
+        """Return the intersection of the candidate hosts of all the
+        filters that can look them up in the host index, or None if none
+        of them can.
+        """
+        candidates = None
+        for filter_fn in filter_fns:
+            filter_obj = getattr(filter_fn, 'im_self', None)
+            candidates_fn = getattr(filter_obj, 'candidate_hosts', None)
+            if candidates_fn is None:
+                continue
+            filter_candidates = candidates_fn(self.host_index,
+                                              filter_properties)
+            if filter_candidates is None:
+                continue
+            if candidates is None:
+                candidates = filter_candidates
+            else:
+                candidates = candidates & filter_candidates
+        return candidates
+
+    def _prefilter_hosts(self, hosts, filter_fns, filter_properties, trace):
+        """Drop the hosts the host index says can't pass the filters.
+
+        The filters still check every host that's left.  Hosts missing
+        from the index are always kept.
+        """
+        if filter_properties.get('force_hosts'):
+            return hosts
+        start = time.time()
+        candidates = self._get_candidate_hosts(filter_fns, filter_properties)
+        if candidates is None:
+            return hosts
+        # hosts may be an iterator, e.g. from FilterScheduler._schedule
+        hosts = list(hosts)
+        hosts_before = len(hosts)
+        hosts = [host_state for host_state in hosts
+                 if (host_state.host in candidates or
+                     host_state.host not in self.host_index)]
+        if trace is not None:
+            trace.add_filter('HostStateIndex', (time.time() - start) * 1000,
+                             hosts_before, len(hosts))
+        return hosts
+
+    def filter_hosts(self, hosts, filter_properties, filters=None,
+                     trace=None):
+        """Filter hosts and return only ones passing all filters.
+
+        If a SchedulerTrace is given, the time spent in each filter and
+        the number of hosts it removed are recorded in it.
+
+        When hosts are filtered one at a time, the names of all the hosts
+        being filtered are put in filter_properties['candidate_hosts'],
+        so filters can look them up in bulk the first time they're called.
+        """
         filtered_hosts = []
         filter_fns = self._choose_host_filters(filters)
+        if trace is not None and not trace.enabled:
+            trace = None
+        if self.host_index is not None:
+            hosts = self._prefilter_hosts(hosts, filter_fns,
+                                          filter_properties, trace)
+        if FLAGS.scheduler_columnar_filtering:
+            return self._filter_host_columns(hosts, filter_fns,
+                                             filter_properties, trace)
+        # hosts may be an iterator, e.g. from FilterScheduler._schedule
+        hosts = list(hosts)
+        filter_properties['candidate_hosts'] = [host_state.host
+                                                for host_state in hosts]
+        if trace is not None:
+            return self._filter_hosts_traced(hosts, filter_fns,
+                                             filter_properties, trace)
         for host in hosts:
             if host.passes_filters(filter_fns, filter_properties):
                 filtered_hosts.append(host)
@@ -278,6 +609,17 @@ class HostManager(object):
         service_caps[service_name] = capab_copy
         self.service_states[host] = service_caps
 
+        host_state = self.host_state_map.get(host)
+        if host_state is not None:
+            host_state.update_capabilities(service_caps)
+            if self.host_index is not None and host in self.host_index:
+                self.host_index.update_capabilities(host_state)
+        elif (FLAGS.scheduler_cache_host_states and
+              service_name == 'compute'):
+            # A compute node we don't know about yet.  Make sure the
+            # next request picks it up.
+            self.invalidate_host_states()
+
     def host_service_caps_stale(self, host, service):
         """Check if host service capabilites are not recent enough."""
         allowed_time_diff = FLAGS.periodic_interval * 3
@@ -296,6 +638,19 @@ class HostManager(object):
                 if len(service_caps) == 0:  # Delete host if no services
                     del self.service_states[host]
 
+    def invalidate_host_states(self):
+        """Force the cached host states to be resynced against the db
+        on the next call to get_all_host_states().
+        """
+        self.host_states_synced_at = None
+
+    def _host_states_need_resync(self):
+        """Check if the cached host states are not recent enough."""
+        if self.host_states_synced_at is None:
+            return True
+        return timeutils.is_older_than(self.host_states_synced_at,
+                FLAGS.scheduler_host_states_resync_interval)
+
     def get_all_host_states(self, context, topic):
         """Returns a dict of all the hosts the HostManager
         knows about. Also, each of the consumable resources in HostState
@@ -304,15 +659,49 @@ class HostManager(object):
         For example:
         {'192.168.1.100': HostState(), ...}
 
-        Note: this can be very slow with a lot of instances.
-        InstanceType table isn't required since a copy is stored
-        with the instance (in case the InstanceType changed since the
-        instance was created)."""
+        If scheduler_cache_host_states is set, the HostStates are kept
+        between calls, so resources consumed by previous requests stay
+        consumed.  They are rebuilt from the db every
+        scheduler_host_states_resync_interval seconds, or sooner if a
+        new compute node reports its capabilities.
+
+        If scheduler_use_host_indexes is set, a HostStateIndex of the
+        returned hosts is kept in host_index for filter_hosts().
+        """
 
         if topic != 'compute':
             raise NotImplementedError(_(
                 "host_manager only implemented for 'compute'"))
 
+        if not FLAGS.scheduler_cache_host_states:
+            host_state_map = self._get_host_states_from_db(context, topic)
+            self.host_index = None
+            if FLAGS.scheduler_use_host_indexes:
+                self.host_index = HostStateIndex(topic,
+                                                 host_state_map.values())
+            return host_state_map
+
+        if self._host_states_need_resync():
+            LOG.debug(_("Resyncing cached host states"))
+            self.host_state_map = self._get_host_states_from_db(context,
+                                                                topic)
+            self.host_states_synced_at = timeutils.utcnow()
+            self.host_index = None
+            if FLAGS.scheduler_use_host_indexes:
+                self.host_index = HostStateIndex(topic,
+                                                 self.host_state_map.values())
+        # Return a copy so callers can't add or remove hosts from the
+        # cache.  The HostStates themselves are shared on purpose.
+        return dict(self.host_state_map)
+
+    def _get_host_states_from_db(self, context, topic):
+        """Build a dict of fresh HostStates from the db.
+
+        Note: this can be very slow with a lot of instances.
+        InstanceType table isn't required since a copy is stored
+        with the instance (in case the InstanceType changed since the
+        instance was created)."""
+
         host_state_map = {}
 
         # Make a compute node dict with the bare essential metrics.
@@ -78,12 +78,28 @@ def noop_cost_fn(host_state, weighing_properties):
     return 1
 
 
+def noop_cost_columns_fn(host_columns, weighing_properties):
+    """Column version of noop_cost_fn()"""
+    return [1] * len(host_columns)
+
+
+noop_cost_fn.columns_fn = noop_cost_columns_fn
+
+
 def compute_fill_first_cost_fn(host_state, weighing_properties):
     """More free ram = higher weight. So servers will less free
     ram will be preferred."""
     return host_state.free_ram_mb
 
 
+def compute_fill_first_cost_columns_fn(host_columns, weighing_properties):
+    """Column version of compute_fill_first_cost_fn()"""
+    return host_columns.free_ram_mb
+
+
+compute_fill_first_cost_fn.columns_fn = compute_fill_first_cost_columns_fn
+
+
 def weighted_sum(weighted_fns, host_states, weighing_properties):
     """Use the weighted-sum method to compute a score for an array of objects.
 
@@ -110,3 +126,32 @@ def weighted_sum(weighted_fns, host_states, weighing_properties):
             min_score, best_host = score, host_state
 
     return WeightedHost(min_score, host_state=best_host)
+
+
+def weighted_sum_columns(weighted_fns, host_columns, weighing_properties):
+    """Same as weighted_sum(), but for a HostStateColumns.
+
+    Cost functions with a ``columns_fn`` attribute are called once with
+    all the hosts, the others are called once per host.
+
+    :returns: a single WeightedHost object which represents the best
+              candidate.
+    """
+    host_states = host_columns.host_states
+    if not host_states:
+        return WeightedHost(None)
+
+    scores = [0] * len(host_states)
+    for weight, fn in weighted_fns:
+        columns_fn = getattr(fn, 'columns_fn', None)
+        if columns_fn is not None:
+            costs = columns_fn(host_columns, weighing_properties)
+        else:
+            costs = [fn(host_state, weighing_properties)
+                     for host_state in host_states]
+        scores = [score + weight * cost
+                  for score, cost in zip(scores, costs)]
+
+    min_score = min(scores)
+    best_host = host_states[scores.index(min_score)]
+    return WeightedHost(min_score, host_state=best_host)
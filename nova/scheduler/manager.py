@@ -35,6 +35,7 @@ from nova.openstack.common import cfg
 from nova.openstack.common import excutils
 from nova.openstack.common import importutils
 from nova import quota
+from nova.scheduler import tracing
 
 
 LOG = logging.getLogger(__name__)
@@ -52,7 +53,7 @@ QUOTAS = quota.QUOTAS
 class SchedulerManager(manager.Manager):
     """Chooses a host to run instances on."""
 
-    RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.1'
 
     def __init__(self, scheduler_driver=None, *args, **kwargs):
         if not scheduler_driver:
@@ -71,6 +72,10 @@ class SchedulerManager(manager.Manager):
         """Get a list of hosts from the HostManager."""
         return self.driver.get_host_list()
 
+    def get_scheduler_stats(self, context):
+        """Get the latency histograms of the traced scheduling requests."""
+        return tracing.get_stats()
+
     def get_service_capabilities(self, context):
         """Get the normalized set of capabilities for this zone."""
         return self.driver.get_service_capabilities()
@@ -252,3 +257,7 @@ class SchedulerManager(manager.Manager):
     @manager.periodic_task
     def _expire_reservations(self, context):
         QUOTAS.expire(context)
+
+    @manager.periodic_task
+    def _refresh_quota_usages(self, context):
+        QUOTAS.refresh_usages(context)
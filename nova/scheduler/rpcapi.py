@@ -31,6 +31,7 @@ class SchedulerAPI(nova.openstack.common.rpc.proxy.RpcProxy):
     API version history:
 
         1.0 - Initial version.
+        1.1 - Add get_scheduler_stats()
     '''
 
     RPC_API_VERSION = '1.0'
@@ -78,3 +79,7 @@ class SchedulerAPI(nova.openstack.common.rpc.proxy.RpcProxy):
 
     def get_host_list(self, ctxt):
         return self.call(ctxt, self.make_msg('get_host_list'))
+
+    def get_scheduler_stats(self, ctxt):
+        return self.call(ctxt, self.make_msg('get_scheduler_stats'),
+                version='1.1')
@@ -0,0 +1,205 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Scheduler decision tracing.
+
+A SchedulerTrace records how long each stage of a single scheduling
+request took (loading the host states, each filter, weighing and
+provisioning) and how many hosts each filter removed.  Finished traces
+are folded into SchedulerStats, which keeps rolling latency histograms
+per stage that can be read back through the scheduler RPC API.
+"""
+
+import collections
+import contextlib
+import time
+
+from nova import flags
+from nova import log as logging
+from nova.openstack.common import cfg
+
+
+tracing_opts = [
+    cfg.BoolOpt('scheduler_tracing',
+                default=False,
+                help='Record the time spent in each stage of a scheduling '
+                     'request and keep latency histograms for them'),
+    cfg.IntOpt('scheduler_tracing_samples',
+               default=1000,
+               help='Number of most recent samples kept per stage for the '
+                    'scheduler latency histograms'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(tracing_opts)
+
+LOG = logging.getLogger(__name__)
+
+# Upper bounds, in milliseconds, of the histogram buckets.  Samples above
+# the last bound are counted in an extra overflow bucket.
+HISTOGRAM_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _percentile(sorted_samples, percent):
+    """Return the nearest-rank percentile of a sorted list of samples."""
+    if not sorted_samples:
+        return None
+    index = int(round(percent / 100.0 * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
+
+
+class LatencyHistogram(object):
+    """Rolling histogram of the most recent latency samples."""
+
+    def __init__(self, max_samples):
+        self.samples = collections.deque(maxlen=max_samples)
+        self.count = 0
+
+    def add(self, elapsed_ms):
+        self.samples.append(elapsed_ms)
+        self.count += 1
+
+    def to_dict(self):
+        samples = sorted(self.samples)
+        buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        bucket = 0
+        for sample in samples:
+            while (bucket < len(HISTOGRAM_BUCKETS) and
+                   sample > HISTOGRAM_BUCKETS[bucket]):
+                bucket += 1
+            buckets[bucket] += 1
+        bounds = list(HISTOGRAM_BUCKETS) + [None]
+        return {'count': self.count,
+                'samples': len(samples),
+                'min': samples[0] if samples else None,
+                'max': samples[-1] if samples else None,
+                'avg': sum(samples) / len(samples) if samples else None,
+                'p50': _percentile(samples, 50),
+                'p90': _percentile(samples, 90),
+                'p99': _percentile(samples, 99),
+                'buckets': [{'le': le, 'count': count}
+                            for le, count in zip(bounds, buckets)]}
+
+
+class SchedulerStats(object):
+    """Aggregates finished SchedulerTraces."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # { <stage> : LatencyHistogram }
+        self.stages = {}
+        # { <filter name> : LatencyHistogram }
+        self.filters = {}
+        # { <filter name> : number of hosts removed }
+        self.hosts_removed = {}
+
+    def _histogram(self, histograms, name):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = LatencyHistogram(FLAGS.scheduler_tracing_samples)
+            histograms[name] = histogram
+        return histogram
+
+    def record(self, trace):
+        for stage, elapsed_ms in trace.stages:
+            self._histogram(self.stages, stage).add(elapsed_ms)
+        self._histogram(self.stages, 'total').add(trace.elapsed_ms)
+        for name, elapsed_ms, hosts_before, hosts_after in trace.filters:
+            self._histogram(self.filters, name).add(elapsed_ms)
+            self.hosts_removed[name] = (self.hosts_removed.get(name, 0) +
+                                        hosts_before - hosts_after)
+
+    def to_dict(self):
+        stages = dict((stage, histogram.to_dict())
+                      for stage, histogram in self.stages.iteritems())
+        filters = {}
+        for name, histogram in self.filters.iteritems():
+            filters[name] = histogram.to_dict()
+            filters[name]['hosts_removed'] = self.hosts_removed.get(name, 0)
+        return {'stages': stages, 'filters': filters}
+
+
+STATS = SchedulerStats()
+
+
+class SchedulerTrace(object):
+    """Timings of a single scheduling request."""
+
+    enabled = True
+
+    def __init__(self, method):
+        self.method = method
+        self.started = time.time()
+        self.elapsed_ms = None
+        # [(<stage>, <elapsed ms>), ...]
+        self.stages = []
+        # [(<filter name>, <elapsed ms>, <hosts before>, <hosts after>), ...]
+        self.filters = []
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        """Time the body of a with statement as the given stage."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stages.append((stage, (time.time() - start) * 1000))
+
+    def add_filter(self, name, elapsed_ms, hosts_before, hosts_after):
+        self.filters.append((name, elapsed_ms, hosts_before, hosts_after))
+
+    def finish(self):
+        """Record the trace in the scheduler stats and log it."""
+        self.elapsed_ms = (time.time() - self.started) * 1000
+        STATS.record(self)
+        stages = ', '.join('%s=%.1fms' % stage for stage in self.stages)
+        filters = ', '.join('%s=%.1fms (%d -> %d hosts)' % filter_timing
+                            for filter_timing in self.filters)
+        LOG.debug(_("Scheduled %(method)s in %(elapsed).1fms: %(stages)s; "
+                    "filters: %(filters)s"),
+                  {'method': self.method, 'elapsed': self.elapsed_ms,
+                   'stages': stages, 'filters': filters})
+
+
+class NullTrace(object):
+    """Stand-in for SchedulerTrace when tracing is disabled."""
+
+    enabled = False
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        yield
+
+    def add_filter(self, name, elapsed_ms, hosts_before, hosts_after):
+        pass
+
+    def finish(self):
+        pass
+
+
+def start_trace(method):
+    """Return a new trace for a scheduling request of the given method."""
+    if not FLAGS.scheduler_tracing:
+        return NullTrace()
+    return SchedulerTrace(method)
+
+
+def get_stats():
+    return STATS.to_dict()
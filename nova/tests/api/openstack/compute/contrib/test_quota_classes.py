@@ -37,6 +37,10 @@ class QuotaClassSetsTest(test.TestCase):
         super(QuotaClassSetsTest, self).setUp()
         self.controller = quota_classes.QuotaClassSetsController()
 
+    def tearDown(self):
+        quota_classes.QUOTAS.invalidate_limits()
+        super(QuotaClassSetsTest, self).tearDown()
+
     def test_format_quota_set(self):
         raw_quota_set = {
             'instances': 10,
@@ -106,6 +110,19 @@ class QuotaClassSetsTest(test.TestCase):
 
         self.assertEqual(res_dict, body)
 
+    def test_quotas_update_invalidates_cached_limits(self):
+        self.flags(quota_limits_cache_ttl=60)
+        req = fakes.HTTPRequest.blank(
+            '/v2/fake4/os-quota-class-sets/test_class',
+            use_admin_context=True)
+        res_dict = self.controller.show(req, 'test_class')
+        self.assertEqual(res_dict['quota_class_set']['instances'], 10)
+
+        body = {'quota_class_set': {'instances': 50}}
+        self.controller.update(req, 'test_class', body)
+        res_dict = self.controller.show(req, 'test_class')
+        self.assertEqual(res_dict['quota_class_set']['instances'], 50)
+
     def test_quotas_update_as_user(self):
         body = {'quota_class_set': {'instances': 50, 'cores': 50,
                                     'ram': 51200, 'volumes': 10,
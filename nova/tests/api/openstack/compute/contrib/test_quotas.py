@@ -39,6 +39,10 @@ class QuotaSetsTest(test.TestCase):
         super(QuotaSetsTest, self).setUp()
         self.controller = quotas.QuotaSetsController()
 
+    def tearDown(self):
+        quotas.QUOTAS.invalidate_limits()
+        super(QuotaSetsTest, self).tearDown()
+
     def test_format_quota_set(self):
         raw_quota_set = {
             'instances': 10,
@@ -128,6 +132,18 @@ class QuotaSetsTest(test.TestCase):
 
         self.assertEqual(res_dict, body)
 
+    def test_quotas_update_invalidates_cached_limits(self):
+        self.flags(quota_limits_cache_ttl=60)
+        req = fakes.HTTPRequest.blank('/v2/fake4/os-quota-sets/update_me',
+                                      use_admin_context=True)
+        res_dict = self.controller.show(req, 'update_me')
+        self.assertEqual(res_dict['quota_set']['instances'], 10)
+
+        body = {'quota_set': {'instances': 50}}
+        self.controller.update(req, 'update_me', body)
+        res_dict = self.controller.show(req, 'update_me')
+        self.assertEqual(res_dict['quota_set']['instances'], 50)
+
     def test_quotas_update_as_user(self):
         body = {'quota_set': {'instances': 50, 'cores': 50,
                               'ram': 51200, 'volumes': 10,
@@ -0,0 +1,75 @@
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from lxml import etree
+
+from nova.api.openstack.compute.contrib import scheduler_stats
+from nova.openstack.common import rpc
+from nova import test
+from nova.tests.api.openstack import fakes
+
+
+def _histogram(count):
+    return {'count': count, 'samples': count, 'min': 1.0, 'max': 2.0,
+            'avg': 1.5, 'p50': 1.0, 'p90': 2.0, 'p99': 2.0,
+            'buckets': [{'le': 1, 'count': 1}, {'le': None, 'count': 1}]}
+
+
+def fake_get_scheduler_stats(context, topic, msg, timeout=None):
+    filter_stats = _histogram(2)
+    filter_stats['hosts_removed'] = 3
+    return {'stages': {'weighing': _histogram(2),
+                       'get_all_host_states': _histogram(1)},
+            'filters': {'RamFilter': filter_stats}}
+
+
+class SchedulerStatsTest(test.TestCase):
+    def setUp(self):
+        super(SchedulerStatsTest, self).setUp()
+        self.controller = scheduler_stats.SchedulerStatsController()
+        self.stubs.Set(rpc, 'call', fake_get_scheduler_stats)
+
+    def test_index(self):
+        req = fakes.HTTPRequest.blank('/v2/fake/os-scheduler-stats',
+                                      use_admin_context=True)
+        res_dict = self.controller.index(req)['scheduler_stats']
+
+        self.assertEqual([s['name'] for s in res_dict['stages']],
+                         ['get_all_host_states', 'weighing'])
+        self.assertEqual(res_dict['stages'][1]['count'], 2)
+        self.assertEqual(res_dict['filters'][0]['name'], 'RamFilter')
+        self.assertEqual(res_dict['filters'][0]['hosts_removed'], 3)
+
+
+class SchedulerStatsSerializerTest(test.TestCase):
+    def test_index_serializer(self):
+        serializer = scheduler_stats.SchedulerStatsTemplate()
+        filter_stats = _histogram(2)
+        filter_stats.update(name='RamFilter', hosts_removed=3)
+        stage_stats = _histogram(1)
+        stage_stats['name'] = 'weighing'
+        text = serializer.serialize({'scheduler_stats': {
+                'stages': [stage_stats],
+                'filters': [filter_stats]}})
+
+        tree = etree.fromstring(text)
+
+        self.assertEqual('scheduler_stats', tree.tag)
+        stage = tree.find('stages/stage')
+        self.assertEqual('weighing', stage.get('name'))
+        self.assertEqual('1', stage.get('count'))
+        elem = tree.find('filters/filter')
+        self.assertEqual('RamFilter', elem.get('name'))
+        self.assertEqual('3', elem.get('hosts_removed'))
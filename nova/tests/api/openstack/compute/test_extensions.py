@@ -178,6 +178,7 @@ class ExtensionControllerTest(ExtensionTestCase):
             "Quotas",
             "Rescue",
             "SchedulerHints",
+            "SchedulerStats",
             "SecurityGroups",
             "ServerDiagnostics",
             "ServerStartStop",
@@ -497,12 +497,23 @@ def fake_instance_get(**kwargs):
 
 
 def fake_instance_get_all_by_filters(num_servers=5, **kwargs):
-    def _return_servers(context, *args, **kwargs):
+    def _return_servers(context, filters=None, sort_key=None,
+                        sort_dir='desc', limit=None, marker=None,
+                        columns_to_join=None, columns=None,
+                        use_slave=False):
         servers_list = []
+        marker_found = marker is None
         for i in xrange(num_servers):
-            server = stub_instance(id=i + 1, uuid=get_fake_uuid(i),
-                    **kwargs)
+            uuid = get_fake_uuid(i)
+            if not marker_found:
+                marker_found = uuid == marker
+                continue
+            server = stub_instance(id=i + 1, uuid=uuid, **kwargs)
             servers_list.append(server)
+            if limit is not None and len(servers_list) >= limit:
+                break
+        if not marker_found:
+            raise exc.MarkerNotFound(marker=marker)
         return servers_list
     return _return_servers
 
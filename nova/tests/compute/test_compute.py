@@ -1767,21 +1767,20 @@ class ComputeTestCase(BaseTestCase):
             call_info['get_by_uuid'] += 1
             return instance_map[instance_uuid]
 
-        # NOTE(comstud): Override the stub in setUp()
-        def fake_get_instance_nw_info(context, instance):
+        def fake_refresh_instances_cache(context, instances):
             # Note that this exception gets caught in compute/manager
             # and is ignored.  However, the below increment of
             # 'get_nw_info' won't happen, and you'll get an assert
             # failure checking it below.
-            self.assertEqual(instance, call_info['expected_instance'])
+            self.assertEqual(instances, [call_info['expected_instance']])
             call_info['get_nw_info'] += 1
 
         self.stubs.Set(db, 'instance_get_all_by_host',
                 fake_instance_get_all_by_host)
         self.stubs.Set(db, 'instance_get_by_uuid',
                 fake_instance_get_by_uuid)
-        self.stubs.Set(self.compute.network_api, 'get_instance_nw_info',
-                fake_get_instance_nw_info)
+        self.stubs.Set(self.compute.network_api, 'refresh_instances_cache',
+                fake_refresh_instances_cache)
 
         call_info['expected_instance'] = instances[0]
         self.compute._heal_instance_info_cache(ctxt)
@@ -1818,6 +1817,97 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(call_info['get_by_uuid'], 3)
         self.assertEqual(call_info['get_nw_info'], 4)
 
+    def test_heal_instance_info_cache_batch(self):
+        # Update on every call for the test
+        self.flags(heal_instance_info_cache_interval=-1,
+                   heal_instance_info_cache_batch_size=3)
+        ctxt = context.get_admin_context()
+
+        instances = [{'uuid': 'fake-uuid-%s' % x, 'host': FLAGS.host}
+                     for x in xrange(5)]
+        # An instance that moved to another host is skipped
+        instances[1]['host'] = 'not-me'
+        instance_map = dict((instance['uuid'], instance)
+                            for instance in instances)
+        healed = []
+
+        def fake_instance_get_all_by_host(context, host):
+            return instances[:]
+
+        def fake_instance_get_by_uuid(context, instance_uuid):
+            return instance_map[instance_uuid]
+
+        def fake_refresh_instances_cache(context, instances):
+            healed.append([instance['uuid'] for instance in instances])
+
+        self.stubs.Set(db, 'instance_get_all_by_host',
+                fake_instance_get_all_by_host)
+        self.stubs.Set(db, 'instance_get_by_uuid',
+                fake_instance_get_by_uuid)
+        self.stubs.Set(self.compute.network_api, 'refresh_instances_cache',
+                fake_refresh_instances_cache)
+
+        self.compute._heal_instance_info_cache(ctxt)
+        self.compute._heal_instance_info_cache(ctxt)
+        self.compute._heal_instance_info_cache(ctxt)
+        self.assertEqual(healed,
+                         [['fake-uuid-0', 'fake-uuid-2', 'fake-uuid-3'],
+                          ['fake-uuid-4'],
+                          ['fake-uuid-0', 'fake-uuid-2', 'fake-uuid-3']])
+
+    def test_sync_power_states_batches_updates(self):
+        self.flags(periodic_task_db_write_batch_size=2)
+        ctxt = context.get_admin_context()
+        instances = [{'uuid': 'fake-uuid-%s' % x,
+                      'power_state': power_state.RUNNING,
+                      'vm_state': vm_states.ACTIVE} for x in xrange(3)]
+        states = {'fake-uuid-0': power_state.RUNNING,
+                  'fake-uuid-1': power_state.SHUTDOWN,
+                  'fake-uuid-2': power_state.PAUSED}
+        writes = []
+
+        def fake_get_info(instance):
+            return {'state': states[instance['uuid']]}
+
+        def fake_instance_update_multi(context, values_by_uuid):
+            writes.append(values_by_uuid)
+            return {}
+
+        self.stubs.Set(db, 'instance_get_all_by_host',
+                       lambda context, host: instances)
+        self.stubs.Set(self.compute.driver, 'get_num_instances', lambda: 3)
+        self.stubs.Set(self.compute.driver, 'get_info', fake_get_info)
+        self.stubs.Set(db, 'instance_update_multi_and_get_original',
+                       fake_instance_update_multi)
+
+        self.compute._sync_power_states(ctxt)
+        expected = {'fake-uuid-1': {'power_state': power_state.SHUTDOWN,
+                                    'vm_state': vm_states.SHUTOFF},
+                    'fake-uuid-2': {'power_state': power_state.PAUSED}}
+        self.assertEqual(writes, [expected])
+
+    def test_poll_bandwidth_usage(self):
+        start_time = timeutils.utcnow()
+        self.flags(bandwith_poll_interval=-1)
+        ctxt = context.get_admin_context()
+        bw_usage = [{'uuid': 'fake-uuid-%s' % x,
+                     'mac_address': 'fake-mac-%s' % x,
+                     'bw_in': 100 * x, 'bw_out': 200 * x} for x in xrange(2)]
+
+        self.stubs.Set(db, 'instance_get_all_by_host',
+                       lambda context, host: [])
+        self.stubs.Set(self.compute.driver, 'get_all_bw_usage',
+                       lambda instances, start_time, stop_time: bw_usage)
+        self.mox.StubOutWithMock(db, 'bw_usage_update_multi')
+        db.bw_usage_update_multi(ctxt, start_time,
+                [{'uuid': 'fake-uuid-0', 'mac': 'fake-mac-0',
+                  'bw_in': 0, 'bw_out': 0},
+                 {'uuid': 'fake-uuid-1', 'mac': 'fake-mac-1',
+                  'bw_in': 100, 'bw_out': 200}])
+        self.mox.ReplayAll()
+
+        self.compute._poll_bandwidth_usage(ctxt, start_time=start_time)
+
     def test_poll_unconfirmed_resizes(self):
         instances = [{'uuid': 'fake_uuid1', 'vm_state': vm_states.ACTIVE,
                       'task_state': task_states.RESIZE_VERIFY},
@@ -2086,6 +2176,60 @@ class ComputeAPITestCase(BaseTestCase):
                 inst_type, None)
         db.instance_destroy(self.context, refs[0]['uuid'])
 
+    def test_create_db_entries_for_new_instances(self):
+        inst_type = instance_types.get_default_instance_type()
+        self.security_group_api.ensure_default(self.context)
+        base_options = {'reservation_id': 'r-fake',
+                        'user_id': self.context.user_id,
+                        'project_id': self.context.project_id,
+                        'instance_type_id': inst_type['id'],
+                        'display_name': None}
+        instances_values = [{'launch_index': 0, 'host': 'host1'},
+                            {'launch_index': 1, 'host': 'host2'}]
+
+        refs = self.compute_api.create_db_entries_for_new_instances(
+                self.context, inst_type, self.fake_image, base_options,
+                None, [], None, instances_values)
+        self.assertEqual(len(refs), 2)
+
+        for i, ref in enumerate(refs):
+            instance = db.instance_get_by_uuid(self.context, ref['uuid'])
+            self.assertEqual(instance['launch_index'], i)
+            self.assertEqual(instance['host'], 'host%d' % (i + 1))
+            self.assertEqual(instance['vm_state'], vm_states.BUILDING)
+            self.assertEqual(instance['task_state'], task_states.SCHEDULING)
+            display_name = 'Server %d' % instance['id']
+            self.assertEqual(instance['display_name'], display_name)
+            self.assertEqual(instance['hostname'],
+                             'server-%d' % instance['id'])
+            self.assertEqual(ref['display_name'], display_name)
+            self.assertEqual([g['name'] for g in
+                              instance['security_groups']], ['default'])
+            sys_metadata = db.instance_system_metadata_get(self.context,
+                    instance['uuid'])
+            self.assertEqual(sys_metadata['image_kernel_id'],
+                             'fake_kernel_id')
+            db.instance_destroy(self.context, instance['uuid'])
+
+    def test_create_db_entries_for_new_instances_with_name(self):
+        inst_type = instance_types.get_default_instance_type()
+        self.security_group_api.ensure_default(self.context)
+        base_options = {'reservation_id': 'r-fake',
+                        'user_id': self.context.user_id,
+                        'project_id': self.context.project_id,
+                        'instance_type_id': inst_type['id'],
+                        'display_name': 'Named Server'}
+
+        self.mox.StubOutWithMock(self.compute_api, 'update')
+        self.mox.ReplayAll()
+
+        refs = self.compute_api.create_db_entries_for_new_instances(
+                self.context, inst_type, self.fake_image, base_options,
+                None, [], None, [{'launch_index': 0}])
+        self.assertEqual(refs[0]['display_name'], 'Named Server')
+        self.assertEqual(refs[0]['hostname'], 'named-server')
+        db.instance_destroy(self.context, refs[0]['uuid'])
+
     def test_create_with_no_ram_and_disk_reqs(self):
         """Test an instance type with no min_ram or min_disk"""
 
@@ -0,0 +1,244 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the dispatch of received messages in rpc.amqp.
+"""
+
+import eventlet
+from eventlet import event
+
+from nova import flags
+from nova.openstack.common.rpc import amqp
+from nova.openstack.common.rpc import common as rpc_common
+from nova.openstack.common.rpc import metrics as rpc_metrics
+from nova import test
+
+
+FLAGS = flags.FLAGS
+
+
+class DispatchSchedulerTestCase(test.TestCase):
+    """Test case for DispatchScheduler."""
+
+    def setUp(self):
+        super(DispatchSchedulerTestCase, self).setUp()
+        self.flags(rpc_thread_pool_size=3,
+                   rpc_dispatch_queue_size=4,
+                   rpc_low_priority_methods=['low'],
+                   rpc_low_priority_thread_pool_size=3,
+                   rpc_low_priority_queue_size=3)
+        self.started = []
+        self.events = {}
+        self.finished = False
+        self.metrics = []
+        self.stubs.Set(rpc_metrics, 'record',
+                       lambda conf, metric: self.metrics.append(metric))
+
+    def _work(self, name):
+        self.started.append(name)
+        if not self.finished:
+            self.events.setdefault(name, event.Event()).wait()
+
+    def _release(self, *names):
+        for name in names:
+            self.events.pop(name).send()
+        for i in xrange(10):
+            eventlet.sleep(0)
+
+    def _finish(self):
+        self.finished = True
+        self._release(*self.events.keys())
+
+    def _submit(self, scheduler, method, name, key=None, dropped=None):
+        scheduler.submit(method, self._work, (name,), key, dropped)
+
+    def test_lane_priority(self):
+        scheduler = amqp.DispatchScheduler(FLAGS)
+        for name in ('d1', 'd2', 'd3'):
+            self._submit(scheduler, 'default', name)
+        for name in ('l1', 'l2'):
+            self._submit(scheduler, 'low', name)
+        eventlet.sleep(0)
+
+        # The default lane leaves one thread to the low lane
+        self.assertEqual(self.started, ['d1', 'd2', 'l1'])
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['default']['running'], 2)
+        self.assertEqual(stats['default']['waiting'], 1)
+        self.assertEqual(stats['low']['running'], 1)
+        self.assertEqual(stats['low']['waiting'], 1)
+
+        # Free threads go to the default lane first
+        self._release('d1')
+        self.assertEqual(self.started, ['d1', 'd2', 'l1', 'd3'])
+        self._release('l1')
+        self.assertEqual(self.started, ['d1', 'd2', 'l1', 'd3', 'l2'])
+        self._finish()
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['default']['dispatched'], 3)
+        self.assertEqual(stats['low']['dispatched'], 2)
+        self.assertEqual(stats['low']['running'], 0)
+
+    def test_low_lane_thread_limit(self):
+        self.flags(rpc_low_priority_thread_pool_size=1)
+        scheduler = amqp.DispatchScheduler(FLAGS)
+        for name in ('l1', 'l2'):
+            self._submit(scheduler, 'low', name)
+        self._submit(scheduler, 'default', 'd1')
+        eventlet.sleep(0)
+        self.assertEqual(self.started, ['l1', 'd1'])
+        # The low lane has a free thread it may not use
+        self._release('d1')
+        self.assertEqual(self.started, ['l1', 'd1'])
+        self._release('l1')
+        self.assertEqual(self.started, ['l1', 'd1', 'l2'])
+        self._finish()
+
+    def test_default_lane_admission_bound(self):
+        self.flags(rpc_thread_pool_size=1, rpc_dispatch_queue_size=2)
+        scheduler = amqp.DispatchScheduler(FLAGS)
+        submitted = []
+
+        def _producer():
+            for name in ('d1', 'd2', 'd3', 'd4'):
+                self._submit(scheduler, 'default', name)
+                submitted.append(name)
+            # Low priority messages never block the consumer
+            self._submit(scheduler, 'low', 'l1')
+            submitted.append('l1')
+
+        producer = eventlet.spawn(_producer)
+        for i in xrange(5):
+            eventlet.sleep(0)
+        # One running and two waiting, so the fourth message blocks
+        self.assertEqual(submitted, ['d1', 'd2', 'd3'])
+        self.assertEqual(scheduler.get_stats()['default']['waiting'], 2)
+
+        self._release('d1')
+        self.assertEqual(submitted, ['d1', 'd2', 'd3', 'd4', 'l1'])
+        self._finish()
+        producer.wait()
+        self.assertEqual(self.started, ['d1', 'd2', 'd3', 'd4', 'l1'])
+
+    def test_low_lane_supersedes_same_key(self):
+        self.flags(rpc_low_priority_thread_pool_size=1)
+        scheduler = amqp.DispatchScheduler(FLAGS)
+        dropped = []
+        self._submit(scheduler, 'low', 'busy')
+        self._submit(scheduler, 'low', 'a1', key='a',
+                     dropped=lambda reason: dropped.append('a1'))
+        self._submit(scheduler, 'low', 'b1', key='b')
+        self._submit(scheduler, 'low', 'a2', key='a')
+        eventlet.sleep(0)
+
+        self.assertEqual(dropped, ['a1'])
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['low']['waiting'], 2)
+        self.assertEqual(stats['low']['superseded'], 1)
+        self.assertEqual(stats['low']['dropped'], 0)
+
+        # The newer message keeps the place of the one it superseded
+        self._finish()
+        self.assertEqual(self.started, ['busy', 'a2', 'b1'])
+        self.assertEqual(scheduler.keyed, {})
+        self.assertEqual([m['outcome'] for m in self.metrics],
+                         ['dispatched', 'superseded', 'dispatched',
+                          'dispatched'])
+
+    def test_low_lane_drops_oldest_when_full(self):
+        self.flags(rpc_low_priority_thread_pool_size=1,
+                   rpc_low_priority_queue_size=2)
+        scheduler = amqp.DispatchScheduler(FLAGS)
+        dropped = []
+        self._submit(scheduler, 'low', 'busy')
+        for name in ('l1', 'l2', 'l3'):
+            self._submit(scheduler, 'low', name, key=name,
+                         dropped=lambda reason, name=name:
+                                 dropped.append(name))
+        eventlet.sleep(0)
+
+        self.assertEqual(dropped, ['l1'])
+        self.assertEqual(scheduler.get_stats()['low']['dropped'], 1)
+        self.assertFalse('l1' in scheduler.keyed)
+        self._finish()
+        self.assertEqual(self.started, ['busy', 'l2', 'l3'])
+
+
+class FakeProxy(object):
+    def __init__(self, release):
+        self.release = release
+        self.called = []
+
+    def dispatch(self, ctxt, version, method, **kwargs):
+        self.called.append((method, kwargs))
+        self.release.wait()
+
+
+class ProxyCallbackTestCase(test.TestCase):
+    """Test case for the dispatch of messages by ProxyCallback."""
+
+    def setUp(self):
+        super(ProxyCallbackTestCase, self).setUp()
+        self.flags(rpc_low_priority_methods=['update'],
+                   rpc_low_priority_thread_pool_size=1)
+        self.release = event.Event()
+        self.proxy = FakeProxy(self.release)
+        self.callback = amqp.ProxyCallback(FLAGS, self.proxy, None)
+        self.replies = []
+
+        def fake_reply(ctxt, reply=None, failure=None, ending=False,
+                       connection_pool=None):
+            if ctxt.msg_id:
+                self.replies.append((ctxt.msg_id, reply, failure, ending))
+
+        self.stubs.Set(amqp.RpcContext, 'reply', fake_reply)
+
+    def _update(self, host, msg_id=None, service_name='compute'):
+        msg = {'method': 'update',
+               'args': {'service_name': service_name, 'host': host}}
+        if msg_id:
+            msg['_msg_id'] = msg_id
+        self.callback(msg)
+
+    def test_superseded_call_gets_error_reply(self):
+        self._update('busy')
+        self._update('host1', msg_id='call1')
+        self._update('host1', service_name='volume')
+        self._update('host1', msg_id='call2')
+        eventlet.sleep(0)
+
+        self.assertEqual(len(self.replies), 1)
+        msg_id, reply, failure, ending = self.replies[0]
+        self.assertEqual(msg_id, 'call1')
+        self.assertTrue(isinstance(failure[1], rpc_common.MessageDropped))
+
+        self.release.send()
+        for i in xrange(10):
+            eventlet.sleep(0)
+        self.assertEqual([kwargs for method, kwargs in self.proxy.called],
+                         [{'service_name': 'compute', 'host': 'busy'},
+                          {'service_name': 'compute', 'host': 'host1'},
+                          {'service_name': 'volume', 'host': 'host1'}])
+        self.assertEqual([r[0] for r in self.replies],
+                         ['call1', 'call2', 'call2'])
+
+    def test_superseded_cast_gets_no_reply(self):
+        self._update('busy')
+        self._update('host1')
+        self._update('host1')
+        eventlet.sleep(0)
+        self.assertEqual(self.replies, [])
@@ -0,0 +1,100 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the message encoding of rpc.common.
+"""
+
+import datetime
+
+from nova import flags
+from nova.openstack.common.rpc import common as rpc_common
+from nova import test
+
+
+FLAGS = flags.FLAGS
+
+
+def _have_msgpack():
+    return rpc_common.msgpack is not None
+
+
+class SerializeMsgTestCase(test.TestCase):
+    """Test case for serialize_msg() and deserialize_msg()."""
+
+    def setUp(self):
+        super(SerializeMsgTestCase, self).setUp()
+        self.msg = {'method': 'echo',
+                    'args': {'name': u'caf\xe9',
+                             'when': datetime.datetime(2012, 1, 2),
+                             'values': (1, 2.5, None, True),
+                             'nested': {'a': [{'b': 'c'}]}}}
+        self.expected = {u'method': u'echo',
+                         u'args': {u'name': u'caf\xe9',
+                                   u'when': u'2012-01-02 00:00:00',
+                                   u'values': [1, 2.5, None, True],
+                                   u'nested': {u'a': [{u'b': u'c'}]}}}
+
+    def _round_trip(self):
+        content_type, content_encoding, data = rpc_common.serialize_msg(
+                FLAGS, self.msg)
+        return content_type, content_encoding, rpc_common.deserialize_msg(
+                content_type, data)
+
+    def test_json(self):
+        self.flags(rpc_serializer='json')
+        content_type, content_encoding, msg = self._round_trip()
+        self.assertEqual(content_type, rpc_common.JSON_CONTENT_TYPE)
+        self.assertEqual(content_encoding, 'utf-8')
+        self.assertEqual(msg, self.expected)
+
+    @test.skip_unless(_have_msgpack(), "Test requires msgpack")
+    def test_msgpack(self):
+        self.flags(rpc_serializer='msgpack')
+        content_type, content_encoding, msg = self._round_trip()
+        self.assertEqual(content_type, rpc_common.MSGPACK_CONTENT_TYPE)
+        self.assertEqual(content_encoding, 'binary')
+        self.assertEqual(msg, self.expected)
+
+    @test.skip_unless(_have_msgpack(), "Test requires msgpack")
+    def test_msgpack_same_as_json(self):
+        self.flags(rpc_serializer='json')
+        json_msg = self._round_trip()[2]
+        self.flags(rpc_serializer='msgpack')
+        self.assertEqual(self._round_trip()[2], json_msg)
+
+    def test_msgpack_missing_sends_json(self):
+        self.stubs.Set(rpc_common, 'msgpack', None)
+        self.flags(rpc_serializer='msgpack')
+        content_type, content_encoding, msg = self._round_trip()
+        self.assertEqual(content_type, rpc_common.JSON_CONTENT_TYPE)
+        self.assertEqual(msg, self.expected)
+
+    def test_msgpack_missing_fails_receiving_msgpack(self):
+        self.stubs.Set(rpc_common, 'msgpack', None)
+        self.assertRaises(rpc_common.RPCException,
+                          rpc_common.deserialize_msg,
+                          rpc_common.MSGPACK_CONTENT_TYPE, '\x80')
+
+    def test_unknown_serializer(self):
+        self.flags(rpc_serializer='pickle')
+        self.assertRaises(rpc_common.RPCException,
+                          rpc_common.serialize_msg, FLAGS, self.msg)
+
+    def test_unknown_content_type(self):
+        self.assertRaises(rpc_common.RPCException,
+                          rpc_common.deserialize_msg,
+                          'application/x-pickle', '')
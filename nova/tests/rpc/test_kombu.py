@@ -0,0 +1,265 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For rpc.impl_kombu, on the kombu memory transport.
+"""
+
+import eventlet
+
+from nova import context
+from nova import flags
+from nova.openstack.common.rpc import common as rpc_common
+from nova.openstack.common.rpc import dispatcher
+from nova.openstack.common.rpc import impl_kombu
+from nova import test
+
+
+FLAGS = flags.FLAGS
+
+
+class FakeProxy(object):
+    RPC_API_VERSION = '1.0'
+
+    def __init__(self):
+        self.recorded = []
+
+    def record(self, context, value):
+        self.recorded.append(value)
+
+    def echo(self, context, value, delay=0):
+        eventlet.sleep(delay)
+        return value
+
+    def multi(self, context, value):
+        for i in xrange(value):
+            yield i
+
+    def fail(self, context):
+        raise ValueError('boom')
+
+
+class KombuReplyProxyTestCase(test.TestCase):
+    """Test case for calls replied to on the single reply queue."""
+
+    def setUp(self):
+        super(KombuReplyProxyTestCase, self).setUp()
+        self.flags(fake_rabbit=True, amqp_rpc_single_reply_queue=True)
+        self.context = context.get_admin_context()
+        self.conn = impl_kombu.create_connection(FLAGS, new=True)
+        self.conn.create_consumer('test',
+                dispatcher.RpcDispatcher([FakeProxy()]))
+        self.conn.consume_in_thread()
+
+    def tearDown(self):
+        self.conn.close()
+        impl_kombu.cleanup()
+        super(KombuReplyProxyTestCase, self).tearDown()
+
+    def _call(self, method, timeout=None, topic='test', **kwargs):
+        return impl_kombu.call(FLAGS, self.context, topic,
+                               {'method': method, 'args': kwargs}, timeout)
+
+    def _get_reply_proxy(self):
+        return impl_kombu.Connection.pool.reply_proxy
+
+    def test_replies_demultiplexed_by_msg_id(self):
+        calls = [eventlet.spawn(self._call, 'echo', value=value,
+                                delay=value / 10.0)
+                 for value in (3, 1, 2)]
+        self.assertEqual([call.wait() for call in calls], [3, 1, 2])
+
+        reply_proxy = self._get_reply_proxy()
+        self.assertEqual(self._call('echo', value=4), 4)
+        # All the calls shared the one reply queue
+        self.assertTrue(self._get_reply_proxy() is reply_proxy)
+        self.assertEqual(reply_proxy._call_waiters, {})
+
+    def test_multicall(self):
+        result = impl_kombu.multicall(FLAGS, self.context, 'test',
+                                      {'method': 'multi',
+                                       'args': {'value': 3}})
+        self.assertEqual(list(result), [0, 1, 2])
+        self.assertEqual(self._get_reply_proxy()._call_waiters, {})
+
+    def test_remote_error(self):
+        self.assertRaises(rpc_common.RemoteError, self._call, 'fail')
+        self.assertEqual(self._get_reply_proxy()._call_waiters, {})
+
+    def test_timeout(self):
+        self.assertRaises(rpc_common.Timeout, self._call, 'echo',
+                          timeout=0.1, topic='nobody', value=1)
+        self.assertEqual(self._get_reply_proxy()._call_waiters, {})
+
+    def test_reply_after_timeout(self):
+        self.assertRaises(rpc_common.Timeout, self._call, 'echo',
+                          timeout=0.1, value=1, delay=0.3)
+        # The late reply finds no waiter and is dropped
+        eventlet.sleep(0.4)
+        self.assertEqual(self._call('echo', value=2), 2)
+        self.assertEqual(self._get_reply_proxy()._call_waiters, {})
+
+    def test_waiter_removed_when_send_fails(self):
+        self._call('echo', value=1)
+
+        def fake_topic_send(*args, **kwargs):
+            raise IOError('send failed')
+
+        self.stubs.Set(impl_kombu.Connection, 'topic_send', fake_topic_send)
+        self.assertRaises(IOError, self._call, 'echo', value=1)
+        self.assertEqual(self._get_reply_proxy()._call_waiters, {})
+
+
+class KombuPublishTestCase(test.TestCase):
+    """Test case for the publishers kept by a Connection."""
+
+    def setUp(self):
+        super(KombuPublishTestCase, self).setUp()
+        self.flags(fake_rabbit=True)
+        self.conn = impl_kombu.Connection(FLAGS)
+        self.published = []
+        self.tx_calls = []
+
+    def tearDown(self):
+        self.conn.close()
+        super(KombuPublishTestCase, self).tearDown()
+
+    def test_reset_keeps_publishers_without_consumers(self):
+        self.conn.topic_send('test', {'method': 'echo'})
+        channel = self.conn.channel
+        publishers = self.conn.publishers.values()
+        self.assertEqual(len(publishers), 1)
+
+        self.conn.reset()
+        self.conn.topic_send('other', {'method': 'echo'})
+        self.assertTrue(self.conn.channel is channel)
+        # The topic exchange publisher is shared by all the topics
+        self.assertEqual(self.conn.publishers.values(), publishers)
+
+    def test_reset_recycles_channel_with_consumers(self):
+        self.conn.topic_send('test', {'method': 'echo'})
+        channel = self.conn.channel
+        self.conn.declare_topic_consumer('test', lambda msg: None)
+
+        self.conn.reset()
+        self.assertFalse(self.conn.channel is channel)
+        self.assertEqual(self.conn.publishers, {})
+        self.assertEqual(self.conn.consumers, [])
+
+    def _stub_publish(self, fail_topic):
+        orig_publish = self.conn._publish
+        info = {'failed': False}
+
+        def fake_publish(cls, topic, *args):
+            if topic == fail_topic and not info['failed']:
+                info['failed'] = True
+                raise IOError('connection lost')
+            self.published.append(topic)
+            return orig_publish(cls, topic, *args)
+
+        self.stubs.Set(self.conn, '_publish', fake_publish)
+
+    def _sends(self, count):
+        return [(impl_kombu.TopicPublisher, 't%d' % i, {'value': i},
+                 None, None, {})
+                for i in xrange(count)]
+
+    def test_publish_batch_resumes_after_reconnect(self):
+        self._stub_publish('t2')
+        self.conn.publish_batch(self._sends(4))
+        self.assertEqual(self.published, ['t0', 't1', 't2', 't3'])
+
+    def test_publish_batch_transactional_replays_batch(self):
+        orig_open_channel = self.conn._open_channel
+
+        def fake_open_channel():
+            orig_open_channel()
+            self.conn.channel.tx_select = lambda: self.tx_calls.append(
+                    'select')
+            self.conn.channel.tx_commit = lambda: self.tx_calls.append(
+                    'commit')
+
+        self.stubs.Set(self.conn, '_open_channel', fake_open_channel)
+        self.conn.reconnect()
+        self._stub_publish('t2')
+
+        self.conn.publish_batch(self._sends(4), transactional=True)
+        self.assertEqual(self.published,
+                         ['t0', 't1', 't0', 't1', 't2', 't3'])
+        self.assertEqual(self.tx_calls, ['select', 'select', 'commit'])
+
+        # The channel stays in transaction mode for the next batch
+        self.conn.publish_batch(self._sends(1), transactional=True)
+        self.assertEqual(self.tx_calls,
+                         ['select', 'select', 'commit', 'commit'])
+
+
+class KombuCastBatcherTestCase(test.TestCase):
+    """Test case for casts published in batches by the CastBatcher."""
+
+    def setUp(self):
+        super(KombuCastBatcherTestCase, self).setUp()
+        self.flags(fake_rabbit=True, rabbit_cast_batch_window=0.05,
+                   rabbit_cast_batch_size=4)
+        self.context = context.get_admin_context()
+        self.proxy = FakeProxy()
+        self.conn = impl_kombu.create_connection(FLAGS, new=True)
+        self.conn.create_consumer('test',
+                dispatcher.RpcDispatcher([self.proxy]))
+        self.conn.consume_in_thread()
+
+        self.batches = []
+        orig_publish_batch = impl_kombu.Connection.publish_batch
+
+        def fake_publish_batch(conn, sends, transactional=False):
+            self.batches.append([send[2] for send in sends])
+            return orig_publish_batch(conn, sends, transactional)
+
+        self.stubs.Set(impl_kombu.Connection, 'publish_batch',
+                       fake_publish_batch)
+
+    def tearDown(self):
+        self.conn.close()
+        impl_kombu.cleanup()
+        super(KombuCastBatcherTestCase, self).tearDown()
+
+    def _cast(self, value):
+        impl_kombu.cast(FLAGS, self.context, 'test',
+                        {'method': 'record', 'args': {'value': value}})
+
+    def _wait_recorded(self, count):
+        for i in xrange(100):
+            if len(self.proxy.recorded) >= count:
+                break
+            eventlet.sleep(0.01)
+
+    def test_casts_in_order_in_batches_of_batch_size(self):
+        for value in xrange(10):
+            self._cast(value)
+        self._wait_recorded(10)
+
+        self.assertEqual(self.proxy.recorded, range(10))
+        self.assertEqual([len(batch) for batch in self.batches], [4, 4, 2])
+
+    def test_batch_window(self):
+        self._cast(0)
+        self._cast(1)
+        eventlet.sleep(0.2)
+        self._cast(2)
+        self._wait_recorded(3)
+
+        self.assertEqual(self.proxy.recorded, [0, 1, 2])
+        self.assertEqual([len(batch) for batch in self.batches], [2, 1])
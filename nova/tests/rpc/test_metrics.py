@@ -0,0 +1,212 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For rpc.metrics.
+"""
+
+from nova import context
+from nova import flags
+from nova.openstack.common import jsonutils
+from nova.openstack.common.rpc import common as rpc_common
+from nova.openstack.common.rpc import dispatcher
+from nova.openstack.common.rpc import impl_kombu
+from nova.openstack.common.rpc import metrics as rpc_metrics
+from nova import test
+from nova.tests.rpc import fake_metrics_driver
+
+
+FLAGS = flags.FLAGS
+
+
+class BaseMetricsTestCase(test.TestCase):
+    def setUp(self):
+        super(BaseMetricsTestCase, self).setUp()
+        self.flags(rpc_metrics_drivers=['nova.tests.rpc.fake_metrics_driver'])
+        self.stubs.Set(rpc_metrics, '_drivers', None)
+        self.stubs.Set(rpc_metrics, '_in_flight', {})
+        fake_metrics_driver.reset()
+        self.warnings = []
+        self.stubs.Set(rpc_metrics.LOG, 'warn',
+                       lambda msg, *args: self.warnings.append(msg))
+
+    def _recorded(self, kind=None):
+        return [metric for metric in fake_metrics_driver.RECORDED
+                if kind is None or metric['kind'] == kind]
+
+
+class TimerTestCase(BaseMetricsTestCase):
+    """Test case for the metrics of a Timer."""
+
+    def setUp(self):
+        super(TimerTestCase, self).setUp()
+        self.msg = {'method': 'echo', 'args': {'value': 1}}
+
+    def _timer(self, kind='call', topic='compute.host1', msg=None):
+        return rpc_metrics.Timer(FLAGS, kind, topic, msg or self.msg)
+
+    def test_in_flight(self):
+        timer1 = self._timer()
+        timer2 = self._timer()
+        other = self._timer(topic='compute.host2')
+        self.assertEqual(rpc_metrics.get_in_flight(),
+                         {('compute.host1', 'echo'): 2,
+                          ('compute.host2', 'echo'): 1})
+
+        timer1.stop()
+        other.stop()
+        self.assertEqual(rpc_metrics.get_in_flight(),
+                         {('compute.host1', 'echo'): 1})
+        # Stopping twice only counts once
+        timer1.stop()
+        timer2.stop()
+        self.assertEqual(rpc_metrics.get_in_flight(), {})
+        self.assertEqual([metric['in_flight'] for metric in self._recorded()],
+                         [0, 0, 1])
+
+    def test_metric(self):
+        self._timer().stop()
+        metric, = self._recorded()
+        self.assertEqual(metric['kind'], 'call')
+        self.assertEqual(metric['topic'], 'compute.host1')
+        self.assertEqual(metric['method'], 'echo')
+        self.assertEqual(metric['size'], len(jsonutils.dumps(self.msg)))
+        self.assertTrue(metric['duration'] >= 0)
+
+    def test_no_size_without_drivers(self):
+        self.flags(rpc_metrics_drivers=[])
+        self.stubs.Set(rpc_metrics, '_drivers', None)
+        timer = self._timer()
+        timer.stop()
+        self.assertEqual(timer.metric['size'], None)
+        self.assertEqual(self._recorded(), [])
+
+    def test_outcome(self):
+        self._timer().stop()
+        self._timer().stop(rpc_common.Timeout())
+        self._timer().stop(ValueError())
+        self.assertEqual([metric['outcome'] for metric in self._recorded()],
+                         ['ok', 'timeout', 'error'])
+
+    def test_context_manager(self):
+        with self._timer(kind='cast'):
+            pass
+        try:
+            with self._timer(kind='cast'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual([metric['outcome'] for metric in self._recorded()],
+                         ['ok', 'error'])
+        self.assertEqual(rpc_metrics.get_in_flight(), {})
+
+    def test_slow_call_threshold(self):
+        self.flags(rpc_slow_call_threshold=1.0)
+        fast = self._timer()
+        fast.stop()
+        self.assertEqual(self.warnings, [])
+
+        for kind in ('call', 'cast'):
+            slow = self._timer(kind=kind)
+            slow.started_at -= 2
+            slow.stop()
+        # Only calls are logged
+        self.assertEqual(len(self.warnings), 1)
+
+    def test_slow_call_threshold_disabled(self):
+        self.flags(rpc_slow_call_threshold=0.0)
+        slow = self._timer()
+        slow.started_at -= 100
+        slow.stop()
+        self.assertEqual(self.warnings, [])
+
+    def test_driver_error_logged(self):
+        def fake_record(metric):
+            raise ValueError()
+
+        exceptions = []
+        self.stubs.Set(fake_metrics_driver, 'record', fake_record)
+        self.stubs.Set(rpc_metrics.LOG, 'exception',
+                       lambda msg, *args: exceptions.append(msg))
+        self._timer().stop()
+        self.assertEqual(len(exceptions), 1)
+        self.assertEqual(rpc_metrics.get_in_flight(), {})
+
+
+class KombuMetricsTestCase(BaseMetricsTestCase):
+    """Test case for the metrics of the calls made over kombu."""
+
+    def setUp(self):
+        super(KombuMetricsTestCase, self).setUp()
+        self.flags(fake_rabbit=True)
+        self.context = context.get_admin_context()
+        self.conn = impl_kombu.create_connection(FLAGS, new=True)
+        self.conn.create_consumer('test',
+                dispatcher.RpcDispatcher([FakeProxy()]))
+        self.conn.consume_in_thread()
+
+    def tearDown(self):
+        self.conn.close()
+        impl_kombu.cleanup()
+        super(KombuMetricsTestCase, self).tearDown()
+
+    def _multicall(self, value=3, topic='test', timeout=None):
+        return impl_kombu.multicall(FLAGS, self.context, topic,
+                                    {'method': 'multi',
+                                     'args': {'value': value}}, timeout)
+
+    def _test_abandoned_multicall(self):
+        result = iter(self._multicall())
+        self.assertEqual(result.next(), 0)
+        self.assertEqual(rpc_metrics.get_in_flight(), {('test', 'multi'): 1})
+
+        result.close()
+        self.assertEqual(rpc_metrics.get_in_flight(), {})
+        self.assertEqual([metric['outcome']
+                          for metric in self._recorded('call')], ['ok'])
+
+    def test_abandoned_multicall(self):
+        self._test_abandoned_multicall()
+
+    def test_abandoned_multicall_single_reply_queue(self):
+        self.flags(amqp_rpc_single_reply_queue=True)
+        self._test_abandoned_multicall()
+        reply_proxy = impl_kombu.Connection.pool.reply_proxy
+        self.assertEqual(reply_proxy._call_waiters, {})
+
+    def test_call_outcomes(self):
+        self.assertEqual(list(self._multicall()), [0, 1, 2])
+        self.assertRaises(rpc_common.Timeout, list,
+                          self._multicall(topic='nobody', timeout=0.1))
+        impl_kombu.cast(FLAGS, self.context, 'test',
+                        {'method': 'multi', 'args': {'value': 0}})
+
+        self.assertEqual([(metric['kind'], metric['topic'],
+                           metric['outcome'])
+                          for metric in self._recorded()
+                          if metric['kind'] != 'dispatch'],
+                         [('call', 'test', 'ok'),
+                          ('call', 'nobody', 'timeout'),
+                          ('cast', 'test', 'ok')])
+        self.assertEqual(rpc_metrics.get_in_flight(), {})
+
+
+class FakeProxy(object):
+    RPC_API_VERSION = '1.0'
+
+    def multi(self, context, value):
+        for i in xrange(value):
+            yield i
@@ -0,0 +1,65 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the message encoding of rpc.impl_zmq.
+"""
+
+from nova import flags
+from nova.openstack.common.rpc import common as rpc_common
+from nova import test
+
+try:
+    from nova.openstack.common.rpc import impl_zmq
+except ImportError:
+    impl_zmq = None
+
+
+FLAGS = flags.FLAGS
+
+
+class ZmqSerializeTestCase(test.TestCase):
+    """Test case for the content type prefix of zmq messages."""
+
+    def setUp(self):
+        super(ZmqSerializeTestCase, self).setUp()
+        if impl_zmq:
+            self.stubs.Set(impl_zmq, 'FLAGS', FLAGS)
+        self.msg = {'method': 'echo', 'args': {'value': [1, u'caf\xe9']}}
+
+    @test.skip_if(impl_zmq is None, "Test requires zmq")
+    def test_json_not_prefixed(self):
+        self.flags(rpc_serializer='json')
+        data = impl_zmq._serialize(self.msg)
+        self.assertTrue(data.startswith('{'))
+        self.assertEqual(impl_zmq._deserialize(data), self.msg)
+
+    @test.skip_if(impl_zmq is None or rpc_common.msgpack is None,
+                  "Test requires zmq and msgpack")
+    def test_msgpack_prefixed(self):
+        self.flags(rpc_serializer='msgpack')
+        data = impl_zmq._serialize(self.msg)
+        prefix = '\0%s\0' % rpc_common.MSGPACK_CONTENT_TYPE
+        self.assertTrue(data.startswith(prefix))
+        self.assertEqual(impl_zmq._deserialize(data), self.msg)
+
+    @test.skip_if(impl_zmq is None, "Test requires zmq")
+    def test_msgpack_missing_not_prefixed(self):
+        self.stubs.Set(rpc_common, 'msgpack', None)
+        self.flags(rpc_serializer='msgpack')
+        data = impl_zmq._serialize(self.msg)
+        self.assertFalse(data.startswith('\0'))
+        self.assertEqual(impl_zmq._deserialize(data), self.msg)
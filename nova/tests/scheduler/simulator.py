@@ -0,0 +1,556 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Scheduler simulator.
+
+A FakeFleet fills the database with a synthetic fleet of compute nodes
+and instances, and plays the part of the compute services: the casts
+the scheduler sends to the compute hosts are captured and applied to
+the database as if the hosts had carried them out.
+
+A SchedulerSimulation replays a random stream of run_instance, resize
+and live migration requests through a SchedulerManager, timing each
+request, and reports the throughput, the latency percentiles and how
+well the instances ended up packed on the hosts.
+
+See tools/scheduler_benchmark.py to run it against a large fleet.
+"""
+
+import random
+import time
+
+import stubout
+
+from nova.compute import power_state
+from nova.compute import vm_states
+from nova import db
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import session as db_session
+from nova import exception
+from nova import flags
+from nova.openstack.common import jsonutils
+from nova.openstack.common import rpc
+from nova.openstack.common import timeutils
+from nova.scheduler import manager
+from nova.scheduler import tracing
+from nova import utils
+
+
+FLAGS = flags.FLAGS
+
+SCHEDULER_DRIVERS = {
+    'filter': 'nova.scheduler.filter_scheduler.FilterScheduler',
+    'simple': 'nova.scheduler.simple.SimpleScheduler',
+    'chance': 'nova.scheduler.chance.ChanceScheduler',
+    }
+
+REQUEST_TYPES = ('run_instance', 'resize', 'live_migration')
+
+DEFAULT_REQUEST_MIX = {'run_instance': 0.8,
+                       'resize': 0.1,
+                       'live_migration': 0.1}
+
+# Project (and user) owning the instances of the fleet.
+PROJECT_ID = 'simulator'
+
+# Rows are inserted this many at a time when building the fleet.
+INSERT_BATCH_SIZE = 1000
+
+
+def _insert_rows(session, table, rows):
+    """Insert a list of dicts into a table, INSERT_BATCH_SIZE at a time.
+
+    There's no bulk create in the db api, and going through the models
+    one instance at a time takes minutes for the fleets we run.
+    """
+    for start in xrange(0, len(rows), INSERT_BATCH_SIZE):
+        session.execute(table.insert(),
+                        rows[start:start + INSERT_BATCH_SIZE])
+
+
+class FakeFleet(object):
+    """A synthetic fleet of compute hosts and their instances."""
+
+    def __init__(self, context, num_hosts, num_instances, instance_types,
+                 host_memory_mb=32768, host_vcpus=16, host_local_gb=1024,
+                 num_zones=1, seed=None):
+        self.context = context
+        self.num_hosts = num_hosts
+        self.num_instances = num_instances
+        self.instance_types = instance_types
+        self.host_memory_mb = host_memory_mb
+        self.host_vcpus = host_vcpus
+        self.host_local_gb = host_local_gb
+        self.zones = ['zone%d' % i for i in xrange(num_zones)]
+        self.random = random.Random(seed)
+        self.hosts = ['simhost%05d' % i for i in xrange(num_hosts)]
+        # { <instance uuid> : { 'id', 'host', 'instance_type_id' } }
+        self.instances = {}
+        # uuids of the instances that can be resized or migrated
+        self.active_uuids = []
+        # [(<host>, <method>, <args>), ...] casts not yet carried out
+        self.pending_casts = []
+        self.heartbeat_at = None
+        # (<first id>, <last id>) of the services of the fleet
+        self.service_ids = None
+        self.stubs = stubout.StubOutForTesting()
+
+    def _free_host(self, host_memory, instance_type):
+        """Return a random host with room for the instance type, or None
+        if none was found in a few tries.
+        """
+        for _x in xrange(10):
+            host = self.random.choice(self.hosts)
+            if (host_memory[host] + instance_type['memory_mb'] <=
+                    self.host_memory_mb):
+                return host
+        return None
+
+    def build(self):
+        """Create the services, compute nodes and instances in the db.
+
+        The instances are spread at random over the hosts, without
+        overcommitting their memory.
+        """
+        session = db_session.get_session()
+        now = timeutils.utcnow()
+        with session.begin():
+            service_id = (session.query(models.Service.id).
+                          order_by(models.Service.id.desc()).first())
+            service_id = service_id[0] if service_id else 0
+            instance_id = (session.query(models.Instance.id).
+                           order_by(models.Instance.id.desc()).first())
+            instance_id = instance_id[0] if instance_id else 0
+
+            host_memory = dict((host, 0) for host in self.hosts)
+            host_vcpus = dict((host, 0) for host in self.hosts)
+            host_disk = dict((host, 0) for host in self.hosts)
+            host_vms = dict((host, 0) for host in self.hosts)
+            instances = []
+            for i in xrange(self.num_instances):
+                instance_type = self.random.choice(self.instance_types)
+                host = self._free_host(host_memory, instance_type)
+                if host is None:
+                    continue
+                instance_id += 1
+                instance = self._instance_values(instance_type)
+                instance.update({'id': instance_id,
+                                 'host': host,
+                                 'launched_on': host,
+                                 'vm_state': vm_states.ACTIVE,
+                                 'power_state': power_state.RUNNING,
+                                 'created_at': now,
+                                 'launched_at': now,
+                                 'deleted': False})
+                instances.append(instance)
+                host_memory[host] += instance_type['memory_mb']
+                host_vcpus[host] += instance_type['vcpus']
+                host_disk[host] += (instance_type['root_gb'] +
+                                    instance_type['ephemeral_gb'])
+                host_vms[host] += 1
+                self._track_instance(instance)
+
+            services = []
+            compute_nodes = []
+            for i, host in enumerate(self.hosts):
+                services.append({'id': service_id + i + 1,
+                                 'host': host,
+                                 'binary': 'nova-compute',
+                                 'topic': FLAGS.compute_topic,
+                                 'report_count': 0,
+                                 'disabled': False,
+                                 'availability_zone':
+                                        self.zones[i % len(self.zones)],
+                                 'created_at': now,
+                                 'updated_at': now,
+                                 'deleted': False})
+                compute_nodes.append({
+                        'service_id': service_id + i + 1,
+                        'vcpus': self.host_vcpus,
+                        'memory_mb': self.host_memory_mb,
+                        'local_gb': self.host_local_gb,
+                        'vcpus_used': host_vcpus[host],
+                        'memory_mb_used': host_memory[host],
+                        'local_gb_used': host_disk[host],
+                        'free_ram_mb': self.host_memory_mb - host_memory[host],
+                        'free_disk_gb': self.host_local_gb - host_disk[host],
+                        'disk_available_least': (self.host_local_gb -
+                                                 host_disk[host]),
+                        'current_workload': 0,
+                        'running_vms': host_vms[host],
+                        'hypervisor_type': 'QEMU',
+                        'hypervisor_version': 1000,
+                        'hypervisor_hostname': host,
+                        'cpu_info': '',
+                        'created_at': now,
+                        'deleted': False})
+
+            self.service_ids = (service_id + 1, service_id + len(services))
+            _insert_rows(session, models.Service.__table__, services)
+            _insert_rows(session, models.ComputeNode.__table__,
+                         compute_nodes)
+            _insert_rows(session, models.Instance.__table__, instances)
+        self.heartbeat_at = time.time()
+
+    def _services(self, session):
+        return session.query(models.Service).\
+                filter(models.Service.id.between(*self.service_ids))
+
+    def destroy(self):
+        """Remove the fleet from the db."""
+        session = db_session.get_session()
+        with session.begin():
+            instance_uuids = session.query(models.Instance.uuid).\
+                    filter_by(project_id=PROJECT_ID)
+            session.query(models.InstanceInfoCache).\
+                    filter(models.InstanceInfoCache.instance_id.in_(
+                        instance_uuids.subquery())).\
+                    delete(synchronize_session=False)
+            session.query(models.Instance).\
+                    filter_by(project_id=PROJECT_ID).\
+                    delete(synchronize_session=False)
+            session.query(models.ComputeNode).\
+                    filter(models.ComputeNode.service_id.between(
+                        *self.service_ids)).\
+                    delete(synchronize_session=False)
+            self._services(session).delete(synchronize_session=False)
+        self.instances = {}
+        self.active_uuids = []
+
+    def heartbeat(self):
+        """Keep the compute services up, as their report_state() would."""
+        if (self.heartbeat_at is not None and
+                time.time() - self.heartbeat_at < FLAGS.service_down_time / 2):
+            return
+        session = db_session.get_session()
+        with session.begin():
+            self._services(session).update(
+                    {'updated_at': timeutils.utcnow()},
+                    synchronize_session=False)
+        self.heartbeat_at = time.time()
+
+    def _instance_values(self, instance_type, zone=None):
+        return {'uuid': str(utils.gen_uuid()),
+                'project_id': PROJECT_ID,
+                'user_id': PROJECT_ID,
+                'image_ref': 'simulator',
+                'launch_index': 0,
+                'instance_type_id': instance_type['id'],
+                'memory_mb': instance_type['memory_mb'],
+                'vcpus': instance_type['vcpus'],
+                'root_gb': instance_type['root_gb'],
+                'ephemeral_gb': instance_type['ephemeral_gb'],
+                'availability_zone': zone}
+
+    def _track_instance(self, instance):
+        self.instances[instance['uuid']] = {
+                'id': instance['id'],
+                'host': instance['host'],
+                'instance_type_id': instance['instance_type_id']}
+        self.active_uuids.append(instance['uuid'])
+
+    def create_instance(self, instance_type, zone=None):
+        """Create the db entry of a new instance, the way the compute api
+        does before asking the scheduler to run it.
+        """
+        values = self._instance_values(instance_type, zone)
+        values.update({'vm_state': vm_states.BUILDING,
+                       'power_state': power_state.NOSTATE})
+        instance = db.instance_create(self.context, values)
+        values['id'] = instance['id']
+        return values
+
+    def random_instance(self):
+        """Return the uuid of a random instance that's running."""
+        if not self.active_uuids:
+            return None
+        return self.random.choice(self.active_uuids)
+
+    def random_host(self):
+        return self.random.choice(self.hosts)
+
+    def random_zone(self):
+        if len(self.zones) < 2:
+            return None
+        return self.random.choice(self.zones)
+
+    def instance_failed(self, instance_uuid):
+        """Forget an instance the scheduler put in the ERROR state."""
+        if instance_uuid in self.instances:
+            del self.instances[instance_uuid]
+            self.active_uuids.remove(instance_uuid)
+
+    def start(self):
+        """Capture the messages sent to the compute hosts."""
+        self.stubs.Set(rpc, 'cast', self._cast)
+        self.stubs.Set(rpc, 'call', self._call)
+
+    def stop(self):
+        self.stubs.UnsetAll()
+        self.pending_casts = []
+
+    def _cast(self, context, topic, msg):
+        prefix = '%s.' % FLAGS.compute_topic
+        if topic.startswith(prefix):
+            self.pending_casts.append((topic[len(prefix):], msg['method'],
+                                       msg.get('args', {})))
+
+    def _call(self, context, topic, msg, timeout=None):
+        # Every host has the same cpu and shares its instances directory
+        # with every other host.
+        if msg['method'] == 'create_shared_storage_test_file':
+            return 'simulator'
+        if msg['method'] == 'check_shared_storage_test_file':
+            return True
+        return None
+
+    def apply_casts(self):
+        """Carry out the casts sent to the compute hosts so far.
+
+        Returns the number of instances that were placed or moved.
+        """
+        casts, self.pending_casts = self.pending_casts, []
+        placed = 0
+        for host, method, args in casts:
+            apply_fn = getattr(self, '_apply_%s' % method, None)
+            if apply_fn is not None:
+                apply_fn(host, **args)
+                placed += 1
+        return placed
+
+    def _move_instance(self, instance_uuid, host, values=None):
+        if values is None:
+            values = {}
+        values.update({'host': host,
+                       'vm_state': vm_states.ACTIVE,
+                       'task_state': None})
+        instance = db.instance_update(self.context, instance_uuid, values)
+        if instance_uuid in self.instances:
+            self.instances[instance_uuid]['host'] = host
+        return instance
+
+    def _apply_run_instance(self, host, instance_uuid, **kwargs):
+        instance = self._move_instance(instance_uuid, host,
+                                       {'power_state': power_state.RUNNING,
+                                        'launched_on': host,
+                                        'launched_at': timeutils.utcnow()})
+        self._track_instance(instance)
+
+    def _apply_prep_resize(self, host, instance_uuid, instance_type_id,
+                           **kwargs):
+        instance_type = db.instance_type_get(self.context, instance_type_id)
+        self._move_instance(instance_uuid, host,
+                {'instance_type_id': instance_type_id,
+                 'memory_mb': instance_type['memory_mb'],
+                 'vcpus': instance_type['vcpus'],
+                 'root_gb': instance_type['root_gb'],
+                 'ephemeral_gb': instance_type['ephemeral_gb']})
+        self.instances[instance_uuid]['instance_type_id'] = instance_type_id
+
+    def _apply_live_migration(self, host, instance_id, dest, **kwargs):
+        instance = db.instance_get(self.context, instance_id)
+        self._move_instance(instance['uuid'], dest)
+
+    def placement_stats(self, largest_memory_mb):
+        """Return how well the instances are packed on the hosts.
+
+        packing_density is the share of the memory in use on the hosts
+        that run at least one instance, fragmentation the share of the
+        free memory that can't fit an instance of largest_memory_mb.
+        """
+        used = dict((host, 0) for host in self.hosts)
+        for instance in db.instance_get_all(self.context):
+            if instance['host'] in used:
+                used[instance['host']] += instance['memory_mb']
+
+        used_hosts = [host for host in self.hosts if used[host]]
+        total_used = sum(used.itervalues())
+        total_free = 0
+        usable_free = 0
+        for host in self.hosts:
+            free = max(self.host_memory_mb - used[host], 0)
+            total_free += free
+            usable_free += free - free % largest_memory_mb
+
+        packing_density = None
+        if used_hosts:
+            packing_density = (float(total_used) /
+                               (len(used_hosts) * self.host_memory_mb))
+        fragmentation = None
+        if total_free:
+            fragmentation = 1 - float(usable_free) / total_free
+        return {'hosts': len(self.hosts),
+                'hosts_used': len(used_hosts),
+                'instances': len(self.instances),
+                'memory_used': (float(total_used) /
+                                (len(self.hosts) * self.host_memory_mb)),
+                'packing_density': packing_density,
+                'fragmentation': fragmentation}
+
+
+class SchedulerSimulation(object):
+    """Replays a stream of requests through a scheduler driver."""
+
+    def __init__(self, context, fleet, scheduler_driver, request_mix=None,
+                 seed=None):
+        self.context = context
+        self.fleet = fleet
+        self.scheduler_driver = scheduler_driver
+        self.scheduler = manager.SchedulerManager(
+                scheduler_driver=scheduler_driver)
+        if request_mix is None:
+            request_mix = DEFAULT_REQUEST_MIX
+        self.request_mix = request_mix
+        self.random = random.Random(seed)
+        self.latencies = {}
+        self.requests = dict((request_type, 0)
+                             for request_type in REQUEST_TYPES)
+        self.failures = dict((request_type, 0)
+                             for request_type in REQUEST_TYPES)
+        self.elapsed = 0.0
+
+    def _random_request_type(self):
+        total = sum(self.request_mix.itervalues())
+        point = self.random.random() * total
+        for request_type in REQUEST_TYPES:
+            point -= self.request_mix.get(request_type, 0)
+            if point < 0:
+                return request_type
+        return REQUEST_TYPES[0]
+
+    def _random_instance_type(self, exclude_id=None):
+        instance_types = [instance_type
+                          for instance_type in self.fleet.instance_types
+                          if instance_type['id'] != exclude_id]
+        return self.random.choice(instance_types)
+
+    def _run_instance(self):
+        instance_type = self._random_instance_type()
+        instance_properties = self.fleet.create_instance(instance_type,
+                self.fleet.random_zone())
+        request_spec = {'image': {},
+                        'instance_properties': instance_properties,
+                        'instance_type': instance_type,
+                        'num_instances': 1,
+                        'block_device_mapping': [],
+                        'security_group': ['default']}
+
+        def _request():
+            self.scheduler.run_instance(self.context, FLAGS.compute_topic,
+                    request_spec=request_spec, admin_password=None,
+                    injected_files=[], requested_networks=None,
+                    is_first_time=True, filter_properties={},
+                    reservations=None)
+        return _request
+
+    def _resize(self):
+        instance_uuid = self.fleet.random_instance()
+        if instance_uuid is None:
+            return None
+        instance = db.instance_get_by_uuid(self.context, instance_uuid)
+        instance_type = self._random_instance_type(
+                exclude_id=instance['instance_type_id'])
+        request_spec = jsonutils.to_primitive({
+                'instance_type': instance_type,
+                'num_instances': 1,
+                'instance_properties': instance})
+
+        def _request():
+            self.scheduler.prep_resize(self.context, FLAGS.compute_topic,
+                    instance_uuid=instance_uuid,
+                    instance_type_id=instance_type['id'], image={},
+                    update_db=False, request_spec=request_spec,
+                    filter_properties={'ignore_hosts': [instance['host']]})
+        return _request
+
+    def _live_migration(self):
+        instance_uuid = self.fleet.random_instance()
+        if instance_uuid is None:
+            return None
+        instance = self.fleet.instances[instance_uuid]
+        dest = self.fleet.random_host()
+        while dest == instance['host'] and len(self.fleet.hosts) > 1:
+            dest = self.fleet.random_host()
+
+        def _request():
+            try:
+                self.scheduler.live_migration(self.context,
+                        FLAGS.compute_topic, instance_id=instance['id'],
+                        dest=dest, block_migration=False,
+                        disk_over_commit=False)
+            except exception.NovaException:
+                # The scheduler put the instance in the ERROR state.
+                self.fleet.instance_failed(instance_uuid)
+                raise
+        return _request
+
+    def run(self, num_requests):
+        """Replay num_requests random requests through the scheduler.
+
+        Only the time spent in the scheduler is measured, the compute
+        hosts carry out the casts in between requests.
+        """
+        self.fleet.start()
+        try:
+            for i in xrange(num_requests):
+                self.fleet.heartbeat()
+                request_type = self._random_request_type()
+                request = getattr(self, '_%s' % request_type)()
+                if request is None:
+                    continue
+                self.requests[request_type] += 1
+                start = time.time()
+                try:
+                    request()
+                except exception.NovaException:
+                    pass
+                elapsed = time.time() - start
+                self.elapsed += elapsed
+                self._latency(request_type).add(elapsed * 1000)
+                if not self.fleet.apply_casts():
+                    self.failures[request_type] += 1
+        finally:
+            self.fleet.stop()
+
+    def _latency(self, request_type):
+        histogram = self.latencies.get(request_type)
+        if histogram is None:
+            histogram = tracing.LatencyHistogram(None)
+            self.latencies[request_type] = histogram
+        return histogram
+
+    def report(self):
+        """Return the results of the simulation as a dict."""
+        requests = sum(self.requests.itervalues())
+        throughput = None
+        if self.elapsed:
+            throughput = requests / self.elapsed
+        latencies = {}
+        for request_type, histogram in self.latencies.iteritems():
+            latency = histogram.to_dict()
+            del latency['buckets']
+            latencies[request_type] = latency
+        largest_memory_mb = max(instance_type['memory_mb']
+                                for instance_type in self.fleet.instance_types)
+        return {'scheduler_driver': self.scheduler_driver,
+                'requests': dict(self.requests),
+                'failures': dict(self.failures),
+                'elapsed': self.elapsed,
+                'throughput': throughput,
+                'latency': latencies,
+                'placement': self.fleet.placement_stats(largest_memory_mb)}
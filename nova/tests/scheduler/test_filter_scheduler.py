@@ -19,15 +19,18 @@ Tests For Distributed Scheduler.
 import mox
 
 from nova import context
+from nova import db
 from nova import exception
+from nova.scheduler import driver
 from nova.scheduler import filter_scheduler
 from nova.scheduler import host_manager
 from nova.scheduler import least_cost
+from nova.scheduler import tracing
 from nova.tests.scheduler import fakes
 from nova.tests.scheduler import test_scheduler
 
 
-def fake_filter_hosts(hosts, filter_properties):
+def fake_filter_hosts(hosts, filter_properties, trace=None):
     return list(hosts)
 
 
@@ -111,8 +114,8 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         self.mox.StubOutWithMock(self.driver, '_provision_resource')
 
         self.driver._schedule(context_fake, 'compute',
-                              request_spec, **fake_kwargs
-                              ).AndReturn(['host1', 'host2'])
+                              request_spec, trace=mox.IgnoreArg(),
+                              **fake_kwargs).AndReturn(['host1', 'host2'])
         # instance 1
         self.driver._provision_resource(
             ctxt, 'host1',
@@ -128,6 +131,72 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         self.driver.schedule_run_instance(context_fake, request_spec, None,
                                           **fake_kwargs)
 
+    def test_run_instance_bulk(self):
+        self.flags(scheduler_bulk_run_instance=True)
+        ctxt = context.RequestContext('user', 'project', is_admin=True)
+        fake_kwargs = {'fake_kwarg1': 'fake_value1'}
+        request_spec = {'num_instances': 2,
+                        'instance_properties': {'fake_opt1': 'meow'}}
+        weighted_hosts = [
+                least_cost.WeightedHost(1,
+                        host_state=host_manager.HostState('host1',
+                                                          'compute')),
+                least_cost.WeightedHost(2,
+                        host_state=host_manager.HostState('host2',
+                                                          'compute'))]
+        instance1 = {'id': 1, 'uuid': 'fake-uuid1'}
+        instance2 = {'id': 2, 'uuid': 'fake-uuid2'}
+
+        def _check_instances_values(values):
+            return ([(v['launch_index'], v['host']) for v in values] ==
+                    [(0, 'host1'), (1, 'host2')])
+
+        self.mox.StubOutWithMock(self.driver, '_schedule')
+        self.mox.StubOutWithMock(self.driver, '_provision_resource')
+        self.mox.StubOutWithMock(self.driver, 'create_instance_db_entries')
+        self.mox.StubOutWithMock(driver, 'cast_to_compute_host')
+
+        self.driver._schedule(mox.IgnoreArg(), 'compute', request_spec,
+                              trace=mox.IgnoreArg(),
+                              **fake_kwargs).AndReturn(weighted_hosts)
+        self.driver.create_instance_db_entries(mox.IgnoreArg(),
+                request_spec, None,
+                mox.Func(_check_instances_values)).AndReturn(
+                        [instance1, instance2])
+        driver.cast_to_compute_host(mox.IgnoreArg(), 'host1',
+                'run_instance', update_db=False, instance_uuid='fake-uuid1',
+                fake_kwarg1='fake_value1')
+        driver.cast_to_compute_host(mox.IgnoreArg(), 'host2',
+                'run_instance', update_db=False, instance_uuid='fake-uuid2',
+                fake_kwarg1='fake_value1')
+        self.mox.ReplayAll()
+
+        instances = self.driver.schedule_run_instance(ctxt, request_spec,
+                None, **fake_kwargs)
+        self.assertEqual([1, 2], [i['id'] for i in instances])
+
+    def test_run_instance_bulk_single_instance(self):
+        """Single instances go through _provision_resource()."""
+        self.flags(scheduler_bulk_run_instance=True)
+        ctxt = context.RequestContext('user', 'project', is_admin=True)
+        request_spec = {'num_instances': 1,
+                        'instance_properties': {'fake_opt1': 'meow'}}
+
+        self.mox.StubOutWithMock(self.driver, '_schedule')
+        self.mox.StubOutWithMock(self.driver, '_provision_resource')
+        self.mox.StubOutWithMock(self.driver, '_provision_resources')
+
+        self.driver._schedule(mox.IgnoreArg(), 'compute',
+                              request_spec,
+                              trace=mox.IgnoreArg()).AndReturn(['host1'])
+        self.driver._provision_resource(mox.IgnoreArg(), 'host1',
+                request_spec, None, {}).AndReturn({'id': 1})
+        self.mox.ReplayAll()
+
+        instances = self.driver.schedule_run_instance(ctxt, request_spec,
+                None)
+        self.assertEqual([{'id': 1}], instances)
+
     def test_schedule_happy_day(self):
         """Make sure there's nothing glaringly wrong with _schedule()
         by doing a happy day pass through."""
@@ -165,6 +234,83 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         for weighted_host in weighted_hosts:
             self.assertTrue(weighted_host.host_state is not None)
 
+    def test_schedule_traced(self):
+        sched = fakes.FakeFilterScheduler()
+        fake_context = context.RequestContext('user', 'project',
+                is_admin=True)
+
+        self.stubs.Set(sched.host_manager, 'filter_hosts',
+                fake_filter_hosts)
+        fakes.mox_host_manager_db_calls(self.mox, fake_context)
+
+        request_spec = {'num_instances': 2,
+                        'instance_type': {'memory_mb': 512, 'root_gb': 512,
+                                          'ephemeral_gb': 0,
+                                          'vcpus': 1},
+                        'instance_properties': {'project_id': 1,
+                                                'root_gb': 512,
+                                                'memory_mb': 512,
+                                                'ephemeral_gb': 0,
+                                                'vcpus': 1}}
+        self.mox.ReplayAll()
+        trace = tracing.SchedulerTrace('run_instance')
+        weighted_hosts = sched._schedule(fake_context, 'compute',
+                request_spec, trace=trace)
+        self.assertEquals(len(weighted_hosts), 2)
+        self.assertEqual([stage for stage, _elapsed in trace.stages],
+                         ['get_all_host_states',
+                          'filter_hosts', 'weighing',
+                          'filter_hosts', 'weighing'])
+
+    def _test_schedule_claims(self, conflicting_hosts):
+        self.flags(scheduler_optimistic_claims=True,
+                   scheduler_claim_retries=1, ram_allocation_ratio=1.0)
+        sched = fakes.FakeFilterScheduler()
+        fake_context = context.RequestContext('user', 'project',
+                is_admin=True)
+
+        self.stubs.Set(sched.host_manager, 'filter_hosts',
+                fake_filter_hosts)
+        fakes.mox_host_manager_db_calls(self.mox, fake_context)
+        self.mox.StubOutWithMock(db, 'compute_node_utilization_update')
+
+        def _claim(host):
+            return db.compute_node_utilization_update(mox.IgnoreArg(), host,
+                    free_ram_mb_delta=-512, free_disk_gb_delta=-1,
+                    work_delta=1, vm_delta=1, min_free_ram_mb=512)
+
+        # Hosts are picked from the one with the most free RAM down.
+        for host in conflicting_hosts:
+            _claim(host).AndRaise(
+                    exception.ComputeNodeClaimConflict(host=host))
+        if len(conflicting_hosts) < 2:
+            _claim('host%d' % (4 - len(conflicting_hosts))).AndReturn({})
+
+        request_spec = {'num_instances': 1,
+                        'instance_type': {'memory_mb': 512, 'root_gb': 1,
+                                          'ephemeral_gb': 0, 'vcpus': 1},
+                        'instance_properties': {'project_id': 1,
+                                                'root_gb': 1,
+                                                'memory_mb': 512,
+                                                'ephemeral_gb': 0,
+                                                'vcpus': 1}}
+        self.mox.ReplayAll()
+        return sched._schedule(fake_context, 'compute', request_spec)
+
+    def test_schedule_claim(self):
+        weighted_hosts = self._test_schedule_claims([])
+        self.assertEqual([w.host_state.host for w in weighted_hosts],
+                         ['host4'])
+
+    def test_schedule_claim_conflict(self):
+        weighted_hosts = self._test_schedule_claims(['host4'])
+        self.assertEqual([w.host_state.host for w in weighted_hosts],
+                         ['host3'])
+
+    def test_schedule_claim_conflict_retries_exhausted(self):
+        weighted_hosts = self._test_schedule_claims(['host4', 'host3'])
+        self.assertEqual(weighted_hosts, [])
+
     def test_get_cost_functions(self):
         self.flags(reserved_host_memory_mb=128)
         fixture = fakes.FakeFilterScheduler()
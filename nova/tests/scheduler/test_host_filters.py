@@ -16,19 +16,30 @@ Tests For Scheduler Host Filters.
 """
 
 import httplib
+
+import mox
 import stubout
+import webob.dec
+import webob.exc
 
 from nova import context
+from nova import db
 from nova import exception
 from nova import flags
 from nova.openstack.common import jsonutils
+from nova.openstack.common import timeutils
 from nova.scheduler import filters
+from nova.scheduler.filters import compute_filter
+from nova.scheduler.filters import trusted_filter
 from nova.scheduler.filters.trusted_filter import AttestationService
+from nova.scheduler import host_manager
 from nova import test
 from nova.tests.scheduler import fakes
 from nova import utils
+from nova import wsgi
 
 
+FLAGS = flags.FLAGS
 DATA = ''
 
 
@@ -300,6 +311,122 @@ class HostFiltersTestCase(test.TestCase):
                  'service': service})
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
 
+    def test_compute_filter_caches_extra_specs_by_timestamp(self):
+        self._stub_service_is_up(True)
+        filt_cls = self.class_map['ComputeFilter']()
+        extra_specs = {'opt1': 1, 'opt2': 2}
+        filter_properties = {'instance_type': {'memory_mb': 1024,
+                                               'extra_specs': extra_specs}}
+        capabilities = {'enabled': True, 'opt1': 1, 'opt2': 2,
+                        'timestamp': 1}
+        service = {'disabled': False}
+        host = fakes.FakeHostState('host1', 'compute',
+                {'capabilities': capabilities, 'service': service})
+        self.assertTrue(filt_cls.host_passes(host, filter_properties))
+
+        self.mox.StubOutWithMock(filt_cls, '_satisfies_extra_specs')
+        filt_cls._satisfies_extra_specs(mox.IgnoreArg(),
+                mox.IgnoreArg()).AndReturn(False)
+        self.mox.ReplayAll()
+
+        # Same capabilities timestamp, so the result is remembered
+        self.assertTrue(filt_cls.host_passes(host, filter_properties))
+        self.assertEqual(filt_cls.columns_pass(
+                host_manager.HostStateColumns([host]), filter_properties),
+                [True])
+        # New capabilities, so it is checked again
+        host.capabilities = dict(capabilities, opt2=3, timestamp=2)
+        self.assertFalse(filt_cls.host_passes(host, filter_properties))
+
+    def test_compute_filter_extra_specs_key_once_per_request(self):
+        self._stub_service_is_up(True)
+        filt_cls = self.class_map['ComputeFilter']()
+        filter_properties = {'instance_type': {'memory_mb': 1024,
+                                               'extra_specs': {'opt2': 2,
+                                                               'opt1': 1}}}
+        host = fakes.FakeHostState('host1', 'compute',
+                {'capabilities': {'enabled': True, 'opt1': 1, 'opt2': 2,
+                                  'timestamp': 1},
+                 'service': {'disabled': False}})
+        self.assertTrue(filt_cls.host_passes(host, filter_properties))
+        self.assertEqual(filter_properties['extra_specs_key'],
+                         (('opt1', 1), ('opt2', 2)))
+
+        # The key of the request is not computed again, so the remembered
+        # result is used
+        filter_properties['instance_type']['extra_specs']['opt1'] = 3
+        self.assertTrue(filt_cls.host_passes(host, filter_properties))
+        self.assertEqual(filt_cls.columns_pass(
+                host_manager.HostStateColumns([host]), filter_properties),
+                [True])
+
+    def test_compute_filter_extra_specs_cache_bounded(self):
+        self._stub_service_is_up(True)
+        self.stubs.Set(compute_filter, 'MAX_EXTRA_SPECS_PER_HOST', 2)
+        filt_cls = self.class_map['ComputeFilter']()
+        capabilities = {'enabled': True, 'opt1': 1, 'timestamp': 1}
+        host = fakes.FakeHostState('host1', 'compute',
+                {'capabilities': capabilities,
+                 'service': {'disabled': False}})
+
+        def _request(value):
+            return {'instance_type': {'memory_mb': 1024,
+                                      'extra_specs': {'opt1': value}}}
+
+        for value in (1, 2):
+            filt_cls.host_passes(host, _request(value))
+        self.assertEqual(len(filt_cls._extra_specs_cache['host1'][1]), 2)
+        # Full, so the results of the host are forgotten
+        filt_cls.host_passes(host, _request(3))
+        self.assertEqual(filt_cls._extra_specs_cache['host1'][1],
+                         {(('opt1', 3),): False})
+        # New capabilities, so the stale results are dropped
+        host.capabilities = dict(capabilities, timestamp=2)
+        self.assertTrue(filt_cls.host_passes(host, _request(1)))
+        self.assertEqual(filt_cls._extra_specs_cache,
+                         {'host1': (2, {(('opt1', 1),): True})})
+
+    def test_compute_filter_columns_pass(self):
+        self._stub_service_is_up(True)
+        filt_cls = self.class_map['ComputeFilter']()
+        extra_specs = {'opt1': 1}
+        filter_properties = {'instance_type': {'memory_mb': 1024,
+                                               'extra_specs': extra_specs}}
+        good = fakes.FakeHostState('host1', 'compute',
+                {'capabilities': {'enabled': True, 'opt1': 1},
+                 'service': {'disabled': False}})
+        disabled = fakes.FakeHostState('host2', 'compute',
+                {'capabilities': {'enabled': True, 'opt1': 1},
+                 'service': {'disabled': True}})
+        caps_disabled = fakes.FakeHostState('host3', 'compute',
+                {'capabilities': {'enabled': False, 'opt1': 1},
+                 'service': {'disabled': False}})
+        bad_specs = fakes.FakeHostState('host4', 'compute',
+                {'capabilities': {'enabled': True, 'opt1': 2},
+                 'service': {'disabled': False}})
+        volume = fakes.FakeHostState('host5', 'volume',
+                {'capabilities': {'enabled': False},
+                 'service': {'disabled': False}})
+        hosts = [good, disabled, caps_disabled, bad_specs, volume]
+        host_columns = host_manager.HostStateColumns(hosts)
+        result = filt_cls.columns_pass(host_columns, filter_properties)
+        self.assertEqual([bool(r) for r in result],
+                         [filt_cls.host_passes(h, filter_properties)
+                          for h in hosts])
+        self.assertEqual([bool(r) for r in result],
+                         [True, False, False, False, True])
+
+    def test_compute_filter_columns_pass_on_service_down(self):
+        self._stub_service_is_up(False)
+        filt_cls = self.class_map['ComputeFilter']()
+        filter_properties = {'instance_type': {'memory_mb': 1024}}
+        host = fakes.FakeHostState('host1', 'compute',
+                {'capabilities': {'enabled': True},
+                 'service': {'disabled': False}})
+        host_columns = host_manager.HostStateColumns([host])
+        result = filt_cls.columns_pass(host_columns, filter_properties)
+        self.assertFalse(result[0])
+
     def test_compute_filter_passes_on_volume(self):
         self._stub_service_is_up(True)
         filt_cls = self.class_map['ComputeFilter']()
@@ -335,6 +462,20 @@ class HostFiltersTestCase(test.TestCase):
                  'service': service})
         self.assertTrue(filt_cls.host_passes(host, filter_properties))
 
+    def test_compute_filter_candidate_hosts(self):
+        filt_cls = self.class_map['ComputeFilter']()
+        hosts = [fakes.FakeHostState('host%s' % i, 'compute',
+                {'capabilities': {'opt1': 1, 'opt2': i}})
+                 for i in xrange(1, 4)]
+        host_index = host_manager.HostStateIndex('compute', hosts)
+        filter_properties = {'instance_type': {'memory_mb': 1024,
+                'extra_specs': {'opt1': 1, 'opt2': 2}}}
+        self.assertEqual(filt_cls.candidate_hosts(host_index,
+                filter_properties), set(['host2']))
+        filter_properties = {'instance_type': {'memory_mb': 1024}}
+        self.assertEqual(filt_cls.candidate_hosts(host_index,
+                filter_properties), None)
+
     def test_compute_filter_fails_extra_specs(self):
         self._stub_service_is_up(True)
         filt_cls = self.class_map['ComputeFilter']()
@@ -695,6 +836,37 @@ class HostFiltersTestCase(test.TestCase):
         }
         self.assertTrue(filt_cls.host_passes(host, filter_properties))
 
+    def test_json_filter_query_compiled_once(self):
+        filt_cls = self.class_map['JsonFilter']()
+        filter_properties = {'scheduler_hints': {'query': self.json_query}}
+        host1 = fakes.FakeHostState('host1', 'compute',
+                {'free_ram_mb': 1024, 'free_disk_mb': 200 * 1024})
+        host2 = fakes.FakeHostState('host2', 'compute',
+                {'free_ram_mb': 1023, 'free_disk_mb': 200 * 1024})
+
+        self.mox.StubOutWithMock(jsonutils, 'loads')
+        jsonutils.loads(self.json_query).AndReturn(
+                ['and', ['>=', '$free_ram_mb', 1024],
+                        ['>=', '$free_disk_mb', 200 * 1024]])
+        self.mox.ReplayAll()
+
+        self.assertTrue(filt_cls.host_passes(host1, filter_properties))
+        self.assertFalse(filt_cls.host_passes(host2, filter_properties))
+        self.assertEqual(filt_cls.columns_pass(
+                host_manager.HostStateColumns([host1, host2]),
+                filter_properties), [True, False])
+
+    def test_json_filter_compiled_queries_bounded(self):
+        filt_cls = self.class_map['JsonFilter']()
+        filt_cls.max_cached_queries = 2
+        host = fakes.FakeHostState('host1', 'compute', {'free_ram_mb': 1})
+        for i in xrange(3):
+            query = jsonutils.dumps(['>=', '$free_ram_mb', i])
+            filter_properties = {'scheduler_hints': {'query': query}}
+            self.assertEqual(filt_cls.host_passes(host, filter_properties),
+                             i <= 1)
+        self.assertEqual(len(filt_cls._compiled_queries), 1)
+
     def test_trusted_filter_default_passes(self):
         self._stub_service_is_up(True)
         filt_cls = self.class_map['TrustedFilter']()
@@ -708,7 +880,8 @@ class HostFiltersTestCase(test.TestCase):
         self._stub_service_is_up(True)
         filt_cls = self.class_map['TrustedFilter']()
         extra_specs = {'trusted_host': 'trusted'}
-        filter_properties = {'instance_type': {'memory_mb': 1024,
+        filter_properties = {'context': self.context,
+                             'instance_type': {'memory_mb': 1024,
                                                'extra_specs': extra_specs}}
         host = fakes.FakeHostState('host1', 'compute', {})
         self.assertTrue(filt_cls.host_passes(host, filter_properties))
@@ -719,7 +892,8 @@ class HostFiltersTestCase(test.TestCase):
         self._stub_service_is_up(True)
         filt_cls = self.class_map['TrustedFilter']()
         extra_specs = {'trusted_host': 'trusted'}
-        filter_properties = {'instance_type': {'memory_mb': 1024,
+        filter_properties = {'context': self.context,
+                             'instance_type': {'memory_mb': 1024,
                                                'extra_specs': extra_specs}}
         host = fakes.FakeHostState('host1', 'compute', {})
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
@@ -730,7 +904,8 @@ class HostFiltersTestCase(test.TestCase):
         self._stub_service_is_up(True)
         filt_cls = self.class_map['TrustedFilter']()
         extra_specs = {'trusted_host': 'untrusted'}
-        filter_properties = {'instance_type': {'memory_mb': 1024,
+        filter_properties = {'context': self.context,
+                             'instance_type': {'memory_mb': 1024,
                                                'extra_specs': extra_specs}}
         host = fakes.FakeHostState('host1', 'compute', {})
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
@@ -741,11 +916,52 @@ class HostFiltersTestCase(test.TestCase):
         self._stub_service_is_up(True)
         filt_cls = self.class_map['TrustedFilter']()
         extra_specs = {'trusted_host': 'untrusted'}
-        filter_properties = {'instance_type': {'memory_mb': 1024,
+        filter_properties = {'context': self.context,
+                             'instance_type': {'memory_mb': 1024,
                                                'extra_specs': extra_specs}}
         host = fakes.FakeHostState('host1', 'compute', {})
         self.assertTrue(filt_cls.host_passes(host, filter_properties))
 
+    def test_trusted_filter_attests_hosts_once_per_request(self):
+        global DATA
+        DATA = ('{"hosts":[{"host_name":"host1","trust_lvl":"trusted"},'
+                '{"host_name":"host2","trust_lvl":"untrusted"}]}')
+        requests = []
+        real_request = AttestationService._request
+
+        def fake_request(self, cmd, subcmd, hosts):
+            requests.append(sorted(hosts))
+            return real_request(self, cmd, subcmd, hosts)
+
+        self.stubs.Set(AttestationService, '_request', fake_request)
+        filt_cls = self.class_map['TrustedFilter']()
+        extra_specs = {'trusted_host': 'trusted'}
+        filter_properties = {'context': self.context,
+                             'candidate_hosts': ['host1', 'host2'],
+                             'instance_type': {'memory_mb': 1024,
+                                               'extra_specs': extra_specs}}
+        hosts = [fakes.FakeHostState('host%s' % i, 'compute', {})
+                 for i in xrange(1, 4)]
+        self.assertEqual([filt_cls.host_passes(host, filter_properties)
+                          for host in hosts], [True, False, False])
+        # Only the candidate hosts were attested, then the host that
+        # wasn't one of them
+        self.assertEqual(requests, [['host1', 'host2'], ['host3']])
+
+    def test_trusted_filter_columns_pass(self):
+        global DATA
+        DATA = ('{"hosts":[{"host_name":"host1","trust_lvl":"trusted"},'
+                '{"host_name":"host2","trust_lvl":"untrusted"}]}')
+        filt_cls = self.class_map['TrustedFilter']()
+        extra_specs = {'trusted_host': 'trusted'}
+        filter_properties = {'instance_type': {'memory_mb': 1024,
+                                               'extra_specs': extra_specs}}
+        hosts = [fakes.FakeHostState('host%s' % i, 'compute', {})
+                 for i in xrange(1, 4)]
+        self.assertEqual(filt_cls.columns_pass(
+                host_manager.HostStateColumns(hosts), filter_properties),
+                [True, False, False])
+
     def test_core_filter_passes(self):
         filt_cls = self.class_map['CoreFilter']()
         filter_properties = {'instance_type': {'vcpus': 1}}
@@ -768,6 +984,46 @@ class HostFiltersTestCase(test.TestCase):
                 {'vcpus_total': 4, 'vcpus_used': 8})
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
 
+    def test_core_filter_columns_pass(self):
+        filt_cls = self.class_map['CoreFilter']()
+        filter_properties = {'instance_type': {'vcpus': 1}}
+        self.flags(cpu_allocation_ratio=2)
+        hosts = [fakes.FakeHostState('host1', 'compute',
+                        {'vcpus_total': 4, 'vcpus_used': 7}),
+                 fakes.FakeHostState('host2', 'compute',
+                        {'vcpus_total': 4, 'vcpus_used': 8}),
+                 fakes.FakeHostState('host3', 'compute', {}),
+                 fakes.FakeHostState('host4', 'volume',
+                        {'vcpus_total': 1, 'vcpus_used': 8})]
+        host_columns = host_manager.HostStateColumns(hosts)
+        self.assertEqual(filt_cls.columns_pass(host_columns,
+                                               filter_properties),
+                         [True, False, True, True])
+
+    def test_ram_filter_columns_pass(self):
+        filt_cls = self.class_map['RamFilter']()
+        self.flags(ram_allocation_ratio=1.0)
+        filter_properties = {'instance_type': {'memory_mb': 1024}}
+        hosts = [fakes.FakeHostState('host1', 'compute',
+                        {'free_ram_mb': 1023}),
+                 fakes.FakeHostState('host2', 'compute',
+                        {'free_ram_mb': 1024})]
+        host_columns = host_manager.HostStateColumns(hosts)
+        self.assertEqual(filt_cls.columns_pass(host_columns,
+                                               filter_properties),
+                         [False, True])
+
+    def test_base_filter_columns_pass(self):
+        filt_cls = self.class_map['AvailabilityZoneFilter']()
+        request = self._make_zone_request('nova')
+        hosts = [fakes.FakeHostState('host1', 'compute',
+                        {'service': {'availability_zone': 'nova'}}),
+                 fakes.FakeHostState('host2', 'compute',
+                        {'service': {'availability_zone': 'other'}})]
+        host_columns = host_manager.HostStateColumns(hosts)
+        self.assertEqual(filt_cls.columns_pass(host_columns, request),
+                         [True, False])
+
     @staticmethod
     def _make_zone_request(zone, is_admin=False):
         ctxt = context.RequestContext('fake', 'fake', is_admin=is_admin)
@@ -794,6 +1050,70 @@ class HostFiltersTestCase(test.TestCase):
         host = fakes.FakeHostState('host1', 'compute', {'service': service})
         self.assertFalse(filt_cls.host_passes(host, request))
 
+    def test_availability_zone_filter_candidate_hosts(self):
+        filt_cls = self.class_map['AvailabilityZoneFilter']()
+        hosts = [fakes.FakeHostState('host%s' % i, 'compute',
+                {'service': {'availability_zone': zone}})
+                 for i, zone in enumerate(['nova', 'other', 'nova'])]
+        host_index = host_manager.HostStateIndex('compute', hosts)
+        request = self._make_zone_request('nova')
+        self.assertEqual(filt_cls.candidate_hosts(host_index, request),
+                         set(['host0', 'host2']))
+        request = self._make_zone_request(None)
+        self.assertEqual(filt_cls.candidate_hosts(host_index, request), None)
+
+    def _stub_aggregate(self, metadata):
+        self.mox.StubOutWithMock(db, 'aggregate_get_by_host')
+        if metadata is None:
+            db.aggregate_get_by_host(mox.IgnoreArg(), 'host1').AndRaise(
+                    exception.AggregateHostNotFound(host='host1'))
+        else:
+            aggregate = self.mox.CreateMockAnything()
+            aggregate.metadetails = metadata
+            db.aggregate_get_by_host(mox.IgnoreArg(), 'host1').AndReturn(
+                    aggregate)
+        self.mox.ReplayAll()
+
+    def _do_test_aggregate_instance_extra_specs(self, metadata, passes):
+        filt_cls = self.class_map['AggregateInstanceExtraSpecsFilter']()
+        self._stub_aggregate(metadata)
+        filter_properties = {'context': self.context,
+                'instance_type': {'memory_mb': 1024,
+                                  'extra_specs': {'opt1': '1', 'opt2': '2'}}}
+        host = fakes.FakeHostState('host1', 'compute', {})
+        self.assertEqual(passes, filt_cls.host_passes(host,
+                                                      filter_properties))
+
+    def test_aggregate_instance_extra_specs_passes(self):
+        self._do_test_aggregate_instance_extra_specs(
+                {'opt1': '1', 'opt2': '2', 'opt3': '3'}, True)
+
+    def test_aggregate_instance_extra_specs_fails(self):
+        self._do_test_aggregate_instance_extra_specs(
+                {'opt1': '1', 'opt2': '3'}, False)
+
+    def test_aggregate_instance_extra_specs_no_aggregate(self):
+        self._do_test_aggregate_instance_extra_specs(None, False)
+
+    def test_aggregate_instance_extra_specs_no_extra_specs(self):
+        filt_cls = self.class_map['AggregateInstanceExtraSpecsFilter']()
+        host = fakes.FakeHostState('host1', 'compute', {})
+        filter_properties = {'context': self.context,
+                             'instance_type': {'memory_mb': 1024}}
+        self.assertTrue(filt_cls.host_passes(host, filter_properties))
+
+    def test_aggregate_instance_extra_specs_candidate_hosts(self):
+        filt_cls = self.class_map['AggregateInstanceExtraSpecsFilter']()
+        host_index = self.mox.CreateMock(host_manager.HostStateIndex)
+        host_index.hosts_with_aggregate_metadata(self.context,
+                {'opt1': '1'}).AndReturn(set(['host1']))
+        self.mox.ReplayAll()
+        filter_properties = {'context': self.context,
+                'instance_type': {'memory_mb': 1024,
+                                  'extra_specs': {'opt1': '1'}}}
+        self.assertEqual(filt_cls.candidate_hosts(host_index,
+                filter_properties), set(['host1']))
+
     def test_arch_filter_same(self):
         permitted_instances = ['x86_64']
         filt_cls = self.class_map['ArchFilter']()
@@ -847,3 +1167,115 @@ class HostFiltersTestCase(test.TestCase):
         host = fakes.FakeHostState('host1', 'compute',
             {'capabilities': capabilities, 'service': service})
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
+
+
+class AttestationCacheTestCase(test.TestCase):
+    """Test case for the TrustedFilter attestation cache, against a fake
+    attestation server.
+    """
+
+    def setUp(self):
+        super(AttestationCacheTestCase, self).setUp()
+        self.requests = []
+        self.trust_levels = {'host1': 'trusted', 'host2': 'untrusted'}
+        self.server_error = False
+
+        @webob.dec.wsgify
+        def fake_attestation_server(req):
+            hosts = jsonutils.loads(req.body)['hosts']
+            self.requests.append(sorted(hosts))
+            if self.server_error:
+                return webob.exc.HTTPInternalServerError()
+            states = [{'host_name': host, 'trust_lvl': self.trust_levels[host]}
+                      for host in hosts if host in self.trust_levels]
+            return jsonutils.dumps({'hosts': states})
+
+        self.server = wsgi.Server('fake_attestation', fake_attestation_server,
+                                  host='127.0.0.1')
+        self.server.start()
+        self._trusted_flags(server='127.0.0.1', port=str(self.server.port),
+                            attestation_cache_ttl=60)
+
+        def fake_connection(host, port, **kwargs):
+            return httplib.HTTPConnection(host, port)
+
+        self.stubs.Set(trusted_filter, 'HTTPSClientAuthConnection',
+                       fake_connection)
+        timeutils.set_time_override()
+        self.cache = trusted_filter.AttestationCache()
+
+    def tearDown(self):
+        timeutils.clear_time_override()
+        self.server.stop()
+        super(AttestationCacheTestCase, self).tearDown()
+
+    def _trusted_flags(self, **kw):
+        for k, v in kw.iteritems():
+            FLAGS.set_override(k, v, group='trusted_computing')
+
+    def test_get_trust_levels_bulk(self):
+        levels = self.cache.get_trust_levels(['host1', 'host2', 'host3'])
+        self.assertEqual(levels, {'host1': 'trusted', 'host2': 'untrusted',
+                                  'host3': ''})
+        self.assertEqual(self.requests, [['host1', 'host2', 'host3']])
+
+    def test_get_trust_level_cached(self):
+        self.assertEqual(self.cache.get_trust_level('host1'), 'trusted')
+        self.trust_levels['host1'] = 'untrusted'
+        timeutils.advance_time_seconds(59)
+        self.assertEqual(self.cache.get_trust_level('host1'), 'trusted')
+        self.assertEqual(self.requests, [['host1']])
+
+    def test_get_trust_level_expired(self):
+        self.cache.get_trust_levels(['host1', 'host2'])
+        self.trust_levels['host1'] = 'untrusted'
+        timeutils.advance_time_seconds(61)
+        self.assertEqual(self.cache.get_trust_level('host1'), 'untrusted')
+        # The other expired host is only attested when it's asked for
+        self.assertEqual(self.requests, [['host1', 'host2'], ['host1']])
+        self.assertEqual(self.cache.get_trust_level('host2'), 'untrusted')
+        self.assertEqual(self.requests, [['host1', 'host2'], ['host1'],
+                                         ['host2']])
+
+    def test_get_trust_levels_attests_stale_hosts(self):
+        self.cache.get_trust_level('host1')
+        timeutils.advance_time_seconds(30)
+        self.cache.get_trust_level('host2')
+        timeutils.advance_time_seconds(31)
+        levels = self.cache.get_trust_levels(['host1', 'host2', 'host3'])
+        self.assertEqual(levels, {'host1': 'trusted', 'host2': 'untrusted',
+                                  'host3': ''})
+        self.assertEqual(self.requests, [['host1'], ['host2'],
+                                         ['host1', 'host3']])
+
+    def test_get_trust_level_cache_disabled(self):
+        self._trusted_flags(attestation_cache_ttl=0)
+        self.cache.get_trust_level('host1')
+        self.cache.get_trust_level('host1')
+        self.assertEqual(self.requests, [['host1'], ['host1']])
+
+    def test_get_trust_level_cache_disabled_attests_requested_hosts(self):
+        self._trusted_flags(attestation_cache_ttl=0)
+        self.cache.get_trust_levels(['host1', 'host2'])
+        self.cache.get_trust_level('host1')
+        self.assertEqual(self.requests, [['host1', 'host2'], ['host1']])
+
+    def test_get_trust_level_expired_server_error(self):
+        self.assertEqual(self.cache.get_trust_level('host1'), 'trusted')
+        timeutils.advance_time_seconds(61)
+        self.server_error = True
+        self.assertEqual(self.cache.get_trust_level('host1'), '')
+
+    def test_refresh(self):
+        self.cache.get_trust_level('host1')
+        self.trust_levels['host1'] = 'untrusted'
+        self.cache.refresh()
+        self.assertEqual(self.cache.get_trust_level('host1'), 'untrusted')
+        self.assertEqual(self.requests, [['host1'], ['host1']])
+
+    def test_server_error_not_cached(self):
+        self.server_error = True
+        self.assertEqual(self.cache.get_trust_level('host1'), '')
+        self.assertEqual(self.cache.trust_levels, {})
+        self.server_error = False
+        self.assertEqual(self.cache.get_trust_level('host1'), 'trusted')
@@ -18,10 +18,14 @@ Tests For HostManager
 
 import datetime
 
+import mox
+
+from nova import context
 from nova import db
 from nova import exception
 from nova.openstack.common import timeutils
 from nova.scheduler import host_manager
+from nova.scheduler import tracing
 from nova import test
 from nova.tests.scheduler import fakes
 
@@ -43,6 +47,10 @@ class HostManagerTestCase(test.TestCase):
         super(HostManagerTestCase, self).setUp()
         self.host_manager = host_manager.HostManager()
 
+    def tearDown(self):
+        timeutils.clear_time_override()
+        super(HostManagerTestCase, self).tearDown()
+
     def test_choose_host_filters_not_found(self):
         self.flags(scheduler_default_filters='ComputeFilterClass3')
         self.host_manager.filter_classes = [ComputeFilterClass1,
@@ -61,6 +69,39 @@ class HostManagerTestCase(test.TestCase):
         self.assertEqual(filter_fns[0].__func__,
                 ComputeFilterClass2.host_passes.__func__)
 
+    def test_choose_host_filters_cached(self):
+        info = {'created': 0}
+
+        class CountingFilterClass(object):
+            def __init__(self):
+                info['created'] += 1
+
+            def host_passes(self, *args, **kwargs):
+                pass
+
+        self.host_manager.filter_classes = [ComputeFilterClass1,
+                CountingFilterClass]
+
+        filter_fns1 = self.host_manager._choose_host_filters(
+                ['CountingFilterClass', 'ComputeFilterClass1'])
+        filter_fns2 = self.host_manager._choose_host_filters(
+                ['CountingFilterClass', 'ComputeFilterClass1'])
+        filter_fns3 = self.host_manager._choose_host_filters(
+                'CountingFilterClass')
+        self.assertEqual(len(filter_fns1), 2)
+        self.assertEqual(filter_fns1, filter_fns2)
+        self.assertEqual(filter_fns3, filter_fns1[:1])
+        # The filter instance is shared by both lists of filters
+        self.assertEqual(filter_fns1[0].im_self, filter_fns3[0].im_self)
+        self.assertEqual(info['created'], 1)
+
+    def test_choose_host_filters_not_found_not_cached(self):
+        self.host_manager.filter_classes = [ComputeFilterClass1]
+        self.assertRaises(exception.SchedulerHostFilterNotFound,
+                self.host_manager._choose_host_filters,
+                ['ComputeFilterClass1', 'ComputeFilterClass3'])
+        self.assertEqual(self.host_manager.filter_fns_map, {})
+
     def test_filter_hosts(self):
         topic = 'fake_topic'
 
@@ -68,7 +109,7 @@ class HostManagerTestCase(test.TestCase):
         fake_host1 = host_manager.HostState('host1', topic)
         fake_host2 = host_manager.HostState('host2', topic)
         hosts = [fake_host1, fake_host2]
-        filter_properties = 'fake_properties'
+        filter_properties = {}
 
         self.mox.StubOutWithMock(self.host_manager,
                 '_choose_host_filters')
@@ -82,10 +123,159 @@ class HostManagerTestCase(test.TestCase):
                 True)
 
         self.mox.ReplayAll()
-        filtered_hosts = self.host_manager.filter_hosts(hosts,
+        filtered_hosts = self.host_manager.filter_hosts(iter(hosts),
                 filter_properties, filters=None)
         self.assertEqual(len(filtered_hosts), 1)
         self.assertEqual(filtered_hosts[0], fake_host2)
+        self.assertEqual(filter_properties['candidate_hosts'],
+                         ['host1', 'host2'])
+
+    def _test_filter_hosts_traced(self):
+        hosts = [fakes.FakeHostState('host%s' % i, 'compute',
+                                     {'free_ram_mb': i * 1024})
+                 for i in xrange(1, 5)]
+
+        class RamFilter(object):
+            def host_passes(self, host_state, filter_properties):
+                return host_state.free_ram_mb >= 2048
+
+        class NotHost3Filter(object):
+            def host_passes(self, host_state, filter_properties):
+                return host_state.host != 'host3'
+
+        self.mox.StubOutWithMock(self.host_manager,
+                '_choose_host_filters')
+        self.host_manager._choose_host_filters(None).AndReturn(
+                [RamFilter().host_passes, NotHost3Filter().host_passes])
+
+        self.mox.ReplayAll()
+        trace = tracing.SchedulerTrace('fake_method')
+        filtered_hosts = self.host_manager.filter_hosts(hosts,
+                {'ignore_hosts': ['host4']}, trace=trace)
+        self.assertEqual([h.host for h in filtered_hosts], ['host2'])
+        self.assertEqual([(name, before, after)
+                          for name, _elapsed, before, after in trace.filters],
+                         [('RamFilter', 3, 2), ('NotHost3Filter', 2, 1)])
+
+    def test_filter_hosts_traced(self):
+        self._test_filter_hosts_traced()
+
+    def test_filter_hosts_columnar_traced(self):
+        self.flags(scheduler_columnar_filtering=True)
+        self._test_filter_hosts_traced()
+
+    def test_filter_hosts_columnar(self):
+        self.flags(scheduler_columnar_filtering=True)
+        topic = 'compute'
+        hosts = [fakes.FakeHostState('host%s' % i, topic,
+                                     {'free_ram_mb': i * 1024})
+                 for i in xrange(1, 5)]
+
+        class ColumnsFilter(object):
+            def host_passes(self, host_state, filter_properties):
+                raise AssertionError('should not be called')
+
+            def columns_pass(self, host_columns, filter_properties):
+                return [free_ram_mb >= 2048
+                        for free_ram_mb in host_columns.free_ram_mb]
+
+        class PerHostFilter(object):
+            def host_passes(self, host_state, filter_properties):
+                return host_state.host != 'host3'
+
+        self.mox.StubOutWithMock(self.host_manager,
+                '_choose_host_filters')
+        self.host_manager._choose_host_filters(None).AndReturn(
+                [ColumnsFilter().host_passes, PerHostFilter().host_passes])
+        self.host_manager._choose_host_filters(None).AndReturn(
+                [ColumnsFilter().host_passes, PerHostFilter().host_passes])
+
+        self.mox.ReplayAll()
+        filtered_hosts = self.host_manager.filter_hosts(hosts, {})
+        self.assertEqual([h.host for h in filtered_hosts],
+                         ['host2', 'host4'])
+        filtered_hosts = self.host_manager.filter_hosts(hosts,
+                {'ignore_hosts': ['host2']})
+        self.assertEqual([h.host for h in filtered_hosts], ['host4'])
+
+    def test_filter_hosts_columnar_force_hosts(self):
+        self.flags(scheduler_columnar_filtering=True)
+        hosts = [host_manager.HostState('host%s' % i, 'compute')
+                 for i in xrange(1, 5)]
+        self.mox.StubOutWithMock(self.host_manager,
+                '_choose_host_filters')
+        self.host_manager._choose_host_filters(None).AndReturn(
+                [ComputeFilterClass1().host_passes])
+
+        self.mox.ReplayAll()
+        filtered_hosts = self.host_manager.filter_hosts(hosts,
+                {'force_hosts': ['host1', 'host3'],
+                 'ignore_hosts': ['host3']})
+        self.assertEqual([h.host for h in filtered_hosts], ['host1'])
+
+    def _test_filter_hosts_indexed(self, trace=None, as_iterator=False):
+        hosts = [fakes.FakeHostState('host%s' % i, 'compute',
+                {'service': {'availability_zone': 'zone%s' % (i % 2)}})
+                 for i in xrange(1, 5)]
+        self.host_manager.host_index = host_manager.HostStateIndex(
+                'compute', hosts[:3])
+        checked = []
+
+        class ZoneFilter(object):
+            def host_passes(self, host_state, filter_properties):
+                checked.append(host_state.host)
+                return host_state.host != 'host3'
+
+            def candidate_hosts(self, host_index, filter_properties):
+                return host_index.hosts_in_zone('zone1')
+
+        self.host_manager.filter_classes = [ZoneFilter]
+        if as_iterator:
+            hosts = iter(hosts)
+        filtered_hosts = self.host_manager.filter_hosts(hosts, {},
+                ['ZoneFilter'], trace=trace)
+        # host2 isn't a candidate, host4 isn't in the index
+        self.assertEqual(checked, ['host1', 'host3', 'host4'])
+        self.assertEqual([h.host for h in filtered_hosts],
+                         ['host1', 'host4'])
+
+    def test_filter_hosts_indexed(self):
+        self._test_filter_hosts_indexed()
+
+    def test_filter_hosts_indexed_columnar(self):
+        self.flags(scheduler_columnar_filtering=True)
+        self._test_filter_hosts_indexed()
+
+    def test_filter_hosts_indexed_traced(self):
+        trace = tracing.SchedulerTrace('run_instance')
+        self._test_filter_hosts_indexed(trace)
+        self.assertEqual(trace.filters[0][0], 'HostStateIndex')
+        self.assertEqual(trace.filters[0][2:], (4, 3))
+
+    def test_filter_hosts_indexed_iterator(self):
+        # FilterScheduler._schedule passes an iterator of the host states
+        trace = tracing.SchedulerTrace('run_instance')
+        self._test_filter_hosts_indexed(trace, as_iterator=True)
+        self.assertEqual(trace.filters[0][2:], (4, 3))
+
+    def test_filter_hosts_indexed_force_hosts(self):
+        hosts = [fakes.FakeHostState('host%s' % i, 'compute',
+                {'service': {'availability_zone': 'zone%s' % (i % 2)}})
+                 for i in xrange(1, 5)]
+        self.host_manager.host_index = host_manager.HostStateIndex(
+                'compute', hosts)
+
+        class ZoneFilter(object):
+            def host_passes(self, host_state, filter_properties):
+                return False
+
+            def candidate_hosts(self, host_index, filter_properties):
+                raise AssertionError('should not be called')
+
+        self.host_manager.filter_classes = [ZoneFilter]
+        filtered_hosts = self.host_manager.filter_hosts(hosts,
+                {'force_hosts': ['host2']}, ['ZoneFilter'])
+        self.assertEqual([h.host for h in filtered_hosts], ['host2'])
 
     def test_update_service_capabilities(self):
         service_states = self.host_manager.service_states
@@ -275,6 +465,225 @@ class HostManagerTestCase(test.TestCase):
         # 8191GB
         self.assertEqual(host_states['host4'].free_disk_mb, 8387584)
 
+    def _mox_host_states_db_calls(self, times=1):
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        self.mox.StubOutWithMock(db, 'instance_get_all')
+        for i in xrange(times):
+            db.compute_node_get_all(mox.IgnoreArg()).AndReturn(
+                    fakes.COMPUTE_NODES)
+            db.instance_get_all(mox.IgnoreArg()).AndReturn(fakes.INSTANCES)
+
+    def test_get_all_host_states_cached(self):
+        self.flags(scheduler_cache_host_states=True,
+                scheduler_host_states_resync_interval=30)
+        timeutils.set_time_override(datetime.datetime(2012, 6, 1))
+
+        # Only hits the db once
+        self._mox_host_states_db_calls()
+
+        self.mox.ReplayAll()
+        host_states = self.host_manager.get_all_host_states('fake_context',
+                'compute')
+        host_states['host4'].consume_from_instance(fakes.INSTANCES[0])
+        del host_states['host3']
+
+        timeutils.advance_time_seconds(10)
+        host_states = self.host_manager.get_all_host_states('fake_context',
+                'compute')
+        self.assertEqual(len(host_states), 4)
+        # The claim made above is still there
+        self.assertEqual(host_states['host4'].free_ram_mb, 7168)
+
+    def test_get_all_host_states_cache_resync(self):
+        self.flags(scheduler_cache_host_states=True,
+                scheduler_host_states_resync_interval=30)
+        timeutils.set_time_override(datetime.datetime(2012, 6, 1))
+
+        self._mox_host_states_db_calls(times=2)
+
+        self.mox.ReplayAll()
+        host_states = self.host_manager.get_all_host_states('fake_context',
+                'compute')
+        host_states['host4'].consume_from_instance(fakes.INSTANCES[0])
+
+        timeutils.advance_time_seconds(31)
+        host_states = self.host_manager.get_all_host_states('fake_context',
+                'compute')
+        self.assertEqual(host_states['host4'].free_ram_mb, 7680)
+
+    def test_get_all_host_states_not_cached(self):
+        self.flags(scheduler_cache_host_states=False)
+
+        self._mox_host_states_db_calls(times=2)
+
+        self.mox.ReplayAll()
+        host_states1 = self.host_manager.get_all_host_states('fake_context',
+                'compute')
+        host_states2 = self.host_manager.get_all_host_states('fake_context',
+                'compute')
+        self.assertNotEqual(host_states1['host1'], host_states2['host1'])
+        self.assertEqual(self.host_manager.host_state_map, {})
+        self.assertEqual(self.host_manager.host_index, None)
+
+    def test_get_all_host_states_indexed(self):
+        self.flags(scheduler_use_host_indexes=True)
+
+        self._mox_host_states_db_calls()
+
+        self.mox.ReplayAll()
+        host_states = self.host_manager.get_all_host_states('fake_context',
+                'compute')
+        host_index = self.host_manager.host_index
+        self.assertEqual(host_index.all_hosts, set(host_states))
+
+    def test_update_service_capabilities_reindexes_host(self):
+        self.flags(scheduler_cache_host_states=True,
+                   scheduler_use_host_indexes=True)
+
+        self._mox_host_states_db_calls()
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states('fake_context', 'compute')
+        host_index = self.host_manager.host_index
+        self.host_manager.update_service_capabilities('compute', 'host1',
+                dict(gpus='1'))
+        self.assertEqual(host_index.hosts_with_capabilities({'gpus': '1'}),
+                         set(['host1']))
+        self.host_manager.update_service_capabilities('compute', 'host1',
+                dict(gpus='2'))
+        self.assertEqual(host_index.hosts_with_capabilities({'gpus': '1'}),
+                         set())
+        self.assertEqual(self.host_manager.host_index, host_index)
+
+    def test_update_service_capabilities_cached_host_state(self):
+        self.flags(scheduler_cache_host_states=True)
+
+        self._mox_host_states_db_calls()
+
+        self.mox.ReplayAll()
+        host_states = self.host_manager.get_all_host_states('fake_context',
+                'compute')
+        self.assertEqual(host_states['host1'].capabilities, {})
+
+        self.host_manager.update_service_capabilities('compute', 'host1',
+                dict(free_memory=1234))
+        self.assertEqual(host_states['host1'].capabilities['free_memory'],
+                1234)
+        self.assertNotEqual(self.host_manager.host_states_synced_at, None)
+
+    def test_update_service_capabilities_new_host_resyncs(self):
+        self.flags(scheduler_cache_host_states=True)
+
+        self._mox_host_states_db_calls()
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states('fake_context', 'compute')
+        self.host_manager.update_service_capabilities('compute', 'host6',
+                dict(free_memory=1234))
+        self.assertEqual(self.host_manager.host_states_synced_at, None)
+
+
+class HostStateColumnsTestCase(test.TestCase):
+    """Test case for HostStateColumns class"""
+
+    def test_columns(self):
+        hosts = [fakes.FakeHostState('host%s' % i, 'compute',
+                                     {'free_ram_mb': i * 1024,
+                                      'free_disk_mb': i * 2048,
+                                      'vcpus_total': i,
+                                      'vcpus_used': 0})
+                 for i in xrange(1, 4)]
+        host_columns = host_manager.HostStateColumns(hosts)
+        self.assertEqual(len(host_columns), 3)
+        self.assertEqual(host_columns.host_states, hosts)
+        self.assertEqual(host_columns.topic, ['compute'] * 3)
+        self.assertEqual(host_columns.free_ram_mb, [1024, 2048, 3072])
+        self.assertEqual(host_columns.free_disk_mb, [2048, 4096, 6144])
+        self.assertEqual(host_columns.vcpus_total, [1, 2, 3])
+        self.assertEqual(host_columns.vcpus_used, [0, 0, 0])
+
+    def test_compress(self):
+        hosts = [fakes.FakeHostState('host%s' % i, 'compute',
+                                     {'free_ram_mb': i * 1024})
+                 for i in xrange(1, 4)]
+        host_columns = host_manager.HostStateColumns(hosts)
+        selected = host_columns.compress([True, False, True])
+        self.assertEqual(len(selected), 2)
+        self.assertEqual(selected.host_states, [hosts[0], hosts[2]])
+        self.assertEqual(selected.free_ram_mb, [1024, 3072])
+        # The original is left alone
+        self.assertEqual(len(host_columns), 3)
+
+
+class HostStateIndexTestCase(test.TestCase):
+    """Test case for HostStateIndex class"""
+
+    def setUp(self):
+        super(HostStateIndexTestCase, self).setUp()
+        capabilities = [{'gpus': '1', 'arch': 'x86_64'},
+                        {'gpus': '2', 'arch': 'x86_64', 'pci': ['a']},
+                        {'gpus': '1', 'arch': 'arm'}]
+        self.hosts = [fakes.FakeHostState('host%s' % i, 'compute',
+                {'service': {'availability_zone': 'zone%s' % (i % 2)},
+                 'capabilities': capabilities[i - 1]})
+                 for i in xrange(1, 4)]
+        self.host_index = host_manager.HostStateIndex('compute', self.hosts)
+
+    def test_hosts_in_zone(self):
+        self.assertEqual(self.host_index.hosts_in_zone('zone1'),
+                         set(['host1', 'host3']))
+        self.assertEqual(self.host_index.hosts_in_zone('zone0'),
+                         set(['host2']))
+        self.assertEqual(self.host_index.hosts_in_zone('zone2'), set())
+        self.assertTrue('host1' in self.host_index)
+        self.assertFalse('host4' in self.host_index)
+
+    def test_hosts_with_capabilities(self):
+        self.assertEqual(self.host_index.hosts_with_capabilities(
+                {'gpus': '1'}), set(['host1', 'host3']))
+        self.assertEqual(self.host_index.hosts_with_capabilities(
+                {'gpus': '1', 'arch': 'x86_64'}), set(['host1']))
+        self.assertEqual(self.host_index.hosts_with_capabilities(
+                {'gpus': '3'}), set())
+        # The index sets themselves aren't handed out
+        hosts = self.host_index.hosts_with_capabilities({'gpus': '1'})
+        hosts.clear()
+        self.assertEqual(self.host_index.hosts_with_capabilities(
+                {'gpus': '1'}), set(['host1', 'host3']))
+
+    def test_hosts_with_capabilities_not_indexable(self):
+        self.assertEqual(self.host_index.hosts_with_capabilities(
+                {'pci': ['a']}), None)
+        self.assertEqual(self.host_index.hosts_with_capabilities(
+                {'gpus': None}), None)
+
+    def test_update_capabilities(self):
+        self.hosts[0].capabilities = {'gpus': '2'}
+        self.host_index.update_capabilities(self.hosts[0])
+        self.assertEqual(self.host_index.hosts_with_capabilities(
+                {'gpus': '2'}), set(['host1', 'host2']))
+        self.assertEqual(self.host_index.hosts_with_capabilities(
+                {'arch': 'x86_64'}), set(['host2']))
+
+    def test_hosts_with_aggregate_metadata(self):
+        class FakeAggregate(object):
+            def __init__(self, hosts, metadetails):
+                self.hosts = hosts
+                self.metadetails = metadetails
+
+        ctxt = context.get_admin_context()
+        self.mox.StubOutWithMock(db, 'aggregate_get_all')
+        db.aggregate_get_all(mox.IgnoreArg()).AndReturn([
+                FakeAggregate(['host1', 'host2'], {'ssd': 'true'}),
+                FakeAggregate(['host3'], {'ssd': 'true', 'gpu': 'true'})])
+
+        self.mox.ReplayAll()
+        # Only loaded from the db once
+        self.assertEqual(self.host_index.hosts_with_aggregate_metadata(
+                ctxt, {'ssd': 'true'}), set(['host1', 'host2', 'host3']))
+        self.assertEqual(self.host_index.hosts_with_aggregate_metadata(
+                ctxt, {'ssd': 'true', 'gpu': 'true'}), set(['host3']))
+
 
 class HostStateTestCase(test.TestCase):
     """Test case for HostState class"""
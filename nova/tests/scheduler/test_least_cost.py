@@ -88,6 +88,28 @@ class LeastCostTestCase(test.TestCase):
         self.assertEqual(weighted_host.weight, 10512)
         self.assertEqual(weighted_host.host_state.host, 'host1')
 
+    def test_weighted_sum_columns(self):
+        fn_tuples = [(1.0, offset), (1.0, least_cost.noop_cost_fn),
+                     (-1.0, least_cost.compute_fill_first_cost_fn)]
+        hostinfo_list = self._get_all_hosts()
+
+        options = {}
+        expected = least_cost.weighted_sum(fn_tuples, hostinfo_list,
+                options)
+        weighted_host = least_cost.weighted_sum_columns(fn_tuples,
+                host_manager.HostStateColumns(hostinfo_list), options)
+        # offset and fill first cancel out
+        self.assertEqual(weighted_host.weight, 10001)
+        self.assertEqual(weighted_host.weight, expected.weight)
+        self.assertEqual(weighted_host.host_state, expected.host_state)
+
+    def test_weighted_sum_columns_no_hosts(self):
+        fn_tuples = [(1.0, offset), ]
+        weighted_host = least_cost.weighted_sum_columns(fn_tuples,
+                host_manager.HostStateColumns([]), {})
+        self.assertEqual(weighted_host.weight, None)
+        self.assertEqual(weighted_host.host_state, None)
+
 
 class TestWeightedHost(test.TestCase):
     def test_dict_conversion_without_host_state(self):
@@ -40,8 +40,9 @@ class SchedulerRpcAPITestCase(test.TestCase):
         ctxt = context.RequestContext('fake_user', 'fake_project')
         rpcapi = scheduler_rpcapi.SchedulerAPI()
         expected_retval = 'foo' if method == 'call' else None
+        version = kwargs.pop('version', rpcapi.RPC_API_VERSION)
         expected_msg = rpcapi.make_msg(method, **kwargs)
-        expected_msg['version'] = rpcapi.RPC_API_VERSION
+        expected_msg['version'] = version
         if rpc_method == 'cast' and method == 'run_instance':
             kwargs['call'] = False
 
@@ -103,3 +104,7 @@ class SchedulerRpcAPITestCase(test.TestCase):
 
     def test_get_host_list(self):
         self._test_scheduler_api('get_host_list', rpc_method='call')
+
+    def test_get_scheduler_stats(self):
+        self._test_scheduler_api('get_scheduler_stats', rpc_method='call',
+                version='1.1')
@@ -33,6 +33,7 @@ from nova.openstack.common.rpc import common as rpc_common
 from nova.openstack.common import timeutils
 from nova.scheduler import driver
 from nova.scheduler import manager
+from nova.scheduler import tracing
 from nova import test
 from nova.tests.scheduler import fakes
 from nova import utils
@@ -75,6 +76,16 @@ class SchedulerManagerTestCase(test.TestCase):
         result = self.manager.get_host_list(self.context)
         self.assertEqual(result, expected)
 
+    def test_get_scheduler_stats(self):
+        expected = {'stages': {}, 'filters': {}}
+
+        self.mox.StubOutWithMock(tracing, 'get_stats')
+        tracing.get_stats().AndReturn(expected)
+
+        self.mox.ReplayAll()
+        result = self.manager.get_scheduler_stats(self.context)
+        self.assertEqual(result, expected)
+
     def test_get_service_capabilities(self):
         expected = 'fake_service_capabs'
 
@@ -453,7 +464,7 @@ class SchedulerTestCase(test.TestCase):
                 dest, block_migration, disk_over_commit)
         self.driver._live_migration_common_check(self.context, instance,
                 dest, block_migration, disk_over_commit)
-        db.instance_update_and_get_original(self.context, instance['id'],
+        db.instance_update_and_get_original(self.context, instance['uuid'],
                 {"vm_state": vm_states.MIGRATING}).AndReturn(
                         (instance, instance))
 
@@ -562,7 +573,7 @@ class SchedulerTestCase(test.TestCase):
                  'version': compute_rpcapi.ComputeAPI.RPC_API_VERSION}, None
                 ).AndReturn(True)
 
-        db.instance_update_and_get_original(self.context, instance['id'],
+        db.instance_update_and_get_original(self.context, instance['uuid'],
                 {"vm_state": vm_states.MIGRATING}).AndReturn(
                         (instance, instance))
 
@@ -0,0 +1,90 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the scheduler simulator.
+"""
+
+from nova import context
+from nova import db
+from nova import test
+from nova.tests.scheduler import simulator
+
+
+class SchedulerSimulationTestCase(test.TestCase):
+    """Run small simulations through each of the scheduler drivers."""
+
+    def setUp(self):
+        super(SchedulerSimulationTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.instance_types = [instance_type for instance_type in
+                               db.instance_type_get_all(self.context)
+                               if instance_type['memory_mb'] <= 4096]
+        self.fleet = simulator.FakeFleet(self.context, 8, 12,
+                                         self.instance_types,
+                                         host_memory_mb=8192, num_zones=2,
+                                         seed=42)
+        self.fleet.build()
+
+    def test_build(self):
+        self.assertEqual(len(db.compute_node_get_all(self.context)), 8)
+        instances = db.instance_get_all(self.context)
+        self.assertEqual(len(instances), len(self.fleet.instances))
+        for instance in instances:
+            self.assertEqual(instance['host'],
+                             self.fleet.instances[instance['uuid']]['host'])
+
+    def test_destroy(self):
+        self.fleet.destroy()
+        self.assertEqual(db.compute_node_get_all(self.context), [])
+        self.assertEqual(db.instance_get_all(self.context), [])
+
+    def _test_simulation(self, scheduler_driver):
+        simulation = simulator.SchedulerSimulation(self.context, self.fleet,
+                simulator.SCHEDULER_DRIVERS[scheduler_driver], seed=42)
+        simulation.run(20)
+        report = simulation.report()
+
+        self.assertEqual(sum(report['requests'].itervalues()), 20)
+        for request_type, count in report['requests'].iteritems():
+            self.assertTrue(report['failures'][request_type] <= count)
+            if count:
+                self.assertEqual(
+                        report['latency'][request_type]['count'], count)
+        placement = report['placement']
+        self.assertEqual(placement['hosts'], 8)
+        self.assertEqual(placement['instances'], len(self.fleet.instances))
+        # Only the filter scheduler keeps the hosts from being overcommitted
+        self.assertTrue(placement['memory_used'] > 0)
+        if scheduler_driver == 'filter':
+            self.assertTrue(placement['memory_used'] <= 1)
+
+        # The casts to the compute hosts were carried out
+        self.assertEqual(self.fleet.pending_casts, [])
+        for instance_uuid, instance in self.fleet.instances.iteritems():
+            instance_ref = db.instance_get_by_uuid(self.context,
+                                                   instance_uuid)
+            self.assertEqual(instance_ref['host'], instance['host'])
+
+    def test_filter_scheduler(self):
+        self.flags(ram_allocation_ratio=1.0)
+        self._test_simulation('filter')
+
+    def test_simple_scheduler(self):
+        self._test_simulation('simple')
+
+    def test_chance_scheduler(self):
+        self._test_simulation('chance')
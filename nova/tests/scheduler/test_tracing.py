@@ -0,0 +1,97 @@
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For Scheduler tracing.
+"""
+
+from nova.scheduler import tracing
+from nova import test
+
+
+class LatencyHistogramTestCase(test.TestCase):
+    """Test case for LatencyHistogram."""
+
+    def test_empty(self):
+        stats = tracing.LatencyHistogram(10).to_dict()
+        self.assertEqual(stats['count'], 0)
+        self.assertEqual(stats['p50'], None)
+        self.assertEqual(sum(b['count'] for b in stats['buckets']), 0)
+
+    def test_to_dict(self):
+        histogram = tracing.LatencyHistogram(10)
+        for elapsed_ms in (0.5, 3, 3, 40, 10000):
+            histogram.add(elapsed_ms)
+        stats = histogram.to_dict()
+        self.assertEqual(stats['count'], 5)
+        self.assertEqual(stats['min'], 0.5)
+        self.assertEqual(stats['max'], 10000)
+        self.assertEqual(stats['p50'], 3)
+        self.assertEqual(stats['p99'], 10000)
+        buckets = dict((b['le'], b['count']) for b in stats['buckets'])
+        self.assertEqual(buckets[1], 1)
+        self.assertEqual(buckets[5], 2)
+        self.assertEqual(buckets[50], 1)
+        self.assertEqual(buckets[None], 1)
+
+    def test_rolling(self):
+        histogram = tracing.LatencyHistogram(2)
+        for elapsed_ms in (100, 1, 2):
+            histogram.add(elapsed_ms)
+        stats = histogram.to_dict()
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual(stats['samples'], 2)
+        self.assertEqual(stats['max'], 2)
+
+
+class SchedulerTraceTestCase(test.TestCase):
+    """Test case for SchedulerTrace and SchedulerStats."""
+
+    def setUp(self):
+        super(SchedulerTraceTestCase, self).setUp()
+        tracing.STATS.reset()
+
+    def tearDown(self):
+        tracing.STATS.reset()
+        super(SchedulerTraceTestCase, self).tearDown()
+
+    def test_start_trace_disabled(self):
+        self.flags(scheduler_tracing=False)
+        trace = tracing.start_trace('run_instance')
+        self.assertFalse(trace.enabled)
+        with trace.timed('weighing'):
+            pass
+        trace.finish()
+        self.assertEqual(tracing.get_stats(), {'stages': {}, 'filters': {}})
+
+    def test_trace_recorded(self):
+        self.flags(scheduler_tracing=True)
+        trace = tracing.start_trace('run_instance')
+        self.assertTrue(trace.enabled)
+        with trace.timed('get_all_host_states'):
+            pass
+        trace.add_filter('RamFilter', 2.0, 10, 4)
+        trace.finish()
+
+        trace = tracing.start_trace('run_instance')
+        trace.add_filter('RamFilter', 4.0, 5, 4)
+        trace.finish()
+
+        stats = tracing.get_stats()
+        self.assertEqual(sorted(stats['stages']),
+                         ['get_all_host_states', 'total'])
+        self.assertEqual(stats['stages']['total']['count'], 2)
+        self.assertEqual(stats['filters']['RamFilter']['count'], 2)
+        self.assertEqual(stats['filters']['RamFilter']['max'], 4.0)
+        self.assertEqual(stats['filters']['RamFilter']['hosts_removed'], 7)
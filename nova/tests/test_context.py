@@ -55,6 +55,14 @@ class ContextTestCase(test.TestCase):
                           'read_deleted',
                           True)
 
+    def test_request_context_use_primary_db(self):
+        ctxt = context.RequestContext('111', '222')
+        self.assertFalse(ctxt.use_primary_db)
+
+        ctxt = context.RequestContext('111', '222', use_primary_db=True)
+        ctxt = context.RequestContext.from_dict(ctxt.to_dict())
+        self.assertTrue(ctxt.use_primary_db)
+
     def test_extra_args_to_context_get_logged(self):
         info = {}
 
@@ -20,8 +20,13 @@
 
 import datetime
 
+import sqlalchemy
+
 from nova import context
 from nova import db
+from nova.db.sqlalchemy import api as sqa_api
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import session as db_session
 from nova import exception
 from nova import flags
 from nova.openstack.common import timeutils
@@ -66,6 +71,27 @@ class DbApiTestCase(test.TestCase):
         result = db.instance_get_all_by_filters(self.context, {})
         self.assertTrue(2, len(result))
 
+    def test_instance_create_multi(self):
+        ctxt = context.get_admin_context()
+        group = db.security_group_create(ctxt,
+                {'name': 'default', 'project_id': self.project_id,
+                 'user_id': self.user_id, 'description': 'default'})
+        values_list = [{'reservation_id': 'a', 'launch_index': i,
+                        'metadata': {'key%d' % i: 'value'}}
+                       for i in xrange(3)]
+        instances = db.instance_create_multi(self.context, values_list,
+                security_group_ids=[group['id']])
+        self.assertEqual(3, len(instances))
+
+        for i, instance in enumerate(instances):
+            instance = db.instance_get_by_uuid(ctxt, instance['uuid'])
+            self.assertEqual(i, instance['launch_index'])
+            self.assertEqual('key%d' % i, instance['metadata'][0]['key'])
+            self.assertEqual(['default'],
+                             [g['name'] for g in instance['security_groups']])
+            self.assertEqual(instance['uuid'],
+                             instance['info_cache']['instance_id'])
+
     def test_instance_get_all_by_filters_deleted(self):
         args1 = {'reservation_id': 'a', 'image_ref': 1, 'host': 'host1'}
         inst1 = db.instance_create(self.context, args1)
@@ -81,6 +107,183 @@ class DbApiTestCase(test.TestCase):
         else:
             self.assertTrue(result[1].deleted)
 
+    def test_instance_get_all_by_filters_regexp(self):
+        ctxt = context.get_admin_context()
+        for name in ('web-1', 'web-10', 'Web-2', 'db-1', 'web_1'):
+            db.instance_create(ctxt, {'display_name': name})
+
+        def _names(filters):
+            result = db.instance_get_all_by_filters(ctxt, filters)
+            return sorted(instance['display_name'] for instance in result)
+
+        self.assertEqual(_names({'display_name': 'web-1'}),
+                         ['web-1', 'web-10'])
+        self.assertEqual(_names({'display_name': '^web-1$'}), ['web-1'])
+        self.assertEqual(_names({'display_name': 'web.1'}),
+                         ['web-1', 'web-10', 'web_1'])
+        self.assertEqual(_names({'display_name': 'webs?-'}),
+                         ['web-1', 'web-10'])
+        self.assertEqual(_names({'display_name': 'web_'}), ['web_1'])
+        self.assertEqual(_names({'display_name': '(?i)web-'}),
+                         ['Web-2', 'web-1', 'web-10'])
+        self.assertEqual(_names({'display_name': 'db|Web'}),
+                         ['Web-2', 'db-1'])
+
+    def test_instance_get_all_by_filters_metadata(self):
+        ctxt = context.get_admin_context()
+        inst1 = db.instance_create(ctxt, {'metadata': {'a': '1', 'b': '2'}})
+        inst2 = db.instance_create(ctxt, {'metadata': {'a': '1'}})
+        db.instance_create(ctxt, {'metadata': {'a': '2'}})
+
+        result = db.instance_get_all_by_filters(ctxt,
+                {'metadata': {'a': '1'}})
+        self.assertEqual(len(result), 2)
+        result = db.instance_get_all_by_filters(ctxt,
+                {'metadata': [{'a': '1'}, {'b': '2'}]})
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['metadata'][0]['key'], 'a')
+        result = db.instance_get_all_by_filters(ctxt,
+                {'metadata': {'a': '1'}}, columns_to_join=[])
+        self.assertEqual(sorted(instance['uuid'] for instance in result),
+                         sorted([inst1['uuid'], inst2['uuid']]))
+        self.assertEqual(db.instance_get_all_by_filters(ctxt,
+                {'metadata': {'a': 'A'}}), [])
+
+    def test_instance_get_all_by_filters_paginate(self):
+        ctxt = context.get_admin_context()
+        created_at = datetime.datetime(2012, 1, 1)
+        uuids = []
+        for i in xrange(7):
+            instance = db.instance_create(ctxt,
+                    {'display_name': 'inst%d' % (i % 2),
+                     'created_at': created_at + datetime.timedelta(i / 2)})
+            uuids.append(instance['uuid'])
+
+        def _uuids(filters, limit, marker=None, sort_dir='desc'):
+            result = db.instance_get_all_by_filters(ctxt, filters,
+                    sort_dir=sort_dir, limit=limit, marker=marker)
+            return [instance['uuid'] for instance in result]
+
+        # Instances created at the same time sort by id
+        self.assertEqual(_uuids({}, 3), uuids[:-4:-1])
+        self.assertEqual(_uuids({}, 3, marker=uuids[4]), uuids[3::-1][:3])
+        self.assertEqual(_uuids({}, 10, marker=uuids[0]), [])
+        self.assertEqual(_uuids({}, 3, sort_dir='asc'), uuids[:3])
+        self.assertEqual(_uuids({}, 3, marker=uuids[2], sort_dir='asc'),
+                         uuids[3:6])
+        # Filters that are only checked after the query is run
+        self.assertEqual(_uuids({'display_name': '.*1'}, 2),
+                         [uuids[5], uuids[3]])
+        self.assertEqual(_uuids({'display_name': '.*1'}, 2,
+                                marker=uuids[3]),
+                         [uuids[1]])
+
+        self.assertRaises(exception.MarkerNotFound,
+                          db.instance_get_all_by_filters, ctxt, {},
+                          limit=1, marker='does-not-exist')
+
+    def test_instance_get_all_by_filters_columns(self):
+        ctxt = context.get_admin_context()
+        group = db.security_group_create(ctxt,
+                {'name': 'default', 'project_id': self.project_id,
+                 'user_id': self.user_id, 'description': 'default'})
+        instance_type = db.instance_type_get_by_name(ctxt, 'm1.small')
+        instance = db.instance_create(ctxt,
+                {'display_name': 'web-1', 'host': 'host1',
+                 'instance_type_id': instance_type['id'],
+                 'metadata': {'a': '1'}})
+        db.instance_add_security_group(ctxt, instance['uuid'], group['id'])
+        db.instance_create(ctxt, {'display_name': 'db-1', 'host': 'host1'})
+
+        result = db.instance_get_all_by_filters(ctxt,
+                {'display_name': 'web', 'host': 'host1'},
+                columns=['display_name'])
+        self.assertEqual(len(result), 1)
+        record = result[0]
+        self.assertEqual(record['display_name'], 'web-1')
+        self.assertEqual(record.uuid, instance['uuid'])
+        self.assertEqual(record.get('host'), 'host1')
+        self.assertEqual(record.get('vm_state'), None)
+        self.assertRaises(KeyError, record.__getitem__, 'vm_state')
+        self.assertEqual(record['name'], instance['name'])
+        self.assertEqual(dict(record.iteritems()),
+                         {'id': instance['id'], 'uuid': instance['uuid'],
+                          'display_name': 'web-1', 'host': 'host1',
+                          'created_at': instance['created_at']})
+
+        result = db.instance_get_all_by_filters(ctxt,
+                {'metadata': {'a': '1'}}, columns=['display_name'],
+                columns_to_join=['info_cache', 'security_groups',
+                                 'instance_type'])
+        self.assertEqual(len(result), 1)
+        record = result[0]
+        self.assertEqual(record['info_cache']['instance_id'],
+                         instance['uuid'])
+        self.assertEqual([g['name'] for g in record['security_groups']],
+                         ['default'])
+        self.assertEqual(record['instance_type']['name'], 'm1.small')
+        self.assertEqual([(m['key'], m['value']) for m in record['metadata']],
+                         [('a', '1')])
+
+        self.assertRaises(exception.InvalidInput,
+                          db.instance_get_all_by_filters, ctxt, {},
+                          columns=['uuid'], columns_to_join=['fixed_ips'])
+
+    def test_instance_update_multi_and_get_original(self):
+        ctxt = context.get_admin_context()
+        inst1 = db.instance_create(ctxt, {'power_state': 1, 'vm_state': 'a'})
+        inst2 = db.instance_create(ctxt, {'power_state': 1, 'vm_state': 'a'})
+
+        results = db.instance_update_multi_and_get_original(ctxt,
+                {inst1['uuid']: {'power_state': 4, 'vm_state': 'b'},
+                 inst2['uuid']: {'power_state': 3},
+                 str(utils.gen_uuid()): {'power_state': 4}})
+
+        self.assertEqual(sorted(results), sorted([inst1['uuid'],
+                                                  inst2['uuid']]))
+        old_ref, new_ref = results[inst1['uuid']]
+        self.assertEqual(old_ref['vm_state'], 'a')
+        self.assertEqual(new_ref['vm_state'], 'b')
+        inst1 = db.instance_get_by_uuid(ctxt, inst1['uuid'])
+        self.assertEqual((inst1['power_state'], inst1['vm_state']), (4, 'b'))
+        inst2 = db.instance_get_by_uuid(ctxt, inst2['uuid'])
+        self.assertEqual((inst2['power_state'], inst2['vm_state']), (3, 'a'))
+
+    def test_instance_info_cache_update_multi(self):
+        ctxt = context.get_admin_context()
+        inst1 = db.instance_create(ctxt, {})
+        inst2 = db.instance_create(ctxt, {})
+        db.instance_info_cache_delete(ctxt, inst2['uuid'])
+        session = sqa_api.get_session()
+        session.query(models.InstanceInfoCache).\
+                filter_by(instance_id=inst2['uuid']).\
+                delete()
+
+        db.instance_info_cache_update_multi(ctxt,
+                {inst1['uuid']: {'network_info': '[1]'},
+                 inst2['uuid']: {'network_info': '[2]'}})
+
+        self.assertEqual(db.instance_info_cache_get(ctxt,
+                inst1['uuid'])['network_info'], '[1]')
+        self.assertEqual(db.instance_info_cache_get(ctxt,
+                inst2['uuid'])['network_info'], '[2]')
+
+    def test_bw_usage_update_multi(self):
+        ctxt = context.get_admin_context()
+        start_period = datetime.datetime(2012, 1, 1)
+        db.bw_usage_update(ctxt, 'uuid1', 'mac1', start_period, 1, 2)
+
+        db.bw_usage_update_multi(ctxt, start_period,
+                [{'uuid': 'uuid1', 'mac': 'mac1', 'bw_in': 10, 'bw_out': 20},
+                 {'uuid': 'uuid2', 'mac': 'mac2', 'bw_in': 30, 'bw_out': 40}])
+
+        usages = db.bw_usage_get_by_uuids(ctxt, ['uuid1', 'uuid2'],
+                                          start_period)
+        self.assertEqual(sorted((u['uuid'], u['mac'], u['bw_in'], u['bw_out'])
+                                for u in usages),
+                         [('uuid1', 'mac1', 10, 20),
+                          ('uuid2', 'mac2', 30, 40)])
+
     def test_migration_get_all_unconfirmed(self):
         ctxt = context.get_admin_context()
 
@@ -424,6 +627,156 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(result, 0)
 
 
+class SlaveReadsTestCase(test.TestCase):
+    """Tests for routing reads to sql_slave_connection."""
+
+    def setUp(self):
+        super(SlaveReadsTestCase, self).setUp()
+        self.context = context.get_admin_context()
+
+        def _read(ctxt, session=None):
+            return getattr(db_session._LOCAL, 'slave', False)
+        self.read = sqa_api.read_from_slave(_read)
+
+    def tearDown(self):
+        db_session._SLAVE_ENGINE = None
+        db_session._SLAVE_MAKER = None
+        super(SlaveReadsTestCase, self).tearDown()
+
+    def test_read_from_slave_without_slave_connection(self):
+        self.assertFalse(self.read(self.context))
+
+    def test_read_from_slave(self):
+        self.flags(sql_slave_connection='sqlite://')
+        self.assertTrue(self.read(self.context))
+        self.assertFalse(getattr(db_session._LOCAL, 'slave', False))
+
+    def test_read_from_slave_use_primary_db(self):
+        self.flags(sql_slave_connection='sqlite://')
+        ctxt = context.get_admin_context()
+        ctxt.use_primary_db = True
+        self.assertFalse(self.read(ctxt))
+
+    def test_read_from_slave_with_session(self):
+        self.flags(sql_slave_connection='sqlite://')
+        session = db_session.get_session()
+        self.assertFalse(self.read(self.context, session=session))
+
+    def test_instance_get_all_by_filters_reads_primary(self):
+        # The slave is an empty database, so only the primary has the
+        # instance
+        self.flags(sql_slave_connection='sqlite://')
+        instance = db.instance_create(self.context, {})
+        result = db.instance_get_all_by_filters(self.context, {})
+        self.assertEqual([inst['uuid'] for inst in result],
+                         [instance['uuid']])
+
+    def test_instance_get_all_by_filters_use_slave(self):
+        self.flags(sql_slave_connection='sqlite://')
+        db.instance_create(self.context, {})
+        read = []
+
+        def fake_read_from_slave(f):
+            read.append(f)
+            return f
+        self.stubs.Set(sqa_api, 'read_from_slave', fake_read_from_slave)
+        db.instance_get_all_by_filters(self.context, {})
+        self.assertEqual(read, [])
+        db.instance_get_all_by_filters(self.context, {}, use_slave=True)
+        self.assertEqual(len(read), 1)
+
+    def test_get_session_slave_reads(self):
+        self.flags(sql_slave_connection='sqlite://')
+        primary_engine = db_session.get_engine()
+        self.assertEqual(db_session.get_session().bind, primary_engine)
+        with db_session.slave_reads():
+            slave_engine = db_session.get_session().bind
+            self.assertEqual(db_session.get_session(slave=False).bind,
+                             primary_engine)
+        self.assertNotEqual(slave_engine, primary_engine)
+        self.assertEqual(slave_engine, db_session.get_engine(slave=True))
+        self.assertEqual(db_session.get_session().bind, primary_engine)
+
+    def test_get_session_slave_reads_without_slave_connection(self):
+        with db_session.slave_reads():
+            self.assertEqual(db_session.get_session().bind,
+                             db_session.get_engine())
+
+
+class ArchiveTestCase(test.TestCase):
+    """Tests for archiving and purging soft-deleted rows."""
+
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.meta = sqlalchemy.MetaData(bind=db_session.get_engine())
+
+    def _count(self, table_name):
+        table = sqlalchemy.Table(table_name, self.meta, autoload=True)
+        return sqlalchemy.select([sqlalchemy.func.count()],
+                                 from_obj=[table]).scalar()
+
+    def _create_deleted_instance(self):
+        instance = db.instance_create(self.context,
+                                      {'metadata': {'key': 'value'}})
+        db.instance_fault_create(self.context,
+                                 {'instance_uuid': instance['uuid'],
+                                  'code': 500, 'message': 'fault'})
+        db.instance_destroy(self.context, instance['uuid'])
+        return instance
+
+    def test_archive_deleted_rows(self):
+        deleted = self._create_deleted_instance()
+        live = db.instance_create(self.context, {'metadata': {'k': 'v'}})
+
+        archived = db.archive_deleted_rows(self.context)
+
+        self.assertEqual(archived['instances'], 1)
+        self.assertEqual(archived['instance_metadata'], 1)
+        # The fault of the deleted instance goes with it
+        self.assertEqual(archived['instance_faults'], 1)
+        self.assertRaises(exception.InstanceNotFound,
+                          db.instance_get_by_uuid,
+                          self.context.elevated(read_deleted='yes'),
+                          deleted['uuid'])
+        live = db.instance_get_by_uuid(self.context, live['uuid'])
+        self.assertEqual(live['metadata'][0]['value'], 'v')
+        self.assertEqual(self._count('shadow_instances'), 1)
+        self.assertEqual(self._count('shadow_instance_metadata'), 1)
+        self.assertEqual(self._count('instances'), 1)
+
+        self.assertEqual(sum(db.archive_deleted_rows(self.context).values()),
+                         0)
+
+    def test_archive_deleted_rows_max_rows(self):
+        for i in xrange(3):
+            self._create_deleted_instance()
+        for table in ('instance_metadata', 'instance_system_metadata',
+                      'instance_info_caches'):
+            sqlalchemy.Table(table, self.meta, autoload=True).delete().\
+                    execute()
+
+        archived = db.archive_deleted_rows(self.context, max_rows=4,
+                                           batch_size=1)
+        self.assertEqual(archived['instance_faults'], 3)
+        self.assertEqual(archived['instances'], 1)
+        self.assertEqual(self._count('instances'), 2)
+
+    def test_purge_shadow_rows(self):
+        self._create_deleted_instance()
+        db.archive_deleted_rows(self.context)
+
+        now = timeutils.utcnow()
+        purged = db.purge_shadow_rows(self.context,
+                                      now - datetime.timedelta(days=1))
+        self.assertEqual(sum(purged.values()), 0)
+        purged = db.purge_shadow_rows(self.context,
+                                      now + datetime.timedelta(days=1))
+        self.assertEqual(purged['instances'], 1)
+        self.assertEqual(self._count('shadow_instances'), 0)
+        self.assertEqual(self._count('shadow_instance_faults'), 0)
+
+
 def _get_fake_aggr_values():
     return {'name': 'fake_aggregate',
             'availability_zone': 'fake_avail_zone', }
@@ -728,6 +1081,100 @@ class AggregateDBApiTestCase(test.TestCase):
                           ctxt, result.id, _get_fake_aggr_hosts()[0])
 
 
+class LookupCacheTestCase(test.TestCase):
+    """Tests for the process wide cache of instance types and aggregates."""
+
+    def setUp(self):
+        super(LookupCacheTestCase, self).setUp()
+        self.flags(db_lookup_cache_interval=60)
+        self.context = context.get_admin_context()
+        sqa_api._LOOKUP_CACHE.clear()
+        self.instance_type = db.instance_type_get_by_name(self.context,
+                                                          'm1.tiny')
+
+    def tearDown(self):
+        sqa_api._LOOKUP_CACHE.clear()
+        timeutils.clear_time_override()
+        super(LookupCacheTestCase, self).tearDown()
+
+    def _update_behind_cache(self, values):
+        """Update the instance type like another service would."""
+        session = db_session.get_session()
+        session.query(models.InstanceTypes).\
+                filter_by(id=self.instance_type['id']).\
+                update(values)
+
+    def _get_memory_mb(self):
+        return db.instance_type_get(self.context,
+                                    self.instance_type['id'])['memory_mb']
+
+    def test_lookups_are_cached(self):
+        self.assertEqual(self._get_memory_mb(), 512)
+        self._update_behind_cache({'memory_mb': 1024})
+        self.assertEqual(self._get_memory_mb(), 512)
+        inst_types = db.instance_type_get_all(self.context,
+                                              filters={'min_memory_mb': 512})
+        self.assertEqual(db.instance_type_get_all(
+                self.context, filters={'min_memory_mb': 512}), inst_types)
+
+    def test_cache_disabled(self):
+        self.flags(db_lookup_cache_interval=0)
+        self.assertEqual(self._get_memory_mb(), 512)
+        self._update_behind_cache({'memory_mb': 1024})
+        self.assertEqual(self._get_memory_mb(), 1024)
+
+    def test_callers_get_copies(self):
+        inst_type = db.instance_type_get(self.context,
+                                         self.instance_type['id'])
+        inst_type['memory_mb'] = 1
+        inst_type['extra_specs']['key'] = 'value'
+        inst_type = db.instance_type_get(self.context,
+                                         self.instance_type['id'])
+        self.assertEqual(inst_type['memory_mb'], 512)
+        self.assertEqual(inst_type['extra_specs'], {})
+
+    def test_write_invalidates(self):
+        self.assertEqual(self._get_memory_mb(), 512)
+        self._update_behind_cache({'memory_mb': 1024})
+        db.instance_type_extra_specs_update_or_create(
+                self.context, self.instance_type['id'], {'key': 'value'})
+        inst_type = db.instance_type_get(self.context,
+                                         self.instance_type['id'])
+        self.assertEqual(inst_type['memory_mb'], 1024)
+        self.assertEqual(inst_type['extra_specs'], {'key': 'value'})
+
+    def test_version_bump_invalidates_after_interval(self):
+        now = timeutils.utcnow()
+        timeutils.set_time_override(now)
+        self.assertEqual(self._get_memory_mb(), 512)
+        # Another service writes the instance type
+        self._update_behind_cache({'memory_mb': 1024})
+        sqa_api._cache_version_bump('instance_types')
+        timeutils.set_time_override(now + datetime.timedelta(seconds=30))
+        self.assertEqual(self._get_memory_mb(), 512)
+        timeutils.set_time_override(now + datetime.timedelta(seconds=61))
+        self.assertEqual(self._get_memory_mb(), 1024)
+
+    def test_aggregate_lookups(self):
+        result = _create_aggregate_with_hosts(context=self.context)
+        aggregate = db.aggregate_get_by_host(self.context,
+                                             'foo.openstack.org')
+        self.assertTrue(db.aggregate_get_by_host(
+                self.context, 'foo.openstack.org') is aggregate)
+        self.assertEqual(aggregate.hosts, _get_fake_aggr_hosts())
+        self.assertEqual(aggregate.metadetails, _get_fake_aggr_metadata())
+        self.assertEqual(db.aggregate_metadata_get(self.context, result.id),
+                         _get_fake_aggr_metadata())
+
+        db.aggregate_metadata_add(self.context, result.id,
+                                  {'fake_key3': 'fake_value3'})
+        aggregate = db.aggregate_get_by_host(self.context,
+                                             'foo.openstack.org')
+        self.assertEqual(aggregate.metadetails['fake_key3'], 'fake_value3')
+        metadata = db.aggregate_metadata_get(self.context, result.id)
+        self.assertEqual(metadata['fake_key3'], 'fake_value3')
+
+
 class CapacityTestCase(test.TestCase):
     def setUp(self):
         super(CapacityTestCase, self).setUp()
@@ -824,6 +1271,25 @@ class CapacityTestCase(test.TestCase):
         self.assertEquals(x.current_workload, 2)
         self.assertEquals(x.running_vms, 5)
 
+    def test_compute_node_utilization_update_claim(self):
+        self._create_helper('host1')
+
+        x = db.compute_node_utilization_update(self.ctxt, 'host1',
+                free_ram_mb_delta=-512, free_disk_gb_delta=-48,
+                work_delta=1, vm_delta=1, min_free_ram_mb=512)
+        self.assertEquals(x.free_ram_mb, 512)
+        self.assertEquals(x.free_disk_gb, 2000)
+        self.assertEquals(x.current_workload, 1)
+        self.assertEquals(x.running_vms, 1)
+
+        self.assertRaises(exception.ComputeNodeClaimConflict,
+                          db.compute_node_utilization_update, self.ctxt,
+                          'host1', free_ram_mb_delta=-1024,
+                          min_free_ram_mb=1024)
+        x = db.compute_node_get_by_host(self.ctxt, 'host1')
+        self.assertEquals(x.free_ram_mb, 512)
+        self.assertEquals(x.running_vms, 1)
+
 
 class TestIpAllocation(test.TestCase):
 
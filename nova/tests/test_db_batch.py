@@ -0,0 +1,77 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Unit tests for the coalescing of DB writes"""
+
+from nova.db import batch
+from nova import test
+
+
+class WriteBatchTestCase(test.TestCase):
+    def setUp(self):
+        super(WriteBatchTestCase, self).setUp()
+        self.writes = []
+
+    def _write(self, values_by_key):
+        self.writes.append(values_by_key)
+        return len(values_by_key)
+
+    def test_flush_coalesces_writes(self):
+        updates = batch.WriteBatch(self._write)
+        updates.add('a', x=1, y=1)
+        updates.add('b', x=2)
+        updates.add('a', y=3)
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.writes, [])
+
+        self.assertEqual(updates.flush(), 2)
+        self.assertEqual(self.writes, [{'a': {'x': 1, 'y': 3},
+                                        'b': {'x': 2}}])
+        self.assertEqual(len(updates), 0)
+        self.assertEqual(updates.flush(), None)
+        self.assertEqual(len(self.writes), 1)
+
+    def test_max_size(self):
+        updates = batch.WriteBatch(self._write, max_size=2)
+        updates.add('a', x=1)
+        updates.add('a', y=2)
+        self.assertEqual(self.writes, [])
+        updates.add('b', x=3)
+        self.assertEqual(self.writes, [{'a': {'x': 1, 'y': 2},
+                                        'b': {'x': 3}}])
+        updates.add('c', x=4)
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(len(updates), 1)
+
+    def test_context_manager(self):
+        with batch.WriteBatch(self._write) as updates:
+            updates.add('a', x=1)
+        self.assertEqual(self.writes, [{'a': {'x': 1}}])
+
+    def test_context_manager_error(self):
+        def _failing_write(values_by_key):
+            self.writes.append(values_by_key)
+            raise test.TestingException()
+
+        def _run():
+            with batch.WriteBatch(_failing_write) as updates:
+                updates.add('a', x=1)
+                raise ValueError()
+
+        # The queued writes are still made, and the original error raised
+        self.assertRaises(ValueError, _run)
+        self.assertEqual(self.writes, [{'a': {'x': 1}}])
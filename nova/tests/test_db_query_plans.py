@@ -0,0 +1,162 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Checks that the hot DB API queries use indexes.
+
+Each test runs a DB API call against a populated database, records the
+SELECTs it issues and runs EXPLAIN on them, failing if the database
+would scan the whole of one of the given tables.  This works on SQLite
+and MySQL.
+"""
+
+import datetime
+import re
+
+from sqlalchemy import event
+
+from nova import context
+from nova import db
+from nova.db.sqlalchemy.session import get_engine
+from nova import exception
+from nova.openstack.common import timeutils
+from nova import test
+
+
+# The SELECTs issued while _RECORDED is not None
+_RECORDED = None
+_LISTENING = []
+
+
+def _record_statement(conn, cursor, statement, parameters, context,
+                      executemany):
+    if (_RECORDED is not None and
+            statement.lstrip().upper().startswith('SELECT')):
+        _RECORDED.append((statement, parameters))
+
+
+def _full_scans_sqlite(conn, statement, parameters):
+    scans = set()
+    for row in conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters):
+        # e.g. "SCAN TABLE instances" or "SCAN instances", unlike
+        # "SEARCH TABLE instances USING INDEX ..."
+        match = re.match(r'SCAN (?:TABLE )?(\w+)', list(row)[-1])
+        if match:
+            scans.add(match.group(1))
+    return scans
+
+
+def _full_scans_mysql(conn, statement, parameters):
+    scans = set()
+    for row in conn.execute('EXPLAIN ' + statement, parameters):
+        if row['type'] == 'ALL':
+            scans.add(row['table'])
+    return scans
+
+
+class QueryPlanTestCase(test.TestCase):
+    """Run EXPLAIN on the queries of the hot DB API calls."""
+
+    def setUp(self):
+        super(QueryPlanTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.engine = get_engine()
+        if not _LISTENING:
+            event.listen(self.engine, 'before_cursor_execute',
+                         _record_statement)
+            _LISTENING.append(self.engine)
+        self._populate()
+
+    def _populate(self):
+        now = timeutils.utcnow()
+        long_ago = now - datetime.timedelta(days=1)
+        self.instance_uuids = []
+        for i in xrange(20):
+            instance = db.instance_create(self.context,
+                                          {'host': 'host%d' % (i % 4),
+                                           'task_state': None})
+            self.instance_uuids.append(instance['uuid'])
+            db.migration_create(self.context,
+                                {'instance_uuid': instance['uuid'],
+                                 'status': 'finished' if i % 5 else 'done'})
+            db.fixed_ip_create(self.context,
+                               {'address': '10.0.0.%d' % i,
+                                'network_id': i % 2,
+                                'host': 'host%d' % (i % 4)})
+            db.bw_usage_update(self.context, instance['uuid'],
+                               'fake_mac', long_ago, 100, 200)
+
+    def _full_scans(self, func, *args, **kwargs):
+        """Call func and return the tables its SELECTs scan in full."""
+        global _RECORDED
+        _RECORDED = []
+        try:
+            try:
+                func(*args, **kwargs)
+            except exception.NotFound:
+                pass
+            recorded = _RECORDED
+        finally:
+            _RECORDED = None
+
+        if self.engine.name == 'mysql':
+            explain = _full_scans_mysql
+        else:
+            explain = _full_scans_sqlite
+        self.assertTrue(recorded)
+        scans = set()
+        conn = self.engine.connect()
+        try:
+            for statement, parameters in recorded:
+                scans |= explain(conn, statement, parameters)
+        finally:
+            conn.close()
+        return scans
+
+    def _assert_no_full_scan(self, table, func, *args, **kwargs):
+        scans = self._full_scans(func, *args, **kwargs)
+        self.assertFalse(table in scans,
+                         '%s scans the whole %s table' %
+                         (func.__name__, table))
+
+    def test_fixed_ip_get_by_network_host(self):
+        self._assert_no_full_scan('fixed_ips', db.fixed_ip_get_by_network_host,
+                                  self.context, 1, 'host1')
+
+    def test_instance_get_all_by_host(self):
+        self._assert_no_full_scan('instances', db.instance_get_all_by_host,
+                                  self.context, 'host1')
+
+    def test_instance_get_all_hung_in_rebooting(self):
+        self._assert_no_full_scan('instances',
+                                  db.instance_get_all_hung_in_rebooting,
+                                  self.context, 60)
+
+    def test_migration_get_all_unconfirmed(self):
+        self._assert_no_full_scan('migrations',
+                                  db.migration_get_all_unconfirmed,
+                                  self.context, 60)
+
+    def test_bw_usage_get_by_uuids(self):
+        start_period = timeutils.utcnow() - datetime.timedelta(days=1)
+        self._assert_no_full_scan('bw_usage_cache', db.bw_usage_get_by_uuids,
+                                  self.context, self.instance_uuids[:5],
+                                  start_period)
+
+    def test_full_scan_is_flagged(self):
+        self.assertTrue('instances' in self._full_scans(
+                db.instance_get_all, self.context))
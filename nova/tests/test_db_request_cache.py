@@ -0,0 +1,100 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Unit tests for the per request memoization of DB reads"""
+
+from nova import context
+from nova import db
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova import exception
+from nova import test
+
+
+class RequestCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(RequestCacheTestCase, self).setUp()
+        self.flags(db_request_cache=True)
+        self.context = context.RequestContext('fake', 'fake')
+        db.enable_request_cache(self.context)
+        self.instance = db.instance_create(self.context,
+                                           {'project_id': 'fake'})
+        self.lookups = []
+        real_instance_get_by_uuid = sqlalchemy_api.instance_get_by_uuid
+
+        def fake_instance_get_by_uuid(context, uuid, session=None):
+            if session is None:
+                self.lookups.append(uuid)
+            return real_instance_get_by_uuid(context, uuid, session=session)
+
+        self.stubs.Set(sqlalchemy_api, 'instance_get_by_uuid',
+                       fake_instance_get_by_uuid)
+
+    def test_disabled(self):
+        self.flags(db_request_cache=False)
+        ctxt = context.RequestContext('fake', 'fake')
+        db.enable_request_cache(ctxt)
+        self.assertEqual(ctxt.db_cache, None)
+        db.instance_get_by_uuid(ctxt, self.instance['uuid'])
+        db.instance_get_by_uuid(ctxt, self.instance['uuid'])
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_reads_are_memoized(self):
+        uuid = self.instance['uuid']
+        first = db.instance_get_by_uuid(self.context, uuid)
+        self.assertTrue(db.instance_get_by_uuid(self.context, uuid) is first)
+        self.assertEqual(self.lookups, [uuid])
+        self.assertEqual(self.context.db_cache.hits, 1)
+
+    def test_cache_is_per_request(self):
+        uuid = self.instance['uuid']
+        db.instance_get_by_uuid(self.context, uuid)
+        ctxt = context.RequestContext('fake', 'fake')
+        db.enable_request_cache(ctxt)
+        db.instance_get_by_uuid(ctxt, uuid)
+        self.assertEqual(self.lookups, [uuid, uuid])
+
+    def test_elevated_shares_cache_but_not_results(self):
+        uuid = self.instance['uuid']
+        db.instance_get_by_uuid(self.context, uuid)
+        elevated = self.context.elevated()
+        self.assertTrue(elevated.db_cache is self.context.db_cache)
+        db.instance_get_by_uuid(elevated, uuid)
+        db.instance_get_by_uuid(elevated, uuid)
+        self.assertEqual(self.lookups, [uuid, uuid])
+
+    def test_write_invalidates(self):
+        uuid = self.instance['uuid']
+        db.instance_get_by_uuid(self.context, uuid)
+        db.instance_update(self.context, uuid, {'host': 'newhost'})
+        instance = db.instance_get_by_uuid(self.context, uuid)
+        self.assertEqual(instance['host'], 'newhost')
+        self.assertEqual(self.lookups, [uuid, uuid])
+
+    def test_write_to_other_entity_does_not_invalidate(self):
+        uuid = self.instance['uuid']
+        db.instance_get_by_uuid(self.context, uuid)
+        db.block_device_mapping_create(self.context,
+                                       {'instance_uuid': uuid,
+                                        'device_name': '/dev/vdb'})
+        db.instance_get_by_uuid(self.context, uuid)
+        self.assertEqual(self.lookups, [uuid])
+
+    def test_errors_are_not_memoized(self):
+        self.assertRaises(exception.InstanceNotFound, db.instance_get_by_uuid,
+                          self.context, 'missing')
+        self.assertRaises(exception.InstanceNotFound, db.instance_get_by_uuid,
+                          self.context, 'missing')
+        self.assertEqual(self.lookups, ['missing', 'missing'])
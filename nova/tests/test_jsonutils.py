@@ -0,0 +1,126 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+from nova.openstack.common import jsonutils
+from nova import test
+
+
+# Subclasses of the dict and list to_primitive() handles first, which it
+# only converts after the checks of the other types.
+class SlowDict(dict):
+    pass
+
+
+class SlowList(list):
+    pass
+
+
+def _slow(value):
+    """Return value with its dicts and lists subclassed."""
+    if type(value) is dict:
+        return SlowDict((k, _slow(v)) for k, v in value.iteritems())
+    if type(value) is list:
+        return SlowList(_slow(v) for v in value)
+    if isinstance(value, Instance):
+        value.__dict__ = _slow(value.__dict__)
+    return value
+
+
+class IterItems(object):
+    def __init__(self, items):
+        self.items = items
+
+    def iteritems(self):
+        return iter(self.items)
+
+
+class Instance(object):
+    def __init__(self, child=None):
+        self.name = 'instance'
+        self.created_at = datetime.datetime(2012, 1, 2, 3, 4, 5)
+        self.child = child
+
+
+class ToPrimitiveTestCase(test.TestCase):
+    def _assert_same(self, value, expected, **kwargs):
+        self.assertEqual(jsonutils.to_primitive(value, **kwargs), expected)
+        self.assertEqual(jsonutils.to_primitive(_slow(value), **kwargs),
+                         expected)
+
+    def test_simple_types(self):
+        for value in (None, 'str', u'unicode', 1, 2L, 1.5, True):
+            self._assert_same(value, value)
+
+    def test_dict(self):
+        self._assert_same({'a': 1, 'b': u'2', 'c': None},
+                          {'a': 1, 'b': u'2', 'c': None})
+
+    def test_list(self):
+        self._assert_same([1, 'a', None], [1, 'a', None])
+
+    def test_tuple(self):
+        self.assertEqual(jsonutils.to_primitive((1, 'a', (2, 3))),
+                         [1, 'a', [2, 3]])
+
+    def test_datetime(self):
+        value = datetime.datetime(2012, 1, 2, 3, 4, 5, 6)
+        self._assert_same(value, '2012-01-02 03:04:05.000006')
+
+    def test_nested(self):
+        value = {'a': [{'b': {'c': [{'d': {'e': [datetime.datetime(2012, 1,
+                                                                   2)]}}]}}],
+                 'f': (1, {'g': [2]})}
+        self._assert_same(value,
+                          {'a': [{'b': {'c': [{'d': {'e': [
+                              '2012-01-02 00:00:00']}}]}}],
+                           'f': [1, {'g': [2]}]})
+
+    def test_iteritems(self):
+        value = IterItems([('a', 1), ('b', [datetime.datetime(2012, 1, 2)])])
+        self._assert_same({'x': value},
+                          {'x': {'a': 1, 'b': ['2012-01-02 00:00:00']}})
+
+    def _instance(self, child):
+        return {'name': 'instance',
+                'created_at': '2012-01-02 03:04:05',
+                'child': child}
+
+    def test_instances_deeper_than_three_levels(self):
+        value = Instance(Instance(Instance(Instance())))
+        expected = self._instance(self._instance(self._instance('?')))
+        self._assert_same(value, expected, convert_instances=True)
+
+    def test_dict_at_third_level(self):
+        value = Instance(Instance(Instance({'a': [1, {'b': 2}]})))
+        expected = self._instance(self._instance(self._instance(
+                {'a': [1, {'b': 2}]})))
+        self._assert_same(value, expected, convert_instances=True)
+
+    def test_instances_not_converted(self):
+        value = Instance()
+        self._assert_same({'a': [value]}, {'a': [value]})
+
+    def test_nasty(self):
+        self.assertEqual(jsonutils.to_primitive({'f': len}),
+                         {'f': unicode(len)})
+
+    def test_dumps(self):
+        value = {'a': [datetime.datetime(2012, 1, 2)], 'b': (1, 2)}
+        self.assertEqual(jsonutils.loads(jsonutils.dumps(value)),
+                         {'a': ['2012-01-02 00:00:00'], 'b': [1, 2]})
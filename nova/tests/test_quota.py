@@ -18,6 +18,8 @@
 
 import datetime
 
+import eventlet
+
 from nova import compute
 from nova.compute import instance_types
 from nova import context
@@ -673,6 +675,51 @@ class QuotaEngineTestCase(test.TestCase):
                 ('expire', context),
                 ])
 
+    def test_invalidate_limits(self):
+        class CachingDriver(FakeDriver):
+            def invalidate_limits(self, project_id=None, quota_class=None):
+                self.called.append(('invalidate_limits', project_id,
+                                    quota_class))
+
+        driver = CachingDriver()
+        quota_obj = self._make_quota_obj(driver)
+        quota_obj.invalidate_limits(project_id='test_project')
+        quota_obj.invalidate_limits(quota_class='test_class')
+
+        self.assertEqual(driver.called, [
+                ('invalidate_limits', 'test_project', None),
+                ('invalidate_limits', None, 'test_class'),
+                ])
+
+    def test_invalidate_limits_driver_without_cache(self):
+        driver = FakeDriver()
+        quota_obj = self._make_quota_obj(driver)
+        quota_obj.invalidate_limits(project_id='test_project')
+
+        self.assertEqual(driver.called, [])
+
+    def test_refresh_usages(self):
+        class RefreshingDriver(FakeDriver):
+            def refresh_usages(self, context, resources):
+                self.called.append(('refresh_usages', context, resources))
+
+        context = FakeContext(None, None)
+        driver = RefreshingDriver()
+        quota_obj = self._make_quota_obj(driver)
+        quota_obj.refresh_usages(context)
+
+        self.assertEqual(driver.called, [
+                ('refresh_usages', context, quota_obj._resources),
+                ])
+
+    def test_refresh_usages_driver_without_refresh(self):
+        context = FakeContext(None, None)
+        driver = FakeDriver()
+        quota_obj = self._make_quota_obj(driver)
+        quota_obj.refresh_usages(context)
+
+        self.assertEqual(driver.called, [])
+
     def test_resources(self):
         quota_obj = self._make_quota_obj(None)
 
@@ -1136,6 +1183,68 @@ class DbQuotaDriverTestCase(test.TestCase):
                     ),
                 ))
 
+    def _get_project_limits(self, context):
+        return self.driver.get_project_quotas(context,
+                quota.QUOTAS._resources, 'test_project', usages=False)
+
+    def test_get_project_quotas_cached(self):
+        self.flags(quota_limits_cache_ttl=60)
+        self._stub_get_by_project()
+        context = FakeContext('test_project', 'test_class')
+        result = self._get_project_limits(context)
+        self.assertEqual(self._get_project_limits(context), result)
+
+        self.assertEqual(self.calls, [
+                'quota_get_all_by_project',
+                'quota_class_get_all_by_name',
+                ])
+
+    def test_get_project_quotas_cache_expires(self):
+        self.flags(quota_limits_cache_ttl=60)
+        self._stub_get_by_project()
+        context = FakeContext('test_project', 'test_class')
+        self._get_project_limits(context)
+        timeutils.advance_time_seconds(61)
+        self._get_project_limits(context)
+
+        self.assertEqual(self.calls, [
+                'quota_get_all_by_project',
+                'quota_class_get_all_by_name',
+                'quota_get_all_by_project',
+                'quota_class_get_all_by_name',
+                ])
+
+    def test_get_project_quotas_cache_invalidated(self):
+        self.flags(quota_limits_cache_ttl=60)
+        self._stub_get_by_project()
+        context = FakeContext('test_project', 'test_class')
+        self._get_project_limits(context)
+        self.driver.invalidate_limits(project_id='test_project')
+        self._get_project_limits(context)
+        self.driver.invalidate_limits(quota_class='test_class')
+        self._get_project_limits(context)
+
+        self.assertEqual(self.calls, [
+                'quota_get_all_by_project',
+                'quota_class_get_all_by_name',
+                'quota_get_all_by_project',
+                'quota_class_get_all_by_name',
+                ])
+
+    def test_get_project_quotas_cache_other_project(self):
+        self.flags(quota_limits_cache_ttl=60)
+        self._stub_get_by_project()
+        self._get_project_limits(FakeContext('test_project', 'test_class'))
+        # The access check of the DB API is not bypassed
+        context = FakeContext('other_project', 'other_class')
+        self._get_project_limits(context)
+
+        self.assertEqual(self.calls, [
+                'quota_get_all_by_project',
+                'quota_class_get_all_by_name',
+                'quota_get_all_by_project',
+                ])
+
     def _stub_get_project_quotas(self):
         def fake_get_project_quotas(context, resources, project_id,
                                     quota_class=None, defaults=True,
@@ -1908,3 +2017,129 @@ class QuotaReserveSqlAlchemyTestCase(test.TestCase):
                      project_id='test_project',
                      delta=-2 * 1024),
                 ])
+
+
+class CounterQuotaDriverTestCase(test.TestCase):
+    def setUp(self):
+        super(CounterQuotaDriverTestCase, self).setUp()
+        self.flags(quota_instances=3, until_refresh=0, max_age=0)
+        self.driver = quota.CounterQuotaDriver()
+        self.resources = quota.QUOTAS._resources
+        self.context = context.RequestContext('fake_user', 'test_project')
+        self.admin_context = context.get_admin_context()
+
+        self.reserve_calls = []
+        orig_quota_reserve_counters = db.quota_reserve_counters
+
+        def fake_quota_reserve_counters(context, resources, quotas, requests,
+                                        until_refresh):
+            self.reserve_calls.append(len(requests))
+            return orig_quota_reserve_counters(context, resources, quotas,
+                                               requests, until_refresh)
+
+        self.stubs.Set(db, 'quota_reserve_counters',
+                       fake_quota_reserve_counters)
+
+    def _create_instance(self):
+        return db.instance_create(self.admin_context,
+                                  {'project_id': 'test_project',
+                                   'vcpus': 1, 'memory_mb': 512})
+
+    def _get_usage(self, resource):
+        return db.quota_usage_get(self.admin_context, 'test_project',
+                                  resource)
+
+    def _reserve_concurrently(self, count):
+        def reserve():
+            try:
+                return self.driver.reserve(self.context, self.resources,
+                                           dict(instances=1))
+            except exception.OverQuota as exc:
+                return exc
+
+        threads = [eventlet.spawn(reserve) for i in xrange(count)]
+        return [thread.wait() for thread in threads]
+
+    def test_reserve_commit(self):
+        self._create_instance()
+        reservations = self.driver.reserve(self.context, self.resources,
+                                           dict(instances=1, cores=2))
+        self.assertEqual(len(reservations), 2)
+        usage = self._get_usage('instances')
+        self.assertEqual((usage.in_use, usage.reserved), (1, 1))
+        self.assertEqual(self._get_usage('cores').reserved, 2)
+
+        self.driver.commit(self.context, reservations)
+        usage = self._get_usage('instances')
+        self.assertEqual((usage.in_use, usage.reserved), (2, 0))
+        self.assertEqual(self._get_usage('cores').in_use, 3)
+
+        # A reservation is only applied once
+        self.driver.commit(self.context, reservations)
+        self.assertEqual(self._get_usage('instances').in_use, 2)
+
+    def test_reserve_rollback(self):
+        reservations = self.driver.reserve(self.context, self.resources,
+                                           dict(instances=1))
+        self.driver.rollback(self.context, reservations)
+        usage = self._get_usage('instances')
+        self.assertEqual((usage.in_use, usage.reserved), (0, 0))
+
+    def test_reserve_over_quota(self):
+        self.driver.reserve(self.context, self.resources,
+                            dict(instances=2, cores=2))
+        self.assertRaises(exception.OverQuota, self.driver.reserve,
+                          self.context, self.resources,
+                          dict(instances=2, cores=2))
+        # The cores reserved before the instances failed are released
+        self.assertEqual(self._get_usage('instances').reserved, 2)
+        self.assertEqual(self._get_usage('cores').reserved, 2)
+
+    def test_reserve_fails_creating_reservations(self):
+        def fake_reservation_create(*args, **kwargs):
+            raise exception.DBError()
+
+        self.stubs.Set(sqa_api, 'reservation_create',
+                       fake_reservation_create)
+        self.assertRaises(exception.DBError, self.driver.reserve,
+                          self.context, self.resources,
+                          dict(instances=1, cores=2))
+        # The reserved counts are raised with the reservations or not at all
+        self.assertEqual(self._get_usage('instances').reserved, 0)
+        self.assertEqual(self._get_usage('cores').reserved, 0)
+
+    def test_concurrent_reserves_are_batched(self):
+        self.flags(quota_instances=10)
+        results = self._reserve_concurrently(5)
+        self.assertEqual(self.reserve_calls, [5])
+        self.assertEqual(len(set(result[0] for result in results)), 5)
+        self.assertEqual(self._get_usage('instances').reserved, 5)
+
+    def test_concurrent_reserves_over_quota(self):
+        results = self._reserve_concurrently(5)
+        self.assertEqual(self.reserve_calls, [5, 1, 1, 1, 1, 1])
+        overs = [result for result in results
+                 if isinstance(result, exception.OverQuota)]
+        self.assertEqual(len(overs), 2)
+        self.assertEqual(self._get_usage('instances').reserved, 3)
+
+    def test_expire(self):
+        self.driver.reserve(self.context, self.resources, dict(instances=1),
+                            expire=-1)
+        self.driver.expire(self.admin_context)
+        self.assertEqual(self._get_usage('instances').reserved, 0)
+
+    def test_refresh_usages(self):
+        self.driver.reserve(self.context, self.resources, dict(instances=1))
+        self._create_instance()
+        self._create_instance()
+        # Not due a refresh yet
+        self.driver.refresh_usages(self.admin_context, self.resources)
+        self.assertEqual(self._get_usage('instances').in_use, 0)
+
+        usage = self._get_usage('instances')
+        sqa_api.quota_usage_update(self.admin_context, 'test_project',
+                                   'instances', -1, usage.reserved, None)
+        self.driver.refresh_usages(self.admin_context, self.resources)
+        usage = self._get_usage('instances')
+        self.assertEqual((usage.in_use, usage.reserved), (2, 1))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""scheduler_benchmark.py - Benchmarks the scheduler drivers
+
+Builds a synthetic fleet in an in-memory database and replays the same
+random stream of run_instance, resize and live migration requests
+through each scheduler driver, then prints the throughput, latency
+percentiles and placement quality of each of them.
+
+Nova flags can be given after a --, for example:
+
+    tools/scheduler_benchmark.py --hosts 10000 --instances 200000 \\
+        -- --scheduler_cache_host_states
+"""
+
+import gettext
+import optparse
+import os
+import sys
+
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import context
+from nova import db
+from nova.db import migration
+from nova import flags
+from nova import log as logging
+from nova.openstack.common import importutils
+from nova.tests.scheduler import simulator
+
+
+FLAGS = flags.FLAGS
+
+
+def parse_options():
+    """process command line options."""
+
+    parser = optparse.OptionParser('usage: %prog [options] [-- nova flags]')
+    parser.add_option('--hosts', type='int', default=100,
+                      help='Number of compute hosts in the fleet')
+    parser.add_option('--instances', type='int', default=1000,
+                      help='Number of instances running before the '
+                           'requests are replayed')
+    parser.add_option('--requests', type='int', default=1000,
+                      help='Number of requests to replay')
+    parser.add_option('--schedulers', default='filter,simple,chance',
+                      help='Comma separated scheduler drivers to run, out '
+                           'of %s' % ', '.join(simulator.SCHEDULER_DRIVERS))
+    parser.add_option('--mix', default='run_instance=0.8,resize=0.1,'
+                                       'live_migration=0.1',
+                      help='Comma separated weights of the request types')
+    parser.add_option('--flavors', default='m1.tiny,m1.small,m1.medium',
+                      help='Comma separated names of the instance types '
+                           'the instances are picked from')
+    parser.add_option('--host-memory-mb', type='int', default=65536)
+    parser.add_option('--host-vcpus', type='int', default=32)
+    parser.add_option('--host-local-gb', type='int', default=1024)
+    parser.add_option('--zones', type='int', default=1,
+                      help='Number of availability zones the hosts are '
+                           'spread over')
+    parser.add_option('--seed', type='int', default=0)
+
+    options, args = parser.parse_args()
+
+    return options, args
+
+
+def _format_ms(value):
+    if value is None:
+        return '-'
+    return '%.1fms' % value
+
+
+def _format_ratio(value):
+    if value is None:
+        return '-'
+    return '%.1f%%' % (value * 100)
+
+
+def print_report(name, report):
+    print '== %s (%s)' % (name, report['scheduler_driver'])
+    throughput = report['throughput']
+    print '  throughput: %s requests/s over %.1fs' % (
+            '-' if throughput is None else '%.1f' % throughput,
+            report['elapsed'])
+    for request_type in simulator.REQUEST_TYPES:
+        latency = report['latency'].get(request_type)
+        if not latency:
+            continue
+        print '  %-15s %6d requests, %5d failed, p50 %s, p99 %s, max %s' % (
+                request_type, report['requests'][request_type],
+                report['failures'][request_type], _format_ms(latency['p50']),
+                _format_ms(latency['p99']), _format_ms(latency['max']))
+    placement = report['placement']
+    print ('  placement: %d instances on %d of %d hosts, memory used %s, '
+           'packing density %s, fragmentation %s' % (
+                placement['instances'], placement['hosts_used'],
+                placement['hosts'], _format_ratio(placement['memory_used']),
+                _format_ratio(placement['packing_density']),
+                _format_ratio(placement['fragmentation'])))
+
+
+def main():
+    """Main loop."""
+    options, args = parse_options()
+    # Register the flags of all the drivers, so they can be given too.
+    for scheduler_driver in simulator.SCHEDULER_DRIVERS.itervalues():
+        importutils.import_class(scheduler_driver)
+    FLAGS.set_default('sql_connection', 'sqlite://')
+    flags.parse_args([sys.argv[0]] + args)
+    logging.setup()
+    migration.db_sync()
+
+    request_mix = {}
+    for item in options.mix.split(','):
+        request_type, _sep, weight = item.partition('=')
+        request_mix[request_type.strip()] = float(weight)
+
+    ctxt = context.get_admin_context()
+    flavors = [name.strip() for name in options.flavors.split(',')]
+    instance_types = [instance_type
+                      for instance_type in db.instance_type_get_all(ctxt)
+                      if instance_type['name'] in flavors]
+    for name in options.schedulers.split(','):
+        name = name.strip()
+        fleet = simulator.FakeFleet(ctxt, options.hosts, options.instances,
+                instance_types, host_memory_mb=options.host_memory_mb,
+                host_vcpus=options.host_vcpus,
+                host_local_gb=options.host_local_gb,
+                num_zones=options.zones, seed=options.seed)
+        fleet.build()
+        try:
+            simulation = simulator.SchedulerSimulation(ctxt, fleet,
+                    simulator.SCHEDULER_DRIVERS[name],
+                    request_mix=request_mix, seed=options.seed)
+            simulation.run(options.requests)
+            print_report(name, simulation.report())
+        finally:
+            fleet.destroy()
+
+if __name__ == '__main__':
+    main()